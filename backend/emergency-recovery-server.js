@@ -3,6 +3,8 @@ const fs = require('fs');
 const path = require('path');
 const { spawn } = require('child_process');
 const cors = require('cors');
+const { isDirectoryArchive, archiveSize, isBackupEntry, restoreJobs } = require('./services/backupArchive');
+const { RestoreCoordinator } = require('./services/restoreCoordinator');
 
 // Load both emergency config and main database config
 require('dotenv').config({ path: '.env.recovery' });
@@ -35,6 +37,14 @@ const EMERGENCY_CREDENTIALS = {
 const BACKUPS_DIR = path.join(__dirname, '..', 'backups');
 const RECOVERY_LOG = path.join(__dirname, '..', 'logs', 'recovery.log');
 
+// Restore queue shared with the main backend and the Python restore tools
+const restoreCoordinator = new RestoreCoordinator(BACKUPS_DIR);
+
+// Warm standby kept current by db/standby.py; promoting it is a rename
+const STANDBY_STATE_FILE = path.join(BACKUPS_DIR, 'standby_state.json');
+const STANDBY_SCRIPT = path.join(__dirname, '..', 'db', 'standby.py');
+const PYTHON = process.env.PYTHON || (process.platform === 'win32' ? 'python' : 'python3');
+
 // Ensure logs directory exists
 const logsDir = path.dirname(RECOVERY_LOG);
 if (!fs.existsSync(logsDir)) {
@@ -49,6 +59,60 @@ function logRecovery(message) {
     fs.appendFileSync(RECOVERY_LOG, logMessage);
 }
 
+// Standby state with its recovery point: the age of the backup it holds
+function standbyStatus() {
+    let state = {};
+    try {
+        state = JSON.parse(fs.readFileSync(STANDBY_STATE_FILE, 'utf8'));
+    } catch (error) {
+        return { configured: false, available: false };
+    }
+    const ageSeconds = (timestamp) => timestamp ? Math.round((Date.now() - new Date(timestamp).getTime()) / 1000) : null;
+    const rpoSeconds = ageSeconds(state.backup_created);
+    return {
+        configured: true,
+        available: Boolean(state.available),
+        database: state.database,
+        backupFile: state.backup_file ? path.basename(state.backup_file) : null,
+        backupCreated: state.backup_created || null,
+        restoredAt: state.restored_at || null,
+        rpoSeconds,
+        rpo: rpoSeconds === null ? null : `${Math.floor(rpoSeconds / 3600)}h ${Math.floor(rpoSeconds % 3600 / 60)}m`,
+        refreshedSecondsAgo: ageSeconds(state.restored_at),
+        lastError: state.last_error || null,
+        promotedAt: state.promoted_at || null
+    };
+}
+
+// Full backup through db/backup.py; resolves to the archive path or null
+function runPreRestoreBackup(backupScript, timeoutMs = 10 * 60 * 1000) {
+    return new Promise((resolve) => {
+        const backupProcess = spawn(PYTHON, [backupScript, '--type', 'full', '--description', 'Pre-restore backup (emergency)'], {
+            cwd: path.dirname(backupScript),
+            env: {
+                ...process.env,
+                BACKUP_PATH: BACKUPS_DIR,
+                DB_PASSWORD: process.env.DB_PASSWORD || 'hengmengly123'
+            }
+        });
+        let stdout = '';
+        const timer = setTimeout(() => backupProcess.kill(), timeoutMs);
+        backupProcess.stdout.on('data', (data) => {
+            stdout += data.toString();
+        });
+        backupProcess.on('close', (code) => {
+            clearTimeout(timer);
+            // backup.py prints the archive path as its last line
+            const lines = stdout.trim().split('\n');
+            resolve(code === 0 ? lines[lines.length - 1].trim() : null);
+        });
+        backupProcess.on('error', () => {
+            clearTimeout(timer);
+            resolve(null);
+        });
+    });
+}
+
 // Emergency authentication middleware
 function emergencyAuth(req, res, next) {
     const authHeader = req.headers.authorization;
@@ -166,15 +230,17 @@ app.get('/api/emergency/backups', emergencyAuth, (req, res) => {
         }
         
         const files = fs.readdirSync(BACKUPS_DIR)
-            .filter(file => file.endsWith('.sql') || file.endsWith('.backup'))
+            .filter(file => isBackupEntry(BACKUPS_DIR, file))
             .map(file => {
                 const filePath = path.join(BACKUPS_DIR, file);
                 const stats = fs.statSync(filePath);
+                const size = archiveSize(filePath);
                 
                 return {
                     filename: file,
-                    size: stats.size,
-                    sizeFormatted: `${(stats.size / (1024 * 1024)).toFixed(2)} MB`,
+                    format: isDirectoryArchive(filePath) ? 'directory' : file.endsWith('.backup') ? 'custom' : 'sql',
+                    size,
+                    sizeFormatted: `${(size / (1024 * 1024)).toFixed(2)} MB`,
                     created: stats.birthtime,
                     modified: stats.mtime,
                     type: file.includes('schema') ? 'schema' : 
@@ -230,7 +296,37 @@ app.post('/api/emergency/restore', emergencyAuth, async (req, res) => {
         });
     }
     
-    logRecovery(`Starting emergency database restore: ${filename}`);
+    // One restore at a time across all entry points; the same backup
+    // submitted again with the same options joins the pending job instead
+    // of running twice
+    let job;
+    try {
+        const submission = await restoreCoordinator.submit(backupPath, 'api/emergency/restore',
+            { mode: 'restore', clean: true, force: Boolean(force) });
+        job = submission.job;
+        if (submission.merged) {
+            logRecovery(`Restore of ${filename} already ${job.status} (job ${job.id}) - waiting for its result`);
+            const finished = await restoreCoordinator.waitFor(job.id);
+            return res.status(finished.status === 'completed' ? 200 : 500).json({
+                success: finished.status === 'completed',
+                message: `Merged into restore job ${job.id} (${finished.status})`,
+                data: { job: finished, merged: true }
+            });
+        }
+        await restoreCoordinator.waitTurn(job, logRecovery);
+    } catch (error) {
+        logRecovery(`Emergency restore could not be queued: ${error.message}`);
+        if (job && job.status === 'queued') {
+            await restoreCoordinator.cancel(job).catch(() => {});
+        }
+        return res.status(503).json({
+            success: false,
+            message: 'Emergency restore could not be queued',
+            error: error.message
+        });
+    }
+    
+    logRecovery(`Starting emergency database restore: ${filename} (job ${job.id})`);
     
     try {
         const startTime = Date.now();
@@ -242,7 +338,10 @@ app.post('/api/emergency/restore', emergencyAuth, async (req, res) => {
                 const backupScript = path.join(__dirname, '..', 'db', 'backup.py');
                 if (fs.existsSync(backupScript)) {
                     logRecovery('Creating pre-restore backup...');
-                    // This is optional and may fail if database is down
+                    // This is optional and fails quickly if the database is down
+                    preRestoreBackup = await runPreRestoreBackup(backupScript);
+                    logRecovery(preRestoreBackup ? `Pre-restore backup created: ${preRestoreBackup}` :
+                        'Pre-restore backup skipped: database not reachable or backup failed');
                 }
             } catch (backupError) {
                 logRecovery(`Pre-restore backup failed (continuing): ${backupError.message}`);
@@ -253,7 +352,22 @@ app.post('/api/emergency/restore', emergencyAuth, async (req, res) => {
         let restoreCommand;
         let args;
         
-        if (filename.endsWith('.backup')) {
+        if (isDirectoryArchive(backupPath)) {
+            // Directory format archive, restored with parallel jobs
+            restoreCommand = 'pg_restore';
+            args = [
+                '-h', process.env.DB_HOST || 'localhost',
+                '-p', process.env.DB_PORT || '5432',
+                '-U', process.env.DB_USER || 'postgres',
+                '-d', process.env.DB_NAME || 'ecommerce_db',
+                '--verbose',
+                '--no-password',
+                '--clean',
+                '--if-exists',
+                `--jobs=${restoreJobs()}`,
+                backupPath
+            ];
+        } else if (filename.endsWith('.backup')) {
             // Custom format backup
             restoreCommand = 'pg_restore';
             args = [
@@ -280,6 +394,7 @@ app.post('/api/emergency/restore', emergencyAuth, async (req, res) => {
                 '-f', backupPath
             ];
         } else {
+            await restoreCoordinator.finish(job, false, 'Unsupported backup file format');
             return res.status(400).json({
                 success: false,
                 message: 'Unsupported backup file format'
@@ -309,6 +424,7 @@ app.post('/api/emergency/restore', emergencyAuth, async (req, res) => {
         
         restoreProcess.on('close', async (code) => {
             const duration = Date.now() - startTime;
+            await restoreCoordinator.finish(job, code === 0, code === 0 ? null : stderr.slice(-2000));
             
             if (code === 0) {
                 logRecovery(`Emergency restore completed successfully in ${duration}ms`);
@@ -343,6 +459,7 @@ app.post('/api/emergency/restore', emergencyAuth, async (req, res) => {
                     success: true,
                     message: 'Emergency database restore completed successfully',
                     data: {
+                        job_id: job.id,
                         filename,
                         duration: `${duration}ms`,
                         verification: verificationResult,
@@ -361,8 +478,9 @@ app.post('/api/emergency/restore', emergencyAuth, async (req, res) => {
             }
         });
         
-        restoreProcess.on('error', (error) => {
+        restoreProcess.on('error', async (error) => {
             logRecovery(`Emergency restore process error: ${error.message}`);
+            await restoreCoordinator.finish(job, false, error.message);
             res.status(500).json({
                 success: false,
                 message: 'Failed to start restore process',
@@ -372,6 +490,7 @@ app.post('/api/emergency/restore', emergencyAuth, async (req, res) => {
         
     } catch (error) {
         logRecovery(`Emergency restore error: ${error.message}`);
+        await restoreCoordinator.finish(job, false, error.message).catch(() => {});
         res.status(500).json({
             success: false,
             message: 'Emergency restore failed',
@@ -380,6 +499,96 @@ app.post('/api/emergency/restore', emergencyAuth, async (req, res) => {
     }
 });
 
+// Emergency recovery from the warm standby: rename it over the production database
+app.post('/api/emergency/standby/promote', emergencyAuth, (req, res) => {
+    const standby = standbyStatus();
+    if (!standby.available) {
+        return res.status(409).json({
+            success: false,
+            message: 'No verified standby database is available - restore from a backup instead',
+            data: { standby }
+        });
+    }
+    
+    logRecovery(`Promoting standby ${standby.database} (data as of ${standby.backupCreated}, RPO ${standby.rpo})`);
+    const startTime = Date.now();
+    
+    // standby.py queues the rename behind any restore in progress
+    const promoteProcess = spawn(PYTHON, [STANDBY_SCRIPT, '--promote'], {
+        cwd: path.dirname(STANDBY_SCRIPT),
+        env: {
+            ...process.env,
+            BACKUP_PATH: BACKUPS_DIR,
+            DB_PASSWORD: process.env.DB_PASSWORD || 'hengmengly123'
+        }
+    });
+    
+    let output = '';
+    promoteProcess.stdout.on('data', (data) => {
+        output += data.toString();
+    });
+    promoteProcess.stderr.on('data', (data) => {
+        output += data.toString();
+    });
+    
+    promoteProcess.on('close', (code) => {
+        const duration = Date.now() - startTime;
+        if (code === 0) {
+            logRecovery(`Standby promoted in ${duration}ms`);
+            res.json({
+                success: true,
+                message: 'Standby database promoted to production',
+                data: {
+                    duration: `${duration}ms`,
+                    rpoSeconds: standby.rpoSeconds,
+                    backupFile: standby.backupFile,
+                    output: output.slice(-1000)
+                }
+            });
+        } else {
+            logRecovery(`Standby promotion failed with code ${code}: ${output.slice(-2000)}`);
+            res.status(500).json({
+                success: false,
+                message: 'Standby promotion failed',
+                error: output.slice(-2000),
+                exitCode: code
+            });
+        }
+    });
+    
+    promoteProcess.on('error', (error) => {
+        logRecovery(`Standby promotion process error: ${error.message}`);
+        res.status(500).json({
+            success: false,
+            message: 'Failed to start standby promotion',
+            error: error.message
+        });
+    });
+});
+
+// Restore queue: running job, queued jobs and recent history
+app.get('/api/emergency/restore/queue', emergencyAuth, (req, res) => {
+    res.json({
+        success: true,
+        data: restoreCoordinator.status()
+    });
+});
+
+// One restore job by id
+app.get('/api/emergency/restore/jobs/:id', emergencyAuth, (req, res) => {
+    const job = restoreCoordinator.job(req.params.id);
+    if (!job) {
+        return res.status(404).json({
+            success: false,
+            message: 'Restore job not found'
+        });
+    }
+    res.json({
+        success: true,
+        data: job
+    });
+});
+
 // Get recovery logs
 app.get('/api/emergency/logs', emergencyAuth, (req, res) => {
     try {
@@ -425,7 +634,7 @@ app.get('/api/emergency/status', emergencyAuth, (req, res) => {
         let backupCount = 0;
         if (fs.existsSync(BACKUPS_DIR)) {
             backupCount = fs.readdirSync(BACKUPS_DIR)
-                .filter(file => file.endsWith('.sql') || file.endsWith('.backup'))
+                .filter(file => isBackupEntry(BACKUPS_DIR, file))
                 .length;
         }
         
@@ -448,6 +657,7 @@ app.get('/api/emergency/status', emergencyAuth, (req, res) => {
                     file: RECOVERY_LOG,
                     exists: fs.existsSync(RECOVERY_LOG)
                 },
+                standby: standbyStatus(),
                 timestamp: new Date().toISOString()
             }
         });
@@ -1,10 +1,15 @@
 const express = require('express');
-const { spawn } = require('child_process');
+const { spawn, execFile } = require('child_process');
 const fs = require('fs');
 const path = require('path');
 const router = express.Router();
 const auth = require('../middleware/auth');
 const { authorizeRoles } = require('../middleware/authorize');
+const {
+    DIRECTORY_TOC, isDirectoryArchive, isArchive, archiveSize, isBackupEntry, isChunkList,
+    chunkListPath, listChunkLists, readChunkList, restoreJobs
+} = require('../services/backupArchive');
+const { RestoreCoordinator } = require('../services/restoreCoordinator');
 
 // Create backups directory if it doesn't exist
 const backupsDir = path.join(__dirname, '..', '..', 'backups');
@@ -12,6 +17,137 @@ if (!fs.existsSync(backupsDir)) {
     fs.mkdirSync(backupsDir, { recursive: true });
 }
 
+// Lines of restore output kept in memory (ring buffer) for logs and errors
+const RESTORE_OUTPUT_LINES = 200;
+
+// Progress of the restore in flight (or the last one), polled by the UI
+let restoreProgress = null;
+
+// Restore queue shared with the emergency server and the Python restore tools
+const restoreCoordinator = new RestoreCoordinator(backupsDir);
+
+function createRestoreProgress(filename, totalBytes, totalItems) {
+    return {
+        filename,
+        status: 'running',
+        phase: 'starting',
+        currentObject: null,
+        bytesDone: 0,
+        totalBytes,
+        itemsDone: 0,
+        totalItems,
+        errors: 0,
+        startedAt: Date.now(),
+        output: [],
+        partialLine: ''
+    };
+}
+
+// Buffer one chunk of psql/pg_restore output and turn it into progress events
+function recordRestoreOutput(progress, text) {
+    // Output arrives in arbitrary chunks; hold back an unfinished last line
+    const lines = (progress.partialLine + text).split(/\r?\n/);
+    progress.partialLine = lines.pop();
+
+    for (const line of lines) {
+        if (!line.trim()) continue;
+
+        progress.output.push(line);
+        if (progress.output.length > RESTORE_OUTPUT_LINES) {
+            progress.output.shift();
+        }
+
+        if (/^pg_restore: error:|ERROR:/.test(line)) {
+            progress.errors++;
+        }
+
+        // pg_restore --verbose reports each TOC entry it handles
+        const item = line.match(/^pg_restore: (?:processing|finished) item \d+ (.+)$/);
+        if (item) {
+            progress.itemsDone++;
+            progress.currentObject = item[1];
+            continue;
+        }
+
+        const object = line.match(/^pg_restore: (?:creating (\S+(?: \S+)?) "(.+)"|processing data for table "(.+)")$/);
+        if (object) {
+            if (object[3]) {
+                progress.phase = 'data';
+                progress.currentObject = `TABLE DATA ${object[3]}`;
+            } else {
+                progress.phase = /INDEX|CONSTRAINT|TRIGGER/.test(object[1]) ? 'post-data' : 'pre-data';
+                progress.currentObject = `${object[1]} ${object[2]}`;
+            }
+        }
+    }
+}
+
+function restoreProgressSnapshot(progress) {
+    if (!progress) return null;
+
+    const elapsedSeconds = (Date.now() - progress.startedAt) / 1000;
+    let percent = null;
+    if (progress.status === 'completed') {
+        percent = 100;
+    } else if (progress.totalBytes) {
+        percent = Math.min(99.9, (progress.bytesDone * 100) / progress.totalBytes);
+    } else if (progress.totalItems) {
+        percent = Math.min(99.9, (progress.itemsDone * 100) / progress.totalItems);
+    }
+
+    const etaSeconds = percent && progress.status === 'running'
+        ? Math.round(elapsedSeconds * (100 - percent) / percent)
+        : null;
+
+    return {
+        filename: progress.filename,
+        status: progress.status,
+        phase: progress.phase,
+        current_object: progress.currentObject,
+        percent: percent === null ? null : Number(percent.toFixed(1)),
+        eta_seconds: etaSeconds,
+        elapsed_seconds: Math.round(elapsedSeconds),
+        bytes_done: progress.bytesDone,
+        total_bytes: progress.totalBytes,
+        items_done: progress.itemsDone,
+        total_items: progress.totalItems,
+        errors: progress.errors,
+        recent_output: progress.output.slice(-20)
+    };
+}
+
+// Count TOC entries of a custom format archive so pg_restore progress has a total
+// Listed without blocking the event loop; a large archive's TOC takes a while
+function countArchiveEntries(backupPath) {
+    return new Promise((resolve) => {
+        execFile('pg_restore', ['-l', backupPath], { encoding: 'utf8', maxBuffer: 64 * 1024 * 1024 }, (error, stdout) => {
+            if (error) {
+                console.error('⚠️ Could not list archive contents:', error.message);
+                resolve(null);
+                return;
+            }
+            resolve(stdout.split('\n').filter(line => line.trim() && !line.startsWith(';')).length);
+        });
+    });
+}
+
+// db/chunk_store.py reassembles deduplicated backups from the backups directory's store
+const python = process.env.PYTHON || (process.platform === 'win32' ? 'python' : 'python3');
+const chunkStoreScript = path.join(__dirname, '..', '..', 'db', 'chunk_store.py');
+const chunkStoreOptions = {
+    cwd: path.dirname(chunkStoreScript),
+    env: { ...process.env, BACKUP_PATH: backupsDir }
+};
+
+// Check that every chunk of a stored backup exists; resolves to the problems found, or null
+function verifyChunkList(name) {
+    return new Promise((resolve) => {
+        execFile(python, [chunkStoreScript, 'verify', name], { ...chunkStoreOptions, encoding: 'utf8' }, (error, stdout) => {
+            resolve(error ? (stdout.trim() || error.message) : null);
+        });
+    });
+}
+
 // Real database backup endpoint with backup type options
 router.post('/backup', auth, authorizeRoles(['admin']), async (req, res) => {
     try {
@@ -141,18 +277,36 @@ router.post('/backup', auth, authorizeRoles(['admin']), async (req, res) => {
 router.get('/backups', auth, authorizeRoles(['admin']), (req, res) => {
     try {
         const backupFiles = fs.readdirSync(backupsDir)
-            .filter(file => file.endsWith('.sql'))
+            .filter(file => isBackupEntry(backupsDir, file))
             .map(file => {
                 const filePath = path.join(backupsDir, file);
                 const stats = fs.statSync(filePath);
                 return {
                     filename: file,
-                    size: `${(stats.size / (1024 * 1024)).toFixed(2)} MB`,
+                    format: isDirectoryArchive(filePath) ? 'directory' : file.endsWith('.backup') ? 'custom' : 'sql',
+                    size: `${(archiveSize(filePath) / (1024 * 1024)).toFixed(2)} MB`,
                     created: stats.birthtime,
                     modified: stats.mtime
                 };
-            })
-            .sort((a, b) => new Date(b.created) - new Date(a.created));
+            });
+
+        // Deduplicated scheduler backups live in the chunk store as chunk lists
+        for (const file of listChunkLists(backupsDir)) {
+            const listPath = chunkListPath(backupsDir, file);
+            try {
+                const chunkList = readChunkList(listPath);
+                backupFiles.push({
+                    filename: file,
+                    format: 'chunks',
+                    size: `${((chunkList.size || 0) / (1024 * 1024)).toFixed(2)} MB`,
+                    created: chunkList.created ? new Date(chunkList.created) : fs.statSync(listPath).birthtime,
+                    modified: fs.statSync(listPath).mtime
+                });
+            } catch (error) {
+                console.error(`⚠️ Unreadable chunk list ${file}:`, error.message);
+            }
+        }
+        backupFiles.sort((a, b) => new Date(b.created) - new Date(a.created));
 
         res.json({
             success: true,
@@ -356,9 +510,10 @@ router.post('/execute-query', auth, authorizeRoles(['admin', 'staff', 'customer'
 // Restore database from backup file
 router.post('/restore', auth, authorizeRoles(['admin']), async (req, res) => {
     let responsesSent = false; // Track if response already sent
+    let job = null;
     
     try {
-        const { filename, force = false } = req.body;
+        const { filename, force = false, wait = true } = req.body;
 
         if (!filename) {
             return res.status(400).json({
@@ -367,7 +522,9 @@ router.post('/restore', auth, authorizeRoles(['admin']), async (req, res) => {
             });
         }
 
-        const backupPath = path.join(__dirname, '../../backups', filename);
+        // Deduplicated backups are chunk lists, restored through the chunk store
+        const isChunked = isChunkList(filename);
+        const backupPath = isChunked ? chunkListPath(backupsDir, filename) : path.join(__dirname, '../../backups', filename);
         
         // Check if backup file exists
         if (!fs.existsSync(backupPath)) {
@@ -379,22 +536,51 @@ router.post('/restore', auth, authorizeRoles(['admin']), async (req, res) => {
 
         console.log(`🔄 Starting database restore from: ${filename}`);
 
-        // Get file stats for validation
-        const stats = fs.statSync(backupPath);
-        if (stats.size === 0) {
-            return res.status(400).json({
-                success: false,
-                message: 'Backup file is empty'
-            });
-        }
+        // Get file stats for validation; a directory archive is validated
+        // through its toc.dat and sized by the sum of its files
+        const isDirectory = isDirectoryArchive(backupPath);
+        let stats;
+        if (isChunked) {
+            // A chunk list is sized by the dump it describes and checked for
+            // missing chunks; the dump itself is only reassembled while restoring
+            stats = { size: readChunkList(backupPath).size || 0 };
+            if (stats.size === 0) {
+                return res.status(400).json({
+                    success: false,
+                    message: 'Backup file is empty'
+                });
+            }
+            const problems = await verifyChunkList(filename);
+            if (problems) {
+                return res.status(400).json({
+                    success: false,
+                    message: 'Backup is incomplete in the chunk store',
+                    error: problems
+                });
+            }
+        } else {
+            const headerPath = isDirectory ? path.join(backupPath, DIRECTORY_TOC) : backupPath;
+            stats = { size: archiveSize(backupPath) };
+            if (stats.size === 0 || fs.statSync(headerPath).size === 0) {
+                return res.status(400).json({
+                    success: false,
+                    message: 'Backup file is empty'
+                });
+            }
 
-        // Validate backup file content
-        const fileContent = fs.readFileSync(backupPath, 'utf8', { encoding: 'utf8' });
-        if (!fileContent.includes('CREATE') && !fileContent.includes('INSERT') && !fileContent.includes('COPY')) {
-            return res.status(400).json({
-                success: false,
-                message: 'Invalid backup file format - no SQL statements found'
-            });
+            // Validate backup file content from its first megabyte rather than
+            // loading a multi-GB dump into memory
+            const header = Buffer.alloc(Math.min(fs.statSync(headerPath).size, 1024 * 1024));
+            const fd = fs.openSync(headerPath, 'r');
+            fs.readSync(fd, header, 0, header.length, 0);
+            fs.closeSync(fd);
+            const fileContent = header.toString('utf8');
+            if (!fileContent.startsWith('PGDMP') && !fileContent.includes('CREATE') && !fileContent.includes('INSERT') && !fileContent.includes('COPY')) {
+                return res.status(400).json({
+                    success: false,
+                    message: 'Invalid backup file format - no SQL statements found'
+                });
+            }
         }
 
         // Test database connection before restore
@@ -419,12 +605,54 @@ router.post('/restore', auth, authorizeRoles(['admin']), async (req, res) => {
                 error: connError.message
             });
         }
+
+        // One restore at a time across all entry points; the same backup
+        // submitted again with the same options joins the pending job
+        // instead of running twice. This route takes no pre-restore backup,
+        // which is what force means for restore.py
+        const submission = await restoreCoordinator.submit(backupPath, 'api/database/restore',
+            { mode: 'restore', clean: true, force: true });
+        job = submission.job;
+        if (submission.merged) {
+            console.log(`🔁 Restore of ${filename} already ${job.status} (job ${job.id}) - waiting for its result`);
+            if (!wait) {
+                return res.status(202).json({ success: true, message: 'Restore already pending', data: { job_id: job.id, merged: true } });
+            }
+            const finished = await restoreCoordinator.waitFor(job.id);
+            return res.status(finished.status === 'completed' ? 200 : 500).json({
+                success: finished.status === 'completed',
+                message: `Merged into restore job ${job.id} (${finished.status})`,
+                data: { job: finished, merged: true }
+            });
+        }
+        if (!wait) {
+            // Answer now; the job is followed through /restore/jobs/:id
+            responsesSent = true;
+            res.status(202).json({ success: true, message: 'Restore queued', data: { job_id: job.id } });
+        }
+        await restoreCoordinator.waitTurn(job, message => console.log(`⏳ ${message}`));
+
         try {
             const startTime = Date.now();
             let restoreCommand;
             let args;
             
-            if (filename.endsWith('.backup')) {
+            if (isDirectory) {
+                // Directory format archive - pg_restore reads its per-table files in parallel
+                restoreCommand = 'pg_restore';
+                args = [
+                    '-h', process.env.DB_HOST || 'localhost',
+                    '-p', process.env.DB_PORT || '5432',
+                    '-U', process.env.DB_USER || 'postgres',
+                    '-d', process.env.DB_NAME || 'ecommerce_db',
+                    '--verbose',
+                    '--no-password',
+                    '--clean',
+                    '--if-exists',
+                    `--jobs=${restoreJobs()}`,
+                    backupPath
+                ];
+            } else if (filename.endsWith('.backup')) {
                 // Custom format backup - use pg_restore
                 restoreCommand = 'pg_restore';
                 args = [
@@ -439,8 +667,8 @@ router.post('/restore', auth, authorizeRoles(['admin']), async (req, res) => {
                     '--create',
                     backupPath
                 ];
-            } else if (filename.endsWith('.sql')) {
-                // Plain SQL file - use psql
+            } else if (filename.endsWith('.sql') || isChunked) {
+                // Plain SQL file or chunk list - use psql, fed through stdin so bytes can be counted
                 // Connect to postgres database to allow dropping/creating target database
                 restoreCommand = 'psql';
                 args = [
@@ -448,10 +676,13 @@ router.post('/restore', auth, authorizeRoles(['admin']), async (req, res) => {
                     '-p', process.env.DB_PORT || '5432',
                     '-U', process.env.DB_USER || 'postgres',
                     '-d', 'postgres', // Connect to postgres database first
-                    '--no-password',
-                    '-f', backupPath
+                    '--no-password'
                 ];
             } else {
+                await restoreCoordinator.finish(job, false, 'Unsupported backup file format');
+                if (responsesSent) {
+                    return;
+                }
                 return res.status(400).json({
                     success: false,
                     message: 'Unsupported backup file format'
@@ -460,6 +691,14 @@ router.post('/restore', auth, authorizeRoles(['admin']), async (req, res) => {
 
             console.log(`🚀 Executing restore command: ${restoreCommand} ${args.join(' ')}`);
 
+            const isCustomFormat = isArchive(backupPath);
+            const progress = createRestoreProgress(
+                filename,
+                isCustomFormat ? null : stats.size,
+                isCustomFormat ? await countArchiveEntries(backupPath) : null
+            );
+            restoreProgress = progress;
+
             const restoreProcess = spawn(restoreCommand, args, {
                 env: {
                     ...process.env,
@@ -468,15 +707,64 @@ router.post('/restore', auth, authorizeRoles(['admin']), async (req, res) => {
                 stdio: ['pipe', 'pipe', 'pipe']
             });
 
-            let stdout = '';
-            let stderr = '';
+            // A chunk list's dump is reassembled by chunk_store.py onto its stdout;
+            // psql reading to the end proves nothing if that process failed
+            let chunkSource = null;
+            let chunkSourceExit = null;
+            if (isChunked) {
+                chunkSource = spawn(python, [chunkStoreScript, 'restore', filename, '-o', '-'], chunkStoreOptions);
+                chunkSourceExit = new Promise(resolve => {
+                    chunkSource.on('close', resolve);
+                    chunkSource.on('error', (error) => {
+                        recordRestoreOutput(progress, `ERROR: chunk_store.py could not start: ${error.message}\n`);
+                        restoreProcess.stdin.end();
+                        resolve(-1);
+                    });
+                });
+                chunkSource.stderr.on('data', (data) => {
+                    recordRestoreOutput(progress, data.toString());
+                });
+            }
+
+            if (!isCustomFormat) {
+                // Stream the dump into psql and count the bytes consumed
+                progress.phase = 'restoring';
+                const dumpStream = isChunked ? chunkSource.stdout : fs.createReadStream(backupPath);
+                dumpStream.on('data', (chunk) => {
+                    progress.bytesDone += chunk.length;
+                });
+                dumpStream.on('error', (error) => {
+                    recordRestoreOutput(progress, `ERROR: failed to read backup file: ${error.message}\n`);
+                    restoreProcess.stdin.end();
+                });
+                restoreProcess.stdin.on('error', () => {
+                    // psql exited early; its exit code and stderr report why
+                    dumpStream.destroy();
+                });
+                dumpStream.pipe(restoreProcess.stdin);
+            } else {
+                restoreProcess.stdin.end();
+            }
 
-            // Set timeout for long-running restores
+            // Set timeout for long-running restores. The process is stopped
+            // whether or not the client is still waiting; the queue is only
+            // released from the close handler, once it has really exited
+            let timedOut = false;
             const timeout = setTimeout(() => {
+                timedOut = true;
+                console.error('❌ Restore process timed out after 5 minutes');
+                progress.status = 'failed';
+                restoreProcess.kill('SIGTERM');
+                if (chunkSource) {
+                    chunkSource.kill('SIGTERM');
+                }
+                setTimeout(() => {
+                    if (restoreProcess.exitCode === null && restoreProcess.signalCode === null) {
+                        restoreProcess.kill('SIGKILL');
+                    }
+                }, 10000).unref();
                 if (!responsesSent) {
                     responsesSent = true;
-                    console.error('❌ Restore process timed out after 5 minutes');
-                    restoreProcess.kill('SIGTERM');
                     res.status(408).json({
                         success: false,
                         message: 'Restore process timed out after 5 minutes',
@@ -485,31 +773,45 @@ router.post('/restore', auth, authorizeRoles(['admin']), async (req, res) => {
                 }
             }, 300000); // 5 minutes
 
-            restoreProcess.stdout.on('data', (data) => {
-                stdout += data.toString();
-            });
+            // psql echoes every statement on stdout; it carries no progress
+            // information, so it is drained without being kept
+            restoreProcess.stdout.resume();
 
+            let lastLoggedPercent = -10;
             restoreProcess.stderr.on('data', (data) => {
-                stderr += data.toString();
-                console.log(`📝 Restore progress: ${data.toString().trim()}`);
+                recordRestoreOutput(progress, data.toString());
+                const snapshot = restoreProgressSnapshot(progress);
+                if (snapshot.percent !== null && snapshot.percent - lastLoggedPercent >= 10) {
+                    lastLoggedPercent = snapshot.percent;
+                    console.log(`📝 Restore progress: ${snapshot.percent}% (${snapshot.phase}, ETA ${snapshot.eta_seconds ?? '?'}s)`);
+                }
             });
 
             restoreProcess.on('close', async (code) => {
                 clearTimeout(timeout);
+                recordRestoreOutput(progress, '\n');
+                const sourceFailed = chunkSource ? (await chunkSourceExit) !== 0 : false;
+                const succeeded = code === 0 && !timedOut && !sourceFailed;
+                progress.status = succeeded ? 'completed' : 'failed';
+                progress.phase = 'finished';
+                await restoreCoordinator.finish(job, succeeded,
+                    timedOut ? 'Restore process timed out after 5 minutes' :
+                        succeeded ? null : progress.output.slice(-20).join('\n'));
                 
                 if (responsesSent) {
                     return; // Response already sent (timeout or error)
                 }
 
                 const duration = Date.now() - startTime;
+                const stderr = progress.output.join('\n');
                 console.log(`🏁 Restore process completed with exit code: ${code}`);
                 console.log(`📊 Duration: ${duration}ms`);
                 
                 if (stderr) {
-                    console.log(`📝 Restore stderr output: ${stderr}`);
+                    console.log(`📝 Restore stderr output (last ${progress.output.length} lines): ${stderr}`);
                 }
 
-                if (code === 0) {
+                if (succeeded) {
                     // Successful restore - verify database
                     let verificationResult = { verified: false };
                     try {
@@ -544,31 +846,40 @@ router.post('/restore', auth, authorizeRoles(['admin']), async (req, res) => {
                         success: true,
                         message: 'Database restored successfully',
                         data: {
+                            job_id: job.id,
                             filename,
                             file_size: `${(stats.size / (1024 * 1024)).toFixed(2)} MB`,
                             execution_time_ms: duration,
                             restored_at: new Date().toISOString(),
                             verification: verificationResult,
-                            restore_type: filename.endsWith('.backup') ? 'custom_format' : 'sql_script',
+                            restore_type: isDirectory ? 'directory_format' : filename.endsWith('.backup') ? 'custom_format' :
+                                isChunked ? 'chunk_store' : 'sql_script',
+                            progress: restoreProgressSnapshot(progress),
                             stderr_output: stderr || 'No errors reported'
                         }
                     });
                 } else {
                     // Failed restore
-                    console.error(`❌ Restore failed with exit code ${code}`);
+                    console.error(sourceFailed ? '❌ Restore failed: the chunk store could not reassemble the backup' :
+                        `❌ Restore failed with exit code ${code}`);
                     responsesSent = true;
                     res.status(500).json({
                         success: false,
                         message: 'Database restore failed',
                         error: stderr || 'Unknown error occurred',
                         exitCode: code,
-                        stdout: stdout
+                        progress: restoreProgressSnapshot(progress)
                     });
                 }
             });
 
-            restoreProcess.on('error', (error) => {
+            restoreProcess.on('error', async (error) => {
                 clearTimeout(timeout);
+                if (chunkSource) {
+                    chunkSource.kill('SIGTERM');
+                }
+                progress.status = 'failed';
+                await restoreCoordinator.finish(job, false, error.message);
                 
                 if (responsesSent) {
                     return; // Response already sent
@@ -585,6 +896,7 @@ router.post('/restore', auth, authorizeRoles(['admin']), async (req, res) => {
 
         } catch (error) {
             console.error('❌ Restore setup error:', error);
+            await restoreCoordinator.finish(job, false, error.message);
             if (!responsesSent) {
                 responsesSent = true;
                 res.status(500).json({
@@ -596,6 +908,13 @@ router.post('/restore', auth, authorizeRoles(['admin']), async (req, res) => {
         }
     } catch (error) {
         console.error('❌ Outer restore error:', error);
+        if (job && !job.finishing) {
+            if (job.status === 'queued') {
+                await restoreCoordinator.cancel(job).catch(() => {});
+            } else {
+                await restoreCoordinator.finish(job, false, error.message).catch(() => {});
+            }
+        }
         if (!responsesSent) {
             res.status(500).json({
                 success: false,
@@ -607,4 +926,35 @@ router.post('/restore', auth, authorizeRoles(['admin']), async (req, res) => {
     }
 );
 
+// Restore queue: running job, queued jobs and recent history
+router.get('/restore/queue', auth, authorizeRoles(['admin']), (req, res) => {
+    res.json({
+        success: true,
+        data: restoreCoordinator.status()
+    });
+});
+
+// One restore job, for clients that submitted with wait: false
+router.get('/restore/jobs/:id', auth, authorizeRoles(['admin']), (req, res) => {
+    const job = restoreCoordinator.job(req.params.id);
+    if (!job) {
+        return res.status(404).json({
+            success: false,
+            message: 'Restore job not found'
+        });
+    }
+    res.json({
+        success: true,
+        data: job.status === 'running' ? { ...job, progress: restoreProgressSnapshot(restoreProgress) } : job
+    });
+});
+
+// Live progress of the running (or last) restore
+router.get('/restore/progress', auth, authorizeRoles(['admin']), (req, res) => {
+    res.json({
+        success: true,
+        data: restoreProgressSnapshot(restoreProgress)
+    });
+});
+
 module.exports = router;
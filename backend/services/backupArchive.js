@@ -0,0 +1,84 @@
+const fs = require('fs');
+const os = require('os');
+const path = require('path');
+
+// A pg_dump directory-format archive is a directory holding toc.dat plus
+// one data file per table
+const DIRECTORY_TOC = 'toc.dat';
+
+// Shared with db/chunk_store.py - deduplicated backups are chunk lists in
+// <backups>/chunk_store/backups rather than dumps in the backups directory
+const CHUNK_LIST_DIR = path.join('chunk_store', 'backups');
+const CHUNK_LIST_SUFFIX = '.sql.chunks';
+
+function isDirectoryArchive(backupPath) {
+    try {
+        return fs.statSync(backupPath).isDirectory() &&
+            fs.existsSync(path.join(backupPath, DIRECTORY_TOC));
+    } catch (error) {
+        return false;
+    }
+}
+
+// Archives restored with pg_restore rather than psql
+function isArchive(backupPath) {
+    return backupPath.endsWith('.backup') || isDirectoryArchive(backupPath);
+}
+
+// Size on disk; for a directory archive, the sum of its files
+function archiveSize(backupPath) {
+    const stats = fs.statSync(backupPath);
+    if (!stats.isDirectory()) {
+        return stats.size;
+    }
+    return fs.readdirSync(backupPath)
+        .map(file => fs.statSync(path.join(backupPath, file)))
+        .filter(fileStats => fileStats.isFile())
+        .reduce((total, fileStats) => total + fileStats.size, 0);
+}
+
+// Backups the restore endpoints can list: SQL dumps and pg_dump archives
+function isBackupEntry(backupsDir, file) {
+    return file.endsWith('.sql') || file.endsWith('.backup') ||
+        isDirectoryArchive(path.join(backupsDir, file));
+}
+
+function isChunkList(file) {
+    return file.endsWith(CHUNK_LIST_SUFFIX);
+}
+
+function chunkListPath(backupsDir, file) {
+    return path.join(backupsDir, CHUNK_LIST_DIR, file);
+}
+
+// Names of the chunk lists in the backups directory's chunk store
+function listChunkLists(backupsDir) {
+    try {
+        return fs.readdirSync(path.join(backupsDir, CHUNK_LIST_DIR)).filter(isChunkList);
+    } catch (error) {
+        return []; // No chunk store yet
+    }
+}
+
+// The JSON chunk list: source dump name, creation time, dump size and chunk digests
+function readChunkList(listPath) {
+    return JSON.parse(fs.readFileSync(listPath, 'utf8'));
+}
+
+// Parallel pg_restore jobs for directory archives: one per core, at most 8
+function restoreJobs() {
+    return Math.max(1, Math.min(os.cpus().length, 8));
+}
+
+module.exports = {
+    DIRECTORY_TOC,
+    isDirectoryArchive,
+    isArchive,
+    archiveSize,
+    isBackupEntry,
+    isChunkList,
+    chunkListPath,
+    listChunkLists,
+    readChunkList,
+    restoreJobs
+};
@@ -1,8 +1,18 @@
 const cron = require('node-cron');
 const { spawn } = require('child_process');
 const fs = require('fs').promises;
+const os = require('os');
 const path = require('path');
 
+// Suffixes written by db/block_compress.py for each BACKUP_STREAM_COMPRESSION method
+const COMPRESSION_SUFFIXES = { gzip: '.gz', zstd: '.zst' };
+// Shared with db/backup.py - keep the two in step
+const REGISTRY_MUTEX = 'backup_registry.json.lock';
+// Registry edits take milliseconds; a mutex file older than this was abandoned
+const MUTEX_STALE_MS = 30000;
+
+const sleep = (ms) => new Promise(resolve => setTimeout(resolve, ms));
+
 class BackupScheduler {
     constructor() {
         this.backupDir = path.join(__dirname, '..', '..', 'backups');
@@ -14,6 +24,12 @@ class BackupScheduler {
             user: process.env.DB_USER || 'postgres',
             password: process.env.DB_PASSWORD || 'hengmengly123'
         };
+        // gzip | zstd: compress pg_dump output in parallel blocks on every core
+        this.compression = COMPRESSION_SUFFIXES[process.env.BACKUP_STREAM_COMPRESSION]
+            ? process.env.BACKUP_STREAM_COMPRESSION : null;
+        this.python = process.env.PYTHON || (process.platform === 'win32' ? 'python' : 'python3');
+        // Keep dumps in the deduplicating chunk store (db/chunk_store.py) instead of as full copies
+        this.dedup = process.env.BACKUP_DEDUP === 'true';
         
         this.ensureDirectories();
         this.setupSchedules();
@@ -45,8 +61,9 @@ class BackupScheduler {
 
     async performBackup(schedule, type, retentionDays) {
         const timestamp = new Date().toISOString().replace(/[:.]/g, '-').slice(0, 19);
-        const filename = `${schedule}_backup_${timestamp}.sql`;
-        const filepath = path.join(this.backupDir, filename);
+        const suffix = this.compression ? `.sql${COMPRESSION_SUFFIXES[this.compression]}` : '.sql';
+        const filename = `${schedule}_backup_${timestamp}${suffix}`;
+        let filepath = path.join(this.backupDir, filename);
         const logFile = path.join(this.logDir, `backup_${new Date().toISOString().slice(0, 10)}.log`);
 
         try {
@@ -58,9 +75,11 @@ class BackupScheduler {
                 '-p', this.dbConfig.port,
                 '-U', this.dbConfig.user,
                 '-d', this.dbConfig.database,
-                '-f', filepath,
                 '--verbose'
             ];
+            if (!this.compression) {
+                args.push('-f', filepath);
+            }
 
             if (type === 'schema') {
                 args.push('--schema-only');
@@ -71,7 +90,9 @@ class BackupScheduler {
             }
 
             // Execute pg_dump
-            const success = await this.executePgDump(args, logFile);
+            const success = this.compression
+                ? await this.executeCompressedPgDump(args, filepath, logFile)
+                : await this.executePgDump(args, logFile);
             if (success) {
                 // Verify backup
                 const stats = await fs.stat(filepath);
@@ -79,9 +100,17 @@ class BackupScheduler {
 
                 await this.log(logFile, `Backup completed successfully: ${filename} (${sizeMB} MB)`);
 
+                if (this.dedup) {
+                    const chunkList = await this.runChunkStore(['add', filepath, '--remove-source'], logFile);
+                    if (chunkList) {
+                        filepath = chunkList;
+                        await this.log(logFile, `Stored in chunk store: ${path.basename(chunkList)}`);
+                    }
+                }
+
                 // Update backup registry
                 await this.updateBackupRegistry({
-                    filename,
+                    filename: path.basename(filepath),
                     filepath,
                     type,
                     schedule,
@@ -94,6 +123,11 @@ class BackupScheduler {
                 // Cleanup old backups
                 await this.cleanupOldBackups(schedule, retentionDays, logFile);
 
+                // Restore the new backup into the warm standby
+                if (type === 'complete' && process.env.STANDBY_REFRESH === 'true') {
+                    this.refreshStandby(logFile);
+                }
+
             } else {
                 await this.log(logFile, `Backup failed: ${filename}`, 'ERROR');
             }
@@ -136,25 +170,158 @@ class BackupScheduler {
         });
     }
 
+    // pg_dump piped through db/block_compress.py, which compresses blocks on one thread per core
+    async executeCompressedPgDump(args, filepath, logFile) {
+        const script = path.join(__dirname, '..', '..', 'db', 'block_compress.py');
+        const tempFile = `${filepath}.tmp`;
+
+        const exitCode = (child, name) => new Promise((resolve) => {
+            let errorOutput = '';
+            child.stderr.on('data', (data) => {
+                errorOutput += data.toString();
+            });
+            child.on('close', (code) => resolve({ name, code, errorOutput }));
+            child.on('error', (error) => resolve({ name, code: -1, errorOutput: error.message }));
+        });
+
+        const env = { ...process.env, PGPASSWORD: this.dbConfig.password };
+        const pgDump = spawn('pg_dump', args, { env });
+        const compressor = spawn(this.python, [script, 'compress', '-', '-o', tempFile, '--method', this.compression]);
+        pgDump.stdout.pipe(compressor.stdin);
+        // Keep pg_dump from blocking on a full pipe if the compressor fails
+        compressor.stdin.on('error', () => pgDump.kill());
+
+        const results = await Promise.all([exitCode(pgDump, 'pg_dump'), exitCode(compressor, 'block_compress.py')]);
+        const failed = results.find(result => result.code !== 0);
+        if (failed) {
+            await this.log(logFile, `${failed.name} failed with code ${failed.code}: ${failed.errorOutput}`, 'ERROR');
+            await fs.unlink(tempFile).catch(() => {});
+            return false;
+        }
+
+        await fs.rename(tempFile, filepath);
+        await this.log(logFile, `pg_dump completed successfully (${results[1].errorOutput.trim()})`);
+        return true;
+    }
+
+    // Run db/chunk_store.py; resolves to the last line it printed (after its log output), or null if it failed
+    runChunkStore(args, logFile) {
+        const script = path.join(__dirname, '..', '..', 'db', 'chunk_store.py');
+        return new Promise((resolve) => {
+            const child = spawn(this.python, [script, ...args], {
+                cwd: path.dirname(script),
+                env: { ...process.env, BACKUP_PATH: this.backupDir }
+            });
+            let output = '';
+            let errorOutput = '';
+            child.stdout.on('data', (data) => {
+                output += data.toString();
+            });
+            child.stderr.on('data', (data) => {
+                errorOutput += data.toString();
+            });
+            child.on('close', async (code) => {
+                if (code === 0) {
+                    resolve(output.trim().split('\n').pop());
+                } else {
+                    await this.log(logFile, `chunk_store.py ${args[0]} failed with code ${code}: ${errorOutput}`, 'ERROR');
+                    resolve(null);
+                }
+            });
+            child.on('error', async (error) => {
+                await this.log(logFile, `chunk_store.py could not start: ${error.message}`, 'ERROR');
+                resolve(null);
+            });
+        });
+    }
+
+    refreshStandby(logFile) {
+        const script = path.join(__dirname, '..', '..', 'db', 'standby.py');
+        // A refresh logs a line per restored object; stdout is discarded and
+        // only the tail of stderr is kept, so a full pipe never stalls it
+        const refresh = spawn(this.python, [script, '--refresh'], {
+            cwd: path.dirname(script),
+            env: { ...process.env, BACKUP_PATH: this.backupDir, DB_PASSWORD: this.dbConfig.password },
+            stdio: ['ignore', 'ignore', 'pipe']
+        });
+        let errorOutput = '';
+        refresh.stderr.on('data', (data) => {
+            errorOutput = (errorOutput + data.toString()).slice(-2000);
+        });
+        refresh.on('close', (code) => {
+            const message = code === 0 ? 'Standby database refreshed' :
+                `Standby refresh failed with code ${code}: ${errorOutput.trim()}`;
+            this.log(logFile, message, code === 0 ? 'INFO' : 'ERROR');
+        });
+        refresh.on('error', (error) => {
+            this.log(logFile, `Standby refresh could not start: ${error.message}`, 'ERROR');
+        });
+    }
+
+    async acquireRegistryMutex(mutexFile, timeoutMs = 10000) {
+        const deadline = Date.now() + timeoutMs;
+        for (;;) {
+            try {
+                await fs.writeFile(mutexFile, `${os.hostname()}:${process.pid}`, { flag: 'wx' });
+                return;
+            } catch (error) {
+                if (error.code !== 'EEXIST') {
+                    throw error;
+                }
+            }
+            try {
+                if (Date.now() - (await fs.stat(mutexFile)).mtimeMs > MUTEX_STALE_MS) {
+                    await fs.unlink(mutexFile);
+                    continue;
+                }
+            } catch (error) {
+                // Released between the two calls
+                continue;
+            }
+            if (Date.now() > deadline) {
+                throw new Error(`Backup registry is locked: ${mutexFile}`);
+            }
+            await sleep(50);
+        }
+    }
+
     async updateBackupRegistry(backupInfo) {
         const registryFile = path.join(this.backupDir, 'backup_registry.json');
-        
+        const mutexFile = path.join(this.backupDir, REGISTRY_MUTEX);
+
+        try {
+            await this.acquireRegistryMutex(mutexFile);
+        } catch (error) {
+            console.error('Failed to update backup registry:', error);
+            return;
+        }
         try {
             let registry = [];
             
             try {
                 const data = await fs.readFile(registryFile, 'utf8');
-                registry = JSON.parse(data);
+                // PowerShell writes the file with a byte order mark
+                registry = JSON.parse(data.replace(/^\uFEFF/, ''));
             } catch (error) {
                 // File doesn't exist or is invalid, start fresh
                 console.error('Failed to read backup registry file:', error);
             }
 
+            // The scheduled task writes a single object rather than a list
+            if (!Array.isArray(registry)) {
+                registry = [registry];
+            }
             registry.push(backupInfo);
-            await fs.writeFile(registryFile, JSON.stringify(registry, null, 2));
+
+            // Replace the file in one step so readers never see it half-written
+            const tempFile = `${registryFile}.tmp`;
+            await fs.writeFile(tempFile, JSON.stringify(registry, null, 2));
+            await fs.rename(tempFile, registryFile);
 
         } catch (error) {
             console.error('Failed to update backup registry:', error);
+        } finally {
+            await fs.unlink(mutexFile).catch(() => {});
         }
     }
 
@@ -165,7 +332,7 @@ class BackupScheduler {
 
             const files = await fs.readdir(this.backupDir);
             const backupFiles = files.filter(file => 
-                file.startsWith(`${schedule}_backup_`) && file.endsWith('.sql')
+                file.startsWith(`${schedule}_backup_`) && /\.sql(\.gz|\.zst)?$/.test(file)
             );
 
             let deletedCount = 0;
@@ -176,6 +343,10 @@ class BackupScheduler {
 
                 if (stats.mtime < cutoffDate) {
                     await fs.unlink(filepath);
+                    // Section index cached by selective table restores
+                    await fs.unlink(`${filepath}.index.json`).catch(() => {});
+                    // Row-count / checksum manifest used to verify restores
+                    await fs.unlink(`${filepath}.manifest.json`).catch(() => {});
                     await this.log(logFile, `Deleted old backup: ${file}`);
                     deletedCount++;
                 }
@@ -185,6 +356,15 @@ class BackupScheduler {
                 await this.log(logFile, `Cleanup completed: deleted ${deletedCount} old backup(s)`);
             }
 
+            if (this.dedup) {
+                // Drops expired chunk lists, then the chunks no remaining backup uses
+                const pruned = await this.runChunkStore(
+                    ['prune', '--days', String(retentionDays), '--prefix', `${schedule}_backup_`], logFile);
+                if (pruned !== null) {
+                    await this.log(logFile, `Chunk store retention applied (${retentionDays} days)`);
+                }
+            }
+
         } catch (error) {
             await this.log(logFile, `Cleanup error: ${error.message}`, 'WARNING');
         }
@@ -0,0 +1,386 @@
+const fs = require('fs');
+const os = require('os');
+const path = require('path');
+const crypto = require('crypto');
+
+// Shared with db/restore_coordinator.py - keep the two in step
+const QUEUE_FILE = 'restore_queue.json';
+const QUEUE_MUTEX = 'restore_queue.json.lock';
+const LOCK_FILE = 'restore.lock';
+// pg_advisory_lock key held on the maintenance database while a restore runs
+const ADVISORY_LOCK_KEY = 0x52455354; // 'REST'
+// Queue edits take milliseconds; a mutex file older than this was abandoned
+const MUTEX_STALE_MS = 30000;
+const HISTORY_SIZE = 20;
+
+const sleep = (ms) => new Promise(resolve => setTimeout(resolve, ms));
+
+// Local timestamp in the same shape as Python's datetime.isoformat()
+function now() {
+    const date = new Date();
+    return new Date(date.getTime() - date.getTimezoneOffset() * 60000).toISOString().replace('Z', '');
+}
+
+function processAlive(pid) {
+    try {
+        process.kill(pid, 0);
+        return true;
+    } catch (error) {
+        return error.code === 'EPERM';
+    }
+}
+
+function jobId() {
+    const stamp = now().slice(0, 19).replace(/-/g, '').replace('T', '_').replace(/:/g, '');
+    return `${stamp}_${crypto.randomBytes(3).toString('hex')}`;
+}
+
+/**
+ * Serializes restores started from any entry point (restore.py,
+ * safe_restore.py and the backend endpoints).
+ *
+ * Jobs are appended to a queue file in the backups directory and run in
+ * submission order. The job at the head of the queue starts once it holds
+ * both the lock file (which works while PostgreSQL is down) and a
+ * session-level advisory lock on the maintenance database (which cannot
+ * outlive a crashed holder). A submission for a backup and target that is
+ * already queued or running is merged into that job and waits for its
+ * result instead of restoring the same backup twice.
+ */
+class RestoreCoordinator {
+    constructor(backupsDir, options = {}) {
+        this.backupsDir = backupsDir;
+        this.pollInterval = options.pollInterval || 1000;
+        this.dbConfig = options.dbConfig || {
+            user: process.env.DB_USER || 'postgres',
+            host: process.env.DB_HOST || 'localhost',
+            password: process.env.DB_PASSWORD || 'hengmengly123',
+            port: process.env.DB_PORT || 5432
+        };
+        this.database = options.database || process.env.DB_NAME || 'ecommerce_db';
+        this.queueFile = path.join(backupsDir, QUEUE_FILE);
+        this.mutexFile = path.join(backupsDir, QUEUE_MUTEX);
+        this.lockFile = path.join(backupsDir, LOCK_FILE);
+        this.host = os.hostname();
+        // Advisory lock sessions of the jobs this process is running
+        this.advisoryClients = new Map();
+    }
+
+    // Queue file
+
+    async acquireMutex(timeoutMs = 10000) {
+        const deadline = Date.now() + timeoutMs;
+        for (;;) {
+            try {
+                fs.writeFileSync(this.mutexFile, String(process.pid), { flag: 'wx' });
+                return;
+            } catch (error) {
+                if (error.code !== 'EEXIST') {
+                    throw error;
+                }
+            }
+            try {
+                if (Date.now() - fs.statSync(this.mutexFile).mtimeMs > MUTEX_STALE_MS) {
+                    fs.unlinkSync(this.mutexFile);
+                    continue;
+                }
+            } catch (error) {
+                continue;
+            }
+            if (Date.now() > deadline) {
+                throw new Error(`Restore queue is locked: ${this.mutexFile}`);
+            }
+            await sleep(50);
+        }
+    }
+
+    load() {
+        let state = {};
+        try {
+            state = JSON.parse(fs.readFileSync(this.queueFile, 'utf8'));
+        } catch (error) {
+            state = {};
+        }
+        state.jobs = state.jobs || [];
+        state.history = state.history || [];
+        return state;
+    }
+
+    save(state) {
+        const tempFile = `${this.queueFile}.tmp`;
+        fs.writeFileSync(tempFile, JSON.stringify(state, null, 2));
+        fs.renameSync(tempFile, this.queueFile);
+    }
+
+    // Apply change(state) to the queue under the mutex; returns its result
+    async update(change) {
+        await this.acquireMutex();
+        try {
+            const state = this.load();
+            this.prune(state);
+            const result = change(state);
+            this.save(state);
+            return result;
+        } finally {
+            try {
+                fs.unlinkSync(this.mutexFile);
+            } catch (error) {
+                // Already gone
+            }
+        }
+    }
+
+    isOrphaned(job) {
+        return job.host === this.host && !processAlive(job.pid);
+    }
+
+    // Drop jobs whose process died without finishing them
+    prune(state) {
+        for (const job of [...state.jobs]) {
+            if (this.isOrphaned(job)) {
+                state.jobs.splice(state.jobs.indexOf(job), 1);
+                Object.assign(job, {
+                    status: 'abandoned',
+                    finished_at: now(),
+                    message: `Process ${job.pid} exited without finishing the restore`
+                });
+                state.history.push(job);
+            }
+        }
+        state.history = state.history.slice(-HISTORY_SIZE);
+    }
+
+    // Jobs
+
+    jobKey(backupPath, options) {
+        let key = `${fs.realpathSync(backupPath)}|${this.database}`;
+        if (options && Object.keys(options).length) {
+            const sorted = Object.keys(options).sort().reduce((all, name) => ({ ...all, [name]: options[name] }), {});
+            key += `|${JSON.stringify(sorted)}`;
+        }
+        return key;
+    }
+
+    // Queue a restore; merged means an identical job was already pending
+    async submit(backupPath, source, options = null) {
+        const key = this.jobKey(backupPath, options);
+        return this.update((state) => {
+            const pending = state.jobs.find(job => job.key === key);
+            if (pending) {
+                pending.merged = pending.merged || [];
+                pending.merged.push({ source, pid: process.pid, host: this.host, submitted_at: now() });
+                return { job: pending, merged: true };
+            }
+            const job = {
+                id: jobId(),
+                key,
+                backup_file: fs.realpathSync(backupPath),
+                database: this.database,
+                options: options || {},
+                source,
+                status: 'queued',
+                host: this.host,
+                pid: process.pid,
+                submitted_at: now(),
+                merged: []
+            };
+            state.jobs.push(job);
+            return { job, merged: false };
+        });
+    }
+
+    readLock() {
+        try {
+            return JSON.parse(fs.readFileSync(this.lockFile, 'utf8'));
+        } catch (error) {
+            return null;
+        }
+    }
+
+    takeLockFile(job, advisory) {
+        const holder = this.readLock();
+        if (holder && holder.job_id !== job.id) {
+            // A holder that had the advisory lock keeps it until its session
+            // ends, so getting the lock now means the holder is gone
+            const stale = (holder.host === this.host && !processAlive(holder.pid)) ||
+                (advisory && holder.advisory);
+            if (!stale) {
+                return false;
+            }
+            fs.unlinkSync(this.lockFile);
+        }
+        try {
+            fs.writeFileSync(this.lockFile, JSON.stringify({
+                job_id: job.id,
+                pid: process.pid,
+                host: this.host,
+                backup_file: job.backup_file,
+                advisory,
+                started_at: now()
+            }), { flag: 'wx' });
+            return true;
+        } catch (error) {
+            return false;
+        }
+    }
+
+    // true if taken, false if held elsewhere, null if PostgreSQL is unreachable
+    async tryAdvisoryLock(job) {
+        let client;
+        try {
+            const { Client } = require('pg');
+            client = new Client({ ...this.dbConfig, database: 'postgres', connectionTimeoutMillis: 5000 });
+            await client.connect();
+        } catch (error) {
+            return null;
+        }
+        client.on('error', () => {});
+        const result = await client.query('SELECT pg_try_advisory_lock($1) AS locked', [ADVISORY_LOCK_KEY]);
+        if (result.rows[0].locked) {
+            this.advisoryClients.set(job.id, client);
+            return true;
+        }
+        await client.end();
+        return false;
+    }
+
+    async releaseAdvisoryLock(job) {
+        const client = this.advisoryClients.get(job.id);
+        if (!client) {
+            return;
+        }
+        this.advisoryClients.delete(job.id);
+        try {
+            await client.query('SELECT pg_advisory_unlock($1)', [ADVISORY_LOCK_KEY]);
+            await client.end();
+        } catch (error) {
+            // Ending the session releases the lock anyway
+        }
+    }
+
+    async tryStart(job) {
+        const pending = this.load().jobs.filter(candidate => !this.isOrphaned(candidate));
+        const position = pending.findIndex(candidate => candidate.id === job.id);
+        if (position !== 0) {
+            return { started: false, position: position === -1 ? null : position };
+        }
+
+        const advisory = await this.tryAdvisoryLock(job);
+        if (advisory === false) {
+            return { started: false, position: 0 };
+        }
+        if (!this.takeLockFile(job, advisory === true)) {
+            await this.releaseAdvisoryLock(job);
+            return { started: false, position: 0 };
+        }
+
+        const running = await this.update((state) => {
+            const entry = state.jobs.find(candidate => candidate.id === job.id) || job;
+            Object.assign(entry, { status: 'running', started_at: now() });
+            return entry;
+        });
+        Object.assign(job, running);
+        return { started: true, position: 0, guardedByFileOnly: advisory === null };
+    }
+
+    // Wait until the job is first in the queue and holds both locks
+    async waitTurn(job, onWait = () => {}) {
+        let lastPosition = null;
+        for (;;) {
+            const { started, position, guardedByFileOnly } = await this.tryStart(job);
+            if (started) {
+                if (guardedByFileOnly) {
+                    onWait('PostgreSQL unreachable - restore is guarded by the lock file only');
+                }
+                return job;
+            }
+            if (position === null) {
+                throw new Error(`Restore job ${job.id} is no longer queued`);
+            }
+            if (position !== lastPosition) {
+                onWait(`Restore job ${job.id} waiting: ${position === 0 ? 'a restore is running' : `${position} job(s) ahead`}`);
+                lastPosition = position;
+            }
+            await sleep(this.pollInterval);
+        }
+    }
+
+    // Record the outcome, release both locks and move the job to the history
+    async finish(job, success, message = null) {
+        if (job.finishing) {
+            return job;
+        }
+        job.finishing = true;
+        try {
+            const finished = await this.update((state) => {
+                const index = state.jobs.findIndex(candidate => candidate.id === job.id);
+                const entry = index === -1 ? { ...job } : state.jobs.splice(index, 1)[0];
+                delete entry.finishing;
+                Object.assign(entry, {
+                    status: success ? 'completed' : 'failed',
+                    finished_at: now(),
+                    message: message ? String(message).slice(0, 2000) : null
+                });
+                if (index !== -1) {
+                    state.history.push(entry);
+                    state.history = state.history.slice(-HISTORY_SIZE);
+                }
+                return entry;
+            });
+            Object.assign(job, finished);
+        } finally {
+            const holder = this.readLock();
+            if (holder && holder.job_id === job.id) {
+                fs.unlinkSync(this.lockFile);
+            }
+            await this.releaseAdvisoryLock(job);
+        }
+        return job;
+    }
+
+    // Withdraw a job that has not started
+    async cancel(job) {
+        await this.update((state) => {
+            state.jobs = state.jobs.filter(candidate => candidate.id !== job.id || candidate.status === 'running');
+        });
+    }
+
+    // Wait until the job has finished; resolves to its final record
+    async waitFor(id) {
+        for (;;) {
+            // Pruned on every poll: a runner that died never finishes its job
+            const state = this.load();
+            this.prune(state);
+            const finished = state.history.find(job => job.id === id);
+            if (finished) {
+                return finished;
+            }
+            if (!state.jobs.some(job => job.id === id)) {
+                return { id, status: 'unknown', message: 'Job disappeared from the queue' };
+            }
+            await sleep(this.pollInterval);
+        }
+    }
+
+    // Running and queued jobs plus recent history, for polling
+    status() {
+        const state = this.load();
+        this.prune(state);
+        return {
+            running: state.jobs.find(job => job.status === 'running') || null,
+            queued: state.jobs.filter(job => job.status === 'queued'),
+            history: [...state.history].reverse(),
+            lock: this.readLock()
+        };
+    }
+
+    job(id) {
+        const { running, queued, history } = this.status();
+        return [running, ...queued, ...history].find(job => job && job.id === id) || null;
+    }
+}
+
+module.exports = {
+    RestoreCoordinator,
+    ADVISORY_LOCK_KEY
+};
@@ -0,0 +1,298 @@
+#!/usr/bin/env python3
+"""
+Archive TOC Reader
+Reads entry sizes from pg_dump -Fc and -Fd archives and builds largest-first restore lists
+"""
+
+import os
+import json
+import re
+import subprocess
+
+ARCHIVE_MAGIC = b'PGDMP'
+
+# Archive versions this reader understands (pg_dump 9.x through 17)
+MIN_ARCHIVE_VERSION = (1, 12)
+MAX_ARCHIVE_VERSION = (1, 16)
+
+# ReadOffset flags and archive formats from pg_backup_archiver.h
+OFFSET_POS_SET = 2
+FORMAT_CUSTOM = 1
+FORMAT_DIRECTORY = 3
+
+# A directory-format archive is a directory holding this TOC file plus one
+# data file per table
+DIRECTORY_TOC = 'toc.dat'
+DATA_FILE_SUFFIXES = ('', '.gz', '.lz4', '.zst')
+
+# Entry types whose slots in the list are reordered by weight; everything
+# else keeps pg_dump's dependency-safe order
+DATA_ENTRY_TYPES = {'TABLE DATA', 'MATERIALIZED VIEW DATA'}
+BUILD_ENTRY_TYPES = {'INDEX', 'CONSTRAINT'}
+
+# Table a post-data statement is built on, e.g. "CREATE INDEX x ON public.users"
+# or "ALTER TABLE ONLY public.users ADD CONSTRAINT ..."
+TARGET_TABLE_PATTERN = re.compile(r'(?: ON (?:ONLY )?|^ALTER TABLE (?:ONLY )?)([^\s(]+)', re.MULTILINE)
+
+
+class ArchiveFormatError(Exception):
+    """Raised when a file is not a custom- or directory-format archive this reader supports"""
+
+
+class TocEntry:
+    """One archive TOC entry with the size of its data block (if any)"""
+
+    def __init__(self, dump_id, desc, tag, namespace, defn, data_offset, data_file=None):
+        self.dump_id = dump_id
+        self.desc = desc
+        self.tag = tag
+        self.namespace = namespace
+        self.defn = defn
+        self.data_offset = data_offset
+        self.data_file = data_file
+        self.data_size = 0
+
+    @property
+    def table(self):
+        return f"{self.namespace}.{self.tag}" if self.namespace else self.tag
+
+    def target_table(self):
+        """Table an INDEX or CONSTRAINT is built on, taken from its definition"""
+        match = TARGET_TABLE_PATTERN.search(self.defn or '')
+        return match.group(1).replace('"', '') if match else None
+
+
+class _ArchiveReader:
+    """Minimal reader for the integer/string/offset encoding of pg_dump archives"""
+
+    def __init__(self, f):
+        self.f = f
+        self.int_size = 4
+        self.off_size = 8
+
+    def byte(self):
+        data = self.f.read(1)
+        if not data:
+            raise ArchiveFormatError("Unexpected end of archive header")
+        return data[0]
+
+    def read_int(self):
+        sign = self.byte()
+        data = self.f.read(self.int_size)
+        value = int.from_bytes(data, 'little')
+        return -value if sign else value
+
+    def read_str(self):
+        length = self.read_int()
+        if length < 0:
+            return None
+        return self.f.read(length).decode('utf-8', errors='replace')
+
+    def read_offset(self):
+        flag = self.byte()
+        value = int.from_bytes(self.f.read(self.off_size), 'little')
+        return value if flag == OFFSET_POS_SET else None
+
+
+def is_directory_archive(path):
+    """True for a pg_dump -Fd directory (detected by its toc.dat)"""
+    return os.path.isdir(path) and os.path.isfile(os.path.join(path, DIRECTORY_TOC))
+
+
+def is_archive(path):
+    """True for archives restored with pg_restore rather than psql"""
+    return str(path).endswith('.backup') or is_directory_archive(path)
+
+
+def archive_size(path):
+    """
+    Size of a backup on disk; for a directory archive, the sum of its files.
+
+    A chunk list of the deduplicating store shares its chunks with other
+    backups, so it reports the size of the dump it reassembles to.
+    """
+    if str(path).endswith('.sql.chunks'):
+        with open(path, 'r') as f:
+            return json.load(f)['size']
+    if not os.path.isdir(path):
+        return os.path.getsize(path)
+    return sum(entry.stat().st_size for entry in os.scandir(path) if entry.is_file())
+
+
+def directory_data_file(directory, name):
+    """Path of a directory archive's data file; pg_dump appends the compression suffix"""
+    for suffix in DATA_FILE_SUFFIXES:
+        path = os.path.join(directory, name + suffix)
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def read_archive_toc(backup_file):
+    """
+    Parse the TOC of a custom- or directory-format archive.
+
+    Returns TocEntry objects in archive order; `data_size` is the number of
+    (compressed) bytes restoring the entry has to read: up to the next data
+    block in a custom archive, the size of the entry's data file in a
+    directory archive. Raises ArchiveFormatError for other formats and for
+    custom archives written to a pipe, whose data offsets are unknown.
+    """
+    directory = str(backup_file) if is_directory_archive(backup_file) else None
+    toc_file = os.path.join(directory, DIRECTORY_TOC) if directory else backup_file
+    with open(toc_file, 'rb') as f:
+        if f.read(5) != ARCHIVE_MAGIC:
+            raise ArchiveFormatError("Not a pg_dump archive")
+        reader = _ArchiveReader(f)
+        version = (reader.byte(), reader.byte())
+        reader.byte()  # revision
+        if not MIN_ARCHIVE_VERSION <= version <= MAX_ARCHIVE_VERSION:
+            raise ArchiveFormatError(f"Unsupported archive version {version[0]}.{version[1]}")
+
+        reader.int_size = reader.byte()
+        reader.off_size = reader.byte()
+        archive_format = reader.byte()
+        if archive_format != (FORMAT_DIRECTORY if directory else FORMAT_CUSTOM):
+            raise ArchiveFormatError("Not a custom- or directory-format archive")
+
+        if version >= (1, 15):
+            reader.byte()  # compression algorithm
+        else:
+            reader.read_int()  # compression level
+        for _ in range(7):
+            reader.read_int()  # creation time
+        reader.read_str()  # database name
+        reader.read_str()  # server version
+        reader.read_str()  # pg_dump version
+
+        entries = []
+        for _ in range(reader.read_int()):
+            dump_id = reader.read_int()
+            reader.read_int()  # had dumper
+            reader.read_str()  # table oid
+            reader.read_str()  # oid
+            tag = reader.read_str()
+            desc = reader.read_str()
+            reader.read_int()  # section
+            defn = reader.read_str()
+            reader.read_str()  # drop statement
+            reader.read_str()  # copy statement
+            namespace = reader.read_str()
+            reader.read_str()  # tablespace
+            if version >= (1, 14):
+                reader.read_str()  # table access method
+            if version >= (1, 16):
+                reader.read_int()  # relkind
+            reader.read_str()  # owner
+            reader.read_str()  # with oids
+            while reader.read_str() is not None:
+                pass  # dependencies
+            if directory:
+                # Directory archives name each entry's data file instead of an offset
+                entries.append(TocEntry(dump_id, desc, tag, namespace, defn, None, reader.read_str() or None))
+            else:
+                entries.append(TocEntry(dump_id, desc, tag, namespace, defn, reader.read_offset()))
+
+    if directory:
+        for entry in entries:
+            path = directory_data_file(directory, entry.data_file) if entry.data_file else None
+            if path:
+                entry.data_size = os.path.getsize(path)
+        return entries
+
+    with_data = sorted((entry for entry in entries if entry.data_offset), key=lambda entry: entry.data_offset)
+    if not with_data and any(entry.desc in DATA_ENTRY_TYPES for entry in entries):
+        raise ArchiveFormatError("Archive has no data offsets (written to a pipe)")
+
+    file_size = os.path.getsize(backup_file)
+    for i, entry in enumerate(with_data):
+        end = with_data[i + 1].data_offset if i + 1 < len(with_data) else file_size
+        entry.data_size = end - entry.data_offset
+    return entries
+
+
+def missing_data_files(directory, entries=None):
+    """Data files a directory archive's TOC refers to that are not on disk"""
+    entries = entries or read_archive_toc(directory)
+    return [entry.data_file for entry in entries
+            if entry.data_file and not directory_data_file(directory, entry.data_file)]
+
+
+def entry_weights(entries):
+    """
+    Estimated processing cost of each entry, keyed by dump id.
+
+    Table data is weighted by its size in the archive; index and constraint
+    builds by the size of the table they scan.
+    """
+    table_sizes = {entry.table: entry.data_size for entry in entries if entry.desc in DATA_ENTRY_TYPES}
+    weights = {}
+    for entry in entries:
+        if entry.desc in DATA_ENTRY_TYPES:
+            weights[entry.dump_id] = entry.data_size
+        elif entry.desc in BUILD_ENTRY_TYPES:
+            weights[entry.dump_id] = table_sizes.get(entry.target_table(), 0)
+    return weights
+
+
+def largest_first_list(backup_file, list_output=None, entries=None):
+    """
+    Build a pg_restore -L list that schedules the heaviest work first.
+
+    Table data entries are sorted by size among the positions table data
+    occupies in pg_dump's order, and index/constraint builds likewise, so
+    every other entry (and all dependencies between sections) stay where
+    pg_dump put them. With several jobs this is longest-processing-time
+    scheduling: the big table or index starts at once instead of last.
+    Returns (list_text, weights).
+    """
+    entries = entries or read_archive_toc(backup_file)
+    weights = entry_weights(entries)
+    types = {entry.dump_id: entry.desc for entry in entries}
+
+    if list_output is None:
+        list_output = subprocess.run(['pg_restore', '-l', str(backup_file)],
+                                     capture_output=True, text=True, check=True).stdout
+
+    lines = list_output.splitlines()
+    for group in (DATA_ENTRY_TYPES, BUILD_ENTRY_TYPES):
+        slots = []
+        for i, line in enumerate(lines):
+            if line.startswith(';') or ';' not in line:
+                continue
+            dump_id = int(line.split(';', 1)[0])
+            if types.get(dump_id) in group:
+                slots.append((i, dump_id))
+        ordered = sorted(slots, key=lambda slot: weights.get(slot[1], 0), reverse=True)
+        original = [lines[i] for i, _ in ordered]
+        for (i, _), line in zip(slots, original):
+            lines[i] = line
+
+    return '\n'.join(lines) + '\n', weights
+
+
+def recommended_jobs(entries=None, cpu_count=None):
+    """Parallel restore jobs: one per core, but no more than there are tables to load"""
+    cpu_count = cpu_count or os.cpu_count() or 1
+    jobs = cpu_count
+    if entries is not None:
+        tables = sum(1 for entry in entries if entry.desc in DATA_ENTRY_TYPES and entry.data_size)
+        jobs = min(jobs, max(1, tables))
+    return max(1, min(jobs, 8))
+
+
+def schedule_restore(backup_file, list_file, jobs=None):
+    """
+    Write a largest-first restore list for `pg_restore -L` to `list_file`.
+
+    Returns the jobs count to use (`jobs` if given, else one per core
+    capped by the number of tables) and the heaviest table data entries.
+    """
+    entries = read_archive_toc(backup_file)
+    list_text, _ = largest_first_list(backup_file, entries=entries)
+    with open(list_file, 'w') as f:
+        f.write(list_text)
+
+    heaviest = sorted((entry for entry in entries if entry.desc in DATA_ENTRY_TYPES),
+                      key=lambda entry: entry.data_size, reverse=True)
+    return jobs or recommended_jobs(entries), heaviest
@@ -0,0 +1,533 @@
+#!/usr/bin/env python3
+"""
+PostgreSQL Database Backup Script
+Parallel, compressed directory-format dumps with manifests, metadata and registry entries
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import shutil
+import socket
+import logging
+import datetime
+import subprocess
+from pathlib import Path
+from dotenv import load_dotenv
+
+from archive_toc import archive_size, is_directory_archive, recommended_jobs
+from block_compress import METHOD_SUFFIXES, compress_process_output, default_threads, zstd_available
+from chunk_store import ChunkStore, default_store_path, load_chunk_list
+from restore_manifest import dump_with_manifest, manifest_path
+
+# Load environment variables
+load_dotenv()
+
+# Accepted names for each backup type -> type recorded in metadata and registry
+BACKUP_TYPES = {
+    'full': 'complete',
+    'complete': 'complete',
+    'schema': 'schema_only',
+    'schema_only': 'schema_only',
+    'data': 'data_only',
+    'data_only': 'data_only'
+}
+
+# File name prefixes the restore tools recognise for each type
+BACKUP_PREFIXES = {
+    'complete': 'ecommerce_backup_',
+    'schema_only': 'ecommerce_schema_',
+    'data_only': 'ecommerce_data_'
+}
+
+DIRECTORY_SUFFIX = '.dir'
+EXPORT_SUFFIX = '.export'
+INCREMENTAL_SUFFIX = '.incr'
+PLAIN_SUFFIX = '.sql'
+BACKUP_METHODS = ('pg_dump', 'export', 'plain', 'incremental')
+COMPRESSION_METHODS = ('gzip', 'zstd', 'lz4', 'none')
+
+REGISTRY_FILE = 'backup_registry.json'
+REGISTRY_MUTEX = 'backup_registry.json.lock'
+# Registry edits take milliseconds; a mutex file older than this was abandoned
+MUTEX_STALE_SECONDS = 30
+
+
+class DatabaseBackup:
+    """
+    Takes backups as pg_dump directory-format archives, or with
+    method 'export' as a parallel COPY export (see parallel_export.py),
+    or with method 'plain' as a plain SQL dump compressed in blocks on
+    one thread per CPU (see block_compress.py). With `dedup`, plain dumps
+    are moved into the deduplicating chunk store (see chunk_store.py).
+    Method 'incremental' exports only the rows changed since the previous
+    full backup's chain (see incremental_backup.py), starting a new chain
+    with a full export every `chain_length` incrementals.
+
+    Tables are dumped by `jobs` parallel pg_dump workers, each compressing
+    its own data file. Full and data-only backups run from a snapshot
+    exported by a transaction held open for the dump, and the per-table
+    manifest the restore tools verify against is captured from the same
+    snapshot.
+
+    The archive is written under a temporary name and renamed when
+    pg_dump has finished, so a partial directory is never listed as a
+    backup. A metadata file (<name>.json) is written next to every
+    attempt, and successful backups are appended to backup_registry.json
+    under a lock with an atomic replace.
+    """
+
+    def __init__(self):
+        # Load environment variables from backend directory
+        backend_env_path = os.path.join(os.path.dirname(__file__), '..', 'backend', '.env')
+        if os.path.exists(backend_env_path):
+            load_dotenv(backend_env_path)
+
+        self.db_config = {
+            'host': os.getenv('DB_HOST', 'localhost'),
+            'port': os.getenv('DB_PORT', '5432'),
+            'database': os.getenv('DB_NAME', 'ecommerce_db'),
+            'user': os.getenv('DB_USER', 'postgres'),
+            'password': os.getenv('DB_PASSWORD', 'password')
+        }
+
+        backup_path = os.getenv('BACKUP_PATH', '../backups')
+        if backup_path.startswith('/') and os.name == 'nt':  # Unix-style path on Windows
+            backup_path = '../backups'
+        elif not os.path.isabs(backup_path):
+            backup_path = os.path.join(os.path.dirname(__file__), backup_path)
+
+        self.backup_config = {
+            'backup_path': os.path.abspath(backup_path),
+            # pg_dump (directory archive) | export (parallel COPY) | plain (block-compressed SQL)
+            # | incremental (changed rows since the last chain link)
+            'method': os.getenv('BACKUP_METHOD', 'pg_dump'),
+            # Incrementals taken on one full export before the next full one
+            'chain_length': int(os.getenv('BACKUP_CHAIN_LENGTH', '7')),
+            'jobs': None,  # one per core unless set
+            'compression': os.getenv('BACKUP_COMPRESSION', 'gzip'),  # gzip | zstd | lz4 | none
+            'compression_level': int(os.getenv('BACKUP_COMPRESSION_LEVEL', '6')),
+            # Plain dumps go into the deduplicating chunk store (chunk_store.py)
+            'dedup': os.getenv('BACKUP_DEDUP', 'false').lower() == 'true',
+            'capture_manifest': True,
+            'manifest_jobs': 4,
+            'timeout_minutes': 60,
+            'created_by': 'backup.py'
+        }
+
+        # Metadata of the last backup attempt
+        self.last_backup = None
+
+        self.setup_logging()
+
+    def setup_logging(self):
+        """Setup logging configuration"""
+        os.makedirs(self.backup_config['backup_path'], exist_ok=True)
+
+        logging.basicConfig(
+            level=logging.INFO,
+            format='%(asctime)s - %(levelname)s - %(message)s',
+            handlers=[
+                logging.FileHandler(f"{self.backup_config['backup_path']}/backup.log"),
+                logging.StreamHandler(sys.stdout)
+            ]
+        )
+        self.logger = logging.getLogger(__name__)
+
+    def pg_dump_major_version(self):
+        try:
+            result = subprocess.run(['pg_dump', '--version'], capture_output=True, text=True)
+            match = re.search(r'(\d+)', result.stdout)
+            return int(match.group(1)) if match else None
+        except OSError:
+            return None
+
+    def compression_args(self):
+        """pg_dump options for the configured compression; (args, description for metadata)"""
+        method = self.backup_config['compression']
+        level = self.backup_config['compression_level']
+        if method not in COMPRESSION_METHODS:
+            self.logger.warning(f"Unknown compression '{method}' - using gzip")
+            method = 'gzip'
+        if method == 'none':
+            return ['--compress=0'], False
+        if method != 'gzip':
+            # zstd and lz4 need the method:level syntax of pg_dump 16
+            version = self.pg_dump_major_version()
+            if version is None or version < 16:
+                self.logger.warning(f"pg_dump {version or 'unknown'} cannot write {method} - using gzip")
+                method = 'gzip'
+            else:
+                return [f'--compress={method}:{level}'], f"{method}:{level}"
+        level = max(0, min(level, 9))
+        return [f'--compress={level}'], f"gzip:{level}"
+
+    def build_dump_command(self, backup_type, output_dir, jobs, compression):
+        cmd = [
+            'pg_dump',
+            '-h', self.db_config['host'],
+            '-p', self.db_config['port'],
+            '-U', self.db_config['user'],
+            '-d', self.db_config['database'],
+            '--no-password'
+        ]
+        if output_dir:
+            cmd += ['--format=directory', f'--jobs={jobs}', '-f', output_dir] + compression
+        else:
+            # Plain SQL on stdout
+            cmd += ['--format=plain', '--no-owner', '--no-privileges']
+        if backup_type == 'schema_only':
+            cmd.append('--schema-only')
+        elif backup_type == 'data_only':
+            cmd.append('--data-only')
+        return cmd
+
+    def run_pg_dump(self, kind, backup_file, jobs):
+        """pg_dump -Fd into `backup_file`; returns (success, error, compression label)"""
+        temp_dir = f"{backup_file}.tmp"
+        compression, compression_label = self.compression_args()
+        cmd = self.build_dump_command(kind, temp_dir, jobs, compression)
+        timeout = self.backup_config['timeout_minutes'] * 60
+        try:
+            env = os.environ.copy()
+            env['PGPASSWORD'] = self.db_config['password']
+            # Schema-only archives hold no rows for a manifest to describe
+            if kind != 'schema_only' and self.backup_config['capture_manifest']:
+                result = dump_with_manifest(self.db_config, cmd, backup_file, self.logger,
+                                            jobs=self.backup_config['manifest_jobs'], timeout=timeout)
+            else:
+                result = subprocess.run(cmd, env=env, capture_output=True, text=True, timeout=timeout)
+
+            if result.returncode == 0 and is_directory_archive(temp_dir):
+                os.rename(temp_dir, backup_file)
+                return True, None, compression_label
+            error = (result.stderr or f"pg_dump exited with code {result.returncode}").strip()[-2000:]
+        except subprocess.TimeoutExpired:
+            error = f"pg_dump timed out after {self.backup_config['timeout_minutes']} minutes"
+        finally:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+
+        if compression_label and not compression_label.startswith('gzip') and 'does not support compression' in error:
+            # pg_dump built without zstd/lz4; gzip is always available
+            self.logger.warning(f"{error} - retrying with gzip")
+            self.backup_config['compression'] = 'gzip'
+            return self.run_pg_dump(kind, backup_file, jobs)
+        return False, error, compression_label
+
+    def plain_compression(self):
+        """Block compression method for plain dumps: gzip, zstd or None"""
+        method = self.backup_config['compression']
+        if method == 'none':
+            return None
+        if method == 'zstd' and zstd_available():
+            return 'zstd'
+        if method != 'gzip':
+            self.logger.warning(f"Plain dumps cannot be compressed with {method} here - using gzip")
+        return 'gzip'
+
+    def run_plain_dump(self, kind, backup_file, jobs, method):
+        """pg_dump plain SQL, block-compressed with `method` on `jobs` threads; returns (success, error, compression label)"""
+        level = self.backup_config['compression_level']
+        temp_file = f"{backup_file}.tmp"
+        cmd = self.build_dump_command(kind, None, jobs, None)
+        timeout = self.backup_config['timeout_minutes'] * 60
+
+        def runner(cmd, env):
+            if not method:
+                return subprocess.run(cmd + ['-f', temp_file], env=env, capture_output=True, text=True, timeout=timeout)
+            return compress_process_output(cmd, temp_file, method, level, threads=jobs, env=env, timeout=timeout)
+
+        try:
+            env = os.environ.copy()
+            env['PGPASSWORD'] = self.db_config['password']
+            if kind != 'schema_only' and self.backup_config['capture_manifest']:
+                result = dump_with_manifest(self.db_config, cmd, backup_file, self.logger,
+                                            jobs=self.backup_config['manifest_jobs'], runner=runner)
+            else:
+                result = runner(cmd, env)
+
+            if result.returncode == 0:
+                os.replace(temp_file, backup_file)
+                return True, None, f"{method}:{level}" if method else False
+            error = (result.stderr or f"pg_dump exited with code {result.returncode}").strip()[-2000:]
+        except subprocess.TimeoutExpired:
+            error = f"pg_dump timed out after {self.backup_config['timeout_minutes']} minutes"
+        finally:
+            if os.path.exists(temp_file):
+                os.remove(temp_file)
+        return False, error, f"{method}:{level}" if method else False
+
+    def store_deduplicated(self, backup_file, jobs):
+        """Move a finished plain dump into the chunk store; returns the chunk list path"""
+        store = ChunkStore(default_store_path(self.backup_config['backup_path']), self.logger,
+                           level=self.backup_config['compression_level'], threads=jobs)
+        return store.add(backup_file, remove_source=True)
+
+    def run_export(self, kind, backup_file, jobs):
+        """Parallel COPY export from one snapshot; returns (success, error, compression label)"""
+        from parallel_export import ParallelExport
+        level = self.backup_config['compression_level'] if self.backup_config['compression'] != 'none' else 0
+        exporter = ParallelExport(self.db_config, self.logger, jobs=jobs, compression_level=level)
+        index = exporter.export(backup_file, schema=(kind == 'complete'),
+                                manifest=self.backup_config['capture_manifest'])
+        return True, None, index['compression']
+
+    def incremental_parent(self):
+        """Newest full or incremental backup the next incremental builds on, or None to start a chain"""
+        from incremental_backup import is_incremental, latest_chain_link, load_incremental_index
+        parent = latest_chain_link(self.backup_config['backup_path'])
+        if not parent or not os.path.basename(parent).startswith(BACKUP_PREFIXES['complete']):
+            return None
+        if is_incremental(parent) and load_incremental_index(parent)['depth'] >= self.backup_config['chain_length']:
+            self.logger.info(f"Chain of {os.path.basename(parent)} is {self.backup_config['chain_length']} "
+                             f"incrementals long - starting a new one")
+            return None
+        return parent
+
+    def run_incremental(self, backup_file, jobs):
+        """
+        Incremental on the newest chain link, or a full export starting a chain.
+
+        Returns (success, error, compression label, path): incrementals are
+        written to `backup_file` with the .incr suffix instead of .export.
+        """
+        from incremental_backup import IncrementalBackup, IncrementalBackupError
+        level = self.backup_config['compression_level'] if self.backup_config['compression'] != 'none' else 0
+        backup = IncrementalBackup(self.db_config, self.logger, jobs=jobs, compression_level=level)
+        manifest = self.backup_config['capture_manifest']
+        parent = self.incremental_parent()
+        if parent:
+            incremental_file = backup_file[:-len(EXPORT_SUFFIX)] + INCREMENTAL_SUFFIX
+            try:
+                backup.incremental(incremental_file, parent, manifest=manifest)
+                return True, None, f"gzip:{level}" if level else False, incremental_file
+            except IncrementalBackupError as e:
+                self.logger.warning(f"{e} - taking a full export instead")
+        index = backup.full(backup_file, manifest=manifest)
+        return True, None, index['compression'], backup_file
+
+    def perform_backup(self, backup_type='full', description=None):
+        """
+        Dump the database as `backup_type` (full, schema or data).
+
+        Returns the path of the finished backup, or None on failure.
+        """
+        kind = BACKUP_TYPES.get(backup_type)
+        if not kind:
+            self.logger.error(f"Unknown backup type: {backup_type} (expected one of {', '.join(BACKUP_TYPES)})")
+            return None
+
+        method = self.backup_config['method']
+        if method not in BACKUP_METHODS:
+            self.logger.warning(f"Unknown backup method '{method}' - using pg_dump")
+            method = 'pg_dump'
+        if method == 'export' and kind == 'schema_only':
+            # A schema-only backup has no rows to export in parallel
+            method = 'pg_dump'
+        if method == 'incremental' and kind != 'complete':
+            # Chains replay onto a full export, so they only hold full backups
+            method = 'pg_dump'
+
+        timestamp = datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
+        dedup = method == 'plain' and self.backup_config['dedup']
+        if method == 'plain':
+            # The chunk store compresses chunks itself
+            compression = None if dedup else self.plain_compression()
+            suffix = PLAIN_SUFFIX + (METHOD_SUFFIXES[compression] if compression else '')
+            # Compression threads are CPU-bound, not connection-bound
+            jobs = self.backup_config['jobs'] or default_threads()
+        else:
+            suffix = EXPORT_SUFFIX if method in ('export', 'incremental') else DIRECTORY_SUFFIX
+            jobs = self.backup_config['jobs'] or recommended_jobs()
+        backup_file = os.path.join(self.backup_config['backup_path'], f"{BACKUP_PREFIXES[kind]}{timestamp}{suffix}")
+
+        self.logger.info(f"Starting {kind} backup of '{self.db_config['database']}' "
+                         f"({method}, {jobs} jobs): {backup_file}")
+        start_time = time.time()
+        compression_label = None
+        try:
+            if method == 'export':
+                success, error, compression_label = self.run_export(kind, backup_file, jobs)
+            elif method == 'incremental':
+                success, error, compression_label, backup_file = self.run_incremental(backup_file, jobs)
+            elif method == 'plain':
+                success, error, compression_label = self.run_plain_dump(kind, backup_file, jobs, compression)
+                if success and dedup:
+                    backup_file = self.store_deduplicated(backup_file, jobs)
+                    compression_label = f"chunks:{load_chunk_list(backup_file)['compression']}"
+            else:
+                success, error, compression_label = self.run_pg_dump(kind, backup_file, jobs)
+        except Exception as e:
+            success, error = False, str(e)
+
+        duration = time.time() - start_time
+        if not success:
+            self.logger.error(f"Backup failed after {duration:.2f} seconds: {error}")
+            try:
+                os.remove(manifest_path(backup_file))
+            except OSError:
+                pass
+
+        metadata = {
+            'backup_file': os.path.basename(backup_file),
+            'backup_type': kind,
+            'format': 'chunked_sql' if dedup else 'incremental' if backup_file.endswith(INCREMENTAL_SUFFIX) else {
+                'export': 'copy_export',
+                'incremental': 'copy_export',
+                'plain': 'compressed_sql' if compression_label else 'plain_sql'}.get(method, 'directory'),
+            'success': success,
+            'compression': compression_label,
+            'jobs': jobs,
+            'database': self.db_config['database'],
+            'host': self.db_config['host'],
+            'timestamp': datetime.datetime.now().isoformat(),
+            'duration_seconds': round(duration, 2),
+            'file_size': archive_size(backup_file) if success else 0,
+            'manifest': os.path.basename(manifest_path(backup_file)) if os.path.exists(manifest_path(backup_file)) else None,
+            'description': description,
+            'error': error
+        }
+        self.last_backup = metadata
+        self.save_metadata(backup_file, metadata)
+
+        if not success:
+            return None
+
+        self.register_backup(backup_file, metadata)
+        self.logger.info(
+            f"Backup completed in {duration:.2f} seconds: {backup_file} "
+            f"({metadata['file_size'] / (1024 * 1024):.2f} MB, {compression_label or 'uncompressed'})"
+        )
+        return backup_file
+
+    def create_backup(self, backup_type='complete', description=None):
+        """Alias of perform_backup for callers that name the type 'complete'"""
+        return self.perform_backup(backup_type, description)
+
+    def save_metadata(self, backup_file, metadata):
+        """Write <name>.json next to the archive, where the restore tools look for it"""
+        metadata_file = Path(backup_file).with_suffix('.json')
+        temp_file = f"{metadata_file}.tmp"
+        try:
+            with open(temp_file, 'w') as f:
+                json.dump(metadata, f, indent=2)
+            os.replace(temp_file, metadata_file)
+        except OSError as e:
+            self.logger.error(f"Failed to save backup metadata: {e}")
+
+    def _acquire_registry_mutex(self, mutex_file, timeout=10):
+        deadline = time.time() + timeout
+        while True:
+            try:
+                fd = os.open(mutex_file, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+                with os.fdopen(fd, 'w') as f:
+                    f.write(f"{socket.gethostname()}:{os.getpid()}")
+                return
+            except FileExistsError:
+                pass
+            try:
+                if time.time() - os.path.getmtime(mutex_file) > MUTEX_STALE_SECONDS:
+                    os.remove(mutex_file)
+                    continue
+            except OSError:
+                continue
+            if time.time() > deadline:
+                raise TimeoutError(f"Backup registry is locked: {mutex_file}")
+            time.sleep(0.05)
+
+    def register_backup(self, backup_file, metadata):
+        """Append the backup to backup_registry.json without ever leaving it half-written"""
+        registry_file = os.path.join(self.backup_config['backup_path'], REGISTRY_FILE)
+        mutex_file = os.path.join(self.backup_config['backup_path'], REGISTRY_MUTEX)
+        entry = {
+            'filename': os.path.basename(backup_file),
+            'filepath': backup_file,
+            'type': metadata['backup_type'],
+            'format': metadata['format'],
+            'size': metadata['file_size'],
+            'compression': metadata['compression'],
+            'created_at': metadata['timestamp'],
+            'created_by': self.backup_config['created_by'],
+            'description': metadata['description'],
+            'status': 'completed'
+        }
+
+        try:
+            self._acquire_registry_mutex(mutex_file)
+        except (TimeoutError, OSError) as e:
+            self.logger.error(f"Failed to register backup: {e}")
+            return False
+        try:
+            try:
+                with open(registry_file, 'r', encoding='utf-8-sig') as f:
+                    registry = json.load(f)
+            except FileNotFoundError:
+                registry = []
+            # The scheduled task writes a single object, the Node scheduler a list
+            if not isinstance(registry, list):
+                registry = [registry]
+            registry.append(entry)
+
+            temp_file = f"{registry_file}.tmp"
+            with open(temp_file, 'w', encoding='utf-8') as f:
+                json.dump(registry, f, indent=2)
+            os.replace(temp_file, registry_file)
+            return True
+        except (OSError, ValueError) as e:
+            self.logger.error(f"Failed to register backup: {e}")
+            return False
+        finally:
+            try:
+                os.remove(mutex_file)
+            except OSError:
+                pass
+
+
+def main():
+    """Main function to handle command line execution"""
+    import argparse
+
+    parser = argparse.ArgumentParser(description='PostgreSQL Database Backup Tool')
+    parser.add_argument('--type', choices=sorted(BACKUP_TYPES), default='full',
+                        help='What to back up (default: full)')
+    parser.add_argument('--description', help='Free-text note stored with the backup')
+    parser.add_argument('--method', choices=BACKUP_METHODS,
+                        help='pg_dump directory archive, parallel COPY export from one snapshot, '
+                             'plain SQL block-compressed on all cores, or the rows changed since the '
+                             'last backup of an incremental chain (default: pg_dump)')
+    parser.add_argument('--jobs', type=int, help='Parallel dump or compression jobs (default: one per core)')
+    parser.add_argument('--compression', choices=COMPRESSION_METHODS, help='Data file compression (default: gzip)')
+    parser.add_argument('--level', type=int, help='Compression level (default: 6)')
+    parser.add_argument('--dedup', action='store_true',
+                        help='With --method plain, store the dump in the deduplicating chunk store')
+    parser.add_argument('--chain-length', type=int,
+                        help='With --method incremental, incrementals before a new full export (default: 7)')
+    parser.add_argument('--no-manifest', action='store_true', help='Do not capture a per-table manifest')
+    args = parser.parse_args()
+
+    backup_tool = DatabaseBackup()
+    if args.method:
+        backup_tool.backup_config['method'] = args.method
+    if args.jobs:
+        backup_tool.backup_config['jobs'] = args.jobs
+    if args.compression:
+        backup_tool.backup_config['compression'] = args.compression
+    if args.level is not None:
+        backup_tool.backup_config['compression_level'] = args.level
+    if args.dedup:
+        backup_tool.backup_config['dedup'] = True
+    if args.chain_length is not None:
+        backup_tool.backup_config['chain_length'] = args.chain_length
+    backup_tool.backup_config['capture_manifest'] = not args.no_manifest
+
+    backup_file = backup_tool.perform_backup(args.type, args.description)
+    if backup_file:
+        print(backup_file)
+        sys.exit(0)
+    sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
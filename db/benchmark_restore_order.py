@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+Restore Ordering Benchmark
+Times pg_restore with its default TOC order against the largest-first -L list
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import datetime
+import statistics
+import subprocess
+
+from restore import DatabaseRestore
+from archive_toc import schedule_restore
+
+
+def run_restore(restore_tool, backup_file, database, jobs, list_file=None):
+    """Restore the archive into a fresh scratch database and return the elapsed seconds"""
+    restore_tool.run_admin_sql(f'DROP DATABASE IF EXISTS "{database}";')
+    ok, output = restore_tool.run_admin_sql(f'CREATE DATABASE "{database}";')
+    if not ok:
+        raise RuntimeError(f"Could not create benchmark database: {output}")
+
+    env = os.environ.copy()
+    env['PGPASSWORD'] = restore_tool.db_config['password']
+    cmd = [
+        'pg_restore',
+        '-h', restore_tool.db_config['host'],
+        '-p', restore_tool.db_config['port'],
+        '-U', restore_tool.db_config['user'],
+        '-d', database,
+        '--no-password',
+        '--no-owner',
+        f'--jobs={jobs}'
+    ]
+    if list_file:
+        cmd.extend(['-L', list_file])
+    cmd.append(backup_file)
+
+    start = time.time()
+    result = subprocess.run(cmd, env=env, capture_output=True, text=True)
+    duration = time.time() - start
+
+    restore_tool.run_admin_sql(f'DROP DATABASE IF EXISTS "{database}";')
+    if result.returncode != 0:
+        raise RuntimeError(f"pg_restore failed: {result.stderr.strip()}")
+    return duration
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark pg_restore entry ordering')
+    parser.add_argument('backup_file', help='Custom-format (.backup) archive to restore')
+    parser.add_argument('--jobs', default='1,2,4', help='Comma-separated jobs counts to test')
+    parser.add_argument('--rounds', type=int, default=3, help='Restores per configuration')
+    args = parser.parse_args()
+
+    restore_tool = DatabaseRestore()
+    database = f"{restore_tool.db_config['database']}_order_bench"
+    list_file = os.path.join(restore_tool.restore_config['backup_path'], 'restore_order_bench.list')
+    recommended, heaviest = schedule_restore(args.backup_file, list_file)
+
+    print(f"Archive: {args.backup_file}")
+    print(f"Heaviest tables: {', '.join(entry.table for entry in heaviest[:3])}")
+    print(f"Recommended jobs on this host: {recommended} ({os.cpu_count()} cores)")
+    print(f"\n{'jobs':>4}  {'default order':>14}  {'largest first':>14}  {'change':>7}")
+
+    results = []
+    try:
+        for jobs in [int(value) for value in args.jobs.split(',')]:
+            timings = {'default': [], 'largest_first': []}
+            for _ in range(args.rounds):
+                # Alternate so cache warm-up does not favour one ordering
+                timings['default'].append(run_restore(restore_tool, args.backup_file, database, jobs))
+                timings['largest_first'].append(run_restore(restore_tool, args.backup_file, database, jobs, list_file))
+
+            default = statistics.median(timings['default'])
+            largest_first = statistics.median(timings['largest_first'])
+            change = (largest_first - default) / default * 100 if default else 0
+            print(f"{jobs:>4}  {default:>13.2f}s  {largest_first:>13.2f}s  {change:>+6.1f}%")
+            results.append({
+                'jobs': jobs,
+                'default_seconds': timings['default'],
+                'largest_first_seconds': timings['largest_first'],
+                'default_median': default,
+                'largest_first_median': largest_first,
+                'change_percent': round(change, 1)
+            })
+    except RuntimeError as e:
+        print(f"Benchmark failed: {e}")
+        sys.exit(1)
+    finally:
+        if os.path.exists(list_file):
+            os.remove(list_file)
+
+    report_file = os.path.join(
+        restore_tool.restore_config['backup_path'],
+        f"restore_order_benchmark_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+    )
+    with open(report_file, 'w') as f:
+        json.dump({
+            'backup_file': args.backup_file,
+            'cpu_count': os.cpu_count(),
+            'recommended_jobs': recommended,
+            'rounds': args.rounds,
+            'results': results
+        }, f, indent=2)
+    print(f"\nReport saved: {report_file}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+Restore Profile Benchmark
+Compares restore time and WAL volume for the default, tuned and turbo restore profiles
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import datetime
+import statistics
+
+from restore import DatabaseRestore
+
+PROFILES = {
+    'default': {'restore_profile': 'default', 'turbo': False},
+    'tuned': {'restore_profile': 'tuned', 'turbo': False},
+    'turbo': {'restore_profile': 'tuned', 'turbo': True}
+}
+
+
+def current_wal_lsn(restore_tool):
+    ok, output = restore_tool.run_admin_sql("SELECT pg_current_wal_lsn() - '0/0'::pg_lsn;")
+    return int(float(output)) if ok else None
+
+
+def run_profile(restore_tool, backup_file, database, profile):
+    """Restore into a fresh scratch database; returns (seconds, WAL bytes written)"""
+    restore_tool.run_admin_sql(f'DROP DATABASE IF EXISTS "{database}";')
+    ok, output = restore_tool.run_admin_sql(f'CREATE DATABASE "{database}";')
+    if not ok:
+        raise RuntimeError(f"Could not create benchmark database: {output}")
+
+    production = restore_tool.db_config['database']
+    restore_tool.restore_config.update(PROFILES[profile])
+    restore_tool.db_config['database'] = database
+    try:
+        wal_start = current_wal_lsn(restore_tool)
+        start = time.time()
+        success = restore_tool.restore_backup_file(backup_file)
+        duration = time.time() - start
+        wal_end = current_wal_lsn(restore_tool)
+    finally:
+        restore_tool.db_config['database'] = production
+        restore_tool.run_admin_sql(f'DROP DATABASE IF EXISTS "{database}";')
+
+    if not success:
+        raise RuntimeError(f"Restore with the {profile} profile failed")
+    wal_bytes = wal_end - wal_start if wal_start is not None and wal_end is not None else None
+    return duration, wal_bytes
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark restore session profiles')
+    parser.add_argument('backup_file', help='Backup to restore (.sql, .sql.gz or .backup)')
+    parser.add_argument('--profiles', default='default,tuned,turbo', help='Comma-separated profiles to test')
+    parser.add_argument('--rounds', type=int, default=3, help='Restores per profile')
+    parser.add_argument('--engine', choices=['native', 'parallel', 'psql'], default='native',
+                        help='SQL restore engine to benchmark with')
+    args = parser.parse_args()
+
+    restore_tool = DatabaseRestore()
+    restore_tool.restore_config['sql_restore_mode'] = args.engine
+    restore_tool.restore_config['verify_after_restore'] = False
+    database = f"{restore_tool.db_config['database']}_profile_bench"
+    profiles = [name.strip() for name in args.profiles.split(',')]
+    _, wal_level = restore_tool.run_admin_sql("SHOW wal_level;")
+
+    results = {name: {'seconds': [], 'wal_bytes': []} for name in profiles}
+    try:
+        for _ in range(args.rounds):
+            # Interleave profiles so caching does not favour one of them
+            for name in profiles:
+                duration, wal_bytes = run_profile(restore_tool, args.backup_file, database, name)
+                results[name]['seconds'].append(duration)
+                results[name]['wal_bytes'].append(wal_bytes)
+    except (RuntimeError, KeyError) as e:
+        print(f"Benchmark failed: {e}")
+        sys.exit(1)
+
+    print(f"\nBackup: {args.backup_file} (engine {args.engine}, wal_level={wal_level}, {args.rounds} rounds)")
+    print(f"{'profile':>8}  {'median time':>11}  {'WAL written':>12}  {'speedup':>7}")
+    baseline = statistics.median(results[profiles[0]]['seconds'])
+    for name in profiles:
+        median = statistics.median(results[name]['seconds'])
+        wal = [value for value in results[name]['wal_bytes'] if value is not None]
+        wal_text = f"{statistics.median(wal) / 1024 / 1024:.1f} MB" if wal else 'n/a'
+        results[name]['median_seconds'] = median
+        results[name]['speedup'] = round(baseline / median, 2) if median else None
+        print(f"{name:>8}  {median:>10.2f}s  {wal_text:>12}  {results[name]['speedup']:>6.2f}x")
+
+    report_file = os.path.join(
+        restore_tool.restore_config['backup_path'],
+        f"restore_profile_benchmark_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+    )
+    with open(report_file, 'w') as f:
+        json.dump({
+            'backup_file': args.backup_file,
+            'engine': args.engine,
+            'wal_level': wal_level,
+            'rounds': args.rounds,
+            'results': results
+        }, f, indent=2)
+    print(f"\nReport saved: {report_file}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,454 @@
+#!/usr/bin/env python3
+"""
+Parallel Block Compression
+Compresses and decompresses backup streams in independent blocks on a thread pool
+"""
+
+import io
+import os
+import sys
+import gzip
+import zlib
+import struct
+import argparse
+import threading
+import subprocess
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import zstandard
+except ImportError:  # zstd is optional; gzip is always available
+    zstandard = None
+
+# Uncompressed bytes per block; each block is compressed independently
+BLOCK_SIZE = 4 * 1024 * 1024
+
+METHOD_SUFFIXES = {'gzip': '.gz', 'zstd': '.zst'}
+
+# Every gzip member carries an extra field with its own compressed length
+# (as BGZF does), so readers can hand whole members to worker threads
+# without inflating them first. gzip, zcat and pigz ignore the field.
+GZIP_MAGIC = b'\x1f\x8b'
+GZIP_EXTRA_ID = b'BP'
+GZIP_HEADER = struct.Struct('<2sBBIBBH2sHI')  # magic, CM, FLG, MTIME, XFL, OS, XLEN, SI, LEN, member length
+GZIP_TRAILER = struct.Struct('<II')  # CRC32, ISIZE
+GZIP_FEXTRA = 0x04
+
+# zstd blocks are preceded by a skippable frame holding the length of the
+# data frame that follows; zstd and zstdcat skip it
+ZSTD_SKIPPABLE_MAGIC = 0x184D2A5B
+ZSTD_LENGTH_FRAME = struct.Struct('<III')  # magic, frame size (4), data frame length
+
+
+def default_threads():
+    """One compression thread per CPU"""
+    return os.cpu_count() or 1
+
+
+def zstd_available():
+    return zstandard is not None
+
+
+def compression_method(path):
+    """'gzip' or 'zstd' from a file name, or None for an uncompressed file"""
+    path = str(path)
+    for method, suffix in METHOD_SUFFIXES.items():
+        if path.endswith(suffix):
+            return method
+    return None
+
+
+def _gzip_block(block, level):
+    """One complete gzip member whose header records the member's length"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+    deflated = compressor.compress(block) + compressor.flush()
+    length = GZIP_HEADER.size + len(deflated) + GZIP_TRAILER.size
+    header = GZIP_HEADER.pack(GZIP_MAGIC, 8, GZIP_FEXTRA, 0, 0, 255, 8, GZIP_EXTRA_ID, 4, length)
+    trailer = GZIP_TRAILER.pack(zlib.crc32(block), len(block) & 0xFFFFFFFF)
+    return header + deflated + trailer
+
+
+def _zstd_block(block, level):
+    # Compressor objects are not thread-safe, and cheap to create per block
+    frame = zstandard.ZstdCompressor(level=level).compress(block)
+    return ZSTD_LENGTH_FRAME.pack(ZSTD_SKIPPABLE_MAGIC, 4, len(frame)) + frame
+
+
+def _gunzip_block(member):
+    return zlib.decompress(member, 16 + zlib.MAX_WBITS)
+
+
+def _unzstd_block(frame):
+    return zstandard.ZstdDecompressor().decompress(frame)
+
+
+def compress_block(block, method='gzip', level=6):
+    """`block` as a standalone gzip member or zstd frame, readable by the standard tools"""
+    if method == 'gzip':
+        return _gzip_block(block, max(1, min(int(level), 9)))
+    if not zstd_available():
+        raise RuntimeError("zstd compression needs the zstandard module (pip install zstandard)")
+    return zstandard.ZstdCompressor(level=level).compress(block)
+
+
+def decompress_block(data, method='gzip'):
+    if method == 'gzip':
+        return _gunzip_block(data)
+    if not zstd_available():
+        raise RuntimeError("zstd blocks need the zstandard module (pip install zstandard)")
+    return _unzstd_block(data)
+
+
+class BlockWriter:
+    """
+    Writable stream compressing its input in blocks on a thread pool.
+
+    Input is cut into `block_size` blocks that are compressed concurrently
+    (zlib and zstd release the GIL) and written in order as gzip members
+    or zstd frames. Concatenated members are a valid gzip file and
+    concatenated frames a valid zstd file, so the output decompresses with
+    the standard tools; BlockReader decompresses it in parallel again. At
+    most two blocks per thread are in flight, so memory stays bounded.
+    """
+
+    def __init__(self, fileobj, method='gzip', level=6, threads=None, block_size=BLOCK_SIZE):
+        if method == 'zstd' and not zstd_available():
+            raise RuntimeError("zstd compression needs the zstandard module (pip install zstandard)")
+        if method not in METHOD_SUFFIXES:
+            raise ValueError(f"Unsupported block compression method: {method}")
+        self.fileobj = fileobj
+        self.method = method
+        self.level = max(1, min(int(level), 9)) if method == 'gzip' else int(level)
+        self.threads = max(1, threads or default_threads())
+        self.block_size = block_size
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.blocks = 0
+        self._compress = _gzip_block if method == 'gzip' else _zstd_block
+        self._buffer = bytearray()
+        self._pending = deque()
+        self._executor = ThreadPoolExecutor(max_workers=self.threads)
+        self.closed = False
+
+    def write(self, data):
+        self._buffer += data
+        self.bytes_in += len(data)
+        while len(self._buffer) >= self.block_size:
+            self._submit(bytes(self._buffer[:self.block_size]))
+            del self._buffer[:self.block_size]
+        return len(data)
+
+    def _submit(self, block):
+        self._pending.append(self._executor.submit(self._compress, block, self.level))
+        self.blocks += 1
+        while len(self._pending) > 2 * self.threads:
+            self._write_next()
+
+    def _write_next(self):
+        compressed = self._pending.popleft().result()
+        self.fileobj.write(compressed)
+        self.bytes_out += len(compressed)
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            # An empty stream still gets one block, so the file is valid
+            if self._buffer or not self.blocks:
+                self._submit(bytes(self._buffer))
+                self._buffer.clear()
+            while self._pending:
+                self._write_next()
+            self.fileobj.flush()
+        finally:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self.closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def _read_exact(fileobj, size):
+    data = fileobj.read(size)
+    while len(data) < size:
+        more = fileobj.read(size - len(data))
+        if not more:
+            break
+        data += more
+    return data
+
+
+def _next_gzip_member(fileobj):
+    """Next length-tagged gzip member, b'' at the end, None if the member carries no length"""
+    header = _read_exact(fileobj, GZIP_HEADER.size)
+    if not header:
+        return b''
+    if len(header) < GZIP_HEADER.size:
+        return None
+    magic, method, flags, _, _, _, xlen, extra_id, extra_len, length = GZIP_HEADER.unpack(header)
+    if (magic != GZIP_MAGIC or method != 8 or not flags & GZIP_FEXTRA or xlen != 8
+            or extra_id != GZIP_EXTRA_ID or extra_len != 4):
+        return None
+    body = _read_exact(fileobj, length - GZIP_HEADER.size)
+    if len(body) != length - GZIP_HEADER.size:
+        raise EOFError("Compressed block is truncated")
+    return header + body
+
+
+def _next_zstd_frame(fileobj):
+    """Next length-tagged zstd frame, b'' at the end, None if the frame carries no length"""
+    header = _read_exact(fileobj, ZSTD_LENGTH_FRAME.size)
+    if not header:
+        return b''
+    if len(header) < ZSTD_LENGTH_FRAME.size:
+        return None
+    magic, size, length = ZSTD_LENGTH_FRAME.unpack(header)
+    if magic != ZSTD_SKIPPABLE_MAGIC or size != 4:
+        return None
+    frame = _read_exact(fileobj, length)
+    if len(frame) != length:
+        raise EOFError("Compressed block is truncated")
+    return frame
+
+
+def is_block_compressed(path):
+    """Whether `path` was written by BlockWriter (and can be decompressed in parallel)"""
+    method = compression_method(path)
+    if not method:
+        return False
+    try:
+        with open(path, 'rb') as f:
+            if method == 'gzip':
+                return bool(_next_gzip_member(f))
+            return bool(_next_zstd_frame(f))
+    except (OSError, EOFError):
+        return False
+
+
+class BlockReader(io.RawIOBase):
+    """
+    Readable stream over BlockWriter output, decompressing ahead on a thread pool.
+
+    Blocks are read from `fileobj` in order, up to two per thread are
+    decompressed concurrently, and their contents are returned in order.
+    Wrap it in io.BufferedReader for readline(). Seeking forward discards
+    data; seeking backward starts over from the beginning of the file.
+    """
+
+    def __init__(self, fileobj, method='gzip', threads=None):
+        super().__init__()
+        if method == 'zstd' and not zstd_available():
+            raise RuntimeError("zstd dumps need the zstandard module (pip install zstandard)")
+        self.fileobj = fileobj
+        self.threads = max(1, threads or default_threads())
+        self._next_block = _next_gzip_member if method == 'gzip' else _next_zstd_frame
+        self._decompress = _gunzip_block if method == 'gzip' else _unzstd_block
+        self._executor = ThreadPoolExecutor(max_workers=self.threads)
+        seekable = getattr(fileobj, 'seekable', None)
+        self._start_offset = fileobj.tell() if seekable and seekable() else None
+        self._reset()
+
+    def _reset(self):
+        self._pending = deque()
+        self._block = b''
+        self._block_pos = 0
+        self._position = 0
+        self._exhausted = False
+
+    def _fill(self):
+        while not self._exhausted and len(self._pending) < 2 * self.threads:
+            compressed = self._next_block(self.fileobj)
+            if compressed is None:
+                raise OSError("Not a block-compressed stream (missing block length)")
+            if not compressed:
+                self._exhausted = True
+                break
+            self._pending.append(self._executor.submit(self._decompress, compressed))
+
+    def _current(self):
+        """The block being read, advancing to the next one when it is used up"""
+        while self._block_pos >= len(self._block):
+            self._fill()
+            if not self._pending:
+                return b''
+            self._block = self._pending.popleft().result()
+            self._block_pos = 0
+        return self._block
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        block = self._current()
+        if not block:
+            return 0
+        size = min(len(buffer), len(block) - self._block_pos)
+        buffer[:size] = block[self._block_pos:self._block_pos + size]
+        self._block_pos += size
+        self._position += size
+        return size
+
+    def seekable(self):
+        return self._start_offset is not None
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._position
+        elif whence != io.SEEK_SET:
+            raise io.UnsupportedOperation("Block-compressed streams cannot seek from the end")
+        if offset < self._position:
+            if self._start_offset is None:
+                raise io.UnsupportedOperation("Cannot seek backward in a non-seekable stream")
+            for future in self._pending:
+                future.cancel()
+            self.fileobj.seek(self._start_offset)
+            self._reset()
+        while self._position < offset:
+            block = self._current()
+            if not block:
+                break
+            skip = min(offset - self._position, len(block) - self._block_pos)
+            self._block_pos += skip
+            self._position += skip
+        return self._position
+
+    def close(self):
+        if not self.closed:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+        super().close()
+
+
+def open_block_reader(fileobj, method, threads=None):
+    """Buffered BlockReader with readline() and forward seeks, as GzipFile provides"""
+    return io.BufferedReader(BlockReader(fileobj, method, threads), buffer_size=1024 * 1024)
+
+
+def open_compressed(fileobj, path, threads=None):
+    """
+    Decompressing reader over the .gz or .zst file `path`, open as `fileobj`.
+
+    BlockWriter output is decompressed in parallel; files written by other
+    tools are single streams and are decompressed serially.
+    """
+    method = compression_method(path)
+    if is_block_compressed(path):
+        return open_block_reader(fileobj, method, threads)
+    if method == 'gzip':
+        return gzip.GzipFile(fileobj=fileobj, mode='rb')
+    if not zstd_available():
+        raise RuntimeError("zstd dumps need the zstandard module (pip install zstandard)")
+    return io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(fileobj, read_across_frames=True))
+
+
+def compress_process_output(cmd, output_file, method='gzip', level=6, threads=None, env=None, timeout=None):
+    """
+    Run `cmd` and block-compress its stdout into `output_file`.
+
+    Used to compress pg_dump plain output as it is produced, with
+    `threads` blocks in flight. Returns a CompletedProcess like
+    subprocess.run (stderr as text) and raises subprocess.TimeoutExpired
+    if the process outlives `timeout`.
+    """
+    process = subprocess.Popen(cmd, env=env, stdin=subprocess.DEVNULL,
+                               stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    stderr_chunks = []
+    reader = threading.Thread(target=lambda: stderr_chunks.append(process.stderr.read()), daemon=True)
+    reader.start()
+
+    timed_out = threading.Event()
+
+    def _kill():
+        timed_out.set()
+        process.kill()
+
+    timer = threading.Timer(timeout, _kill) if timeout else None
+    if timer:
+        timer.start()
+    try:
+        with open(output_file, 'wb') as out, BlockWriter(out, method, level, threads) as writer:
+            while True:
+                data = process.stdout.read(BLOCK_SIZE)
+                if not data:
+                    break
+                writer.write(data)
+        returncode = process.wait()
+        reader.join()
+    finally:
+        if timer:
+            timer.cancel()
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+
+    stderr = b''.join(stderr_chunks).decode('utf-8', errors='replace')
+    if timed_out.is_set():
+        raise subprocess.TimeoutExpired(cmd, timeout, stderr=stderr)
+    return subprocess.CompletedProcess(cmd, returncode, None, stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Multi-threaded gzip/zstd compression of backup files')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    compress = subparsers.add_parser('compress', help='Compress a file (or stdin) in parallel blocks')
+    compress.add_argument('input', help="File to compress, or '-' for stdin")
+    compress.add_argument('-o', '--output', help='Output file (default: <input>.gz or <input>.zst)')
+    compress.add_argument('--method', choices=sorted(METHOD_SUFFIXES), default='gzip')
+    compress.add_argument('--level', type=int, default=6, help='Compression level (default: 6)')
+
+    decompress = subparsers.add_parser('decompress', help='Decompress a .gz or .zst file in parallel')
+    decompress.add_argument('input', help='Compressed file')
+    decompress.add_argument('-o', '--output', help="Output file, or '-' for stdout (default: input without suffix)")
+
+    for sub in (compress, decompress):
+        sub.add_argument('--threads', type=int, help='Worker threads (default: one per CPU)')
+    args = parser.parse_args()
+
+    if args.command == 'compress':
+        if args.input == '-' and not args.output:
+            parser.error("--output is required when compressing stdin")
+        output = args.output or args.input + METHOD_SUFFIXES[args.method]
+        source = sys.stdin.buffer if args.input == '-' else open(args.input, 'rb')
+        try:
+            with open(output, 'wb') as out, BlockWriter(out, args.method, args.level, args.threads) as writer:
+                while True:
+                    data = source.read(BLOCK_SIZE)
+                    if not data:
+                        break
+                    writer.write(data)
+        finally:
+            if source is not sys.stdin.buffer:
+                source.close()
+        ratio = writer.bytes_out / writer.bytes_in if writer.bytes_in else 0
+        print(f"{output}: {writer.bytes_in:,} -> {writer.bytes_out:,} bytes ({ratio:.1%}) "
+              f"in {writer.blocks} blocks on {writer.threads} threads", file=sys.stderr)
+        return
+
+    method = compression_method(args.input)
+    if not method:
+        parser.error(f"{args.input} does not end in {' or '.join(METHOD_SUFFIXES.values())}")
+    output = args.output or args.input[:-len(METHOD_SUFFIXES[method])]
+    with open(args.input, 'rb') as raw:
+        source = open_compressed(raw, args.input, args.threads)
+        out = sys.stdout.buffer if output == '-' else open(output, 'wb')
+        try:
+            while True:
+                data = source.read(BLOCK_SIZE)
+                if not data:
+                    break
+                out.write(data)
+        finally:
+            source.close()
+            if out is not sys.stdout.buffer:
+                out.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+Connection Loss Check
+Terminates the native engine's connection partway through a restore and checks that the restore fails;
+with a failing statement instead, checks that the restore goes on without checkpointing it
+"""
+
+import os
+import sys
+import argparse
+import tempfile
+
+import psycopg2
+
+from restore import DatabaseRestore
+from restore_checkpoint import RestoreCheckpoint
+from restore_engine import RestoreEngineError, SqlRestoreEngine
+
+
+class FailingEngine(SqlRestoreEngine):
+    """Engine that fails the statement after the first `after` of `section` by losing its connection or its SQL"""
+
+    def __init__(self, *args, failure, section, after, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.failure = failure
+        self.section = section
+        self.after = after
+        self.seen = 0
+        self.killed = None
+
+    def execute_entry(self, conn, entry):
+        if entry.section == self.section and self.killed is None:
+            self.seen += 1
+            if self.seen > self.after:
+                self.killed = entry
+                if self.failure == 'connection':
+                    terminate_backend(self.db_config, conn.info.backend_pid)
+                else:
+                    entry.sql = b"SELECT 1 / 0;"
+        return super().execute_entry(conn, entry)
+
+
+def terminate_backend(db_config, pid):
+    conn = psycopg2.connect(host=db_config['host'], port=db_config['port'], dbname='postgres',
+                            user=db_config['user'], password=db_config['password'])
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT pg_terminate_backend(%s)", (pid,))
+    finally:
+        conn.close()
+
+
+def run_case(restore_tool, backup_file, database, mode, failure, section, after):
+    """Restore into a fresh scratch database with one failure in `section`; returns a list of problems"""
+    restore_tool.run_admin_sql(f'DROP DATABASE IF EXISTS "{database}";')
+    ok, output = restore_tool.run_admin_sql(f'CREATE DATABASE "{database}";')
+    if not ok:
+        raise RuntimeError(f"Could not create check database: {output}")
+
+    db_config = dict(restore_tool.db_config, database=database)
+    fd, checkpoint_file = tempfile.mkstemp(prefix='connection_loss_', suffix='.json')
+    os.close(fd)
+    problems = []
+    try:
+        checkpoint = RestoreCheckpoint.start(checkpoint_file, backup_file, database)
+        engine = FailingEngine(db_config, restore_tool.logger, jobs=2 if mode == 'parallel' else 1,
+                               checkpoint=checkpoint, failure=failure, section=section, after=after)
+        try:
+            if mode == 'parallel':
+                engine.restore_parallel(backup_file)
+            else:
+                engine.restore_stream(backup_file)
+            if failure == 'connection':
+                problems.append("restore reported success")
+        except RestoreEngineError as e:
+            # A failed CREATE TABLE also fails the COPY into that table
+            restore_tool.logger.info(f"Restore failed: {e}")
+
+        if engine.killed is None:
+            problems.append(f"the dump has no more than {after} {section} entries")
+        elif checkpoint.is_done(engine.killed.dump_id):
+            problems.append(f"{engine.killed.entry_type} {engine.killed.name} was checkpointed")
+        if failure == 'connection' and section in checkpoint.state['phases']:
+            problems.append(f"{section} was checkpointed as complete")
+    finally:
+        os.remove(checkpoint_file)
+        restore_tool.run_admin_sql(f'DROP DATABASE IF EXISTS "{database}";')
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check how a native restore handles a lost connection or a failed statement')
+    parser.add_argument('backup_file', help='Plain-format dump (.sql) with schema to restore')
+    parser.add_argument('--modes', default='stream,parallel', help='Comma-separated engine modes to test')
+    parser.add_argument('--failures', default='connection,statement', help='Comma-separated failures to inject')
+    parser.add_argument('--sections', default='pre-data,post-data', help='Comma-separated sections to fail in')
+    parser.add_argument('--after', type=int, default=3, help='Statements of the section to run before the failure')
+    parser.add_argument('--database', default='connection_loss_check', help='Scratch database (dropped afterwards)')
+    args = parser.parse_args()
+
+    restore_tool = DatabaseRestore()
+    failed = False
+    for mode in args.modes.split(','):
+        for failure in args.failures.split(','):
+            for section in args.sections.split(','):
+                problems = run_case(restore_tool, args.backup_file, args.database, mode, failure, section, args.after)
+                print(f"{mode:<10} {failure:<11} {section:<10} "
+                      f"{'ok' if not problems else 'FAILED: ' + '; '.join(problems)}")
+                failed = failed or bool(problems)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,546 @@
+#!/usr/bin/env python3
+"""
+Deduplicating Backup Store
+Stores plain SQL dumps as lists of content-defined chunks, each chunk kept once
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import zlib
+import shutil
+import hashlib
+import logging
+import argparse
+import datetime
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from block_compress import (METHOD_SUFFIXES, compress_block, compression_method, decompress_block,
+                            default_threads, open_compressed, zstd_available)
+
+STORE_DIR = 'chunk_store'
+CHUNKS_DIR = 'chunks'
+BACKUPS_DIR = 'backups'
+CHUNK_LIST_SUFFIX = '.sql.chunks'
+CHUNK_LIST_VERSION = 1
+
+# Chunk boundaries: never below MIN, forced at MAX, AVERAGE bytes apart on average
+MIN_CHUNK_SIZE = 16 * 1024
+AVERAGE_CHUNK_SIZE = 64 * 1024
+MAX_CHUNK_SIZE = 1024 * 1024
+
+# Unreferenced chunks younger than this are kept: a backup being added may
+# have written (or re-used) them without having saved its chunk list yet
+GC_GRACE_SECONDS = 3600
+
+
+def split_chunks(stream, min_size=MIN_CHUNK_SIZE, average_size=AVERAGE_CHUNK_SIZE, max_size=MAX_CHUNK_SIZE):
+    """
+    Cut a binary stream into content-defined chunks at line boundaries.
+
+    A gear-style rolling hash runs over the CRC32 of each line, so a
+    boundary depends only on the last few dozen lines: rows inserted or
+    changed in one table move the boundaries around them and nowhere
+    else. A line ends a chunk with probability len(line) / average_size,
+    which keeps chunks near `average_size` bytes whatever the row width.
+    """
+    lines = []
+    size = 0
+    rolling = 0
+    while True:
+        line = stream.readline(max_size)
+        if not line:
+            break
+        lines.append(line)
+        size += len(line)
+        rolling = ((rolling << 1) + zlib.crc32(line)) & 0xFFFFFFFF
+        if size >= max_size or (size >= min_size and rolling % average_size < len(line)):
+            yield b''.join(lines)
+            lines, size, rolling = [], 0, 0
+    if lines:
+        yield b''.join(lines)
+
+
+def chunk_list_name(source):
+    """Chunk list file name for a dump: x.sql / x.sql.gz / x.sql.zst -> x.sql.chunks"""
+    name = os.path.basename(source)
+    for suffix in ('.sql.gz', '.sql.zst', '.sql'):
+        if name.endswith(suffix):
+            name = name[:-len(suffix)]
+            break
+    return name + CHUNK_LIST_SUFFIX
+
+
+def load_chunk_list(path):
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+class ChunkReader(io.RawIOBase):
+    """
+    Readable stream reassembling a backup from its chunks.
+
+    Chunks are read and decompressed ahead on a thread pool and returned
+    in order. Seeking forward skips whole chunks without reading them;
+    seeking backward starts over.
+    """
+
+    def __init__(self, store, chunks, threads=None):
+        super().__init__()
+        self.store = store
+        self.chunks = chunks
+        self.threads = max(1, threads or default_threads())
+        self._executor = ThreadPoolExecutor(max_workers=self.threads)
+        self._reset()
+
+    def _reset(self):
+        self._pending = deque()
+        self._next_chunk = 0
+        self._chunk = b''
+        self._chunk_pos = 0
+        self._position = 0
+
+    def _fill(self):
+        while self._next_chunk < len(self.chunks) and len(self._pending) < 2 * self.threads:
+            digest, _ = self.chunks[self._next_chunk]
+            self._pending.append(self._executor.submit(self.store.read_chunk, digest))
+            self._next_chunk += 1
+
+    def _current(self):
+        while self._chunk_pos >= len(self._chunk):
+            self._fill()
+            if not self._pending:
+                return b''
+            self._chunk = self._pending.popleft().result()
+            self._chunk_pos = 0
+        return self._chunk
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        chunk = self._current()
+        if not chunk:
+            return 0
+        size = min(len(buffer), len(chunk) - self._chunk_pos)
+        buffer[:size] = chunk[self._chunk_pos:self._chunk_pos + size]
+        self._chunk_pos += size
+        self._position += size
+        return size
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._position
+        elif whence != io.SEEK_SET:
+            raise io.UnsupportedOperation("Chunked backups cannot seek from the end")
+        if offset < self._position:
+            for future in self._pending:
+                future.cancel()
+            self._reset()
+        # Whole chunks before the target are skipped without being read
+        if not self._pending and self._chunk_pos >= len(self._chunk):
+            while self._next_chunk < len(self.chunks):
+                size = self.chunks[self._next_chunk][1]
+                if self._position + size > offset:
+                    break
+                self._position += size
+                self._next_chunk += 1
+        while self._position < offset:
+            chunk = self._current()
+            if not chunk:
+                break
+            skip = min(offset - self._position, len(chunk) - self._chunk_pos)
+            self._chunk_pos += skip
+            self._position += skip
+        return self._position
+
+    def close(self):
+        if not self.closed:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+        super().close()
+
+
+class ChunkStore:
+    """
+    Content-addressed repository of backup chunks.
+
+    add() splits a plain SQL dump (compressed dumps are decompressed
+    first) into content-defined chunks and stores each chunk, compressed,
+    under the SHA-256 of its contents. A chunk already in the store is
+    not written again, so consecutive dumps that differ in a few tables
+    cost only the chunks around the changes. The backup itself becomes a
+    chunk list in backups/<name>.sql.chunks, which the restore tools open
+    like any other SQL dump.
+
+    Chunk files are written to a temporary name and renamed, and every
+    chunk file is a standalone gzip member or zstd frame. Deleting a chunk
+    list frees nothing by itself; gc() removes the chunks no remaining
+    list refers to.
+    """
+
+    def __init__(self, path, logger=None, compression=None, level=6, threads=None):
+        self.path = path
+        self.logger = logger or logging.getLogger(__name__)
+        if compression not in METHOD_SUFFIXES:
+            compression = 'zstd' if zstd_available() else 'gzip'
+        self.compression = compression
+        self.level = level
+        self.threads = max(1, threads or default_threads())
+        self.chunks_dir = os.path.join(path, CHUNKS_DIR)
+        self.backups_dir = os.path.join(path, BACKUPS_DIR)
+        os.makedirs(self.chunks_dir, exist_ok=True)
+        os.makedirs(self.backups_dir, exist_ok=True)
+
+    # Chunks
+
+    def chunk_path(self, digest, method=None):
+        suffix = METHOD_SUFFIXES[method or self.compression]
+        return os.path.join(self.chunks_dir, digest[:2], digest + suffix)
+
+    def find_chunk(self, digest):
+        """Path of a stored chunk in whichever compression it was written, or None"""
+        for method in METHOD_SUFFIXES:
+            path = self.chunk_path(digest, method)
+            if os.path.exists(path):
+                return path
+        return None
+
+    def read_chunk(self, digest):
+        path = self.find_chunk(digest)
+        if not path:
+            raise FileNotFoundError(f"Chunk {digest} is missing from {self.chunks_dir}")
+        with open(path, 'rb') as f:
+            return decompress_block(f.read(), compression_method(path))
+
+    def _store_chunk(self, data):
+        """Store one chunk unless it exists; returns (digest, size, compressed bytes written)"""
+        digest = hashlib.sha256(data).hexdigest()
+        existing = self.find_chunk(digest)
+        if existing:
+            try:
+                # Fresh mtime keeps gc() from collecting it before the chunk list is saved
+                os.utime(existing)
+                return digest, len(data), 0
+            except FileNotFoundError:
+                pass  # collected in the meantime; write it again
+
+        path = self.chunk_path(digest)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        compressed = compress_block(data, self.compression, self.level)
+        temp_file = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp_file, 'wb') as f:
+            f.write(compressed)
+        os.replace(temp_file, path)
+        return digest, len(data), len(compressed)
+
+    # Backups
+
+    def backup_path(self, name):
+        return os.path.join(self.backups_dir, name)
+
+    def list_backups(self):
+        """Chunk lists in the store, newest first"""
+        backups = []
+        for name in os.listdir(self.backups_dir):
+            if not name.endswith(CHUNK_LIST_SUFFIX):
+                continue
+            try:
+                chunk_list = load_chunk_list(self.backup_path(name))
+            except (OSError, ValueError) as e:
+                self.logger.warning(f"Unreadable chunk list {name}: {e}")
+                continue
+            backups.append({
+                'name': name,
+                'path': self.backup_path(name),
+                'source': chunk_list.get('source'),
+                'created': chunk_list.get('created'),
+                'size': chunk_list.get('size', 0),
+                'chunks': len(chunk_list.get('chunks', [])),
+                'stored_bytes': chunk_list.get('stored_bytes', 0)
+            })
+        return sorted(backups, key=lambda backup: backup['created'] or '', reverse=True)
+
+    def add(self, source, name=None, remove_source=False):
+        """
+        Store the dump `source` and return the path of its chunk list.
+
+        The dump's manifest (<source>.manifest.json), if any, moves along
+        so restores from the chunk list are verified the same way.
+        """
+        name = name or chunk_list_name(source)
+        list_path = self.backup_path(name)
+        if os.path.exists(list_path):
+            raise FileExistsError(f"Backup {name} is already in the store")
+
+        start = time.time()
+        chunks = []
+        digest = hashlib.sha256()
+        size = new_chunks = stored_bytes = 0
+
+        with open(source, 'rb') as raw, ThreadPoolExecutor(max_workers=self.threads) as executor:
+            stream = open_compressed(raw, source, self.threads) if compression_method(source) else raw
+            pending = deque()
+
+            def collect():
+                nonlocal new_chunks, stored_bytes
+                chunk_digest, chunk_size, written = pending.popleft().result()
+                chunks.append([chunk_digest, chunk_size])
+                if written:
+                    new_chunks += 1
+                    stored_bytes += written
+
+            try:
+                # Hashing and compression run on the pool; chunk order is kept
+                for data in split_chunks(stream):
+                    digest.update(data)
+                    size += len(data)
+                    pending.append(executor.submit(self._store_chunk, data))
+                    while len(pending) > 2 * self.threads:
+                        collect()
+                while pending:
+                    collect()
+            finally:
+                if stream is not raw:
+                    stream.close()
+
+        chunk_list = {
+            'version': CHUNK_LIST_VERSION,
+            'name': name,
+            'source': os.path.basename(source),
+            'created': datetime.datetime.fromtimestamp(os.path.getmtime(source)).isoformat(),
+            'added': datetime.datetime.now().isoformat(),
+            'size': size,
+            'sha256': digest.hexdigest(),
+            'compression': self.compression,
+            'new_chunks': new_chunks,
+            'stored_bytes': stored_bytes,
+            'chunks': chunks
+        }
+        temp_file = f"{list_path}.tmp"
+        with open(temp_file, 'w') as f:
+            json.dump(chunk_list, f)
+        os.replace(temp_file, list_path)
+
+        manifest = f"{source}.manifest.json"
+        if os.path.exists(manifest):
+            shutil.copyfile(manifest, f"{list_path}.manifest.json")
+        if remove_source:
+            os.remove(source)
+            if os.path.exists(manifest):
+                os.remove(manifest)
+
+        duration = time.time() - start
+        self.logger.info(
+            f"Stored {os.path.basename(source)} as {name}: {size:,} bytes in {len(chunks)} chunks, "
+            f"{new_chunks} new ({stored_bytes:,} bytes written) in {duration:.2f}s"
+        )
+        return list_path
+
+    def resolve(self, name_or_path):
+        """Absolute path of a chunk list given by name or path; stores may be opened by a relative path"""
+        path = name_or_path if os.path.isabs(name_or_path) else self.backup_path(name_or_path)
+        return os.path.abspath(path)
+
+    def open(self, name_or_path):
+        """Buffered stream over a stored backup, reassembled from its chunks"""
+        path = self.resolve(name_or_path)
+        chunk_list = load_chunk_list(path)
+        return io.BufferedReader(ChunkReader(self, chunk_list['chunks'], self.threads), buffer_size=1024 * 1024)
+
+    def verify(self, name_or_path, full=False):
+        """
+        Check a backup's chunks; returns a list of problems (empty when sound).
+
+        The quick check looks for every chunk file; `full` also reassembles
+        the backup and compares its SHA-256 with the one recorded.
+        """
+        path = self.resolve(name_or_path)
+        chunk_list = load_chunk_list(path)
+        problems = [f"missing chunk {digest}" for digest in {digest for digest, _ in chunk_list['chunks']}
+                    if not self.find_chunk(digest)]
+        if problems or not full:
+            return problems
+
+        digest = hashlib.sha256()
+        size = 0
+        try:
+            with self.open(path) as stream:
+                for block in iter(lambda: stream.read(1024 * 1024), b''):
+                    digest.update(block)
+                    size += len(block)
+        except (OSError, zlib.error) as e:
+            return [f"unreadable chunk: {e}"]
+        if size != chunk_list['size'] or digest.hexdigest() != chunk_list['sha256']:
+            problems.append(f"content does not match the recorded checksum ({size:,} bytes read)")
+        return problems
+
+    def remove(self, name):
+        """Delete a chunk list (and its manifest); chunks are freed by gc()"""
+        path = self.backup_path(name)
+        for file in (path, f"{path}.manifest.json", f"{path}.index.json"):
+            if os.path.exists(file):
+                os.remove(file)
+        self.logger.info(f"Removed {name} from the chunk store")
+
+    def prune(self, keep=None, days=None, prefix=None):
+        """
+        Apply retention, then collect unreferenced chunks.
+
+        Keeps the newest `keep` backups and/or those created within `days`,
+        among backups whose name starts with `prefix` (all when None).
+        Returns the names removed.
+        """
+        backups = [b for b in self.list_backups() if not prefix or b['name'].startswith(prefix)]
+        cutoff = datetime.datetime.now() - datetime.timedelta(days=days) if days is not None else None
+        removed = []
+        for position, backup in enumerate(backups):
+            if keep is not None and position < keep:
+                continue
+            if cutoff and backup['created'] and datetime.datetime.fromisoformat(backup['created']) >= cutoff:
+                continue
+            if keep is None and cutoff is None:
+                continue
+            self.remove(backup['name'])
+            removed.append(backup['name'])
+        self.gc()
+        return removed
+
+    def gc(self, grace_seconds=GC_GRACE_SECONDS):
+        """Delete chunks no chunk list refers to; returns (chunks deleted, bytes freed)"""
+        start = time.time()
+        referenced = set()
+        for name in os.listdir(self.backups_dir):
+            if name.endswith(CHUNK_LIST_SUFFIX) or name.endswith(f"{CHUNK_LIST_SUFFIX}.tmp"):
+                try:
+                    referenced.update(digest for digest, _ in load_chunk_list(self.backup_path(name))['chunks'])
+                except (OSError, ValueError) as e:
+                    # Deleting chunks of a list we cannot read could destroy a backup
+                    self.logger.error(f"Garbage collection skipped: cannot read {name}: {e}")
+                    return 0, 0
+
+        deleted = freed = 0
+        cutoff = time.time() - grace_seconds
+        for entry in os.scandir(self.chunks_dir):
+            if not entry.is_dir():
+                continue
+            for chunk in os.scandir(entry.path):
+                digest = chunk.name.split('.', 1)[0]
+                stats = chunk.stat()
+                if digest in referenced or stats.st_mtime > cutoff:
+                    continue
+                try:
+                    os.remove(chunk.path)
+                    deleted += 1
+                    freed += stats.st_size
+                except FileNotFoundError:
+                    pass
+
+        self.logger.info(f"Garbage collection removed {deleted} chunks ({freed:,} bytes) in {time.time() - start:.2f}s")
+        return deleted, freed
+
+    def stats(self):
+        """Logical size of all backups against the bytes the store occupies"""
+        backups = self.list_backups()
+        chunk_count = stored = 0
+        for entry in os.scandir(self.chunks_dir):
+            if entry.is_dir():
+                for chunk in os.scandir(entry.path):
+                    chunk_count += 1
+                    stored += chunk.stat().st_size
+        logical = sum(backup['size'] for backup in backups)
+        return {
+            'backups': len(backups),
+            'chunks': chunk_count,
+            'logical_bytes': logical,
+            'stored_bytes': stored,
+            'dedup_ratio': round(logical / stored, 2) if stored else None
+        }
+
+
+def default_store_path(backup_path):
+    return os.path.join(backup_path, STORE_DIR)
+
+
+def open_chunk_list(path, threads=None):
+    """Stream over the backup described by the chunk list at `path` (in <store>/backups/)"""
+    store_path = os.path.dirname(os.path.dirname(os.path.abspath(path)))
+    return ChunkStore(store_path, threads=threads).open(os.path.abspath(path))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Deduplicating chunk store for SQL dumps')
+    parser.add_argument('--store', help='Store directory (default: <backup path>/chunk_store)')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    add = subparsers.add_parser('add', help='Store a plain or compressed SQL dump')
+    add.add_argument('backup_file')
+    add.add_argument('--name', help=f'Chunk list name (default: <dump name>{CHUNK_LIST_SUFFIX})')
+    add.add_argument('--remove-source', action='store_true', help='Delete the dump once stored')
+    add.add_argument('--compression', choices=sorted(METHOD_SUFFIXES), help='Chunk compression (default: zstd if available)')
+
+    subparsers.add_parser('list', help='List stored backups')
+    subparsers.add_parser('stats', help='Show deduplication statistics as JSON')
+
+    restore = subparsers.add_parser('restore', help='Reassemble a stored backup into a file')
+    restore.add_argument('name')
+    restore.add_argument('-o', '--output', required=True, help="Output file, or '-' for stdout")
+
+    verify = subparsers.add_parser('verify', help='Check that a stored backup is complete')
+    verify.add_argument('name')
+    verify.add_argument('--full', action='store_true', help='Reassemble and compare the checksum')
+
+    prune = subparsers.add_parser('prune', help='Apply retention and collect unreferenced chunks')
+    prune.add_argument('--keep', type=int, help='Keep the newest N backups')
+    prune.add_argument('--days', type=int, help='Keep backups created in the last N days')
+    prune.add_argument('--prefix', help='Only consider backups whose name starts with this')
+
+    subparsers.add_parser('gc', help='Delete chunks no backup refers to')
+    args = parser.parse_args()
+
+    from restore import DatabaseRestore
+    restore_tool = DatabaseRestore()
+    store = ChunkStore(args.store or default_store_path(restore_tool.restore_config['backup_path']),
+                       restore_tool.logger, compression=getattr(args, 'compression', None))
+
+    if args.command == 'add':
+        print(store.add(args.backup_file, args.name, args.remove_source))
+    elif args.command == 'list':
+        for backup in store.list_backups():
+            print(f"{backup['name']:<48} {backup['size']:>14,} bytes  {backup['chunks']:>6} chunks  "
+                  f"{backup['stored_bytes']:>12,} new  {backup['created']}")
+    elif args.command == 'stats':
+        print(json.dumps(store.stats(), indent=2))
+    elif args.command == 'restore':
+        out = sys.stdout.buffer if args.output == '-' else open(args.output, 'wb')
+        try:
+            with store.open(args.name) as stream:
+                shutil.copyfileobj(stream, out, 1024 * 1024)
+        finally:
+            if out is not sys.stdout.buffer:
+                out.close()
+    elif args.command == 'verify':
+        problems = store.verify(args.name, full=args.full)
+        for problem in problems:
+            print(problem)
+        sys.exit(1 if problems else 0)
+    elif args.command == 'prune':
+        if args.keep is None and args.days is None:
+            parser.error("prune needs --keep and/or --days")
+        for name in store.prune(args.keep, args.days, args.prefix):
+            print(f"Removed {name}")
+    elif args.command == 'gc':
+        store.gc()
+
+
+if __name__ == "__main__":
+    main()
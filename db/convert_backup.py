@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+"""
+Plain SQL to Directory-Format Backup Converter
+Rebuilds old plain dumps as pg_dump -Fd archives so they can be restored with parallel jobs
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import datetime
+import subprocess
+from pathlib import Path
+
+from restore import DatabaseRestore
+from archive_toc import recommended_jobs
+from dump_io import SQL_DUMP_SUFFIXES
+from dump_parser import is_data_only_dump
+
+DIRECTORY_SUFFIX = '.dir'
+
+
+def directory_archive_path(backup_file):
+    """Sibling directory archive for a plain dump: x.sql / x.sql.gz / x.sql.zst -> x.dir"""
+    name = Path(backup_file).name
+    for suffix in ('.sql.gz', '.sql.zst', '.sql'):
+        if name.endswith(suffix):
+            name = name[:-len(suffix)]
+            break
+    return str(Path(backup_file).with_name(name + DIRECTORY_SUFFIX))
+
+
+class BackupConverter:
+    """
+    Converts plain-format dumps to directory-format archives.
+
+    Each dump is loaded into a scratch database with the native restore
+    engine, dumped again with `pg_dump -Fd --jobs`, and the scratch
+    database is dropped. The archive is written under a temporary name and
+    renamed into place, so a half-written directory is never mistaken for
+    a finished one. The conversion is recorded in the dump's metadata file.
+    """
+
+    def __init__(self, jobs=None):
+        self.restore_tool = DatabaseRestore()
+        self.restore_tool.restore_config['verify_after_restore'] = False
+        self.db_config = self.restore_tool.db_config
+        self.backup_path = self.restore_tool.restore_config['backup_path']
+        self.logger = self.restore_tool.logger
+        self.jobs = jobs or recommended_jobs()
+
+    def find_plain_backups(self):
+        """Plain and compressed SQL dumps in the backup directory"""
+        backup_dir = Path(self.backup_path)
+        files = [f for suffix in SQL_DUMP_SUFFIXES for f in backup_dir.glob('*' + suffix)]
+        return sorted(str(f) for f in files)
+
+    def is_data_only(self, backup_file):
+        # A data-only dump has no tables to load into an empty scratch database
+        metadata = self.load_metadata(backup_file)
+        backup_type = metadata.get('backup_type') or metadata.get('type')
+        if backup_type:
+            return 'data' in backup_type
+        return is_data_only_dump(backup_file)
+
+    def metadata_path(self, backup_file):
+        return Path(backup_file).with_suffix('.json')
+
+    def load_metadata(self, backup_file):
+        try:
+            with open(self.metadata_path(backup_file), 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def convert(self, backup_file, force=False):
+        """Convert one dump; returns (success, archive path or error message)"""
+        target = directory_archive_path(backup_file)
+        if os.path.isdir(target) and not force:
+            self.logger.info(f"Already converted: {backup_file} -> {target}")
+            return True, target
+        if self.is_data_only(backup_file):
+            return False, "Data-only dumps cannot be converted without their schema"
+        if not self.restore_tool.verify_backup_file(backup_file):
+            return False, f"Backup file failed verification: {backup_file}"
+
+        production = self.db_config['database']
+        scratch = f"{production}_convert_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}"
+        temp_dir = f"{target}.tmp"
+        start_time = time.time()
+
+        ok, output = self.restore_tool.run_admin_sql(f'CREATE DATABASE "{scratch}";')
+        if not ok:
+            return False, f"Could not create scratch database: {output}"
+
+        try:
+            self.logger.info(f"Loading {backup_file} into scratch database '{scratch}'")
+            self.db_config['database'] = scratch
+            try:
+                if self.restore_tool.restore_config['sql_restore_mode'] == 'psql':
+                    # psql would follow a --create dump's \connect into production
+                    self.restore_tool.restore_config['sql_restore_mode'] = 'native'
+                loaded = self.restore_tool.restore_backup_file(backup_file)
+                if self.restore_tool.progress:
+                    self.restore_tool.progress.finish(loaded)
+            finally:
+                self.db_config['database'] = production
+            if not loaded:
+                return False, f"Could not load {backup_file} into the scratch database"
+
+            shutil.rmtree(temp_dir, ignore_errors=True)
+            if not self.dump_directory(scratch, temp_dir):
+                return False, "pg_dump -Fd failed"
+
+            shutil.rmtree(target, ignore_errors=True)
+            os.rename(temp_dir, target)
+        finally:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+            ok, output = self.restore_tool.run_admin_sql(f'DROP DATABASE IF EXISTS "{scratch}";')
+            if not ok:
+                self.logger.warning(f"Could not drop scratch database '{scratch}': {output}")
+
+        duration = time.time() - start_time
+        self.record_conversion(backup_file, target, duration)
+        self.logger.info(f"Converted {backup_file} -> {target} in {duration:.2f}s")
+        return True, target
+
+    def dump_directory(self, database, output_dir):
+        env = os.environ.copy()
+        env['PGPASSWORD'] = self.db_config['password']
+        cmd = [
+            'pg_dump',
+            '-h', self.db_config['host'],
+            '-p', self.db_config['port'],
+            '-U', self.db_config['user'],
+            '-d', database,
+            '--format=directory',
+            f'--jobs={self.jobs}',
+            '-f', output_dir,
+            '--no-password'
+        ]
+        result = subprocess.run(cmd, env=env, capture_output=True, text=True)
+        if result.returncode != 0:
+            self.logger.error(f"pg_dump failed: {result.stderr}")
+            return False
+        return True
+
+    def record_conversion(self, backup_file, target, duration):
+        """Note the directory-format sibling in the dump's metadata file"""
+        metadata = self.load_metadata(backup_file)
+        metadata.setdefault('backup_file', os.path.basename(backup_file))
+        metadata['directory_archive'] = os.path.basename(target)
+        metadata['directory_archive_created'] = datetime.datetime.now().isoformat()
+        metadata['conversion_seconds'] = round(duration, 2)
+
+        metadata_file = self.metadata_path(backup_file)
+        temp_file = f"{metadata_file}.tmp"
+        with open(temp_file, 'w') as f:
+            json.dump(metadata, f, indent=2)
+        os.replace(temp_file, metadata_file)
+
+    def convert_all(self, force=False):
+        """Convert every plain dump in the backup directory that has no archive yet"""
+        results = {}
+        for backup_file in self.find_plain_backups():
+            if os.path.isdir(directory_archive_path(backup_file)) and not force:
+                continue
+            results[backup_file] = self.convert(backup_file, force=force)
+            if not results[backup_file][0]:
+                self.logger.warning(f"Skipped {backup_file}: {results[backup_file][1]}")
+        return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Convert plain SQL dumps to directory-format archives')
+    parser.add_argument('backup_files', nargs='*', help='Plain or gzip SQL dumps to convert')
+    parser.add_argument('--all', action='store_true', help='Convert every plain dump in the backup directory')
+    parser.add_argument('--jobs', type=int, help='Parallel pg_dump jobs (default: one per core)')
+    parser.add_argument('--force', action='store_true', help='Reconvert dumps that already have an archive')
+    args = parser.parse_args()
+
+    if not args.backup_files and not args.all:
+        parser.error('specify backup files or --all')
+
+    converter = BackupConverter(jobs=args.jobs)
+    if args.all:
+        results = converter.convert_all(force=args.force)
+    else:
+        results = {f: converter.convert(f, force=args.force) for f in args.backup_files}
+
+    failed = [f for f, (success, _) in results.items() if not success]
+    print(f"\nConverted {len(results) - len(failed)} of {len(results)} backups")
+    for backup_file, (success, detail) in results.items():
+        print(f"  {'OK  ' if success else 'FAIL'} {os.path.basename(backup_file)}: {detail}")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
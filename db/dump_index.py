@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+"""
+Plain SQL Dump Index
+Byte offsets of every table's data in a dump, cached next to the backup file
+"""
+
+import os
+import json
+import datetime
+
+from dump_io import open_dump
+from dump_parser import DumpEntry, DumpParser, RangeReader
+
+INDEX_VERSION = 4
+INDEX_SUFFIX = '.index.json'
+
+
+def _text(value):
+    # Dumps may use any server encoding; keep undecodable bytes round-trippable
+    return value.decode('utf-8', errors='surrogateescape')
+
+
+def _bytes(value):
+    return value.encode('utf-8', errors='surrogateescape')
+
+
+class DumpIndex:
+    """
+    Section index of a plain or gzip-compressed pg_dump file.
+
+    Records the session settings and, for every table with data, the COPY
+    statement and the byte range of its rows (offsets into the decompressed
+    stream for .gz files). Tables dumped as INSERT statements are recorded
+    with their data format so the range is rewritten to COPY rows on read.
+    The index is built with one pass over the dump and stored as
+    `<backup>.index.json`; it is rebuilt when the backup's size or
+    modification time no longer match.
+    """
+
+    def __init__(self, backup_file, session_sql=b'', tables=None, file_size=None, file_mtime=None):
+        self.backup_file = str(backup_file)
+        self.session_sql = session_sql
+        self.tables = tables or {}
+        self.file_size = file_size
+        self.file_mtime = file_mtime
+
+    @staticmethod
+    def index_path(backup_file):
+        return f"{backup_file}{INDEX_SUFFIX}"
+
+    @classmethod
+    def build(cls, backup_file):
+        """Scan the dump once and record where each table's data lives"""
+        stat = os.stat(backup_file)
+        tables = {}
+        with open_dump(backup_file) as stream:
+            parser = DumpParser(stream)
+            session_sql = parser.session_sql
+            for entry in parser:
+                if not entry.is_copy:
+                    continue
+                entry.data.drain()
+                tables[entry.table] = {
+                    'dump_id': entry.dump_id,
+                    'copy_sql': _text(entry.copy_sql),
+                    'pre_sql': _text(entry.pre_sql),
+                    'post_sql': _text(entry.post_sql),
+                    'data_format': entry.data_format,
+                    'data_offset': entry.data_offset,
+                    'data_end': entry.data_end
+                }
+        return cls(backup_file, session_sql, tables, stat.st_size, stat.st_mtime)
+
+    @classmethod
+    def load(cls, backup_file):
+        """Load the cached index if it still matches the backup, else None"""
+        path = cls.index_path(backup_file)
+        try:
+            with open(path, 'r') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        stat = os.stat(backup_file)
+        if (data.get('version') != INDEX_VERSION or data.get('file_size') != stat.st_size
+                or data.get('file_mtime') != stat.st_mtime):
+            return None
+
+        return cls(backup_file, _bytes(data['session_sql']), data['tables'],
+                   data['file_size'], data['file_mtime'])
+
+    @classmethod
+    def load_or_build(cls, backup_file, logger=None):
+        index = cls.load(backup_file)
+        if index:
+            if logger:
+                logger.info(f"Using cached dump index: {cls.index_path(backup_file)}")
+            return index
+
+        if logger:
+            logger.info(f"Building dump index for: {backup_file}")
+        index = cls.build(backup_file)
+        try:
+            index.save()
+        except OSError as e:
+            # A read-only backup directory only costs a rescan next time
+            if logger:
+                logger.warning(f"Could not cache dump index: {e}")
+        return index
+
+    def save(self):
+        data = {
+            'version': INDEX_VERSION,
+            'backup_file': os.path.basename(self.backup_file),
+            'file_size': self.file_size,
+            'file_mtime': self.file_mtime,
+            'created_at': datetime.datetime.now().isoformat(),
+            'session_sql': _text(self.session_sql),
+            'tables': self.tables
+        }
+        path = self.index_path(self.backup_file)
+        temp_file = f"{path}.tmp"
+        with open(temp_file, 'w') as f:
+            json.dump(data, f, indent=2)
+        os.replace(temp_file, path)
+
+    def resolve(self, name):
+        """Find the indexed table for `name` or `schema.name`"""
+        if name in self.tables:
+            return name
+        matches = [table for table in self.tables if table.split('.', 1)[-1] == name]
+        return matches[0] if len(matches) == 1 else None
+
+    def entry(self, table):
+        """DumpEntry describing one indexed table's COPY block"""
+        info = self.tables[table]
+        schema, _, name = table.rpartition('.')
+        entry = DumpEntry(info['dump_id'], name, 'TABLE DATA', schema or '-', 'data', None)
+        entry.copy_sql = _bytes(info['copy_sql'])
+        entry.pre_sql = _bytes(info['pre_sql'])
+        entry.post_sql = _bytes(info['post_sql'])
+        entry.data_format = info.get('data_format', 'copy')
+        entry.data_offset = info['data_offset']
+        entry.data_end = info['data_end']
+        return entry
+
+    def open_data(self, stream, entry):
+        """
+        Reader over one entry's COPY rows in an open dump stream.
+
+        Plain files seek directly; gzip streams decompress forward to the
+        offset, so entries should be read in ascending offset order.
+        """
+        return entry.rows_reader(RangeReader(stream, entry.data_offset, entry.data_size))
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""
+Backup Dump Streaming Helpers
+Chunked readers and process pipes shared by the restore tools
+"""
+
+import shutil
+import subprocess
+import threading
+from collections import deque
+from contextlib import contextmanager
+
+from block_compress import compression_method, open_compressed
+from chunk_store import CHUNK_LIST_SUFFIX, open_chunk_list
+
+# Size of each block read from the dump and written to the restore process
+STREAM_CHUNK_SIZE = 1024 * 1024
+
+# Lines of process output retained for error reporting
+OUTPUT_TAIL_LINES = 200
+
+# Plain-format dumps: uncompressed, block/stream compressed, or a chunk list
+# in the deduplicating store (chunk_store.py)
+SQL_DUMP_SUFFIXES = ('.sql', '.sql.gz', '.sql.zst', CHUNK_LIST_SUFFIX)
+
+
+class CountingReader:
+    """Binary reader that reports every block it reads to a callback"""
+
+    def __init__(self, raw, on_read):
+        self.raw = raw
+        self.on_read = on_read
+
+    def read(self, size=-1):
+        data = self.raw.read(size)
+        self.on_read(len(data))
+        return data
+
+    def readline(self, size=-1):
+        line = self.raw.readline(size)
+        self.on_read(len(line))
+        return line
+
+    def close(self):
+        self.raw.close()
+
+
+@contextmanager
+def open_dump(backup_file, progress=None):
+    """
+    Open a plain, gzip- or zstd-compressed dump as a binary stream.
+
+    When a progress tracker is given, the bytes read from disk (compressed
+    bytes for .gz and .zst files) are reported to it so percentages are
+    relative to the file size. Block-compressed dumps (block_compress.py)
+    are decompressed on one thread per CPU. Chunk lists are reassembled
+    from the chunk store; their progress counts dump bytes.
+    """
+    if str(backup_file).endswith(CHUNK_LIST_SUFFIX):
+        with open_chunk_list(backup_file) as stream:
+            yield CountingReader(stream, progress.advance) if progress else stream
+        return
+    with open(backup_file, 'rb') as raw:
+        source = CountingReader(raw, progress.advance) if progress else raw
+        if compression_method(backup_file):
+            with open_compressed(source, backup_file) as decompressed:
+                yield decompressed
+        else:
+            yield source
+
+
+def stream_to_process(cmd, source=None, env=None, timeout=None, chunk_size=STREAM_CHUNK_SIZE, on_line=None):
+    """
+    Run a restore process, optionally feeding a binary stream to its stdin.
+
+    The stream is written in fixed-size chunks, so a multi-GB gzip dump is
+    restored with constant memory and without a decompressed temp file.
+    stderr is read line by line on a background thread: each line goes to
+    `on_line` as it arrives and only the last OUTPUT_TAIL_LINES are kept.
+    Returns a CompletedProcess like subprocess.run and raises
+    subprocess.TimeoutExpired if the process outlives `timeout`.
+    """
+    process = subprocess.Popen(
+        cmd,
+        env=env,
+        stdin=subprocess.PIPE if source is not None else subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE
+    )
+
+    stderr_tail = deque(maxlen=OUTPUT_TAIL_LINES)
+
+    def _drain_stderr():
+        for raw_line in process.stderr:
+            line = raw_line.decode('utf-8', errors='replace').rstrip('\r\n')
+            stderr_tail.append(line)
+            if on_line:
+                on_line(line)
+
+    reader = threading.Thread(target=_drain_stderr, daemon=True)
+    reader.start()
+
+    timed_out = threading.Event()
+
+    def _kill():
+        timed_out.set()
+        process.kill()
+
+    timer = threading.Timer(timeout, _kill) if timeout else None
+    if timer:
+        timer.start()
+
+    try:
+        if source is not None:
+            try:
+                shutil.copyfileobj(source, process.stdin, chunk_size)
+            except BrokenPipeError:
+                # The process exited early (bad credentials, killed on timeout);
+                # its exit code and stderr explain why
+                pass
+            finally:
+                try:
+                    process.stdin.close()
+                except BrokenPipeError:
+                    pass
+
+        returncode = process.wait()
+        reader.join()
+    finally:
+        if timer:
+            timer.cancel()
+
+    stderr = '\n'.join(stderr_tail)
+
+    if timed_out.is_set():
+        raise subprocess.TimeoutExpired(cmd, timeout, stderr=stderr)
+
+    return subprocess.CompletedProcess(cmd, returncode, None, stderr)
@@ -0,0 +1,392 @@
+#!/usr/bin/env python3
+"""
+Plain SQL Dump Parser
+Splits pg_dump plain-format output into pre-data, data and post-data entries
+"""
+
+import re
+
+from archive_toc import ArchiveFormatError, is_archive, read_archive_toc
+from dump_io import open_dump
+from insert_rewriter import InsertCopyReader, copy_statement, insert_header
+
+# pg_dump precedes every archive entry with a header comment such as
+#   -- Name: users; Type: TABLE; Schema: public; Owner: postgres
+#   -- Data for Name: users; Type: TABLE DATA; Schema: public; Owner: -
+HEADER_PATTERN = re.compile(
+    rb'^-- (?P<data>Data for )?Name: (?P<name>.*?); Type: (?P<type>.*?); '
+    rb'Schema: (?P<schema>.*?)(?:; Owner: .*?)?(?:; Tablespace: .*)?\r?$'
+)
+
+COPY_PATTERN = re.compile(rb'^COPY (?P<target>.+) FROM stdin;\r?$', re.MULTILINE)
+
+# Entry types pg_dump places in the data section
+DATA_TYPES = {'TABLE DATA', 'SEQUENCE SET', 'BLOB DATA', 'LARGE OBJECT DATA'}
+
+# Entry types pg_dump places in the post-data section
+POST_DATA_TYPES = {
+    'INDEX', 'INDEX ATTACH', 'CONSTRAINT', 'FK CONSTRAINT', 'CHECK CONSTRAINT',
+    'TRIGGER', 'EVENT TRIGGER', 'RULE', 'POLICY', 'MATERIALIZED VIEW DATA',
+    'PUBLICATION TABLE', 'PUBLICATION TABLES IN SCHEMA'
+}
+
+# Entries that act on the database itself rather than its contents; the
+# restore tools always load into an already created target database
+DATABASE_TYPES = {'DATABASE', 'DATABASE PROPERTIES'}
+
+# Archive TOC entries that only record session settings; a data-only
+# archive carries them alongside its data entries
+SETTING_TYPES = {'ENCODING', 'STDSTRINGS', 'SEARCHPATH'}
+
+COPY_TERMINATOR = b'\\.'
+
+
+def has_copy_data(sql):
+    """True if `sql` holds a COPY ... FROM stdin, whose rows cannot be run as SQL"""
+    return COPY_PATTERN.search(sql) is not None
+
+
+def is_data_only_dump(backup_file):
+    """
+    Whether a dump holds rows only (pg_dump --data-only), judged from its entries.
+
+    Archives are data-only when their TOC has nothing but data, setting
+    and database entries. Plain dumps list pre-data entries first, so the type of the
+    first entry header decides. Archives whose TOC cannot be read are
+    reported as full dumps.
+    """
+    if is_archive(backup_file):
+        try:
+            entries = read_archive_toc(backup_file)
+        except (ArchiveFormatError, OSError):
+            return False
+        allowed = DATA_TYPES | SETTING_TYPES | DATABASE_TYPES
+        return any(e.desc in DATA_TYPES for e in entries) and all(e.desc in allowed for e in entries)
+    with open_dump(backup_file) as stream:
+        for line in iter(stream.readline, b''):
+            match = HEADER_PATTERN.match(line.rstrip(b'\n'))
+            if match:
+                return match.group('type').decode() in DATA_TYPES
+    return False
+
+
+class DumpEntry:
+    """A single archive entry from a plain-format dump"""
+
+    def __init__(self, dump_id, name, entry_type, schema, section, offset):
+        self.dump_id = dump_id
+        self.name = name
+        self.entry_type = entry_type
+        self.schema = schema
+        self.section = section
+        self.offset = offset
+        self.sql = b''
+        # Statements around the rows of a data entry, e.g. the ALTER TABLE
+        # ... DISABLE/ENABLE TRIGGER ALL of a --disable-triggers dump;
+        # post_sql is known once the rows have been read
+        self.pre_sql = b''
+        self.post_sql = b''
+        self.copy_sql = None
+        self.data_format = 'copy'
+        self.data_offset = None
+        self.data_end = None
+        self.data = None
+
+    @property
+    def table(self):
+        """Schema-qualified table name for data entries"""
+        if self.schema and self.schema != '-':
+            return f"{self.schema}.{self.name}"
+        return self.name
+
+    @property
+    def is_copy(self):
+        return self.copy_sql is not None
+
+    @property
+    def data_size(self):
+        """Size in bytes of the COPY data block (0 for non-COPY entries)"""
+        if self.data_offset is None or self.data_end is None:
+            return 0
+        return self.data_end - self.data_offset
+
+    def rows_reader(self, raw):
+        """COPY rows from a reader over this entry's data range (rewriting INSERTs if needed)"""
+        return InsertCopyReader(raw) if self.data_format == 'insert' else raw
+
+    def __repr__(self):
+        return f"<DumpEntry {self.dump_id} {self.entry_type} {self.table} [{self.section}]>"
+
+
+class CopyDataStream:
+    """
+    File-like view of one COPY block in the dump.
+
+    Hands psycopg2's copy_expert the data rows straight from the underlying
+    dump stream, line by line, and reports EOF at the terminating backslash-dot.
+    """
+
+    def __init__(self, parser, entry):
+        self.parser = parser
+        self.entry = entry
+        self.finished = False
+        self.bytes_read = 0
+        self._buffer = b''
+
+    def readline(self, size=-1):
+        if self._buffer:
+            line, self._buffer = self._buffer, b''
+            return line
+        if self.finished:
+            return b''
+        line = self.parser._read_line()
+        if not line or line.rstrip(b'\r\n') == COPY_TERMINATOR:
+            self.finished = True
+            self.entry.data_end = self.parser.position - len(line)
+            self.entry.post_sql = self.parser._read_body()
+            return b''
+        self.bytes_read += len(line)
+        return line
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            return b''.join(iter(self.readline, b''))
+        chunks = []
+        remaining = size
+        while remaining > 0:
+            line = self.readline()
+            if not line:
+                break
+            if len(line) > remaining:
+                self._buffer = line[remaining:]
+                line = line[:remaining]
+            chunks.append(line)
+            remaining -= len(line)
+        return b''.join(chunks)
+
+    def drain(self):
+        """Skip whatever the consumer did not read"""
+        self._buffer = b''
+        while not self.finished:
+            self.readline()
+
+
+class EntryBodyReader:
+    """
+    Line reader over the rest of one entry's body, ending at the next header.
+
+    Feeds the INSERT statements of a TABLE DATA entry to an InsertCopyReader
+    and records where the entry's data ends.
+    """
+
+    def __init__(self, parser, entry):
+        self.parser = parser
+        self.entry = entry
+        self.finished = False
+
+    def readline(self, size=-1):
+        if self.finished:
+            return b''
+        line = self.parser._read_line()
+        if not line or (line.startswith(b'-- ') and HEADER_PATTERN.match(line)):
+            if line:
+                self.parser._unread_line(line)
+            self.finished = True
+            self.entry.data_end = self.parser.position
+            return b''
+        return line
+
+
+class RangeReader:
+    """File-like reader limited to a byte range of a seekable file"""
+
+    def __init__(self, file_obj, offset, length):
+        self.file_obj = file_obj
+        self.file_obj.seek(offset)
+        self.remaining = length
+
+    def read(self, size=-1):
+        if self.remaining <= 0:
+            return b''
+        if size is None or size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file_obj.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def readline(self, size=-1):
+        if self.remaining <= 0:
+            return b''
+        line = self.file_obj.readline(self.remaining)
+        self.remaining -= len(line)
+        return line
+
+
+class DumpParser:
+    """
+    Streaming parser for pg_dump plain-format dumps.
+
+    Iterating yields DumpEntry objects in dump order. COPY entries expose
+    their rows through `entry.data`, which must be consumed before the next
+    entry is requested (anything left unread is skipped). Session settings
+    from the dump preamble are available as `session_sql` once constructed.
+
+    With `rewrite_inserts`, TABLE DATA entries made of INSERT statements
+    (--inserts / --column-inserts dumps) are presented as COPY entries too:
+    `entry.data` rewrites the statements to COPY rows as they are read.
+    """
+
+    def __init__(self, stream, rewrite_inserts=True):
+        self.stream = stream
+        self.position = 0
+        self._pushback = None
+        self.session_sql = b''
+        self.preamble_sql = b''
+        self.section = 'pre-data'
+        self._read_preamble()
+        # Literals are only copied verbatim when backslashes are not escapes
+        self.rewrite_inserts = rewrite_inserts and b'standard_conforming_strings = on' in self.session_sql
+
+    def _read_line(self):
+        if self._pushback is not None:
+            line, self._pushback = self._pushback, None
+        else:
+            line = self.stream.readline()
+        self.position += len(line)
+        return line
+
+    def _unread_line(self, line):
+        self._pushback = line
+        self.position -= len(line)
+
+    def _read_preamble(self):
+        """Collect SET statements and --clean drops that precede the first entry"""
+        session = []
+        preamble = []
+        while True:
+            line = self._read_line()
+            if not line:
+                break
+            if HEADER_PATTERN.match(line):
+                self._unread_line(line)
+                break
+
+            stripped = line.strip()
+            if not stripped or stripped.startswith(b'--') or stripped.startswith(b'\\'):
+                continue
+            if stripped.startswith(b'SET ') or stripped.startswith(b'SELECT pg_catalog.set_config'):
+                session.append(line)
+            elif stripped.startswith(b'DROP DATABASE'):
+                continue
+            else:
+                preamble.append(line)
+
+        self.session_sql = b''.join(session)
+        self.preamble_sql = b''.join(preamble)
+
+    def _classify(self, entry_type, name):
+        """Assign a section; pg_dump emits sections in order so it only moves forward"""
+        if entry_type in DATABASE_TYPES or (entry_type == 'COMMENT' and name.startswith('DATABASE ')):
+            return 'skip'
+        if entry_type in POST_DATA_TYPES:
+            self.section = 'post-data'
+        elif entry_type in DATA_TYPES and self.section == 'pre-data':
+            self.section = 'data'
+        return self.section
+
+    def _read_body(self):
+        """Read entry text up to the next header, dropping psql meta-commands"""
+        lines = []
+        while True:
+            line = self._read_line()
+            if not line:
+                break
+            if line.startswith(b'-- ') and HEADER_PATTERN.match(line):
+                self._unread_line(line)
+                break
+            if line.startswith(b'\\'):
+                continue
+            lines.append(line)
+
+        # The header block of the next entry starts with a bare comment line;
+        # the last entry ends with the "dump complete" comment block. Left
+        # alone, a body of only comments is an empty query to the server
+        while lines and (not lines[-1].strip() or lines[-1].startswith(b'--')):
+            lines.pop()
+        while lines and (not lines[0].strip() or lines[0].startswith(b'--')):
+            lines.pop(0)
+        return b''.join(lines)
+
+    def __iter__(self):
+        dump_id = 0
+        while True:
+            offset = self.position
+            line = self._read_line()
+            if not line:
+                return
+
+            match = HEADER_PATTERN.match(line)
+            if not match:
+                # Trailing comments and blank lines between entries
+                continue
+
+            dump_id += 1
+            name = match.group('name').decode('utf-8', errors='replace')
+            entry_type = match.group('type').decode('utf-8', errors='replace')
+            schema = match.group('schema').decode('utf-8', errors='replace')
+            entry = DumpEntry(dump_id, name, entry_type, schema, self._classify(entry_type, name), offset)
+
+            if entry_type == 'TABLE DATA' and self._start_copy(entry):
+                yield entry
+                entry.data.drain()
+                continue
+            if entry_type != 'TABLE DATA':
+                entry.sql = self._read_body()
+            yield entry
+
+    def schema_entries(self):
+        """Pre-data entries in dump order; reading stops at the first data or post-data entry"""
+        for entry in self:
+            if entry.section == 'skip':
+                continue
+            if entry.section != 'pre-data':
+                return
+            yield entry
+
+    def _start_copy(self, entry):
+        """
+        Position the parser on the rows of a COPY entry, if this is one.
+
+        Statements before the rows go to `entry.pre_sql`. When the entry
+        has no rows to stream, its whole text goes to `entry.sql` instead.
+        """
+        lines = []
+        while True:
+            line = self._read_line()
+            if not line:
+                break
+            if line.startswith(b'-- ') and HEADER_PATTERN.match(line):
+                # An empty table in an INSERT-style dump has no statements
+                self._unread_line(line)
+                break
+            stripped = line.strip()
+            if not stripped or stripped.startswith(b'--') or stripped.startswith(b'\\'):
+                continue
+            if COPY_PATTERN.match(line.rstrip(b'\r\n')):
+                entry.pre_sql = b''.join(lines)
+                entry.copy_sql = line.strip()
+                entry.data_offset = self.position
+                entry.data = CopyDataStream(self, entry)
+                return True
+            header = insert_header(line) if self.rewrite_inserts else None
+            if header:
+                self._unread_line(line)
+                entry.pre_sql = b''.join(lines)
+                entry.copy_sql = copy_statement(*header)
+                entry.data_format = 'insert'
+                entry.data_offset = self.position
+                entry.data = InsertCopyReader(EntryBodyReader(self, entry))
+                return True
+            lines.append(line)
+        entry.sql = b''.join(lines)
+        return False
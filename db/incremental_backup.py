@@ -0,0 +1,541 @@
+#!/usr/bin/env python3
+"""
+Incremental Backups
+Row-level incrementals on top of a parallel export, driven by updated_at watermarks and key-set diffs
+"""
+
+import os
+import re
+import sys
+import io
+import gzip
+import json
+import time
+import shutil
+import argparse
+import datetime
+import functools
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from parallel_export import (EXPORT_TABLES_SQL, SEQUENCES_SQL, ParallelExport, _identifier,
+                             is_copy_export, load_export_index)
+from restore_manifest import RestoreManifest, load_manifest, save_manifest
+
+INCREMENTAL_INDEX = 'incremental.json'
+INCREMENTAL_VERSION = 1
+INCREMENTAL_SUFFIX = '.incr'
+KEYS_DIR = 'keys'
+WATERMARK_COLUMN = 'updated_at'
+
+# Backslash escapes of COPY's text format, as written by COPY TO
+COPY_ESCAPE = re.compile(rb'\\(.)')
+COPY_ESCAPES = {b'b': b'\b', b'f': b'\f', b'n': b'\n', b'r': b'\r', b't': b'\t', b'v': b'\v'}
+
+# Tables whose updated_at is kept current by an update_<table>_updated_at
+# trigger (see schema.sql), with their primary key columns and types
+TRACKED_TABLES_SQL = """
+    SELECT n.nspname, c.relname,
+           array_agg(a.attname::text ORDER BY array_position(i.indkey::int2[], a.attnum)),
+           array_agg(format_type(a.atttypid, a.atttypmod) ORDER BY array_position(i.indkey::int2[], a.attnum))
+      FROM pg_class c
+      JOIN pg_namespace n ON n.oid = c.relnamespace
+      JOIN pg_index i ON i.indrelid = c.oid AND i.indisprimary
+      JOIN pg_attribute a ON a.attrelid = c.oid AND a.attnum = ANY (i.indkey)
+     WHERE c.relkind = 'r'
+       AND EXISTS (SELECT 1 FROM pg_attribute u
+                    WHERE u.attrelid = c.oid AND u.attname = 'updated_at' AND NOT u.attisdropped)
+       AND EXISTS (SELECT 1 FROM pg_trigger t
+                    WHERE t.tgrelid = c.oid AND t.tgname = 'update_' || c.relname || '_updated_at')
+     GROUP BY n.nspname, c.relname
+"""
+
+# Column layout of every table; incrementals only apply on top of the same layout
+COLUMNS_SQL = """
+    SELECT n.nspname || '.' || c.relname, array_agg(a.attname::text || ' ' || format_type(a.atttypid, a.atttypmod)
+                                                   ORDER BY a.attnum)
+      FROM pg_class c
+      JOIN pg_namespace n ON n.oid = c.relnamespace
+      JOIN pg_attribute a ON a.attrelid = c.oid AND a.attnum > 0 AND NOT a.attisdropped
+     WHERE c.relkind = 'r'
+       AND n.nspname NOT IN ('pg_catalog', 'information_schema')
+       AND n.nspname NOT LIKE 'pg_toast%%'
+     GROUP BY 1
+"""
+
+# Rows written by transactions still running when the snapshot is taken are
+# invisible to it but stamped with their (earlier) start time, so the next
+# incremental starts from the oldest transaction open just before the
+# snapshot rather than from now()
+WATERMARK_SQL = """
+    SELECT LEAST(now(), min(xact_start))
+      FROM pg_stat_activity
+     WHERE datname = current_database()
+       AND pid <> pg_backend_pid()
+       AND xact_start IS NOT NULL
+"""
+
+
+class IncrementalBackupError(Exception):
+    """The chain cannot be extended or replayed (missing link, schema change)"""
+
+
+def is_incremental(path):
+    """True for a directory written by IncrementalBackup.incremental()"""
+    return os.path.isdir(path) and os.path.isfile(os.path.join(path, INCREMENTAL_INDEX))
+
+
+def load_incremental_index(backup_dir):
+    with open(os.path.join(backup_dir, INCREMENTAL_INDEX), 'r') as f:
+        return json.load(f)
+
+
+def chain_state(backup_dir):
+    """Watermark, tracked tables and layout recorded by a chain link, or None if it cannot start a chain"""
+    if is_incremental(backup_dir):
+        return load_incremental_index(backup_dir)['state']
+    if is_copy_export(backup_dir):
+        index = load_export_index(backup_dir)
+        # Only exports taken as a chain base record a watermark
+        return index.get('state') if index.get('pre_data') else None
+    return None
+
+
+def resolve_chain(backup_dir):
+    """Full export followed by the incrementals leading to `backup_dir`, oldest first"""
+    chain = []
+    current = os.path.abspath(backup_dir)
+    while is_incremental(current):
+        chain.append(current)
+        parent = os.path.join(os.path.dirname(current), load_incremental_index(current)['parent'])
+        if not os.path.isdir(parent):
+            raise IncrementalBackupError(f"Chain is broken: {os.path.basename(parent)} (parent of "
+                                         f"{os.path.basename(current)}) is missing")
+        current = parent
+    if not chain_state(current):
+        raise IncrementalBackupError(f"{os.path.basename(current)} is not a full export a chain can start from")
+    chain.append(current)
+    return list(reversed(chain))
+
+
+def latest_chain_link(backup_path):
+    """Newest full export or incremental in `backup_path` a new incremental can build on"""
+    links = []
+    for entry in os.scandir(backup_path):
+        if entry.is_dir() and chain_state(entry.path):
+            index = load_incremental_index(entry.path) if is_incremental(entry.path) else load_export_index(entry.path)
+            links.append((index['created'], entry.path))
+    return max(links)[1] if links else None
+
+
+def _key_fields(line):
+    """Column values of one COPY text line of key columns"""
+    return [COPY_ESCAPE.sub(lambda m: COPY_ESCAPES.get(m.group(1), m.group(1)), field).decode('utf-8')
+            for field in line.split(b'\t')]
+
+
+def _key_line_set(path):
+    with gzip.open(path, 'rb') as f:
+        return set(f.read().splitlines())
+
+
+def chain_key_set(chain, table):
+    """Keys of `table` as of the last link: the base's key set plus each link's inserted minus its deleted keys"""
+    keys = _key_line_set(os.path.join(chain[0], chain_state(chain[0])['tracked'][table]['keys']))
+    for link in chain[1:]:
+        for entry in load_incremental_index(link)['tables']:
+            if entry['table'] != table:
+                continue
+            if entry.get('inserted_file'):
+                keys |= _key_line_set(os.path.join(link, entry['inserted_file']))
+            if entry.get('deleted_file'):
+                keys -= _key_line_set(os.path.join(link, entry['deleted_file']))
+    return keys
+
+
+class IncrementalBackup(ParallelExport):
+    """
+    Chains of row-level incremental backups.
+
+    full() takes a parallel export (see parallel_export.py) that also
+    records a watermark taken just before its snapshot and, from the
+    snapshot, the primary keys of every tracked table - tables with an
+    updated_at column kept current by an update_<table>_updated_at
+    trigger.
+
+    incremental() builds on the newest link of a chain. For tracked tables
+    it exports the rows with updated_at at or after the parent's watermark
+    (and rows whose key is new, in case an insert set an old timestamp),
+    and the keys that disappeared, found by comparing the key set with the
+    parent's. Other tables are checksummed (a full scan of each, but only
+    of those) and exported whole only when the checksum differs from the
+    parent's manifest; tracked tables enter the manifest with the row
+    count of their key set and no checksum. The output is an <name>.incr
+    directory indexed by incremental.json, which names its parent.
+
+    restore() loads the full export into an empty database and replays
+    each incremental in order, one transaction per link, with triggers
+    suspended so updated_at keeps its backed-up values.
+    """
+
+    # Backup
+
+    def _watermark(self):
+        """Read before the snapshot is taken, on its own connection"""
+        conn = self.connect()
+        try:
+            with conn.cursor() as cur:
+                cur.execute(WATERMARK_SQL)
+                return cur.fetchone()[0].isoformat()
+        finally:
+            conn.close()
+
+    def _table_layout(self, cur):
+        cur.execute(COLUMNS_SQL)
+        return {table: columns for table, columns in cur.fetchall()}
+
+    def _tracked_tables(self, cur):
+        cur.execute(TRACKED_TABLES_SQL)
+        return {f"{schema}.{name}": {'key': list(columns), 'key_types': list(types)}
+                for schema, name, columns, types in cur.fetchall()}
+
+    def _export_keys(self, snapshot, table, key, f):
+        """COPY the primary keys of `table` into `f`, one line per row"""
+        from psycopg2 import sql
+        conn = self._snapshot_connection(snapshot)
+        columns = sql.SQL(', ').join(map(sql.Identifier, key))
+        query = sql.SQL("COPY (SELECT {} FROM {}) TO STDOUT").format(columns, _identifier(table))
+        with conn.cursor() as cur:
+            cur.copy_expert(query.as_string(conn), f)
+
+    def _write_keys(self, path, keys):
+        with self._open_data_file(path, 'wb') as f:
+            f.write(b''.join(key + b'\n' for key in sorted(keys)))
+        return os.path.getsize(path)
+
+    def _capture_state(self, cur, snapshot, output_dir, watermark):
+        """Chain state as of `snapshot`: watermark, key sets of tracked tables and table layout"""
+        tracked = self._tracked_tables(cur)
+        os.makedirs(os.path.join(output_dir, KEYS_DIR), exist_ok=True)
+        for table, info in tracked.items():
+            info['keys'] = os.path.join(KEYS_DIR, f"{table}.keys.gz")
+            with self._open_data_file(os.path.join(output_dir, info['keys']), 'wb') as f:
+                self._export_keys(snapshot, table, info['key'], f)
+        return {
+            'watermark': watermark,
+            'tracked': tracked,
+            'columns': self._table_layout(cur)
+        }
+
+    def full(self, output_dir, manifest=True):
+        """Take the full export a chain starts from; returns its index"""
+        watermark = self._watermark()
+        index = self.export(output_dir, schema=True, manifest=manifest,
+                            on_snapshot=functools.partial(self._capture_state, watermark=watermark))
+        self.logger.info(f"Chain base {os.path.basename(output_dir)}: watermark {index['state']['watermark']}, "
+                         f"{len(index['state']['tracked'])} tracked tables")
+        return index
+
+    def _export_changes(self, snapshot, output_dir, chain, parent_state, table, info, number):
+        """Changed rows, inserted and deleted keys of one tracked table since the parent"""
+        from psycopg2 import sql
+        start = time.time()
+        buffer = io.BytesIO()
+        self._export_keys(snapshot, table, info['key'], buffer)
+        current = set(buffer.getvalue().splitlines())
+        previous = chain_key_set(chain, table)
+        deleted = previous - current
+        inserted = current - previous
+
+        conn = self._snapshot_connection(snapshot)
+        # updated_at is a timestamp without time zone written in the server's
+        # TimeZone, so the watermark is converted to that type rather than
+        # the column to timestamptz (which would also bypass its index)
+        condition = sql.SQL(
+            "{column} >= (%s::timestamptz AT TIME ZONE current_setting('TimeZone')) OR {column} IS NULL"
+        ).format(column=sql.Identifier(WATERMARK_COLUMN))
+        params = [parent_state['watermark']]
+        if inserted:
+            # New keys are exported whatever their timestamp says; a row
+            # value compares composite keys column by column
+            values = list(zip(*(_key_fields(key) for key in sorted(inserted))))
+            condition = sql.SQL("{} OR ({}) IN (SELECT * FROM unnest({}))").format(
+                condition,
+                sql.SQL(', ').join(map(sql.Identifier, info['key'])),
+                sql.SQL(', ').join(sql.SQL("%s::{}[]").format(sql.SQL(key_type)) for key_type in info['key_types']))
+            params.extend(list(column) for column in values)
+
+        entry = {'table': table, 'mode': 'upsert', 'key': info['key'], 'file': None, 'rows': 0,
+                 'inserted_file': None, 'inserted': len(inserted), 'deleted_file': None, 'deleted': len(deleted),
+                 'bytes': 0, 'table_rows': len(current)}
+        with conn.cursor() as cur:
+            query = sql.SQL("SELECT * FROM {} WHERE {}").format(_identifier(table), condition).as_string(conn)
+            file_name = f"changes_{number:04d}.copy.gz"
+            path = os.path.join(output_dir, file_name)
+            with self._open_data_file(path, 'wb') as f:
+                cur.copy_expert(f"COPY ({cur.mogrify(query, params).decode('utf-8')}) TO STDOUT", f)
+            entry['rows'] = cur.rowcount
+            if entry['rows']:
+                entry['file'] = file_name
+                entry['bytes'] += os.path.getsize(path)
+            else:
+                os.remove(path)
+
+        # Key deltas let the next incremental rebuild this key set from the chain
+        if inserted:
+            entry['inserted_file'] = f"inserted_{number:04d}.keys.gz"
+            entry['bytes'] += self._write_keys(os.path.join(output_dir, entry['inserted_file']), inserted)
+        if deleted:
+            entry['deleted_file'] = f"deleted_{number:04d}.keys.gz"
+            entry['bytes'] += self._write_keys(os.path.join(output_dir, entry['deleted_file']), deleted)
+
+        self.logger.info(f"{table}: {entry['rows']:,} changed rows ({entry['inserted']:,} new), "
+                         f"{entry['deleted']:,} deleted in {time.time() - start:.2f}s")
+        return entry
+
+    def incremental(self, output_dir, parent_dir, manifest=True):
+        """
+        Export what changed since `parent_dir` (a chain base or incremental) into `output_dir`.
+
+        Raises IncrementalBackupError when the parent cannot be built on,
+        e.g. after a schema change; take a new full() then.
+        """
+        if os.path.exists(output_dir):
+            raise FileExistsError(f"Incremental target already exists: {output_dir}")
+        parent_state = chain_state(parent_dir)
+        if not parent_state:
+            raise IncrementalBackupError(f"{parent_dir} is not a chain base or incremental backup")
+        parent_index = load_incremental_index(parent_dir) if is_incremental(parent_dir) else None
+        chain = resolve_chain(parent_dir)
+        base = os.path.basename(chain[0])
+
+        temp_dir = f"{output_dir}.tmp"
+        shutil.rmtree(temp_dir, ignore_errors=True)
+        os.makedirs(temp_dir)
+        start = time.time()
+
+        watermark = self._watermark()
+        coordinator = self.connect()
+        try:
+            with coordinator.cursor() as cur:
+                cur.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ, READ ONLY")
+                cur.execute("SELECT pg_export_snapshot()")
+                snapshot = cur.fetchone()[0]
+                columns = self._table_layout(cur)
+                tracked = self._tracked_tables(cur)
+                cur.execute(EXPORT_TABLES_SQL)
+                tables = [f"{schema}.{name}" for schema, name, _ in cur.fetchall()]
+                cur.execute(SEQUENCES_SQL)
+                sequences = [{'schema': schema, 'name': name, 'last_value': value}
+                             for schema, name, value in cur.fetchall()]
+
+            if columns != parent_state['columns'] or set(tracked) != set(parent_state['tracked']):
+                raise IncrementalBackupError("The schema changed since the parent backup - a new full backup is needed")
+
+            # Only untracked tables are checksummed: tracked tables are
+            # diffed by key set and watermark, which needs no full scan
+            parent_manifest = load_manifest(parent_dir)
+            captured = None
+            if manifest or parent_manifest:
+                captured = RestoreManifest(self.db_config, self.logger, self.jobs).capture(
+                    snapshot, tables=[table for table in tables if table not in tracked])
+
+            entries = []
+            with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+                futures = {}
+                for number, table in enumerate(tables):
+                    if table in tracked:
+                        futures[executor.submit(self._export_changes, snapshot, temp_dir, chain, parent_state,
+                                                table, tracked[table], number)] = table
+                        continue
+                    unchanged = (captured and parent_manifest and
+                                 parent_manifest['tables'].get(table) == captured['tables'].get(table))
+                    if not unchanged:
+                        futures[executor.submit(self._export_table, snapshot, temp_dir, table,
+                                                f"table_{number:04d}.copy.gz")] = table
+                for future in as_completed(futures):
+                    result = future.result()
+                    if 'mode' not in result:
+                        entries.append(dict(result, mode='replace'))
+                        continue
+                    if captured:
+                        captured['tables'][result['table']] = {'rows': result['table_rows'], 'checksum': None}
+                    if result['file'] or result['deleted_file']:
+                        entries.append(result)
+            self._close_connections()
+
+            index = {
+                'version': INCREMENTAL_VERSION,
+                'type': 'incremental',
+                'database': self.db_config['database'],
+                'snapshot': snapshot,
+                'created': datetime.datetime.now().isoformat(),
+                'base': base,
+                'parent': os.path.basename(parent_dir),
+                'depth': (parent_index['depth'] if parent_index else 0) + 1,
+                'since': parent_state['watermark'],
+                'state': {'watermark': watermark, 'tracked': tracked, 'columns': columns},
+                'tables': sorted(entries, key=lambda entry: entry['table']),
+                'sequences': sequences,
+                'rows': sum(entry['rows'] for entry in entries),
+                'deleted': sum(entry.get('deleted', 0) for entry in entries),
+                'duration_seconds': round(time.time() - start, 2)
+            }
+            if captured and manifest:
+                self.logger.info(f"Manifest saved: {save_manifest(captured, output_dir)}")
+            with open(os.path.join(temp_dir, INCREMENTAL_INDEX), 'w') as f:
+                json.dump(index, f, indent=2)
+            os.rename(temp_dir, output_dir)
+        except BaseException:
+            self._close_connections()
+            shutil.rmtree(temp_dir, ignore_errors=True)
+            raise
+        finally:
+            coordinator.rollback()
+            coordinator.close()
+
+        self.logger.info(
+            f"Incremental completed: {index['rows']:,} rows and {index['deleted']:,} deletions in "
+            f"{len(entries)} tables since {index['since']} in {index['duration_seconds']:.2f}s"
+        )
+        return index
+
+    # Restore
+
+    def _apply_entry(self, cur, backup_dir, entry, number):
+        from psycopg2 import sql
+        table = _identifier(entry['table'])
+        if entry['mode'] == 'replace':
+            cur.execute(sql.SQL("DELETE FROM {}").format(table))
+            with self._open_data_file(os.path.join(backup_dir, entry['file']), 'rb') as f:
+                cur.copy_expert(sql.SQL("COPY {} FROM STDIN").format(table).as_string(cur.connection), f)
+            return cur.rowcount
+
+        key = sql.SQL(', ').join(map(sql.Identifier, entry['key']))
+        rows = 0
+        if entry['file']:
+            staging = sql.Identifier(f"incremental_rows_{number}")
+            cur.execute(sql.SQL("CREATE TEMP TABLE {} (LIKE {}) ON COMMIT DROP").format(staging, table))
+            with self._open_data_file(os.path.join(backup_dir, entry['file']), 'rb') as f:
+                cur.copy_expert(sql.SQL("COPY {} FROM STDIN").format(staging).as_string(cur.connection), f)
+            rows = cur.rowcount
+            cur.execute(sql.SQL("DELETE FROM {table} WHERE ({key}) IN (SELECT {key} FROM {staging})").format(
+                table=table, key=key, staging=staging))
+            cur.execute(sql.SQL("INSERT INTO {} SELECT * FROM {}").format(table, staging))
+        if entry['deleted_file']:
+            removed = sql.Identifier(f"incremental_deleted_{number}")
+            cur.execute(sql.SQL("CREATE TEMP TABLE {} ON COMMIT DROP AS SELECT {} FROM {} WITH NO DATA").format(
+                removed, key, table))
+            with self._open_data_file(os.path.join(backup_dir, entry['deleted_file']), 'rb') as f:
+                cur.copy_expert(sql.SQL("COPY {} FROM STDIN").format(removed).as_string(cur.connection), f)
+            cur.execute(sql.SQL("DELETE FROM {table} WHERE ({key}) IN (SELECT {key} FROM {removed})").format(
+                table=table, key=key, removed=removed))
+        return rows
+
+    def apply(self, backup_dir):
+        """Replay one incremental onto a database holding its parent; returns per-table stats"""
+        index = load_incremental_index(backup_dir)
+        start = time.time()
+        stats = {}
+        conn = self.connect()
+        try:
+            with conn.cursor() as cur:
+                # Triggers off: updated_at keeps its backed-up value, FKs are consistent at commit
+                cur.execute("SET LOCAL session_replication_role = replica")
+                for number, entry in enumerate(index['tables']):
+                    rows = self._apply_entry(cur, backup_dir, entry, number)
+                    stats[entry['table']] = {'rows': rows, 'deleted': entry.get('deleted', 0),
+                                             'bytes': entry['bytes'], 'mode': entry['mode']}
+                for sequence in index.get('sequences', []):
+                    if sequence['last_value'] is not None:
+                        cur.execute("SELECT setval(format('%%I.%%I', %s, %s)::regclass, %s)",
+                                    (sequence['schema'], sequence['name'], sequence['last_value']))
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+        self.logger.info(f"Applied {os.path.basename(backup_dir)}: {index['rows']:,} rows, "
+                         f"{index['deleted']:,} deletions in {time.time() - start:.2f}s")
+        return stats
+
+    def restore(self, backup_dir):
+        """
+        Restore a chain base or incremental into the configured (empty) database.
+
+        For an incremental, its full export is loaded first and every
+        incremental up to and including `backup_dir` is replayed in order.
+        Returns a summary like the restore engine's.
+        """
+        chain = resolve_chain(backup_dir)
+        self.logger.info(f"Restoring chain of {len(chain)} backups: {', '.join(map(os.path.basename, chain))}")
+        summary = super().restore(chain[0])
+
+        phase_start = time.time()
+        for link in chain[1:]:
+            for table, stats in self.apply(link).items():
+                total = summary['tables'].setdefault(table, {'rows': 0, 'bytes': 0})
+                total['rows'] += stats['rows']
+                total['bytes'] += stats['bytes']
+                summary['rows'] += stats['rows']
+                summary['bytes'] += stats['bytes']
+        if len(chain) > 1:
+            summary['phases']['incremental'] = round(time.time() - phase_start, 3)
+        summary['chain'] = [os.path.basename(link) for link in chain]
+        return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Full and incremental backups based on updated_at watermarks')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    full = subparsers.add_parser('full', help='Take a full export that starts a chain')
+    full.add_argument('output_dir')
+
+    incremental = subparsers.add_parser('incremental', help='Export the changes since a chain link')
+    incremental.add_argument('output_dir')
+    incremental.add_argument('--parent', help='Chain base or incremental to build on (default: newest in the '
+                                              "output directory's folder)")
+
+    restore = subparsers.add_parser('restore', help='Load a chain base and replay incrementals up to a backup')
+    restore.add_argument('backup_dir')
+
+    chain = subparsers.add_parser('chain', help='Show the backups a restore of this one replays')
+    chain.add_argument('backup_dir')
+
+    for sub in (full, incremental, restore):
+        sub.add_argument('--jobs', type=int, help='Worker connections (default: one per core)')
+    args = parser.parse_args()
+
+    if args.command == 'chain':
+        for link in resolve_chain(args.backup_dir):
+            print(link)
+        return
+
+    import psycopg2
+    from restore import DatabaseRestore
+    from archive_toc import recommended_jobs
+    restore_tool = DatabaseRestore()
+    backup = IncrementalBackup(restore_tool.db_config, restore_tool.logger, jobs=args.jobs or recommended_jobs())
+
+    try:
+        if args.command == 'full':
+            index = backup.full(args.output_dir)
+            print(f"Exported {index['rows']:,} rows from {len(index['tables'])} tables to {args.output_dir}")
+        elif args.command == 'incremental':
+            parent = args.parent or latest_chain_link(os.path.dirname(os.path.abspath(args.output_dir)))
+            if not parent:
+                sys.exit("No chain base found - take a full backup first")
+            index = backup.incremental(args.output_dir, parent)
+            print(f"Exported {index['rows']:,} changed rows and {index['deleted']:,} deletions to {args.output_dir}")
+        else:
+            summary = backup.restore(args.backup_dir)
+            print(f"Loaded {summary['rows']:,} rows from {len(summary['chain'])} backups")
+            sys.exit(1 if summary['warnings'] else 0)
+    except (IncrementalBackupError, psycopg2.Error) as e:
+        restore_tool.logger.error(str(e))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+"""
+INSERT-to-COPY Rewriter
+Turns the INSERT statements of --inserts / --column-inserts dumps into COPY rows on the fly
+"""
+
+import re
+import tempfile
+
+# INSERT INTO public.users (user_id, email) VALUES (...);
+# INSERT INTO public.users VALUES (...), (...);   (--rows-per-insert)
+INSERT_PATTERN = re.compile(
+    rb'^INSERT INTO (?P<table>(?:"[^"]*"|[^\s("])+)(?: \((?P<columns>[^)]*)\))?'
+    rb' (?:OVERRIDING SYSTEM VALUE )?VALUES\s*'
+)
+
+# A VALUES list holding nothing but literals, as pg_dump writes them:
+# string-like values as standard-conforming literals, numbers and booleans
+# bare, bit strings as B'..'. It is validated in one match, then split.
+LITERAL = (rb"(?:'[^']*(?:''[^']*)*'|B'[01]*'|NULL|true|false"
+           rb"|[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)")
+TUPLE = rb"\(\s*" + LITERAL + rb"(?:\s*,\s*" + LITERAL + rb")*\s*\)"
+VALUES_PATTERN = re.compile(TUPLE + rb"(?:\s*,\s*" + TUPLE + rb")*\s*;")
+TOKEN_PATTERN = re.compile(rb"'[^']*(?:''[^']*)*'|B'[01]*'|[^\s,()';]+|\)")
+
+COPY_NULL = b'\\N'
+QUOTE = ord("'")
+BIT_PREFIX = ord('B')
+# Characters other than backslash that must be escaped in COPY text format
+COPY_ESCAPES = [(b'\n', b'\\n'), (b'\r', b'\\r'), (b'\t', b'\\t')]
+# Fallback statements of one entry kept in memory; the rest go to a temporary file
+FALLBACK_MEMORY_BYTES = 16 * 1024 * 1024
+
+
+def insert_header(line):
+    """(table, columns) of an INSERT statement line, or None for anything else"""
+    match = INSERT_PATTERN.match(line)
+    if not match:
+        return None
+    return match.group('table'), match.group('columns')
+
+
+def copy_statement(table, columns):
+    """COPY statement that loads the rows an INSERT with this header would add"""
+    target = table + (b' (' + columns + b')' if columns else b'')
+    return b'COPY ' + target + b' FROM stdin;'
+
+
+def _copy_text(literal):
+    value = literal[1:-1].replace(b"''", b"'")
+    for raw, escaped in COPY_ESCAPES:
+        if raw in value:
+            value = value.replace(raw, escaped)
+    return value
+
+
+def parse_rows(statement, start):
+    """
+    COPY text lines for the VALUES list of `statement` beginning at `start`.
+
+    Returns None when the list holds anything other than plain literals
+    (expressions, casts, DEFAULT), so the caller can run the statement as is.
+    """
+    match = VALUES_PATTERN.match(statement, start)
+    if not match or match.end() != len(statement):
+        return None
+
+    values = statement[start:]
+    if b'\\' in values:
+        # Only string literals can hold a backslash, so escape them all at once
+        values = values.replace(b'\\', b'\\\\')
+    # Most statements need no per-value translation at all
+    multiline = any(raw in values for raw, _ in COPY_ESCAPES)
+    doubled = b"''" in values
+
+    rows = []
+    row = []
+    for token in TOKEN_PATTERN.findall(values):
+        first = token[0]
+        if first == QUOTE:
+            if multiline:
+                row.append(_copy_text(token))
+            elif doubled:
+                row.append(token[1:-1].replace(b"''", b"'"))
+            else:
+                row.append(token[1:-1])
+        elif token == b')':
+            rows.append(b'\t'.join(row) + b'\n')
+            row = []
+        elif token == b'NULL':
+            row.append(COPY_NULL)
+        elif first == BIT_PREFIX:
+            row.append(token[2:-1])
+        else:
+            row.append(token)
+    return rows
+
+
+class StatementSpool:
+    """
+    Statements queued while a COPY is running, in order.
+
+    Held in memory up to `max_size` bytes and spilled to a temporary file
+    beyond that, so a table whose INSERTs mostly cannot be rewritten does
+    not have to fit in memory. close() releases it.
+    """
+
+    def __init__(self, max_size=FALLBACK_MEMORY_BYTES):
+        self._file = tempfile.SpooledTemporaryFile(max_size=max_size)
+        self._count = 0
+
+    def append(self, statement):
+        self._file.write(len(statement).to_bytes(8, 'little'))
+        self._file.write(statement)
+        self._count += 1
+
+    def __len__(self):
+        return self._count
+
+    def __iter__(self):
+        self._file.seek(0)
+        while True:
+            size = self._file.read(8)
+            if not size:
+                return
+            yield self._file.read(int.from_bytes(size, 'little'))
+
+    def close(self):
+        self._file.close()
+
+
+class InsertCopyReader:
+    """
+    File-like COPY data view over a run of INSERT statements.
+
+    Reads statements from `source` (anything with readline) and hands out
+    one COPY text line per row. Statements that cannot be rewritten - an
+    expression instead of a literal, or a different table or column list
+    than the first statement - are kept in `fallback_sql` (a
+    StatementSpool) to be executed as SQL once the COPY has finished.
+    """
+
+    def __init__(self, source):
+        self.source = source
+        self.header = None
+        self.fallback_sql = StatementSpool()
+        self.rows_rewritten = 0
+        self.finished = False
+        self._rows = []
+        self._buffer = b''
+
+    def _read_statement(self):
+        """Next complete statement, joining lines broken inside string literals"""
+        lines = []
+        quotes = 0
+        while True:
+            line = self.source.readline()
+            if not line:
+                return b''.join(lines)
+            if not lines:
+                stripped = line.strip()
+                if not stripped or stripped.startswith(b'--') or stripped.startswith(b'\\'):
+                    continue
+            lines.append(line)
+            quotes += line.count(b"'")
+            if quotes % 2 == 0 and line.rstrip().endswith(b';'):
+                return b''.join(lines)
+
+    def _next_rows(self):
+        while not self._rows:
+            statement = self._read_statement()
+            if not statement:
+                self.finished = True
+                return
+            statement = statement.rstrip()
+            match = INSERT_PATTERN.match(statement)
+            header = match.group('table', 'columns') if match else None
+            if self.header is None:
+                self.header = header
+            rows = parse_rows(statement, match.end()) if header and header == self.header else None
+            if rows is None:
+                self.fallback_sql.append(statement)
+                continue
+            self.rows_rewritten += len(rows)
+            self._rows = rows
+            self._rows.reverse()
+
+    def readline(self, size=-1):
+        if self._buffer:
+            line, self._buffer = self._buffer, b''
+            return line
+        if not self._rows and not self.finished:
+            self._next_rows()
+        return self._rows.pop() if self._rows else b''
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            return b''.join(iter(self.readline, b''))
+        chunks = []
+        remaining = size
+        while remaining > 0:
+            line = self.readline()
+            if not line:
+                break
+            if len(line) > remaining:
+                self._buffer = line[remaining:]
+                line = line[:remaining]
+            chunks.append(line)
+            remaining -= len(line)
+        return b''.join(chunks)
+
+    def drain(self):
+        """Skip whatever the consumer did not read, without parsing it"""
+        self._buffer = b''
+        self._rows = []
+        while not self.finished:
+            self.finished = not self.source.readline()
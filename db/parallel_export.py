@@ -0,0 +1,398 @@
+#!/usr/bin/env python3
+"""
+Parallel Snapshot Export
+Per-table COPY export from one exported snapshot over N worker connections, and its parallel reload
+"""
+
+import os
+import sys
+import gzip
+import json
+import time
+import shutil
+import logging
+import argparse
+import datetime
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+EXPORT_INDEX = 'export.json'
+EXPORT_VERSION = 1
+EXPORT_SUFFIX = '.export'
+PRE_DATA_FILE = 'pre-data.sql'
+POST_DATA_FILE = 'post-data.sql'
+
+# Plain tables only: partitioned parents hold no rows of their own
+EXPORT_TABLES_SQL = """
+    SELECT n.nspname, c.relname, pg_relation_size(c.oid)
+      FROM pg_class c
+      JOIN pg_namespace n ON n.oid = c.relnamespace
+     WHERE c.relkind = 'r'
+       AND n.nspname NOT IN ('pg_catalog', 'information_schema')
+       AND n.nspname NOT LIKE 'pg_toast%%'
+     ORDER BY pg_relation_size(c.oid) DESC
+"""
+
+SEQUENCES_SQL = """
+    SELECT schemaname, sequencename, last_value
+      FROM pg_sequences
+     WHERE schemaname NOT IN ('pg_catalog', 'information_schema')
+"""
+
+
+def is_copy_export(path):
+    """True for a directory written by ParallelExport (detected by its export.json)"""
+    return os.path.isdir(path) and os.path.isfile(os.path.join(path, EXPORT_INDEX))
+
+
+def load_export_index(export_dir):
+    with open(os.path.join(export_dir, EXPORT_INDEX), 'r') as f:
+        return json.load(f)
+
+
+def is_data_only_export(path):
+    """True for an export without pre-data/post-data, reloaded into the existing tables"""
+    return is_copy_export(path) and not load_export_index(path).get('pre_data')
+
+
+def _identifier(table):
+    from psycopg2 import sql
+    schema, _, name = table.partition('.')
+    return sql.Identifier(schema, name)
+
+
+class ParallelExport:
+    """
+    Exports every table with COPY TO over `jobs` connections that share one snapshot.
+
+    A coordinator transaction (REPEATABLE READ, READ ONLY) publishes its
+    snapshot with pg_export_snapshot() and stays open until the export is
+    done. Each worker connection imports it with SET TRANSACTION SNAPSHOT,
+    so all tables are read as of the same instant, like pg_dump, but
+    several at a time, largest first. Rows go to one compressed file per
+    table; the schema is written by pg_dump --section=pre-data/post-data
+    from the same snapshot, and the per-table manifest is captured from it
+    too. export.json indexes the files and is written last, into a
+    temporary directory that is renamed into place.
+
+    restore() reverses this: pre-data through the restore engine, the
+    tables loaded in parallel with COPY FROM, sequences set, and post-data
+    built in parallel waves. A data-only export has no schema to create,
+    so it is loaded into the existing tables instead: all of them are
+    truncated and reloaded in one transaction with triggers and foreign
+    key checks off (session_replication_role = replica), so either every
+    table holds the exported rows or none was touched.
+    """
+
+    def __init__(self, db_config, logger=None, jobs=4, compression_level=6):
+        self.db_config = db_config
+        self.logger = logger or logging.getLogger(__name__)
+        self.jobs = max(1, int(jobs))
+        self.compression_level = max(0, min(int(compression_level), 9))
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+
+    def connect(self, database=None):
+        # Imported here so restore.py can detect exports without psycopg2
+        import psycopg2
+        return psycopg2.connect(
+            host=self.db_config['host'],
+            port=self.db_config['port'],
+            dbname=database or self.db_config['database'],
+            user=self.db_config['user'],
+            password=self.db_config['password']
+        )
+
+    def _snapshot_connection(self, snapshot):
+        """Per-thread connection inside a transaction that imported `snapshot`"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self.connect()
+            with conn.cursor() as cur:
+                cur.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ, READ ONLY")
+                cur.execute("SET TRANSACTION SNAPSHOT %s", (snapshot,))
+            self._local.conn = conn
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    def _load_connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self.connect()
+            conn.autocommit = True
+            self._local.conn = conn
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    def _close_connections(self):
+        import psycopg2
+        with self._lock:
+            for conn in self._connections:
+                try:
+                    conn.rollback()
+                    conn.close()
+                except psycopg2.Error:
+                    pass
+            self._connections = []
+        self._local = threading.local()
+
+    def _open_data_file(self, path, mode):
+        if path.endswith('.gz'):
+            return gzip.open(path, mode, compresslevel=self.compression_level) if 'w' in mode else gzip.open(path, mode)
+        return open(path, mode)
+
+    # Export
+
+    def _export_table(self, snapshot, output_dir, table, file_name):
+        from psycopg2 import sql
+        conn = self._snapshot_connection(snapshot)
+        path = os.path.join(output_dir, file_name)
+        start = time.time()
+        with self._open_data_file(path, 'wb') as f, conn.cursor() as cur:
+            cur.copy_expert(sql.SQL("COPY {} TO STDOUT").format(_identifier(table)).as_string(conn), f)
+            rows = cur.rowcount
+        stats = {
+            'table': table,
+            'file': file_name,
+            'rows': rows,
+            'bytes': os.path.getsize(path),
+            'seconds': round(time.time() - start, 3)
+        }
+        self.logger.info(f"Exported {table}: {rows:,} rows, {stats['bytes']:,} bytes in {stats['seconds']:.2f}s")
+        return stats
+
+    def _dump_section(self, snapshot, section, path):
+        env = os.environ.copy()
+        env['PGPASSWORD'] = self.db_config['password']
+        cmd = [
+            'pg_dump',
+            '-h', self.db_config['host'],
+            '-p', self.db_config['port'],
+            '-U', self.db_config['user'],
+            '-d', self.db_config['database'],
+            f'--section={section}',
+            f'--snapshot={snapshot}',
+            '-f', path,
+            '--no-password'
+        ]
+        result = subprocess.run(cmd, env=env, capture_output=True, text=True)
+        if result.returncode != 0:
+            raise RuntimeError(f"pg_dump --section={section} failed: {result.stderr.strip()}")
+
+    def export(self, output_dir, schema=True, manifest=True, on_snapshot=None):
+        """
+        Export the database into `output_dir` (created; must not exist).
+
+        With `schema` false only table rows are exported (data-only).
+        `on_snapshot(cursor, snapshot, temp_dir)` runs on the coordinator
+        right after the snapshot is exported; what it returns is kept in
+        the index as `state`. Returns the export index.
+        """
+        if os.path.exists(output_dir):
+            raise FileExistsError(f"Export target already exists: {output_dir}")
+        temp_dir = f"{output_dir}.tmp"
+        shutil.rmtree(temp_dir, ignore_errors=True)
+        os.makedirs(temp_dir)
+        start = time.time()
+        suffix = '.copy.gz' if self.compression_level else '.copy'
+
+        coordinator = self.connect()
+        try:
+            with coordinator.cursor() as cur:
+                cur.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ, READ ONLY")
+                cur.execute("SELECT pg_export_snapshot()")
+                snapshot = cur.fetchone()[0]
+                state = on_snapshot(cur, snapshot, temp_dir) if on_snapshot else None
+                cur.execute(EXPORT_TABLES_SQL)
+                tables = [f"{schema_name}.{name}" for schema_name, name, _ in cur.fetchall()]
+                cur.execute(SEQUENCES_SQL)
+                sequences = [{'schema': schema_name, 'name': name, 'last_value': value}
+                             for schema_name, name, value in cur.fetchall()]
+            self.logger.info(f"Exporting {len(tables)} tables from snapshot {snapshot} with {self.jobs} jobs")
+
+            results = []
+            with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+                futures = [executor.submit(self._export_table, snapshot, temp_dir, table, f"table_{i:04d}{suffix}")
+                           for i, table in enumerate(tables)]
+                if schema:
+                    # pg_dump runs as its own process alongside the workers
+                    futures.append(executor.submit(self._dump_section, snapshot, 'pre-data',
+                                                   os.path.join(temp_dir, PRE_DATA_FILE)))
+                    futures.append(executor.submit(self._dump_section, snapshot, 'post-data',
+                                                   os.path.join(temp_dir, POST_DATA_FILE)))
+                for future in as_completed(futures):
+                    result = future.result()
+                    if result:
+                        results.append(result)
+            self._close_connections()
+
+            index = {
+                'version': EXPORT_VERSION,
+                'database': self.db_config['database'],
+                'snapshot': snapshot,
+                'created': datetime.datetime.now().isoformat(),
+                'jobs': self.jobs,
+                'compression': f"gzip:{self.compression_level}" if self.compression_level else False,
+                'pre_data': PRE_DATA_FILE if schema else None,
+                'post_data': POST_DATA_FILE if schema else None,
+                'tables': sorted(results, key=lambda stats: stats['file']),
+                'sequences': sequences,
+                'state': state,
+                'rows': sum(stats['rows'] for stats in results),
+                'duration_seconds': round(time.time() - start, 2)
+            }
+
+            if manifest:
+                # Captured before the rename; load_manifest looks next to the export
+                import psycopg2
+                from restore_manifest import RestoreManifest, save_manifest
+                try:
+                    captured = RestoreManifest(self.db_config, self.logger, self.jobs).capture(snapshot)
+                    self.logger.info(f"Manifest saved: {save_manifest(captured, output_dir)}")
+                except (psycopg2.Error, RuntimeError, OSError) as e:
+                    self.logger.warning(f"Could not capture export manifest: {e}")
+
+            with open(os.path.join(temp_dir, EXPORT_INDEX), 'w') as f:
+                json.dump(index, f, indent=2)
+            os.rename(temp_dir, output_dir)
+        except BaseException:
+            self._close_connections()
+            shutil.rmtree(temp_dir, ignore_errors=True)
+            raise
+        finally:
+            coordinator.rollback()
+            coordinator.close()
+
+        self.logger.info(
+            f"Export completed: {index['rows']:,} rows in {len(tables)} tables in {index['duration_seconds']:.2f}s"
+        )
+        return index
+
+    # Restore
+
+    def _load_table(self, export_dir, stats, conn=None):
+        from psycopg2 import sql
+        conn = conn or self._load_connection()
+        start = time.time()
+        with self._open_data_file(os.path.join(export_dir, stats['file']), 'rb') as f, conn.cursor() as cur:
+            cur.copy_expert(sql.SQL("COPY {} FROM STDIN").format(_identifier(stats['table'])).as_string(conn), f)
+            rows = cur.rowcount
+        duration = time.time() - start
+        self.logger.info(f"Loaded {stats['table']}: {rows:,} rows in {duration:.2f}s")
+        return stats['table'], {'rows': rows, 'bytes': stats['bytes'], 'seconds': round(duration, 3)}
+
+    @staticmethod
+    def _set_sequences(cur, index):
+        for sequence in index.get('sequences', []):
+            if sequence['last_value'] is not None:
+                cur.execute("SELECT setval(format('%%I.%%I', %s, %s)::regclass, %s)",
+                            (sequence['schema'], sequence['name'], sequence['last_value']))
+
+    def _restore_data_only(self, export_dir, index):
+        """Replace the rows of every exported table in one transaction"""
+        from psycopg2 import sql
+        table_stats = {}
+        conn = self.connect()
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SET LOCAL session_replication_role = replica")
+                if index['tables']:
+                    cur.execute(sql.SQL("TRUNCATE {}").format(
+                        sql.SQL(', ').join(_identifier(stats['table']) for stats in index['tables'])))
+                for stats in index['tables']:
+                    table, loaded = self._load_table(export_dir, stats, conn)
+                    table_stats[table] = loaded
+                self._set_sequences(cur, index)
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+        return table_stats
+
+    def restore(self, export_dir):
+        """Load an export into the configured database; returns a summary like the restore engine's"""
+        from restore_engine import SqlRestoreEngine
+        index = load_export_index(export_dir)
+        phases, table_stats, warnings = {}, {}, []
+
+        if index.get('pre_data'):
+            engine = SqlRestoreEngine(self.db_config, self.logger)
+            summary = engine.restore_stream(os.path.join(export_dir, index['pre_data']))
+            phases.update(summary['phases'])
+            warnings.extend(summary['warnings'])
+
+        phase_start = time.time()
+        if not index.get('pre_data'):
+            table_stats = self._restore_data_only(export_dir, index)
+        else:
+            tables = sorted(index['tables'], key=lambda stats: stats['bytes'], reverse=True)
+            try:
+                with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+                    futures = [executor.submit(self._load_table, export_dir, stats) for stats in tables]
+                    for future in as_completed(futures):
+                        table, stats = future.result()
+                        table_stats[table] = stats
+
+                conn = self._load_connection()
+                with conn.cursor() as cur:
+                    self._set_sequences(cur, index)
+            finally:
+                self._close_connections()
+        phases['data'] = round(time.time() - phase_start, 3)
+        self.logger.info(f"Data completed in {phases['data']:.2f}s")
+
+        if index.get('post_data'):
+            engine = SqlRestoreEngine(self.db_config, self.logger, jobs=self.jobs)
+            summary = engine.restore_parallel(os.path.join(export_dir, index['post_data']))
+            phases['post-data'] = summary['phases'].get('post-data', 0)
+            warnings.extend(summary['warnings'])
+
+        return {
+            'tables': table_stats,
+            'rows': sum(stats['rows'] for stats in table_stats.values()),
+            'bytes': sum(stats['bytes'] for stats in table_stats.values()),
+            'phases': phases,
+            'warnings': warnings
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Snapshot-consistent parallel COPY export of the database')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    export = subparsers.add_parser('export', help='Export every table into a directory')
+    export.add_argument('output_dir')
+    export.add_argument('--data-only', action='store_true', help='Rows only, no pre-data/post-data schema files')
+    export.add_argument('--level', type=int, default=6, help='gzip level for table files, 0 for none (default: 6)')
+
+    restore = subparsers.add_parser(
+        'restore', help='Load an export into the configured database (empty, unless the export is data-only)')
+    restore.add_argument('export_dir')
+
+    for sub in (export, restore):
+        sub.add_argument('--jobs', type=int, help='Worker connections (default: one per core)')
+    args = parser.parse_args()
+
+    from restore import DatabaseRestore
+    from archive_toc import recommended_jobs
+    restore_tool = DatabaseRestore()
+    exporter = ParallelExport(restore_tool.db_config, restore_tool.logger, jobs=args.jobs or recommended_jobs(),
+                              compression_level=getattr(args, 'level', 6))
+
+    if args.command == 'export':
+        index = exporter.export(args.output_dir, schema=not args.data_only)
+        print(f"Exported {index['rows']:,} rows from {len(index['tables'])} tables to {args.output_dir}")
+    else:
+        summary = exporter.restore(args.export_dir)
+        print(f"Loaded {summary['rows']:,} rows into {len(summary['tables'])} tables")
+        sys.exit(1 if summary['warnings'] else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -7,6 +7,7 @@ Automated restore with verification and rollback capabilities
 import os
 import sys
 import subprocess
+import tempfile
 import datetime
 import logging
 import json
@@ -14,9 +15,32 @@ import shutil
 from pathlib import Path
 from dotenv import load_dotenv
 
+from dump_io import SQL_DUMP_SUFFIXES, open_dump, stream_to_process
+from dump_parser import is_data_only_dump
+from restore_progress import RestoreProgress
+from archive_toc import (ArchiveFormatError, archive_size, is_archive, is_directory_archive,
+                         missing_data_files, recommended_jobs, schedule_restore)
+from restore_tuning import RestoreTuning
+from restore_checkpoint import RestoreCheckpoint
+from restore_manifest import RestoreManifest, load_manifest
+from restore_predictor import RestorePredictor, backup_format
+from restore_coordinator import RestoreCoordinator
+from parallel_export import ParallelExport, is_copy_export, is_data_only_export, load_export_index
+from chunk_store import CHUNK_LIST_SUFFIX, ChunkStore, default_store_path
+from incremental_backup import (IncrementalBackup, IncrementalBackupError, is_incremental, load_incremental_index,
+                                resolve_chain)
+
 # Load environment variables
 load_dotenv()
 
+# Basic post-restore check for backups without a manifest
+VERIFY_QUERIES = [
+    "SELECT COUNT(*) FROM users;",
+    "SELECT COUNT(*) FROM products;",
+    "SELECT COUNT(*) FROM orders;",
+    "SELECT version();"
+]
+
 class DatabaseRestore:
     def __init__(self):
         # Load environment variables from backend directory
@@ -47,9 +71,55 @@ class DatabaseRestore:
             'backup_path': backup_path,
             'create_backup_before_restore': True,
             'verify_after_restore': True,
-            'parallel_jobs': 4
+            'verify_mode': 'fast',  # fast (planner estimates) | exact (counts and checksums)
+            'verify_jobs': 4,
+            'parallel_jobs': None,  # one per core unless set
+            'largest_first': True,
+            'restore_profile': 'tuned',  # tuned | default
+            'turbo': False,
+            'warmup_after_restore': False,
+            'warmup_time_budget_seconds': 60,
+            'warmup_create_extension': False,  # CREATE EXTENSION pg_prewarm if it is missing
+            'check_foreign_keys': 'auto',  # auto (data-only backups) | always | never
+            'delete_orphans': False,
+            'orphan_delete_batch': 5000,
+            'sql_restore_mode': 'native',
+            'schema_template': True,  # clone clean SQL restores from a cached pre-data template
+            'schema_templates_to_keep': 3,
+            'queue_wait_timeout_minutes': None,  # wait for other restores indefinitely
+            'progress_callback': None
         }
         
+        # Per-table statistics from the last engine-based restore
+        self.last_restore_summary = None
+        
+        # Checkpoint of the engine restore in flight, kept on failure for --resume
+        self.checkpoint = None
+        
+        # Report of the post-restore ANALYZE/prewarm stage
+        self.last_warmup = None
+        
+        # Expected duration of the restore in flight, from past restores
+        self.last_prediction = None
+        
+        # Parallel jobs the last restore ran with
+        self.restore_jobs = None
+        
+        # Report of the post-restore foreign key orphan check
+        self.last_integrity = None
+        
+        # Schema template the restore in flight was cloned from
+        self.schema_template = None
+        
+        # Report of the last manifest verification
+        self.last_verification = None
+        
+        # Session tuning of the restore in flight
+        self.tuning = None
+        
+        # Progress of the restore in flight, also mirrored to restore_progress.json
+        self.progress = None
+        
         # Setup logging
         self.setup_logging()
 
@@ -84,11 +154,17 @@ class DatabaseRestore:
         patterns = [
             'ecommerce_backup_*.sql',
             'ecommerce_backup_*.sql.gz',
+            'ecommerce_backup_*.sql.zst',
             'ecommerce_backup_*.backup',
             'ecommerce_data_*.sql',
+            'ecommerce_data_*.sql.gz',
+            'ecommerce_data_*.sql.zst',
             'ecommerce_schema_*.sql',
+            'ecommerce_schema_*.sql.gz',
+            'ecommerce_schema_*.sql.zst',
             'ecommerce_db_*.sql',
             'ecommerce_db_*.sql.gz',
+            'ecommerce_db_*.sql.zst',
             'ecommerce_db_*.backup'
         ]
         
@@ -98,6 +174,17 @@ class DatabaseRestore:
             all_backup_files.extend(files)
             self.logger.debug(f"Pattern {pattern} found {len(files)} files")
         
+        # Directory-format archives are directories holding a toc.dat,
+        # parallel COPY exports directories holding an export.json and
+        # incrementals directories holding an incremental.json
+        all_backup_files.extend(path for path in backup_dir.iterdir()
+                                if is_directory_archive(path) or is_copy_export(path) or is_incremental(path))
+        
+        # Chunk lists of the deduplicating store
+        store_backups = Path(default_store_path(str(backup_dir))) / 'backups'
+        if store_backups.is_dir():
+            all_backup_files.extend(store_backups.glob(f'*{CHUNK_LIST_SUFFIX}'))
+        
         # Remove duplicates and sort by modification time (newest first)
         unique_files = list(set(all_backup_files))
         sorted_files = sorted(unique_files, key=lambda x: x.stat().st_mtime, reverse=True)
@@ -108,7 +195,7 @@ class DatabaseRestore:
             backup_info = {
                 'file': str(backup_file),
                 'name': backup_file.name,
-                'size': backup_file.stat().st_size,
+                'size': archive_size(backup_file),
                 'created': datetime.datetime.fromtimestamp(backup_file.stat().st_mtime),
                 'type': 'unknown'
             }
@@ -136,9 +223,17 @@ class DatabaseRestore:
                     self.logger.warning(f"Failed to load metadata for {backup_file}: {e}")
             
             # Determine file format from extension
-            if backup_file.suffix == '.backup':
+            if is_copy_export(backup_file):
+                backup_info['format'] = 'copy_export'
+            elif is_incremental(backup_file):
+                backup_info['format'] = 'incremental'
+            elif backup_file.name.endswith(CHUNK_LIST_SUFFIX):
+                backup_info['format'] = 'chunked_sql'
+            elif backup_file.is_dir():
+                backup_info['format'] = 'directory'
+            elif backup_file.suffix == '.backup':
                 backup_info['format'] = 'custom'
-            elif backup_file.suffix == '.gz':
+            elif backup_file.suffix in ('.gz', '.zst'):
                 backup_info['format'] = 'compressed_sql'
             else:
                 backup_info['format'] = 'plain_sql'
@@ -154,6 +249,15 @@ class DatabaseRestore:
             self.logger.error(f"Backup file does not exist: {backup_file}")
             return False
         
+        if is_copy_export(backup_file):
+            return self.verify_copy_export(backup_file)
+        if is_incremental(backup_file):
+            return self.verify_incremental(backup_file)
+        if backup_file.endswith(CHUNK_LIST_SUFFIX):
+            return self.verify_chunk_list(backup_file)
+        if os.path.isdir(backup_file):
+            return self.verify_directory_archive(backup_file)
+        
         if os.path.getsize(backup_file) == 0:
             self.logger.error(f"Backup file is empty: {backup_file}")
             return False
@@ -172,6 +276,82 @@ class DatabaseRestore:
         self.logger.info(f"Backup file verification passed: {backup_file}")
         return True
 
+    def verify_directory_archive(self, backup_dir):
+        """Verify a directory-format archive has a readable TOC and all its data files"""
+        if not is_directory_archive(backup_dir):
+            self.logger.error(f"Directory is not a pg_dump directory archive (no toc.dat): {backup_dir}")
+            return False
+        
+        try:
+            missing = missing_data_files(backup_dir)
+        except (ArchiveFormatError, OSError) as e:
+            self.logger.error(f"Cannot read archive TOC in {backup_dir}: {e}")
+            return False
+        if missing:
+            self.logger.error(f"Directory archive is missing data files: {', '.join(missing)}")
+            return False
+        
+        self.logger.info(f"Directory archive verification passed: {backup_dir} ({archive_size(backup_dir):,} bytes)")
+        return True
+
+    def verify_copy_export(self, export_dir):
+        """Verify a parallel COPY export has a readable index and every file it lists"""
+        try:
+            index = load_export_index(export_dir)
+        except (OSError, ValueError) as e:
+            self.logger.error(f"Cannot read export index in {export_dir}: {e}")
+            return False
+        
+        files = [stats['file'] for stats in index.get('tables', [])]
+        files.extend(name for name in (index.get('pre_data'), index.get('post_data')) if name)
+        missing = [name for name in files if not os.path.isfile(os.path.join(export_dir, name))]
+        if missing:
+            self.logger.error(f"COPY export is missing files: {', '.join(missing)}")
+            return False
+        
+        self.logger.info(f"COPY export verification passed: {export_dir} ({archive_size(export_dir):,} bytes)")
+        return True
+
+    def verify_incremental(self, backup_dir):
+        """Verify an incremental's chain back to its full export is complete"""
+        try:
+            chain = resolve_chain(backup_dir)
+        except (IncrementalBackupError, OSError, ValueError) as e:
+            self.logger.error(f"Cannot follow incremental chain of {backup_dir}: {e}")
+            return False
+        
+        if not self.verify_copy_export(chain[0]):
+            return False
+        for link in chain[1:]:
+            index = load_incremental_index(link)
+            files = [entry[key] for entry in index['tables'] for key in ('file', 'deleted_file') if entry.get(key)]
+            missing = [name for name in files if not os.path.isfile(os.path.join(link, name))]
+            if missing:
+                self.logger.error(f"Incremental {os.path.basename(link)} is missing files: {', '.join(missing)}")
+                return False
+        
+        self.logger.info(f"Incremental verification passed: {backup_dir} (chain of {len(chain)} backups)")
+        return True
+
+    def verify_chunk_list(self, list_file):
+        """Verify every chunk a deduplicated backup refers to is in the store"""
+        store = ChunkStore(os.path.dirname(os.path.dirname(os.path.abspath(list_file))), self.logger)
+        try:
+            problems = store.verify(os.path.abspath(list_file))
+        except (OSError, ValueError, KeyError) as e:
+            self.logger.error(f"Cannot read chunk list {list_file}: {e}")
+            return False
+        if problems:
+            self.logger.error(f"Deduplicated backup is incomplete: {len(problems)} problems, e.g. {problems[0]}")
+            return False
+        
+        self.logger.info(f"Chunk list verification passed: {list_file} ({archive_size(list_file):,} bytes)")
+        return True
+
+    def is_supported_format(self, backup_file):
+        return (is_copy_export(backup_file) or is_incremental(backup_file) or is_archive(backup_file)
+                or backup_file.endswith(SQL_DUMP_SUFFIXES))
+
     def create_pre_restore_backup(self):
         """Create a backup before restore operation"""
         if not self.restore_config['create_backup_before_restore']:
@@ -188,7 +368,7 @@ class DatabaseRestore:
                 try:
                     from backup import DatabaseBackup
                     backup_tool = DatabaseBackup()
-                    backup_path = backup_tool.perform_backup('full')
+                    backup_path = backup_tool.perform_backup('full', description='Pre-restore backup')
                     if backup_path:
                         self.logger.info(f"Pre-restore backup created: {backup_path}")
                         return backup_path
@@ -301,32 +481,85 @@ class DatabaseRestore:
                 return False
             
             # Create database
-            create_cmd = [
-                'psql',
-                '-h', self.db_config['host'],
-                '-p', self.db_config['port'],
-                '-U', self.db_config['user'],
-                '-d', 'postgres',
-                '-c', f"CREATE DATABASE {self.db_config['database']};",
-                '--no-password'
-            ]
-            
-            result = subprocess.run(create_cmd, env=env, capture_output=True, text=True)
-            if result.returncode == 0:
+            ok, output = self.create_database(self.db_config['database'])
+            if ok:
                 self.logger.info("Database recreated successfully")
                 return True
             else:
-                self.logger.error(f"Failed to create database: {result.stderr}")
+                self.logger.error(f"Failed to create database: {output}")
                 return False
                 
         except Exception as e:
             self.logger.error(f"Error recreating database: {e}")
             return False
 
+    def create_database(self, database):
+        """Create `database`, as a clone of the schema template of the restore in flight if there is one"""
+        if self.schema_template:
+            ok, output = self.run_admin_sql(f'CREATE DATABASE "{database}" TEMPLATE "{self.schema_template}";')
+            if ok:
+                self.logger.info(f"Created '{database}' from schema template '{self.schema_template}'")
+                return True, output
+            self.logger.warning(f"Failed to clone schema template '{self.schema_template}': {output} - "
+                                "restoring the schema from the dump")
+            self.schema_template = None
+        return self.run_admin_sql(f'CREATE DATABASE "{database}";')
+    
+    def prepare_schema_template(self, backup_file):
+        """
+        Template database with the pre-data of `backup_file` applied, or None.
+        
+        Only SQL dumps restored by the native engine use templates; the
+        template is built on the first restore of each schema and reused by
+        every later one.
+        """
+        self.schema_template = None
+        if not (self.restore_config['schema_template'] and self.uses_restore_engine(backup_file)):
+            return None
+        try:
+            from schema_template import SchemaTemplateCache
+            cache = SchemaTemplateCache(self.db_config, self.logger, keep=self.restore_config['schema_templates_to_keep'])
+            self.schema_template = cache.ensure(backup_file)
+        except Exception as e:
+            self.logger.warning(f"Schema template unavailable ({e}) - restoring the schema from the dump")
+        return self.schema_template
+    
+    def start_progress(self, backup_file, total_items=None):
+        """Create the progress tracker for a restore of `backup_file`"""
+        self.progress = RestoreProgress(
+            backup_file,
+            total_bytes=None if total_items else archive_size(backup_file),
+            total_items=total_items,
+            state_file=os.path.join(self.restore_config['backup_path'], 'restore_progress.json'),
+            callback=self.restore_config['progress_callback'],
+            logger=self.logger
+        )
+        return self.progress
+
+    def count_archive_entries(self, backup_file):
+        """Count TOC entries in a custom format archive (used for progress)"""
+        try:
+            result = subprocess.run(['pg_restore', '-l', backup_file], capture_output=True, text=True)
+            if result.returncode == 0:
+                return sum(1 for line in result.stdout.splitlines() if line.strip() and not line.startswith(';'))
+        except Exception as e:
+            self.logger.warning(f"Could not list archive contents: {e}")
+        return None
+
+    def start_tuning(self):
+        """Restore profile for the next restore, or None for server defaults"""
+        self.tuning = None
+        if self.restore_config['restore_profile'] == 'tuned':
+            self.tuning = RestoreTuning(self.db_config, self.logger, turbo=self.restore_config['turbo']).prepare()
+        return self.tuning
+
     def restore_from_custom_format(self, backup_file):
-        """Restore from pg_dump custom format backup"""
+        """Restore from pg_dump custom or directory format archive"""
         env = os.environ.copy()
         env['PGPASSWORD'] = self.db_config['password']
+        tuning = self.start_tuning()
+        if tuning:
+            tuning.pg_env(env)
         
         cmd = [
             'pg_restore',
@@ -337,14 +570,47 @@ class DatabaseRestore:
             '--verbose',
             '--no-password',
             '--clean',
-            '--if-exists',
-            f'--jobs={self.restore_config["parallel_jobs"]}',
-            backup_file
+            '--if-exists'
         ]
         
+        # Schedule the largest tables and index builds first so no worker is
+        # left finishing the biggest item alone at the end
+        jobs = self.restore_config['parallel_jobs']
+        list_file = None
+        if self.restore_config['largest_first']:
+            # A private file per restore, removed once pg_restore has read it
+            fd, list_file = tempfile.mkstemp(prefix='restore_order_', suffix='.list')
+            os.close(fd)
+            try:
+                jobs, heaviest = schedule_restore(backup_file, list_file, jobs)
+                cmd.extend(['-L', list_file])
+                self.logger.info("Largest-first restore order: " + ', '.join(
+                    f"{entry.table} ({entry.data_size:,} bytes)" for entry in heaviest[:3]))
+            except (ArchiveFormatError, OSError, subprocess.CalledProcessError) as e:
+                self.logger.warning(f"Using pg_restore's default ordering: {e}")
+        jobs = jobs or recommended_jobs()
+        if tuning and tuning.turbo:
+            # pg_restore only loads tables in their creating transaction in parallel mode
+            jobs = max(jobs, 2)
+        cmd.extend([f'--jobs={jobs}', backup_file])
+        self.restore_jobs = jobs
+        
         try:
+            progress = self.start_progress(backup_file, total_items=self.count_archive_entries(backup_file))
             self.logger.info(f"Starting custom format restore: {' '.join(cmd[:-1])} [backup_file]")
-            result = subprocess.run(cmd, env=env, capture_output=True, text=True)
+            # Verbose output is parsed line by line into progress events
+            # instead of being buffered until pg_restore exits
+            passes = tuning.pg_restore_passes(cmd) if tuning else [cmd]
+            try:
+                for pass_number, pass_cmd in enumerate(passes):
+                    if pass_number:
+                        tuning.suspend_autovacuum()
+                    result = stream_to_process(pass_cmd, env=env, on_line=progress.record_line)
+                    if result.returncode != 0:
+                        break
+            finally:
+                if tuning:
+                    tuning.resume_autovacuum()
             
             if result.returncode == 0:
                 self.logger.info("Custom format restore completed successfully")
@@ -356,85 +622,35 @@ class DatabaseRestore:
         except Exception as e:
             self.logger.error(f"Error during custom format restore: {e}")
             return False
+        finally:
+            if list_file and os.path.exists(list_file):
+                os.remove(list_file)
 
     def restore_from_sql(self, backup_file):
         """Restore from SQL dump file"""
         env = os.environ.copy()
         env['PGPASSWORD'] = self.db_config['password']
         
-        # Handle compressed files
-        if backup_file.endswith('.gz'):
-            # For Windows PowerShell, we need to handle this differently
-            if os.name == 'nt':  # Windows
-                # Use Python to decompress and pipe to psql
-                import gzip
-                try:
-                    self.logger.info(f"Decompressing and restoring from: {backup_file}")
-                    
-                    # Read and decompress the file
-                    with gzip.open(backup_file, 'rt', encoding='utf-8') as f:
-                        sql_content = f.read()
-                    
-                    # Write to temporary file
-                    temp_file = backup_file.replace('.gz', '.tmp')
-                    with open(temp_file, 'w', encoding='utf-8') as f:
-                        f.write(sql_content)
-                    
-                    # Use the temporary file for restore
-                    cmd = [
-                        'psql',
-                        '-h', self.db_config['host'],
-                        '-p', self.db_config['port'],
-                        '-U', self.db_config['user'],
-                        '-d', self.db_config['database'],
-                        '--no-password',
-                        '-f', temp_file
-                    ]
-                    
-                    result = subprocess.run(cmd, env=env, capture_output=True, text=True)
-                    
-                    # Clean up temporary file
-                    try:
-                        os.remove(temp_file)
-                    except:
-                        pass
-                    
-                    if result.returncode == 0:
-                        self.logger.info("SQL restore completed successfully")
-                        return True
-                    else:
-                        self.logger.error(f"SQL restore failed: {result.stderr}")
-                        return False
-                        
-                except Exception as e:
-                    self.logger.error(f"Error handling compressed file: {e}")
-                    return False
-            else:
-                # Unix/Linux - use gunzip piping
-                cmd = f"gunzip -c {backup_file} | psql -h {self.db_config['host']} -p {self.db_config['port']} -U {self.db_config['user']} -d {self.db_config['database']} --no-password"
-                use_shell = True
-        else:
-            cmd = [
-                'psql',
-                '-h', self.db_config['host'],
-                '-p', self.db_config['port'],
-                '-U', self.db_config['user'],
-                '-d', self.db_config['database'],
-                '--no-password',
-                '-f', backup_file
-            ]
-            use_shell = False
+        cmd = [
+            'psql',
+            '-h', self.db_config['host'],
+            '-p', self.db_config['port'],
+            '-U', self.db_config['user'],
+            '-d', self.db_config['database'],
+            '--no-password'
+        ]
+        if self.start_tuning():
+            self.tuning.pg_env(env)
         
         try:
+            # Plain and gzip dumps are both fed to psql's stdin in fixed-size
+            # chunks: constant memory, no temporary file, and the bytes read
+            # from disk drive the progress percentage
             self.logger.info(f"Starting SQL restore from: {backup_file}")
-            
-            if backup_file.endswith('.gz') and os.name != 'nt':
-                result = subprocess.run(cmd, env=env, shell=True, capture_output=True, text=True)
-            elif not backup_file.endswith('.gz'):
-                result = subprocess.run(cmd, env=env, capture_output=True, text=True)
-            else:
-                # Already handled above for Windows
-                return True
+            progress = self.start_progress(backup_file)
+            progress.set_phase('restoring')
+            with open_dump(backup_file, progress) as source:
+                result = stream_to_process(cmd, source, env=env, on_line=progress.record_line)
             
             if result.returncode == 0:
                 self.logger.info("SQL restore completed successfully")
@@ -447,26 +663,205 @@ class DatabaseRestore:
             self.logger.error(f"Error during SQL restore: {e}")
             return False
 
-    def verify_restore(self):
-        """Verify the restore operation was successful"""
+    def restore_from_sql_engine(self, backup_file):
+        """Restore a plain or gzip SQL dump with the in-process COPY engine"""
+        try:
+            from restore_engine import SqlRestoreEngine
+        except ImportError as e:
+            self.logger.warning(f"Native restore engine unavailable ({e}) - falling back to psql")
+            return self.restore_from_sql(backup_file)
+        
+        # Parallel loading needs to seek into the dump, so gzip dumps are streamed
+        parallel = self.restore_config['sql_restore_mode'] == 'parallel' and backup_file.endswith('.sql')
+        jobs = (self.restore_config['parallel_jobs'] or recommended_jobs()) if parallel else 1
+        self.restore_jobs = jobs
+        
+        try:
+            self.logger.info(f"Starting native SQL restore from: {backup_file} ({jobs} jobs)")
+            engine = SqlRestoreEngine(self.db_config, self.logger, jobs=jobs,
+                                      progress=self.start_progress(backup_file), checkpoint=self.checkpoint,
+                                      tuning=self.start_tuning(), schema_ready=bool(self.schema_template))
+            if parallel:
+                summary = engine.restore_parallel(backup_file)
+            else:
+                summary = engine.restore_stream(backup_file)
+            self.last_restore_summary = summary
+            
+            self.logger.info(
+                f"Native SQL restore completed: {summary['rows']:,} rows, "
+                f"{summary['bytes']:,} bytes in {len(summary['tables'])} tables"
+            )
+            if summary['warnings']:
+                self.logger.warning(f"{len(summary['warnings'])} statements reported errors during restore")
+            return True
+            
+        except Exception as e:
+            self.logger.error(f"Error during native SQL restore: {e}")
+            return False
+
+    def restore_from_export(self, export_dir):
+        """Restore a parallel COPY export (see parallel_export.py)"""
+        jobs = self.restore_config['parallel_jobs'] or recommended_jobs()
+        self.restore_jobs = jobs
+        
+        try:
+            self.logger.info(f"Starting COPY export restore from: {export_dir} ({jobs} jobs)")
+            summary = ParallelExport(self.db_config, self.logger, jobs=jobs).restore(export_dir)
+            self.last_restore_summary = summary
+            
+            self.logger.info(
+                f"COPY export restore completed: {summary['rows']:,} rows, "
+                f"{summary['bytes']:,} bytes in {len(summary['tables'])} tables"
+            )
+            if summary['warnings']:
+                self.logger.warning(f"{len(summary['warnings'])} statements reported errors during restore")
+            return True
+            
+        except Exception as e:
+            self.logger.error(f"Error during COPY export restore: {e}")
+            return False
+
+    def restore_from_incremental(self, backup_dir):
+        """Restore the full export of an incremental chain and replay it up to `backup_dir`"""
+        jobs = self.restore_config['parallel_jobs'] or recommended_jobs()
+        self.restore_jobs = jobs
+        
+        try:
+            self.logger.info(f"Starting incremental restore from: {backup_dir} ({jobs} jobs)")
+            summary = IncrementalBackup(self.db_config, self.logger, jobs=jobs).restore(backup_dir)
+            self.last_restore_summary = summary
+            
+            self.logger.info(
+                f"Incremental restore completed: {summary['rows']:,} rows, "
+                f"{summary['bytes']:,} bytes from a chain of {len(summary['chain'])} backups"
+            )
+            if summary['warnings']:
+                self.logger.warning(f"{len(summary['warnings'])} statements reported errors during restore")
+            return True
+            
+        except Exception as e:
+            self.logger.error(f"Error during incremental restore: {e}")
+            return False
+
+    def coordinator(self):
+        """Queue shared with safe_restore.py and the backend restore endpoints"""
+        wait_minutes = self.restore_config['queue_wait_timeout_minutes']
+        return RestoreCoordinator(
+            self.restore_config['backup_path'],
+            self.db_config,
+            self.logger,
+            wait_timeout=wait_minutes * 60 if wait_minutes else None
+        )
+
+    def checkpoint_path(self):
+        return os.path.join(self.restore_config['backup_path'], f"restore_checkpoint_{self.db_config['database']}.json")
+
+    def needs_empty_database(self, backup_file):
+        """Whether a clean restore of this backup drops and recreates the database first"""
+        if is_data_only_export(backup_file):
+            # Reloaded into the existing tables, which it cannot create
+            return False
+        return backup_file.endswith(SQL_DUMP_SUFFIXES) or is_copy_export(backup_file) or is_incremental(backup_file)
+
+    def uses_restore_engine(self, backup_file):
+        return backup_file.endswith(SQL_DUMP_SUFFIXES) and self.restore_config['sql_restore_mode'] != 'psql'
+
+    def restore_selected_tables(self, backup_file, tables):
+        """Replace the data of selected tables from a backup, leaving the rest untouched"""
+        try:
+            from restore_engine import SqlRestoreEngine
+        except ImportError as e:
+            self.logger.error(f"Selective restore needs the native restore engine: {e}")
+            return False
+        
+        try:
+            self.logger.info(f"Starting selective restore of {', '.join(tables)} from: {backup_file}")
+            engine = SqlRestoreEngine(self.db_config, self.logger, progress=self.start_progress(backup_file),
+                                      tuning=self.start_tuning())
+            summary = engine.restore_tables(backup_file, tables)
+            self.last_restore_summary = summary
+            
+            self.logger.info(
+                f"Selective restore completed: {summary['rows']:,} rows in {len(summary['tables'])} tables"
+            )
+            return True
+            
+        except Exception as e:
+            self.logger.error(f"Error during selective restore: {e}")
+            return False
+
+    def verify_restore(self, backup_file=None, tables=None):
+        """
+        Verify the restore operation was successful.
+        
+        With a manifest captured when the backup was taken, every table is
+        compared with it (planner estimates in fast mode, row counts and
+        checksums in exact mode). Older backups get a basic check of the
+        core tables over a single connection.
+        """
         if not self.restore_config['verify_after_restore']:
             return True
         
         self.logger.info("Verifying restore operation...")
+        self.last_verification = None
+        
+        try:
+            import psycopg2
+        except ImportError:
+            # Restores through psql run without psycopg2; so does their check
+            self.logger.warning("psycopg2 is not installed - running the basic checks through psql")
+            return self.verify_with_psql()
+        
+        manifest = load_manifest(backup_file) if backup_file else None
+        if manifest:
+            try:
+                checker = RestoreManifest(self.db_config, self.logger, self.restore_config['verify_jobs'])
+                self.last_verification = checker.verify(manifest, self.restore_config['verify_mode'], tables)
+                return self.last_verification['ok']
+            except Exception as e:
+                self.logger.error(f"Error during manifest verification: {e}")
+                return False
+        
+        try:
+            conn = psycopg2.connect(
+                host=self.db_config['host'],
+                port=self.db_config['port'],
+                dbname=self.db_config['database'],
+                user=self.db_config['user'],
+                password=self.db_config['password']
+            )
+        except Exception as e:
+            self.logger.error(f"Verification failed: cannot connect: {e}")
+            return False
         
         try:
-            env = os.environ.copy()
-            env['PGPASSWORD'] = self.db_config['password']
-            
             # Check if database exists and is accessible
-            test_queries = [
-                "SELECT COUNT(*) FROM users;",
-                "SELECT COUNT(*) FROM products;",
-                "SELECT COUNT(*) FROM orders;",
-                "SELECT version();"
-            ]
+            with conn.cursor() as cur:
+                for query in VERIFY_QUERIES:
+                    try:
+                        cur.execute(query)
+                    except Exception as e:
+                        self.logger.error(f"Verification failed for query: {query}")
+                        self.logger.error(f"Error: {e}")
+                        return False
+                    self.logger.info(f"Verification passed: {query.strip()} -> {cur.fetchone()[0]}")
+            
+            self.logger.info("Restore verification completed successfully (no manifest for this backup)")
+            return True
             
-            for query in test_queries:
+        except Exception as e:
+            self.logger.error(f"Error during restore verification: {e}")
+            return False
+        finally:
+            conn.close()
+
+    def verify_with_psql(self):
+        """Basic check of the core tables with one psql call per query"""
+        env = os.environ.copy()
+        env['PGPASSWORD'] = self.db_config['password']
+        
+        try:
+            for query in VERIFY_QUERIES:
                 cmd = [
                     'psql',
                     '-h', self.db_config['host'],
@@ -484,8 +879,7 @@ class DatabaseRestore:
                     self.logger.error(f"Verification failed for query: {query}")
                     self.logger.error(f"Error: {result.stderr}")
                     return False
-                else:
-                    self.logger.info(f"Verification passed: {query.strip()} -> {result.stdout.strip()}")
+                self.logger.info(f"Verification passed: {query.strip()} -> {result.stdout.strip()}")
             
             self.logger.info("Restore verification completed successfully")
             return True
@@ -494,21 +888,315 @@ class DatabaseRestore:
             self.logger.error(f"Error during restore verification: {e}")
             return False
 
-    def perform_restore(self, backup_file, force=False, clean=True):
-        """Perform the complete restore operation"""
+    def warm_up_database(self):
+        """Collect planner statistics and prewarm hot relations after a restore"""
+        if not self.restore_config['warmup_after_restore']:
+            return None
+        
+        try:
+            from restore_warmup import RestoreWarmup
+        except ImportError as e:
+            self.logger.warning(f"Warm-up unavailable: {e}")
+            return None
+        
+        self.logger.info("Warming up restored database (ANALYZE + prewarm)...")
+        try:
+            warmup = RestoreWarmup(
+                self.db_config,
+                self.logger,
+                jobs=self.restore_config['parallel_jobs'] or recommended_jobs(),
+                time_budget=self.restore_config['warmup_time_budget_seconds'],
+                create_extension=self.restore_config['warmup_create_extension']
+            )
+            self.last_warmup = warmup.run()
+        except Exception as e:
+            # A cold cache is slow, not broken; never fail the restore over it
+            self.logger.warning(f"Warm-up failed: {e}")
+            self.last_warmup = None
+        return self.last_warmup
+
+    def is_data_only_backup(self, backup_file):
+        """Whether the backup holds rows only (pg_dump --data-only)"""
+        metadata_file = Path(backup_file).with_suffix('.json')
+        try:
+            with open(metadata_file, 'r') as f:
+                metadata = json.load(f)
+            backup_type = metadata.get('backup_type') or metadata.get('type')
+            if backup_type:
+                return 'data' in backup_type
+        except (OSError, ValueError):
+            pass
+        return is_data_only_dump(backup_file)
+
+    def check_foreign_keys(self, backup_file, tables=None):
+        """
+        Count rows whose foreign keys point at missing parents.
+        
+        Data-only dumps are loaded with triggers disabled, so nothing else
+        catches them; by default the check only runs for those backups.
+        """
+        mode = self.restore_config['check_foreign_keys']
+        if mode == 'never' or (mode == 'auto' and not self.is_data_only_backup(backup_file)):
+            return None
+        
+        try:
+            from restore_integrity import ForeignKeyChecker
+        except ImportError as e:
+            self.logger.warning(f"Foreign key check unavailable: {e}")
+            return None
+        
+        self.logger.info("Checking foreign keys for orphaned rows...")
+        try:
+            checker = ForeignKeyChecker(
+                self.db_config,
+                self.logger,
+                jobs=self.restore_config['parallel_jobs'] or recommended_jobs(),
+                batch_size=self.restore_config['orphan_delete_batch']
+            )
+            self.last_integrity = checker.run(
+                delete_orphans=self.restore_config['delete_orphans'],
+                tables=tables
+            )
+        except Exception as e:
+            self.logger.warning(f"Foreign key check failed: {e}")
+            self.last_integrity = None
+            return None
+        
+        remaining = self.last_integrity.get('orphans_remaining', self.last_integrity['orphans'])
+        if remaining:
+            self.logger.warning(
+                f"{remaining:,} orphaned rows remain - rerun with --delete-orphans "
+                f"or restore the parent tables"
+            )
+        return self.last_integrity
+
+    def predict_duration(self, backup_file):
+        """Log the expected duration and best --jobs for this restore, judged from past restores"""
+        try:
+            predictor = RestorePredictor(self.restore_config['backup_path'], self.logger)
+            self.last_prediction = predictor.predict(
+                backup_file,
+                engine=self.restore_config['sql_restore_mode'],
+                jobs=self.restore_config['parallel_jobs']
+            )
+        except Exception as e:
+            self.logger.warning(f"Could not predict restore duration: {e}")
+            self.last_prediction = None
+        
+        if self.last_prediction:
+            self.logger.info(predictor.describe(self.last_prediction))
+        else:
+            self.logger.info("No restore history yet - duration cannot be predicted")
+        return self.last_prediction
+
+    def restore_backup_file(self, backup_file):
+        """Load a backup into the configured database using the matching restore method"""
+        self.restore_jobs = 1
+        if is_copy_export(backup_file):
+            return self.restore_from_export(backup_file)
+        if is_incremental(backup_file):
+            return self.restore_from_incremental(backup_file)
+        if is_archive(backup_file):
+            return self.restore_from_custom_format(backup_file)
+        if self.restore_config['sql_restore_mode'] == 'psql':
+            return self.restore_from_sql(backup_file)
+        return self.restore_from_sql_engine(backup_file)
+
+    def run_admin_sql(self, sql):
+        """Run SQL against the maintenance database as a single transaction"""
+        env = os.environ.copy()
+        env['PGPASSWORD'] = self.db_config['password']
+        
+        cmd = [
+            'psql',
+            '-h', self.db_config['host'],
+            '-p', self.db_config['port'],
+            '-U', self.db_config['user'],
+            '-d', 'postgres',
+            '-v', 'ON_ERROR_STOP=1',
+            '-c', sql,
+            '--no-password',
+            '-t',
+            '-A'
+        ]
+        
+        result = subprocess.run(cmd, env=env, capture_output=True, text=True)
+        if result.returncode == 0:
+            return True, result.stdout.strip()
+        return False, result.stderr.strip()
+
+    def database_exists(self, database):
+        ok, output = self.run_admin_sql(f"SELECT 1 FROM pg_database WHERE datname = '{database}';")
+        return ok and output == '1'
+
+    def swap_databases(self, replacement, production, retired, attempts=3):
+        """
+        Atomically put `replacement` in place of `production`.
+        
+        Production stops accepting connections, existing sessions are
+        terminated and both renames run in one transaction, so either the
+        swap happens completely or production is left untouched. The
+        previous production database is kept under the name `retired`.
+        """
+        if self.database_exists(production):
+            swap_sql = f"""
+            ALTER DATABASE "{production}" WITH ALLOW_CONNECTIONS false;
+            SELECT count(pg_terminate_backend(pid)) FROM pg_stat_activity
+             WHERE datname IN ('{production}', '{replacement}') AND pid <> pg_backend_pid();
+            ALTER DATABASE "{production}" RENAME TO "{retired}";
+            ALTER DATABASE "{replacement}" RENAME TO "{production}";
+            ALTER DATABASE "{retired}" WITH ALLOW_CONNECTIONS true;
+            """
+        else:
+            self.logger.warning(f"Database '{production}' does not exist - promoting '{replacement}' directly")
+            retired = None
+            swap_sql = f'ALTER DATABASE "{replacement}" RENAME TO "{production}";'
+        
+        for attempt in range(1, attempts + 1):
+            ok, output = self.run_admin_sql(swap_sql)
+            if ok:
+                return True, retired
+            self.logger.warning(f"Database swap attempt {attempt}/{attempts} failed: {output}")
+        
+        # A failed swap rolls back, but make sure production accepts connections again
+        if retired:
+            self.run_admin_sql(f'ALTER DATABASE "{production}" WITH ALLOW_CONNECTIONS true;')
+        return False, None
+
+    def perform_shadow_restore(self, backup_file):
+        """
+        Restore into a shadow database while production keeps serving, then swap.
+        
+        Downtime is limited to the rename step; the previous database is kept
+        as an instant rollback target (see rollback_to_database).
+        """
+        self.logger.info(f"Starting shadow restore from: {backup_file}")
+        
+        if not self.verify_backup_file(backup_file):
+            return False
+        if not self.is_supported_format(backup_file):
+            self.logger.error(f"Unsupported backup format: {backup_file}")
+            return False
+        
+        production = self.db_config['database']
+        timestamp = datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
+        shadow = f"{production}_restore_{timestamp}"
+        retired = f"{production}_old_{timestamp}"
+        
+        if self.restore_config['sql_restore_mode'] == 'psql' and not is_archive(backup_file):
+            # psql would follow a dump's \connect back into production
+            self.logger.info("Using the native engine for shadow restore of SQL dumps")
+            self.restore_config['sql_restore_mode'] = 'native'
+        
+        self.prepare_schema_template(backup_file)
+        ok, output = self.create_database(shadow)
+        if not ok:
+            self.logger.error(f"Failed to create shadow database '{shadow}': {output}")
+            return False
+        self.logger.info(f"Restoring into shadow database '{shadow}' while '{production}' stays online")
+        self.predict_duration(backup_file)
+        
+        start_time = datetime.datetime.now()
+        self.db_config['database'] = shadow
+        try:
+            success = self.restore_backup_file(backup_file)
+            if self.progress:
+                self.progress.finish(success)
+            if success and not self.verify_restore(backup_file):
+                self.logger.error("Shadow database verification failed")
+                success = False
+            if success:
+                self.check_foreign_keys(backup_file)
+                # Warm the shadow while production still serves; the cache
+                # belongs to the database, so it survives the rename
+                self.warm_up_database()
+        finally:
+            self.db_config['database'] = production
+        
+        duration = (datetime.datetime.now() - start_time).total_seconds()
+        
+        if not success:
+            self.logger.error(f"Shadow restore failed after {duration:.2f} seconds - production was not touched")
+            ok, output = self.run_admin_sql(f'DROP DATABASE IF EXISTS "{shadow}";')
+            if not ok:
+                self.logger.warning(f"Failed to drop shadow database '{shadow}': {output}")
+            self.log_restore_metadata(backup_file, False, duration, None, {'mode': 'shadow'})
+            return False
+        
+        swap_start = datetime.datetime.now()
+        swapped, retired = self.swap_databases(shadow, production, retired)
+        downtime = (datetime.datetime.now() - swap_start).total_seconds()
+        
+        if not swapped:
+            self.logger.error(f"Failed to swap databases; restored data remains in '{shadow}'")
+            self.log_restore_metadata(backup_file, False, duration, None, {'mode': 'shadow', 'shadow_database': shadow})
+            return False
+        
+        self.logger.info(f"Shadow restore completed in {duration:.2f} seconds; swap downtime {downtime:.2f} seconds")
+        if retired:
+            self.logger.info(f"Previous database kept as '{retired}' (rollback: --rollback-to {retired})")
+        
+        self.log_restore_metadata(backup_file, True, duration + downtime, None, {
+            'mode': 'shadow',
+            'swap_downtime_seconds': downtime,
+            'rollback_database': retired
+        })
+        return True
+
+    def rollback_to_database(self, retired):
+        """Swap a database kept by a shadow restore back into production"""
+        production = self.db_config['database']
+        if not self.database_exists(retired):
+            self.logger.error(f"Rollback database does not exist: {retired}")
+            return False
+        
+        timestamp = datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
+        swapped, replaced = self.swap_databases(retired, production, f"{production}_rolledback_{timestamp}")
+        if swapped:
+            self.logger.info(f"Rolled back '{production}' to '{retired}'" + (f"; replaced database kept as '{replaced}'" if replaced else ''))
+        else:
+            self.logger.error(f"Rollback to '{retired}' failed")
+        return swapped
+
+    def perform_restore(self, backup_file, force=False, clean=True, tables=None, resume=False):
+        """
+        Perform the complete restore operation, or only `tables` when given.
+        
+        With `resume`, an engine restore of the same backup that was
+        interrupted continues from its checkpoint: finished tables are
+        skipped and the one in flight is reloaded from the start.
+        """
         self.logger.info(f"Starting restore operation from: {backup_file}")
         
         # Verify backup file
         if not self.verify_backup_file(backup_file):
             return False
         
-        # Create pre-restore backup
+        checkpoint = None
+        self.schema_template = None
+        if resume:
+            if not backup_file.endswith(SQL_DUMP_SUFFIXES):
+                self.logger.warning("Resume is only supported for SQL dumps - starting a full restore")
+            else:
+                # Only the native engine records checkpoints
+                if self.restore_config['sql_restore_mode'] == 'psql':
+                    self.restore_config['sql_restore_mode'] = 'native'
+                checkpoint = RestoreCheckpoint.resume(self.checkpoint_path(), backup_file, self.db_config['database'])
+                if checkpoint:
+                    self.logger.info(
+                        f"Resuming restore (attempt {checkpoint.state['attempts']}): "
+                        f"{len(checkpoint.tables)} tables already loaded"
+                    )
+                else:
+                    self.logger.warning("No checkpoint found for this backup - starting a full restore")
+        
+        # Create pre-restore backup; a half-restored database is not worth keeping
         pre_restore_backup = None
-        if not force:
+        if not force and not checkpoint:
             pre_restore_backup = self.create_pre_restore_backup()
         
-        # Get initial connection count
-        initial_connections = self.get_database_connection_count()
+        # Get initial connection count; a table restore runs alongside them
+        initial_connections = 0 if tables else self.get_database_connection_count()
         if initial_connections > 0:
             self.logger.info(f"Found {initial_connections} active connections to database")
             
@@ -523,35 +1211,64 @@ class DatabaseRestore:
                 self.logger.error("Failed to terminate database connections")
                 return False
         
+        if not tables:
+            self.predict_duration(backup_file)
+        
         start_time = datetime.datetime.now()
         
         # Determine backup format and restore accordingly
-        success = False
-        if backup_file.endswith('.backup'):
-            success = self.restore_from_custom_format(backup_file)
-        elif backup_file.endswith(('.sql', '.sql.gz')):
-            if clean:
-                # For SQL files, we need to drop/recreate database
+        if not self.is_supported_format(backup_file):
+            self.logger.error(f"Unsupported backup format: {backup_file}")
+            return False
+        
+        if tables:
+            success = self.restore_selected_tables(backup_file, tables)
+        else:
+            if checkpoint:
+                self.logger.info("Keeping the partially restored database")
+            elif clean and self.needs_empty_database(backup_file):
+                # SQL dumps and exports create their objects without dropping
+                # them first; pg_restore cleans up with --clean --if-exists
+                self.prepare_schema_template(backup_file)
                 if not self.drop_and_recreate_database():
                     self.logger.error("Failed to recreate database")
                     return False
-            success = self.restore_from_sql(backup_file)
-        else:
-            self.logger.error(f"Unsupported backup format: {backup_file}")
-            return False
+            
+            if self.uses_restore_engine(backup_file):
+                self.checkpoint = checkpoint or RestoreCheckpoint.start(
+                    self.checkpoint_path(), backup_file, self.db_config['database'])
+            success = self.restore_backup_file(backup_file)
         
         end_time = datetime.datetime.now()
         duration = (end_time - start_time).total_seconds()
         
+        if self.progress:
+            self.progress.finish(success)
+        
+        metadata_extra = None
+        if tables:
+            metadata_extra = {'mode': 'tables', 'selected_tables': tables}
+        elif checkpoint:
+            metadata_extra = {'resumed': True, 'attempt': checkpoint.state['attempts']}
+        
+        if self.checkpoint:
+            if success:
+                self.checkpoint.remove()
+            else:
+                self.logger.info(f"Checkpoint saved to {self.checkpoint.path} - run again with --resume to continue")
+            self.checkpoint = None
+        
         if success:
             self.logger.info(f"Restore completed in {duration:.2f} seconds")
             
             # Verify restore
-            if self.verify_restore():
+            if self.verify_restore(backup_file, tables):
                 self.logger.info("Restore operation completed successfully")
+                self.check_foreign_keys(backup_file, tables)
+                self.warm_up_database()
                 
                 # Log restore metadata
-                self.log_restore_metadata(backup_file, True, duration, pre_restore_backup)
+                self.log_restore_metadata(backup_file, True, duration, pre_restore_backup, metadata_extra)
                 return True
             else:
                 self.logger.error("Restore verification failed")
@@ -559,14 +1276,14 @@ class DatabaseRestore:
         
         if not success:
             self.logger.error(f"Restore failed after {duration:.2f} seconds")
-            self.log_restore_metadata(backup_file, False, duration, pre_restore_backup)
+            self.log_restore_metadata(backup_file, False, duration, pre_restore_backup, metadata_extra)
             
             if pre_restore_backup:
                 self.logger.info(f"Pre-restore backup is available at: {pre_restore_backup}")
         
         return success
 
-    def log_restore_metadata(self, backup_file, success, duration, pre_restore_backup):
+    def log_restore_metadata(self, backup_file, success, duration, pre_restore_backup, extra=None):
         """Log restore operation metadata"""
         metadata = {
             'restore_timestamp': datetime.datetime.now().isoformat(),
@@ -575,9 +1292,45 @@ class DatabaseRestore:
             'host': self.db_config['host'],
             'success': success,
             'duration_seconds': duration,
-            'pre_restore_backup': pre_restore_backup
+            'pre_restore_backup': pre_restore_backup,
+            'engine': 'copy_export' if is_copy_export(backup_file) else (
+                'incremental' if is_incremental(backup_file) else
+                'pg_restore' if is_archive(backup_file) else self.restore_config['sql_restore_mode']),
+            'jobs': self.restore_jobs
         }
         
+        # Size and format feed the duration predictor for later restores
+        try:
+            metadata['backup_size'] = archive_size(backup_file)
+            metadata['backup_format'] = backup_format(backup_file)
+        except OSError:
+            pass
+        
+        if self.last_prediction:
+            metadata['prediction'] = self.last_prediction
+        
+        if extra:
+            metadata.update(extra)
+        
+        if self.last_warmup:
+            metadata['warmup'] = self.last_warmup
+        
+        if self.last_verification:
+            metadata['verification'] = self.last_verification
+        
+        if self.last_integrity:
+            metadata['foreign_key_check'] = self.last_integrity
+        
+        if self.schema_template:
+            metadata['schema_template'] = self.schema_template
+        
+        if self.tuning:
+            metadata['restore_profile'] = self.tuning.summary()
+        
+        if self.last_restore_summary:
+            metadata['tables'] = self.last_restore_summary['tables']
+            metadata['phases'] = self.last_restore_summary['phases']
+        
         metadata_file = os.path.join(
             self.restore_config['backup_path'], 
             f"restore_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
@@ -600,11 +1353,59 @@ def main():
     parser.add_argument('--force', action='store_true', help='Force restore without prompts')
     parser.add_argument('--no-clean', action='store_true', help='Do not drop/recreate database')
     parser.add_argument('--latest', action='store_true', help='Restore from latest backup')
+    parser.add_argument('--engine', choices=['native', 'parallel', 'psql'], default='native',
+                        help='SQL dump restore engine (default: native)')
+    parser.add_argument('--parallel', action='store_true', help='Shortcut for --engine parallel')
+    parser.add_argument('--jobs', type=int, help='Number of parallel restore jobs')
+    parser.add_argument('--resume', action='store_true',
+                        help='Continue an interrupted restore of the same backup from its checkpoint')
+    parser.add_argument('--profile', choices=['tuned', 'default'], default='tuned',
+                        help='Restore session profile (default: tuned)')
+    parser.add_argument('--no-schema-template', action='store_true',
+                        help='Replay the dump\'s pre-data instead of cloning a cached schema template')
+    parser.add_argument('--turbo', action='store_true',
+                        help='Load each table in the transaction that creates it (skips WAL with wal_level=minimal)')
+    parser.add_argument('--warmup', action='store_true',
+                        help='Run parallel ANALYZE and prewarm hot tables after a successful restore')
+    parser.add_argument('--warmup-budget', type=int, default=60, metavar='SECONDS',
+                        help='Time budget for the warm-up stage (default: 60)')
+    parser.add_argument('--prewarm-extension', action='store_true',
+                        help='Let the warm-up create the pg_prewarm extension if it is not installed')
+    parser.add_argument('--verify-mode', choices=['fast', 'exact'], default='fast',
+                        help='Manifest check: planner estimates (fast) or full counts and checksums (exact)')
+    parser.add_argument('--check-fks', choices=['auto', 'always', 'never'], default='auto',
+                        help='Count rows with missing foreign key parents after restore (auto: data-only backups)')
+    parser.add_argument('--delete-orphans', action='store_true',
+                        help='Delete rows with missing foreign key parents in batches (implies --check-fks always)')
+    parser.add_argument('--tables', help='Comma-separated tables to restore (e.g. users,orders); other tables are untouched')
+    parser.add_argument('--shadow', action='store_true',
+                        help='Restore into a shadow database and swap it in, keeping production online')
+    parser.add_argument('--rollback-to', metavar='DATABASE',
+                        help='Swap a database kept by a shadow restore back into production')
     
     args = parser.parse_args()
     
     restore_tool = DatabaseRestore()
     
+    if args.rollback_to:
+        success = restore_tool.coordinator().run(
+            args.rollback_to, 'restore.py', lambda: restore_tool.rollback_to_database(args.rollback_to),
+            options={'mode': 'rollback'})
+        sys.exit(0 if success else 1)
+    
+    restore_tool.restore_config['sql_restore_mode'] = 'parallel' if args.parallel else args.engine
+    if args.jobs:
+        restore_tool.restore_config['parallel_jobs'] = args.jobs
+    restore_tool.restore_config['restore_profile'] = args.profile
+    restore_tool.restore_config['turbo'] = args.turbo
+    restore_tool.restore_config['schema_template'] = not args.no_schema_template
+    restore_tool.restore_config['warmup_after_restore'] = args.warmup
+    restore_tool.restore_config['warmup_time_budget_seconds'] = args.warmup_budget
+    restore_tool.restore_config['warmup_create_extension'] = args.prewarm_extension
+    restore_tool.restore_config['verify_mode'] = args.verify_mode
+    restore_tool.restore_config['check_foreign_keys'] = 'always' if args.delete_orphans else args.check_fks
+    restore_tool.restore_config['delete_orphans'] = args.delete_orphans
+    
     if args.list:
         print("\n=== Available Backups ===")
         backups = restore_tool.list_available_backups()
@@ -673,11 +1474,27 @@ def main():
             print("Restore cancelled.")
             sys.exit(1)
     
-    success = restore_tool.perform_restore(
-        backup_file, 
-        force=args.force, 
-        clean=not args.no_clean
-    )
+    # Restores from every entry point run one at a time; the same restore
+    # with the same options submitted twice waits for the first instead of
+    # running again
+    tables = [name.strip() for name in args.tables.split(',') if name.strip()] if args.tables else None
+    if args.shadow:
+        options = {'mode': 'shadow'}
+        work = lambda: restore_tool.perform_shadow_restore(backup_file)
+    else:
+        options = {'mode': 'restore', 'clean': not args.no_clean, 'force': args.force}
+        if args.resume:
+            options['resume'] = True
+        if tables:
+            options.update(mode='tables', tables=tables)
+        work = lambda: restore_tool.perform_restore(
+            backup_file, 
+            force=args.force, 
+            clean=not args.no_clean,
+            resume=args.resume,
+            tables=tables
+        )
+    success = restore_tool.coordinator().run(backup_file, 'restore.py', work, options=options)
     
     if success:
         print(f"\nRestore completed successfully from: {backup_file}")
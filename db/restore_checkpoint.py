@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+Restore Checkpoints
+Records finished dump entries so an interrupted restore can pick up where it stopped
+"""
+
+import os
+import json
+import datetime
+import threading
+
+
+class RestoreCheckpoint:
+    """
+    Checkpoint file for one restore of one backup into one database.
+
+    Every dump entry (identified by its position in the dump) is recorded
+    as it completes, together with the rows loaded for COPY entries and the
+    phases that have finished. The file is rewritten atomically after each
+    entry, so after a timeout or dropped connection it lists exactly the
+    work that was committed. `resumed` is True when the checkpoint was
+    loaded from an earlier attempt rather than started fresh.
+    """
+
+    def __init__(self, path, backup_file, database, state=None):
+        self.path = path
+        self.backup_file = str(backup_file)
+        self.database = database
+        self.resumed = state is not None
+        self._lock = threading.Lock()
+
+        stat = os.stat(backup_file)
+        self.state = state or {
+            'backup_file': self.backup_file,
+            'file_size': stat.st_size,
+            'file_mtime': stat.st_mtime,
+            'database': database,
+            'started_at': datetime.datetime.now().isoformat(),
+            'attempts': 0,
+            'phases': [],
+            'entries': [],
+            'tables': {}
+        }
+        self.state['attempts'] += 1
+        self._done = set(self.state['entries'])
+
+    @classmethod
+    def start(cls, path, backup_file, database):
+        """Begin a fresh checkpoint, replacing any earlier one"""
+        checkpoint = cls(path, backup_file, database)
+        checkpoint.save()
+        return checkpoint
+
+    @classmethod
+    def resume(cls, path, backup_file, database):
+        """Load the checkpoint of an interrupted restore of this backup, or None"""
+        try:
+            with open(path, 'r') as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        stat = os.stat(backup_file)
+        if (state.get('backup_file') != str(backup_file) or state.get('database') != database
+                or state.get('file_size') != stat.st_size or state.get('file_mtime') != stat.st_mtime):
+            return None
+        return cls(path, backup_file, database, state)
+
+    @property
+    def tables(self):
+        return self.state['tables']
+
+    def is_done(self, key):
+        return str(key) in self._done
+
+    def mark(self, key, table=None, rows=None):
+        """Record a finished entry (and the rows of a loaded table)"""
+        with self._lock:
+            self._done.add(str(key))
+            self.state['entries'].append(str(key))
+            if table:
+                self.state['tables'][table] = rows
+            self._save_locked()
+
+    def phase_done(self, phase):
+        return phase in self.state['phases']
+
+    def mark_phase(self, phase):
+        with self._lock:
+            if phase not in self.state['phases']:
+                self.state['phases'].append(phase)
+                self._save_locked()
+
+    def save(self):
+        with self._lock:
+            self._save_locked()
+
+    def _save_locked(self):
+        self.state['updated_at'] = datetime.datetime.now().isoformat()
+        temp_file = f"{self.path}.tmp"
+        with open(temp_file, 'w') as f:
+            json.dump(self.state, f, indent=2)
+        os.replace(temp_file, self.path)
+
+    def remove(self):
+        """Delete the checkpoint once the restore has completed"""
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,422 @@
+#!/usr/bin/env python3
+"""
+Restore Coordinator
+Runs restores one at a time across processes: FIFO queue, lock file and PostgreSQL advisory lock
+"""
+
+import os
+import sys
+import json
+import time
+import uuid
+import socket
+import logging
+import argparse
+import datetime
+
+# Shared with backend/services/restoreCoordinator.js - keep the two in step
+QUEUE_FILE = 'restore_queue.json'
+QUEUE_MUTEX = 'restore_queue.json.lock'
+LOCK_FILE = 'restore.lock'
+# pg_advisory_lock key held on the maintenance database while a restore runs
+ADVISORY_LOCK_KEY = 0x52455354  # 'REST'
+# Queue edits take milliseconds; a mutex file older than this was abandoned
+MUTEX_STALE_SECONDS = 30
+HISTORY_SIZE = 20
+
+
+def _now():
+    return datetime.datetime.now().isoformat()
+
+
+def _process_alive(pid):
+    if os.name == 'nt':
+        # os.kill(pid, 0) is not a probe on Windows; the advisory lock and
+        # the submitter's own cleanup cover dead processes there
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class RestoreCoordinator:
+    """
+    Serializes restores started from any entry point.
+
+    Jobs are appended to a queue file in the backup directory and run in
+    submission order. The job at the head of the queue starts once it holds
+    both the lock file (which works while PostgreSQL is down, e.g. for the
+    emergency server) and a session-level advisory lock on the maintenance
+    database (which cannot outlive a crashed holder). A submission for a
+    backup, target and options (mode, clean, force, ...) that is already
+    queued or running is merged into that job: the submitter waits for it
+    and takes its result instead of restoring the same backup twice.
+    """
+
+    def __init__(self, backup_path, db_config, logger=None, poll_interval=1.0, wait_timeout=None):
+        self.backup_path = backup_path
+        self.db_config = db_config
+        self.logger = logger or logging.getLogger(__name__)
+        self.poll_interval = poll_interval
+        self.wait_timeout = wait_timeout
+        self.queue_file = os.path.join(backup_path, QUEUE_FILE)
+        self.mutex_file = os.path.join(backup_path, QUEUE_MUTEX)
+        self.lock_file = os.path.join(backup_path, LOCK_FILE)
+        self.host = socket.gethostname()
+        self._advisory_conn = None
+
+    # Queue file
+
+    def _acquire_mutex(self, timeout=10):
+        deadline = time.time() + timeout
+        while True:
+            try:
+                fd = os.open(self.mutex_file, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+                os.write(fd, str(os.getpid()).encode())
+                os.close(fd)
+                return
+            except FileExistsError:
+                try:
+                    if time.time() - os.path.getmtime(self.mutex_file) > MUTEX_STALE_SECONDS:
+                        os.remove(self.mutex_file)
+                        continue
+                except OSError:
+                    continue
+                if time.time() > deadline:
+                    raise TimeoutError(f"Restore queue is locked: {self.mutex_file}")
+                time.sleep(0.05)
+
+    def _load(self):
+        try:
+            with open(self.queue_file, 'r') as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            state = {}
+        state.setdefault('jobs', [])
+        state.setdefault('history', [])
+        return state
+
+    def _save(self, state):
+        temp_file = f"{self.queue_file}.tmp"
+        with open(temp_file, 'w') as f:
+            json.dump(state, f, indent=2)
+        os.replace(temp_file, self.queue_file)
+
+    def _update(self, change):
+        """Apply `change(state)` to the queue under the mutex; returns its result"""
+        self._acquire_mutex()
+        try:
+            state = self._load()
+            self._prune(state)
+            result = change(state)
+            self._save(state)
+            return result
+        finally:
+            try:
+                os.remove(self.mutex_file)
+            except OSError:
+                pass
+
+    def _is_orphaned(self, job):
+        return job.get('host') == self.host and not _process_alive(job['pid'])
+
+    def _prune(self, state):
+        """Drop jobs whose process died without finishing them"""
+        for job in list(state['jobs']):
+            if self._is_orphaned(job):
+                state['jobs'].remove(job)
+                job.update(status='abandoned', finished_at=_now(),
+                           message=f"Process {job['pid']} exited without finishing the restore")
+                state['history'].append(job)
+        del state['history'][:-HISTORY_SIZE]
+
+    # Jobs
+
+    @staticmethod
+    def _backup_name(backup_file):
+        # Rollbacks name a database rather than a file
+        return os.path.realpath(backup_file) if os.path.exists(backup_file) else backup_file
+
+    def job_key(self, backup_file, database, options=None):
+        """Submissions with the same key restore the same thing and are merged"""
+        key = f"{self._backup_name(backup_file)}|{database}"
+        if options:
+            key += '|' + json.dumps(options, sort_keys=True, separators=(',', ':'))
+        return key
+
+    def submit(self, backup_file, source, options=None):
+        """Queue a restore; returns (job, merged) where merged means an identical job was pending"""
+        database = self.db_config['database']
+        key = self.job_key(backup_file, database, options)
+
+        def change(state):
+            for job in state['jobs']:
+                if job['key'] == key:
+                    job.setdefault('merged', []).append(
+                        {'source': source, 'pid': os.getpid(), 'host': self.host, 'submitted_at': _now()})
+                    return job, True
+            job = {
+                'id': f"{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:6]}",
+                'key': key,
+                'backup_file': self._backup_name(backup_file),
+                'database': database,
+                'options': options or {},
+                'source': source,
+                'status': 'queued',
+                'host': self.host,
+                'pid': os.getpid(),
+                'submitted_at': _now(),
+                'merged': []
+            }
+            state['jobs'].append(job)
+            return job, False
+
+        job, merged = self._update(change)
+        if merged:
+            self.logger.info(f"Restore of {backup_file} is already {job['status']} (job {job['id']}, "
+                             f"from {job['source']}) - waiting for its result instead of restoring again")
+        else:
+            self.logger.info(f"Restore job {job['id']} queued")
+        return job, merged
+
+    def _read_lock(self):
+        try:
+            with open(self.lock_file, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _take_lock_file(self, job, advisory):
+        holder = self._read_lock()
+        if holder and holder.get('job_id') != job['id']:
+            stale = (holder.get('host') == self.host and not _process_alive(holder.get('pid', 0)))
+            # A holder that had the advisory lock keeps it until its session
+            # ends, so getting the lock now means the holder is gone
+            stale = stale or (advisory and holder.get('advisory'))
+            if not stale:
+                return False
+            self.logger.warning(f"Removing stale restore lock of job {holder.get('job_id')} (pid {holder.get('pid')})")
+            os.remove(self.lock_file)
+        try:
+            fd = os.open(self.lock_file, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            return False
+        with os.fdopen(fd, 'w') as f:
+            json.dump({'job_id': job['id'], 'pid': os.getpid(), 'host': self.host,
+                       'backup_file': job['backup_file'], 'advisory': advisory, 'started_at': _now()}, f)
+        return True
+
+    def _try_advisory_lock(self):
+        """True if taken, False if held elsewhere, None if PostgreSQL is unreachable"""
+        try:
+            # Imported here so restores through psql run without psycopg2;
+            # the lock file alone guards them then
+            import psycopg2
+        except ImportError:
+            return None
+        try:
+            conn = psycopg2.connect(
+                host=self.db_config['host'],
+                port=self.db_config['port'],
+                dbname='postgres',
+                user=self.db_config['user'],
+                password=self.db_config['password'],
+                connect_timeout=5
+            )
+        except psycopg2.Error:
+            return None
+        conn.autocommit = True
+        with conn.cursor() as cur:
+            cur.execute("SELECT pg_try_advisory_lock(%s)", (ADVISORY_LOCK_KEY,))
+            taken = cur.fetchone()[0]
+        if taken:
+            self._advisory_conn = conn
+        else:
+            conn.close()
+        return taken
+
+    def _release_advisory_lock(self):
+        if self._advisory_conn is None:
+            return
+        import psycopg2
+        try:
+            with self._advisory_conn.cursor() as cur:
+                cur.execute("SELECT pg_advisory_unlock(%s)", (ADVISORY_LOCK_KEY,))
+            self._advisory_conn.close()
+        except psycopg2.Error:
+            pass
+        self._advisory_conn = None
+
+    def _try_start(self, job):
+        state = self._load()
+        pending = [j for j in state['jobs'] if not self._is_orphaned(j)]
+        if not pending or pending[0]['id'] != job['id']:
+            return False, next((i for i, j in enumerate(pending) if j['id'] == job['id']), None)
+
+        advisory = self._try_advisory_lock()
+        if advisory is False:
+            return False, 0
+        if not self._take_lock_file(job, advisory is True):
+            self._release_advisory_lock()
+            return False, 0
+        if advisory is None:
+            self.logger.warning("PostgreSQL unreachable - restore is guarded by the lock file only")
+
+        def change(state):
+            for j in state['jobs']:
+                if j['id'] == job['id']:
+                    j.update(status='running', started_at=_now())
+                    return j
+            return job
+        job.update(self._update(change))
+        return True, 0
+
+    def wait_turn(self, job):
+        """Block until `job` is first in the queue and holds both locks"""
+        start = time.time()
+        last_position = None
+        while True:
+            started, position = self._try_start(job)
+            if started:
+                waited = time.time() - start
+                if waited >= 1:
+                    self.logger.info(f"Restore job {job['id']} starting after {waited:.0f}s in the queue")
+                return job
+            if position is None:
+                raise RuntimeError(f"Restore job {job['id']} is no longer queued")
+            if position != last_position:
+                ahead = 'a restore is running' if position == 0 else f"{position} job(s) ahead"
+                self.logger.info(f"Restore job {job['id']} waiting: {ahead}")
+                last_position = position
+            if self.wait_timeout and time.time() - start > self.wait_timeout:
+                self.cancel(job)
+                raise TimeoutError(f"Gave up waiting for a restore slot after {self.wait_timeout}s")
+            time.sleep(self.poll_interval)
+
+    def finish(self, job, success, message=None):
+        """Record the outcome, release both locks and move the job to the history"""
+        def change(state):
+            for j in list(state['jobs']):
+                if j['id'] == job['id']:
+                    state['jobs'].remove(j)
+                    j.update(status='completed' if success else 'failed', finished_at=_now(), message=message)
+                    state['history'].append(j)
+                    del state['history'][:-HISTORY_SIZE]
+                    return j
+            return job
+        try:
+            job.update(self._update(change))
+        finally:
+            holder = self._read_lock()
+            if holder and holder.get('job_id') == job['id']:
+                os.remove(self.lock_file)
+            self._release_advisory_lock()
+        return job
+
+    def cancel(self, job):
+        """Withdraw a job that has not started"""
+        def change(state):
+            state['jobs'] = [j for j in state['jobs'] if j['id'] != job['id'] or j['status'] == 'running']
+        self._update(change)
+
+    def wait_for(self, job_id):
+        """Block until the job has finished; returns its final record"""
+        start = time.time()
+        while True:
+            # Pruned on every poll: a runner that died never finishes its job
+            state = self._load()
+            self._prune(state)
+            for job in state['history']:
+                if job['id'] == job_id:
+                    return job
+            if not any(job['id'] == job_id for job in state['jobs']):
+                return {'id': job_id, 'status': 'unknown', 'message': 'Job disappeared from the queue'}
+            if self.wait_timeout and time.time() - start > self.wait_timeout:
+                raise TimeoutError(f"Gave up waiting for restore job {job_id} after {self.wait_timeout}s")
+            time.sleep(self.poll_interval)
+
+    def run(self, backup_file, source, work, options=None, on_merged=None):
+        """
+        Run `work()` as a queued restore job and return its result.
+
+        A merged submission does not call `work`; it returns
+        `on_merged(job)` for the job it joined (by default whether that
+        job completed).
+        """
+        job, merged = self.submit(backup_file, source, options)
+        if merged:
+            finished = self.wait_for(job['id'])
+            self.logger.info(f"Merged restore job {finished['id']} finished: {finished['status']}")
+            return on_merged(finished) if on_merged else finished['status'] == 'completed'
+
+        try:
+            self.wait_turn(job)
+        except BaseException:
+            self.cancel(job)
+            raise
+
+        success, message = False, None
+        try:
+            result = work()
+            success = bool(result[0] if isinstance(result, tuple) else result)
+            if isinstance(result, tuple) and len(result) > 1 and isinstance(result[1], str):
+                message = result[1]
+            return result
+        except BaseException as e:
+            message = str(e) or type(e).__name__
+            raise
+        finally:
+            self.finish(job, success, message)
+
+    def status(self):
+        """Running and queued jobs plus recent history, for polling"""
+        state = self._load()
+        self._prune(state)
+        return {
+            'running': next((job for job in state['jobs'] if job['status'] == 'running'), None),
+            'queued': [job for job in state['jobs'] if job['status'] == 'queued'],
+            'history': list(reversed(state['history'])),
+            'lock': self._read_lock()
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Show the restore queue')
+    parser.add_argument('--job', help='Show one job by id')
+    parser.add_argument('--json', action='store_true', help='Print raw JSON')
+    args = parser.parse_args()
+
+    from restore import DatabaseRestore
+    restore_tool = DatabaseRestore()
+    coordinator = RestoreCoordinator(restore_tool.restore_config['backup_path'], restore_tool.db_config)
+    status = coordinator.status()
+
+    if args.job:
+        jobs = ([status['running']] if status['running'] else []) + status['queued'] + status['history']
+        job = next((j for j in jobs if j['id'] == args.job), None)
+        if not job:
+            print(f"No restore job {args.job}")
+            sys.exit(1)
+        print(json.dumps(job, indent=2))
+        return
+    if args.json:
+        print(json.dumps(status, indent=2))
+        return
+
+    running = status['running']
+    print(f"Running: {running['id']} {running['backup_file']} ({running['source']}, since {running['started_at']})"
+          if running else "Running: none")
+    print(f"Queued:  {len(status['queued'])}")
+    for position, job in enumerate(status['queued'], 1):
+        print(f"  {position}. {job['id']} {job['backup_file']} ({job['source']})")
+    print("Recent:")
+    for job in status['history'][:5]:
+        print(f"  {job['id']} {job['status']:<9} {os.path.basename(job['backup_file'])} ({job['source']})")
+
+
+if __name__ == "__main__":
+    main()
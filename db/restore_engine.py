@@ -0,0 +1,674 @@
+#!/usr/bin/env python3
+"""
+In-Process SQL Restore Engine
+Loads plain-format pg_dump files over psycopg2 connections
+"""
+
+import os
+import time
+import logging
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import psycopg2
+from psycopg2 import errors, extensions, sql
+
+from archive_toc import is_archive
+from dump_io import open_dump
+from dump_index import DumpIndex
+from dump_parser import DumpParser, RangeReader, has_copy_data
+
+# Post-data entries are built in dependency waves: primary keys, unique
+# constraints and indexes first, then objects that rely on them
+POST_DATA_WAVES = [
+    {'CONSTRAINT', 'INDEX'},
+    {'FK CONSTRAINT', 'TRIGGER', 'INDEX ATTACH', 'RULE', 'POLICY', 'CHECK CONSTRAINT'}
+]
+
+
+class RestoreEngineError(Exception):
+    """Raised when a restore phase cannot be completed"""
+
+
+def connection_lost(conn, error):
+    """
+    True when a statement failed because the session is gone rather than
+    because of the statement; psql gives up in that case instead of going on
+    """
+    return isinstance(error, (psycopg2.OperationalError, psycopg2.InterfaceError)) or bool(conn.closed)
+
+
+class DeadlineReader:
+    """COPY source that stops the feed once the restore's deadline has passed"""
+
+    def __init__(self, source, check_deadline):
+        self.source = source
+        self.check_deadline = check_deadline
+
+    def read(self, size=-1):
+        self.check_deadline()
+        return self.source.read(size)
+
+    def readline(self, size=-1):
+        self.check_deadline()
+        return self.source.readline(size)
+
+    def __getattr__(self, name):
+        return getattr(self.source, name)
+
+
+class SqlRestoreEngine:
+    def __init__(self, db_config, logger=None, jobs=1, timeout=None, progress=None, checkpoint=None, tuning=None,
+                 schema_ready=False):
+        self.db_config = db_config
+        self.logger = logger or logging.getLogger(__name__)
+        self.jobs = max(1, int(jobs))
+        self.progress = progress
+        self.checkpoint = checkpoint
+        self.tuning = tuning
+        # The target was cloned from a schema template: pre-data is already applied
+        self.schema_ready = schema_ready
+        self._autovacuum_suspended = False
+        self.deadline = time.time() + timeout if timeout else None
+        self.session_sql = b''
+        self.table_stats = {}
+        self.statement_timings = []
+        self.phase_timings = {}
+        self.warnings = []
+        self._local = threading.local()
+        self._connections = []
+        self._executor = None
+        self._entry_spans = {}
+        self._lock = threading.Lock()
+
+    def connect(self):
+        """Open a connection with the dump's session settings applied"""
+        conn = psycopg2.connect(
+            host=self.db_config['host'],
+            port=self.db_config['port'],
+            dbname=self.db_config['database'],
+            user=self.db_config['user'],
+            password=self.db_config['password']
+        )
+        conn.autocommit = True
+        session_sql = self.session_sql + (self.tuning.session_sql() if self.tuning else b'')
+        if session_sql:
+            with conn.cursor() as cur:
+                cur.execute(session_sql)
+        return conn
+
+    def _worker_connection(self):
+        """Per-thread connection reused across the tasks a worker runs"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or conn.closed:
+            conn = self.connect()
+            self._local.conn = conn
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    def close(self):
+        with self._lock:
+            for conn in self._connections:
+                try:
+                    conn.close()
+                except Exception:
+                    pass
+            self._connections = []
+
+    def execute_entry(self, conn, entry):
+        """
+        Run the SQL of a non-data entry; returns whether it succeeded.
+
+        A failing statement is logged and skipped like psql does; a lost
+        connection raises RestoreEngineError.
+        """
+        if not entry.sql.strip():
+            return True
+        if has_copy_data(entry.sql):
+            # The rows would be sent as statements and the table left empty
+            raise RestoreEngineError(f"{entry.entry_type} {entry.name}: COPY data could not be streamed")
+        start = time.time()
+        try:
+            with conn.cursor() as cur:
+                cur.execute(entry.sql)
+            with self._lock:
+                self.statement_timings.append((entry.entry_type, entry.name, round(time.time() - start, 3)))
+            return True
+        except errors.DeadlockDetected:
+            raise
+        except psycopg2.Error as e:
+            message = f"{entry.entry_type} {entry.name}: {str(e).strip()}"
+            if connection_lost(conn, e):
+                raise RestoreEngineError(f"Connection lost during {message}") from e
+            self.logger.warning(f"Statement failed: {message}")
+            with self._lock:
+                self.warnings.append(message)
+            return False
+
+    def copy_entry(self, conn, entry, source):
+        """Stream one COPY block from `source` into the database"""
+        start = time.time()
+        # A single large table would otherwise run past the deadline, which
+        # is only checked between entries
+        feed = DeadlineReader(source, self._check_deadline) if self.deadline else source
+        with conn.cursor() as cur:
+            try:
+                cur.copy_expert(entry.copy_sql, feed)
+            except psycopg2.Error:
+                # psycopg2 turns the reader's error into a cancelled COPY
+                self._check_deadline()
+                raise
+            rows = cur.rowcount
+        stats = {
+            'rows': rows,
+            'bytes': entry.data_size
+        }
+        if entry.data_format == 'insert':
+            try:
+                stats['rows'] += self._run_fallback_inserts(conn, entry, source.fallback_sql)
+            finally:
+                # Released per entry rather than with the reader
+                source.fallback_sql.close()
+            stats['rewritten_inserts'] = source.rows_rewritten
+            stats['fallback_statements'] = len(source.fallback_sql)
+        duration = time.time() - start
+        stats['seconds'] = round(duration, 3)
+        with self._lock:
+            self.table_stats[entry.table] = stats
+        rewritten = " (rewritten from INSERT statements)" if entry.data_format == 'insert' else ""
+        self.logger.info(
+            f"Loaded {entry.table}: {stats['rows']:,} rows, {entry.data_size:,} bytes in {duration:.2f}s{rewritten}"
+        )
+        return stats
+
+    def _run_fallback_inserts(self, conn, entry, statements):
+        """
+        Execute the INSERTs of a rewritten entry that COPY could not take.
+
+        On an autocommit connection a failing statement is logged and
+        skipped, as psql would; inside a turbo load's BEGIN block each
+        statement runs under a savepoint so a failure does not abort the
+        table's transaction. Inside a table-load transaction it fails the
+        load so the transaction is not left aborted.
+        """
+        if not statements:
+            return 0
+        self.logger.info(f"Executing {len(statements):,} INSERT statements for {entry.table} that could not be rewritten")
+        in_block = conn.autocommit and conn.info.transaction_status != extensions.TRANSACTION_STATUS_IDLE
+        rows = 0
+        with conn.cursor() as cur:
+            for statement in statements:
+                try:
+                    if in_block:
+                        cur.execute("SAVEPOINT fallback_insert")
+                    cur.execute(statement)
+                    rows += max(cur.rowcount, 0)
+                    if in_block:
+                        cur.execute("RELEASE SAVEPOINT fallback_insert")
+                except psycopg2.Error as e:
+                    if not conn.autocommit or connection_lost(conn, e):
+                        raise
+                    if in_block:
+                        cur.execute("ROLLBACK TO SAVEPOINT fallback_insert")
+                    message = f"INSERT into {entry.table}: {str(e).strip()}"
+                    self.logger.warning(f"Statement failed: {message}")
+                    with self._lock:
+                        self.warnings.append(message)
+        return rows
+
+    def restore_stream(self, backup_file):
+        """
+        Restore a plain or gzip dump in a single pass over one connection.
+
+        DDL is executed as it is read and every COPY block is handed to
+        copy_expert as a view over the dump stream itself, so nothing is
+        buffered beyond the current line and gzip dumps need no temp file.
+        """
+        self.logger.info(f"Streaming restore from: {backup_file}")
+        phase = None
+        phase_start = time.time()
+
+        try:
+            with open_dump(backup_file, self.progress) as stream:
+                parser = DumpParser(stream)
+                self.session_sql = parser.session_sql
+                conn = self._worker_connection()
+                self._run_preamble(conn, parser.preamble_sql)
+
+                for entry in parser:
+                    self._check_deadline()
+                    if entry.section == 'skip' or self._already_restored(entry):
+                        continue
+                    if entry.section == 'pre-data' and self.schema_ready:
+                        self._mark_restored(entry)
+                        continue
+                    if entry.section != phase:
+                        if phase:
+                            self._finish_phase(phase, phase_start)
+                        if entry.section != 'pre-data':
+                            self._suspend_autovacuum()
+                        phase, phase_start = entry.section, time.time()
+                    if self.progress:
+                        self.progress.set_phase(entry.section, f"{entry.entry_type} {entry.table}")
+
+                    if entry.is_copy:
+                        self._reset_partial_table(conn, entry)
+                        self._copy_or_fail(conn, entry, entry.data)
+                    elif not self.execute_entry(conn, entry):
+                        # Not checkpointed, so a resumed restore tries it again
+                        continue
+                    self._mark_restored(entry)
+
+                if phase:
+                    self._finish_phase(phase, phase_start)
+        finally:
+            self._resume_autovacuum()
+            self.close()
+
+        return self.summary()
+
+    def restore_parallel(self, backup_file):
+        """
+        Restore a plain .sql dump using `jobs` worker connections.
+
+        The dump is indexed in one pass, pre-data runs on a single
+        connection, COPY blocks are loaded concurrently (largest first) by
+        seeking each worker's own file handle to the block, and post-data
+        objects are built in parallel dependency waves.
+        """
+        self.logger.info(f"Indexing dump sections: {backup_file}")
+        pre_data, data, post_data, copies, skipped = [], [], [], [], []
+
+        with open(backup_file, 'rb') as stream:
+            parser = DumpParser(stream)
+            self.session_sql = parser.session_sql
+            preamble_sql = parser.preamble_sql
+            for entry in parser:
+                if entry.section == 'skip':
+                    continue
+                if entry.is_copy:
+                    entry.data.drain()
+                if self._already_restored(entry):
+                    skipped.append(entry)
+                elif entry.section == 'pre-data' and self.schema_ready:
+                    self._mark_restored(entry)
+                    skipped.append(entry)
+                elif entry.is_copy:
+                    copies.append(entry)
+                elif entry.section == 'pre-data':
+                    pre_data.append(entry)
+                elif entry.section == 'data':
+                    data.append(entry)
+                else:
+                    post_data.append(entry)
+
+        self.logger.info(
+            f"Dump index: {len(pre_data)} pre-data, {len(copies)} COPY blocks, "
+            f"{len(post_data)} post-data entries; restoring with {self.jobs} jobs"
+        )
+
+        # Each entry accounts for the bytes up to the next one, so progress
+        # reaches the full file size once every entry has been restored
+        entries = sorted(pre_data + data + post_data + copies + skipped, key=lambda entry: entry.offset)
+        file_size = os.path.getsize(backup_file)
+        self._entry_spans = {
+            entry.dump_id: (entries[i + 1].offset if i + 1 < len(entries) else file_size) - entry.offset
+            for i, entry in enumerate(entries)
+        }
+        self._report_bytes(entries[0].offset if entries else file_size)
+        self._report_bytes(sum(self._entry_spans[entry.dump_id] for entry in skipped))
+
+        self._executor = ThreadPoolExecutor(max_workers=self.jobs)
+        try:
+            # Phase 1: pre-data on a single connection, in dump order
+            phase_start = time.time()
+            conn = self._worker_connection()
+            self._run_preamble(conn, preamble_sql)
+            for entry in pre_data:
+                self._check_deadline()
+                self._entry_done(entry, self.execute_entry(conn, entry))
+            self._finish_phase('pre-data', phase_start)
+            self._suspend_autovacuum()
+
+            # Phase 2: table data, largest blocks first across the workers
+            phase_start = time.time()
+            copies.sort(key=lambda entry: entry.data_size, reverse=True)
+            self._run_parallel(copies, self._load_copy_block, backup_file)
+            conn = self._worker_connection()
+            for entry in data:
+                self._entry_done(entry, self.execute_entry(conn, entry))
+            self._finish_phase('data', phase_start)
+
+            # Phase 3: post-data in dependency waves, the rest in dump order
+            phase_start = time.time()
+            remaining = list(post_data)
+            for wave_types in POST_DATA_WAVES:
+                wave = [entry for entry in remaining if entry.entry_type in wave_types]
+                remaining = [entry for entry in remaining if entry.entry_type not in wave_types]
+                self._run_parallel(wave, self._build_post_data)
+            conn = self._worker_connection()
+            for entry in remaining:
+                self._entry_done(entry, self.execute_entry(conn, entry))
+            self._finish_phase('post-data', phase_start)
+        finally:
+            self._executor.shutdown(wait=True)
+            self._resume_autovacuum()
+            self.close()
+
+        return self.summary()
+
+    def restore_schema(self, backup_file):
+        """
+        Run only the pre-data entries of a plain or gzip dump.
+
+        Builds the types, tables, sequences and functions with no rows,
+        indexes or constraints; reading stops where the data begins.
+        """
+        self.logger.info(f"Applying pre-data from: {backup_file}")
+        phase_start = time.time()
+        try:
+            with open_dump(backup_file) as stream:
+                parser = DumpParser(stream)
+                self.session_sql = parser.session_sql
+                conn = self._worker_connection()
+                for entry in parser.schema_entries():
+                    self.execute_entry(conn, entry)
+            self._finish_phase('pre-data', phase_start)
+        finally:
+            self.close()
+
+        return self.summary()
+
+    def restore_tables(self, backup_file, tables):
+        """
+        Replace the rows of selected tables with their contents in a backup.
+
+        Plain and gzip dumps are read through a cached DumpIndex, so only
+        the chosen COPY blocks are read; custom and directory archives are
+        filtered by pg_restore itself. All tables are replaced in a single
+        transaction with triggers and FK checks suspended, so other tables
+        are left untouched and a failure changes nothing.
+        """
+        phase_start = time.time()
+        try:
+            if is_archive(backup_file):
+                self._restore_archive_tables(backup_file, tables)
+            else:
+                self._restore_indexed_tables(backup_file, tables)
+        finally:
+            self._resume_autovacuum()
+        self._finish_phase('data', phase_start)
+        return self.summary()
+
+    def _restore_indexed_tables(self, backup_file, tables):
+        index = DumpIndex.load_or_build(backup_file, self.logger)
+        selected = []
+        for name in tables:
+            table = index.resolve(name)
+            if not table:
+                raise RestoreEngineError(f"Table {name} has no data in {backup_file}")
+            selected.append(index.entry(table))
+
+        # Ascending offsets keep gzip seeks moving forward
+        selected.sort(key=lambda entry: entry.data_offset)
+        if self.progress:
+            self.progress.total_bytes = sum(entry.data_size for entry in selected)
+
+        self.session_sql = index.session_sql
+        self._suspend_autovacuum([entry.table for entry in selected])
+        conn = self._table_load_connection()
+        try:
+            with open_dump(backup_file) as stream:
+                for entry in selected:
+                    self._check_deadline()
+                    if self.progress:
+                        self.progress.set_phase('data', f"TABLE DATA {entry.table}")
+                    self._replace_table(conn, entry, index.open_data(stream, entry))
+                    if self.progress:
+                        self.progress.advance(entry.data_size)
+            conn.commit()
+        finally:
+            conn.close()
+
+    def _restore_archive_tables(self, backup_file, tables):
+        cmd = ['pg_restore', '--data-only', '-f', '-']
+        for name in tables:
+            cmd.extend(['-t', name.split('.', 1)[-1]])
+        cmd.append(str(backup_file))
+
+        process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        # Read alongside stdout: a chatty pg_restore would block on a full stderr pipe
+        stderr_chunks = []
+        reader = threading.Thread(target=lambda: stderr_chunks.append(process.stderr.read()), daemon=True)
+        reader.start()
+        loaded = set()
+        try:
+            parser = DumpParser(process.stdout)
+            self.session_sql = parser.session_sql
+            conn = self._table_load_connection()
+            try:
+                for entry in parser:
+                    self._check_deadline()
+                    if not entry.is_copy:
+                        continue
+                    if self.progress:
+                        self.progress.set_phase('data', f"TABLE DATA {entry.table}")
+                    self._replace_table(conn, entry, entry.data)
+                    loaded.add(entry.table)
+
+                if process.wait() != 0:
+                    reader.join()
+                    error = b''.join(stderr_chunks).decode(errors='replace').strip()
+                    raise RestoreEngineError(f"pg_restore failed: {error}")
+                missing = [name for name in tables
+                           if name not in loaded and not any(table.split('.', 1)[-1] == name for table in loaded)]
+                if missing:
+                    raise RestoreEngineError(f"No data for {', '.join(missing)} in {backup_file}")
+                conn.commit()
+            finally:
+                conn.close()
+        finally:
+            if process.poll() is None:
+                process.kill()
+            process.wait()
+            reader.join()
+
+    def _table_load_connection(self):
+        """Transactional connection with triggers and FK checks suspended"""
+        conn = self.connect()
+        conn.autocommit = False
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SET LOCAL session_replication_role = replica")
+        except psycopg2.Error as e:
+            # Needs superuser; without it FK checks apply to the replaced rows
+            conn.rollback()
+            self.logger.warning(f"Could not suspend triggers for table restore: {str(e).strip()}")
+        return conn
+
+    def _replace_table(self, conn, entry, source):
+        schema, _, name = entry.table.rpartition('.')
+        target = sql.Identifier(schema, name) if schema else sql.Identifier(name)
+        with conn.cursor() as cur:
+            cur.execute(sql.SQL("DELETE FROM {}").format(target))
+            self.logger.info(f"Removed {cur.rowcount:,} existing rows from {entry.table}")
+        self._copy_or_fail(conn, entry, source)
+
+    def _run_preamble(self, conn, preamble_sql):
+        """Run the DROP statements a --clean dump emits before its first entry"""
+        if self.checkpoint and self.checkpoint.is_done('preamble'):
+            # Re-running the drops would throw away the work being resumed
+            return
+        # On a schema template clone the drops would remove the tables to load
+        if preamble_sql.strip() and not self.schema_ready:
+            with conn.cursor() as cur:
+                cur.execute(preamble_sql)
+        if self.checkpoint:
+            self.checkpoint.mark('preamble')
+
+    def _already_restored(self, entry):
+        """True for entries a resumed restore finished before it was interrupted"""
+        if not (self.checkpoint and self.checkpoint.is_done(entry.dump_id)):
+            return False
+        if entry.is_copy:
+            rows = self.checkpoint.tables.get(entry.table)
+            self.logger.info(f"Skipping {entry.table}: restored before interruption ({rows:,} rows)")
+        return True
+
+    def _mark_restored(self, entry):
+        if self.checkpoint:
+            rows = self.table_stats[entry.table]['rows'] if entry.is_copy else None
+            self.checkpoint.mark(entry.dump_id, entry.table if entry.is_copy else None, rows)
+
+    def _reset_partial_table(self, conn, entry):
+        """Empty a table a resumed restore may have part-loaded before the failure"""
+        if not (self.checkpoint and self.checkpoint.resumed):
+            return
+        schema, _, name = entry.table.rpartition('.')
+        target = sql.Identifier(schema, name) if schema else sql.Identifier(name)
+        with conn.cursor() as cur:
+            try:
+                cur.execute(sql.SQL("TRUNCATE ONLY {}").format(target))
+            except errors.FeatureNotSupported:
+                # Referenced by a foreign key (data-only dumps into a full schema)
+                cur.execute(sql.SQL("DELETE FROM ONLY {}").format(target))
+        self.logger.info(f"Cleared {entry.table} before loading")
+
+    def _check_deadline(self):
+        if self.deadline and time.time() > self.deadline:
+            raise RestoreEngineError("Restore operation timed out")
+
+    def _finish_phase(self, phase, phase_start):
+        duration = time.time() - phase_start
+        self.phase_timings[phase] = round(self.phase_timings.get(phase, 0) + duration, 3)
+        self.logger.info(f"{phase.capitalize()} completed in {duration:.2f}s")
+        if self.checkpoint:
+            self.checkpoint.mark_phase(phase)
+
+    def _copy_or_fail(self, conn, entry, source):
+        try:
+            self._run_data_statements(conn, entry, entry.pre_sql)
+            if self.tuning and self.tuning.turbo and conn.autocommit:
+                self._copy_into_new_relfilenode(conn, entry, source)
+            else:
+                self.copy_entry(conn, entry, source)
+            # Only complete once the rows have been read
+            self._run_data_statements(conn, entry, entry.post_sql)
+        except psycopg2.Error as e:
+            raise RestoreEngineError(f"COPY into {entry.table} failed: {str(e).strip()}")
+
+    def _run_data_statements(self, conn, entry, statements):
+        """
+        Run the statements around a data entry's rows.
+
+        Failures are logged like psql does on an autocommit connection;
+        inside a table-load transaction they fail the load.
+        """
+        if not statements.strip():
+            return
+        try:
+            with conn.cursor() as cur:
+                cur.execute(statements)
+        except psycopg2.Error as e:
+            if not conn.autocommit or connection_lost(conn, e):
+                raise
+            message = f"{entry.entry_type} {entry.table}: {str(e).strip()}"
+            self.logger.warning(f"Statement failed: {message}")
+            with self._lock:
+                self.warnings.append(message)
+
+    def _copy_into_new_relfilenode(self, conn, entry, source):
+        """
+        Truncate and load a table in one transaction (turbo mode).
+
+        TRUNCATE gives the table a new relfilenode, so with wal_level=minimal
+        the COPY into it is not WAL-logged; the file is synced at commit.
+        """
+        schema, _, name = entry.table.rpartition('.')
+        target = sql.Identifier(schema, name) if schema else sql.Identifier(name)
+        with conn.cursor() as cur:
+            cur.execute("BEGIN")
+            try:
+                cur.execute(sql.SQL("TRUNCATE ONLY {}").format(target))
+            except errors.FeatureNotSupported:
+                # Referenced by a foreign key; load it the ordinary way
+                cur.execute("ROLLBACK")
+                self.copy_entry(conn, entry, source)
+                return
+            try:
+                self.copy_entry(conn, entry, source)
+                cur.execute("COMMIT")
+            except Exception:
+                cur.execute("ROLLBACK")
+                raise
+            # COMMIT of an aborted transaction reports ROLLBACK instead of failing
+            if cur.statusmessage != 'COMMIT':
+                raise RestoreEngineError(f"Load of {entry.table} was rolled back")
+
+    def _suspend_autovacuum(self, tables=None):
+        # Once per restore, when the tables exist and data is about to load
+        if self.tuning and not self._autovacuum_suspended:
+            self.tuning.suspend_autovacuum(tables)
+            self._autovacuum_suspended = True
+
+    def _resume_autovacuum(self):
+        if self.tuning and self._autovacuum_suspended:
+            self.tuning.resume_autovacuum()
+            self._autovacuum_suspended = False
+
+    def _run_parallel(self, entries, task, *args):
+        if not entries:
+            return
+        futures = [self._executor.submit(task, entry, *args) for entry in entries]
+        for future in as_completed(futures):
+            future.result()
+
+    def _load_copy_block(self, entry, backup_file):
+        self._check_deadline()
+        conn = self._worker_connection()
+        self._reset_partial_table(conn, entry)
+        with open(backup_file, 'rb') as f:
+            self._copy_or_fail(conn, entry, entry.rows_reader(RangeReader(f, entry.data_offset, entry.data_size)))
+        self._entry_done(entry)
+
+    def _build_post_data(self, entry):
+        conn = self._worker_connection()
+        try:
+            restored = self.execute_entry(conn, entry)
+        except errors.DeadlockDetected:
+            # Two constraints locking the same pair of tables; retry once
+            # now that the competing statement has finished
+            self.logger.info(f"Deadlock building {entry.name}, retrying")
+            restored = self.execute_entry(conn, entry)
+        self._entry_done(entry, restored)
+
+    def _entry_done(self, entry, restored=True):
+        # Failed entries are left out of the checkpoint so --resume retries them
+        if restored:
+            self._mark_restored(entry)
+        self._report_bytes(self._entry_spans.get(entry.dump_id, 0), entry)
+
+    def _report_bytes(self, nbytes, entry=None):
+        if not self.progress:
+            return
+        with self._lock:
+            if entry:
+                self.progress.set_phase(entry.section, f"{entry.entry_type} {entry.table}")
+            self.progress.advance(nbytes)
+
+    def summary(self):
+        slowest = sorted(self.statement_timings, key=lambda timing: timing[2], reverse=True)[:5]
+        return {
+            'tables': self.table_stats,
+            'rows': sum(stats['rows'] for stats in self.table_stats.values()),
+            'bytes': sum(stats['bytes'] for stats in self.table_stats.values()),
+            'phases': self.phase_timings,
+            'slowest_statements': [
+                {'type': entry_type, 'name': name, 'seconds': seconds}
+                for entry_type, name, seconds in slowest
+            ],
+            'warnings': self.warnings
+        }
+
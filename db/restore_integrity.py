@@ -0,0 +1,378 @@
+#!/usr/bin/env python3
+"""
+Post-Restore Foreign Key Check
+Parallel anti-join orphan counts for every foreign key, with optional batched cleanup
+"""
+
+import sys
+import time
+import logging
+import argparse
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import psycopg2
+from psycopg2 import sql, errors
+
+# Child tables bigger than this many heap pages are checked in ctid ranges
+DEFAULT_CHUNK_PAGES = 2000
+DEFAULT_DELETE_BATCH = 5000
+ORPHAN_SAMPLE_SIZE = 5
+
+FOREIGN_KEYS_SQL = """
+    SELECT con.conname,
+           cn.nspname, c.relname,
+           pn.nspname, p.relname,
+           array_agg(ca.attname ORDER BY k.ord),
+           array_agg(pa.attname ORDER BY k.ord),
+           con.confdeltype,
+           pg_relation_size(c.oid) / current_setting('block_size')::int
+      FROM pg_constraint con
+      JOIN pg_class c ON c.oid = con.conrelid
+      JOIN pg_namespace cn ON cn.oid = c.relnamespace
+      JOIN pg_class p ON p.oid = con.confrelid
+      JOIN pg_namespace pn ON pn.oid = p.relnamespace
+     CROSS JOIN LATERAL unnest(con.conkey, con.confkey) WITH ORDINALITY AS k(child_att, parent_att, ord)
+      JOIN pg_attribute ca ON ca.attrelid = con.conrelid AND ca.attnum = k.child_att
+      JOIN pg_attribute pa ON pa.attrelid = con.confrelid AND pa.attnum = k.parent_att
+     WHERE con.contype = 'f'
+       AND cn.nspname NOT IN ('pg_catalog', 'information_schema')
+     GROUP BY con.oid, con.conname, cn.nspname, c.relname, pn.nspname, p.relname, c.oid
+     ORDER BY pg_relation_size(c.oid) DESC, con.conname
+"""
+
+ON_DELETE_ACTIONS = {'a': 'NO ACTION', 'r': 'RESTRICT', 'c': 'CASCADE', 'n': 'SET NULL', 'd': 'SET DEFAULT'}
+
+
+class ForeignKey:
+    """One foreign key constraint as read from pg_constraint"""
+
+    def __init__(self, name, child, parent, child_columns, parent_columns, on_delete, child_pages):
+        self.name = name
+        self.child = child
+        self.parent = parent
+        self.child_columns = list(child_columns)
+        self.parent_columns = list(parent_columns)
+        self.on_delete = ON_DELETE_ACTIONS.get(on_delete, on_delete)
+        self.child_pages = child_pages
+
+    @property
+    def child_table(self):
+        return '.'.join(self.child)
+
+    @property
+    def parent_table(self):
+        return '.'.join(self.parent)
+
+    @property
+    def key(self):
+        """Constraint names are only unique per table, so results are keyed by both"""
+        return f"{self.child_table}.{self.name}"
+
+    def orphan_condition(self):
+        """
+        Rows of the child (aliased `c`) whose key has no parent row.
+
+        Keys with a NULL column never reference anything (MATCH SIMPLE),
+        so they are not orphans. NOT EXISTS plans as an anti-join.
+        """
+        not_null = [sql.SQL("c.{} IS NOT NULL").format(sql.Identifier(col)) for col in self.child_columns]
+        join = [
+            sql.SQL("p.{} = c.{}").format(sql.Identifier(parent_col), sql.Identifier(child_col))
+            for child_col, parent_col in zip(self.child_columns, self.parent_columns)
+        ]
+        return sql.SQL("{} AND NOT EXISTS (SELECT 1 FROM {} p WHERE {})").format(
+            sql.SQL(" AND ").join(not_null),
+            sql.Identifier(*self.parent),
+            sql.SQL(" AND ").join(join)
+        )
+
+    def describe(self):
+        return (f"{self.child_table}({', '.join(self.child_columns)}) -> "
+                f"{self.parent_table}({', '.join(self.parent_columns)})")
+
+
+def parents_first(foreign_keys):
+    """
+    Tables ordered so every referenced table comes before its referencing ones.
+
+    Self references are ignored; tables caught in a reference cycle are
+    appended at the end in name order.
+    """
+    tables = set()
+    parents = defaultdict(set)
+    for fk in foreign_keys:
+        tables.update((fk.child_table, fk.parent_table))
+        if fk.child_table != fk.parent_table:
+            parents[fk.child_table].add(fk.parent_table)
+
+    ordered = []
+    ready = sorted(table for table in tables if not parents[table])
+    while ready:
+        table = ready.pop(0)
+        ordered.append(table)
+        for child in sorted(tables):
+            if table in parents[child]:
+                parents[child].discard(table)
+                if not parents[child] and child not in ordered and child not in ready:
+                    ready.append(child)
+    ordered.extend(sorted(tables - set(ordered)))
+    return ordered
+
+
+class ForeignKeyChecker:
+    """
+    Post-restore stage that finds rows pointing at missing parents.
+
+    Data-only dumps are taken with --disable-triggers, so loading one into
+    a schema whose parent tables do not hold the matching rows succeeds
+    without a single foreign key error. This stage reads every foreign key
+    from pg_constraint and counts the orphans of each with an anti-join,
+    spreading the work over `jobs` connections. Child tables larger than
+    `chunk_pages` heap pages are split into ctid ranges (TID range scans)
+    so one big table does not serialize the check.
+
+    With `delete_orphans` the orphans are then removed in batches of
+    `batch_size` rows, parent tables first, each batch in its own
+    transaction.
+    """
+
+    def __init__(self, db_config, logger=None, jobs=2, chunk_pages=DEFAULT_CHUNK_PAGES,
+                 batch_size=DEFAULT_DELETE_BATCH):
+        self.db_config = db_config
+        self.logger = logger or logging.getLogger(__name__)
+        self.jobs = max(1, int(jobs))
+        self.chunk_pages = max(1, int(chunk_pages))
+        self.batch_size = max(1, int(batch_size))
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+
+    def connect(self):
+        conn = psycopg2.connect(
+            host=self.db_config['host'],
+            port=self.db_config['port'],
+            dbname=self.db_config['database'],
+            user=self.db_config['user'],
+            password=self.db_config['password']
+        )
+        conn.autocommit = True
+        return conn
+
+    def _worker_connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or conn.closed:
+            conn = self.connect()
+            self._local.conn = conn
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    def close(self):
+        with self._lock:
+            for conn in self._connections:
+                try:
+                    conn.close()
+                except Exception:
+                    pass
+            self._connections = []
+
+    def load_foreign_keys(self, tables=None):
+        """Foreign keys of the database, limited to those touching `tables` when given"""
+        with self._worker_connection().cursor() as cur:
+            cur.execute(FOREIGN_KEYS_SQL)
+            foreign_keys = [
+                ForeignKey(name, (child_schema, child), (parent_schema, parent),
+                           child_columns, parent_columns, on_delete, pages)
+                for name, child_schema, child, parent_schema, parent,
+                child_columns, parent_columns, on_delete, pages in cur.fetchall()
+            ]
+        if tables:
+            wanted = {table if '.' in table else f"public.{table}" for table in tables}
+            foreign_keys = [fk for fk in foreign_keys
+                            if fk.child_table in wanted or fk.parent_table in wanted]
+        return foreign_keys
+
+    def chunks(self, fk):
+        """ctid page ranges covering the child table, or a single unbounded range"""
+        if fk.child_pages <= self.chunk_pages:
+            return [(None, None)]
+        ranges = [(start, start + self.chunk_pages) for start in range(0, fk.child_pages, self.chunk_pages)]
+        # Rows added after the size was read land past the last page
+        ranges[-1] = (ranges[-1][0], None)
+        return ranges
+
+    def _chunk_filter(self, chunk):
+        start, end = chunk
+        filters = []
+        if start:
+            filters.append(sql.SQL("c.ctid >= {}::tid").format(sql.Literal(f"({start},0)")))
+        if end is not None:
+            filters.append(sql.SQL("c.ctid < {}::tid").format(sql.Literal(f"({end},0)")))
+        return sql.SQL("").join(sql.SQL(" AND ") + f for f in filters)
+
+    def count_orphans(self, fk, chunk=(None, None)):
+        query = sql.SQL("SELECT count(*) FROM {} c WHERE {}{}").format(
+            sql.Identifier(*fk.child), fk.orphan_condition(), self._chunk_filter(chunk))
+        with self._worker_connection().cursor() as cur:
+            cur.execute(query)
+            return cur.fetchone()[0]
+
+    def sample_orphans(self, fk):
+        """A few orphaned keys, for the report"""
+        query = sql.SQL("SELECT DISTINCT {} FROM {} c WHERE {} LIMIT {}").format(
+            sql.SQL(", ").join(sql.SQL("c.{}").format(sql.Identifier(col)) for col in fk.child_columns),
+            sql.Identifier(*fk.child), fk.orphan_condition(), sql.Literal(ORPHAN_SAMPLE_SIZE))
+        with self._worker_connection().cursor() as cur:
+            cur.execute(query)
+            return [row[0] if len(row) == 1 else list(row) for row in cur.fetchall()]
+
+    def check(self, tables=None):
+        """Count orphans for every foreign key in parallel; returns a report"""
+        start = time.time()
+        foreign_keys = self.load_foreign_keys(tables)
+        tasks = [(fk, chunk) for fk in foreign_keys for chunk in self.chunks(fk)]
+
+        counts = defaultdict(int)
+        failed = {}
+        with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            futures = {executor.submit(self.count_orphans, fk, chunk): fk for fk, chunk in tasks}
+            for future in as_completed(futures):
+                fk = futures[future]
+                try:
+                    counts[fk.key] += future.result()
+                except psycopg2.Error as e:
+                    failed[fk.key] = str(e).strip()
+
+        constraints = []
+        for fk in foreign_keys:
+            result = {
+                'constraint': fk.name,
+                'child_table': fk.child_table,
+                'parent_table': fk.parent_table,
+                'columns': fk.child_columns,
+                'on_delete': fk.on_delete,
+                'chunks': len(self.chunks(fk)),
+                'orphans': counts[fk.key]
+            }
+            if fk.key in failed:
+                result['error'] = failed[fk.key]
+                self.logger.warning(f"Orphan check of {fk.describe()} failed: {failed[fk.key]}")
+            elif result['orphans']:
+                result['sample_keys'] = [str(key) for key in self.sample_orphans(fk)]
+                self.logger.warning(
+                    f"{result['orphans']:,} orphaned rows in {fk.describe()} "
+                    f"(e.g. {', '.join(result['sample_keys'])})"
+                )
+            constraints.append(result)
+
+        duration = time.time() - start
+        total = sum(result['orphans'] for result in constraints)
+        self.logger.info(
+            f"Checked {len(foreign_keys)} foreign keys ({len(tasks)} chunks, {self.jobs} connections) "
+            f"in {duration:.2f}s: {total:,} orphaned rows"
+        )
+        return {
+            'foreign_keys_checked': len(foreign_keys),
+            'chunks_checked': len(tasks),
+            'orphans': total,
+            'failed': sorted(failed),
+            'constraints': constraints,
+            'check_seconds': round(duration, 3),
+            'foreign_keys': foreign_keys
+        }
+
+    def delete_orphans(self, foreign_keys, report):
+        """
+        Delete orphaned rows in batches, parent tables first.
+
+        Removing an orphaned order cascades to its order_items where the
+        constraint says so; a NO ACTION / RESTRICT reference from another
+        table stops that constraint's cleanup and is reported instead.
+        """
+        start = time.time()
+        order = {table: position for position, table in enumerate(parents_first(foreign_keys))}
+        with_orphans = {(result['child_table'], result['constraint'])
+                        for result in report['constraints'] if result['orphans']}
+        targets = sorted((fk for fk in foreign_keys if (fk.child_table, fk.name) in with_orphans),
+                         key=lambda fk: (order.get(fk.child_table, len(order)), fk.name))
+
+        deleted = {}
+        blocked = {}
+        conn = self._worker_connection()
+        for fk in targets:
+            query = sql.SQL(
+                "DELETE FROM {table} WHERE ctid = ANY(ARRAY("
+                "SELECT c.ctid FROM {table} c WHERE {condition} LIMIT {batch}))"
+            ).format(table=sql.Identifier(*fk.child), condition=fk.orphan_condition(),
+                     batch=sql.Literal(self.batch_size))
+            deleted[fk.key] = 0
+            try:
+                while True:
+                    with conn.cursor() as cur:
+                        cur.execute(query)
+                        removed = cur.rowcount
+                    deleted[fk.key] += removed
+                    if removed < self.batch_size:
+                        break
+            except (errors.ForeignKeyViolation, errors.RestrictViolation) as e:
+                blocked[fk.key] = str(e).strip()
+                self.logger.warning(f"Could not delete all orphans of {fk.describe()}: {blocked[fk.key]}")
+            if deleted[fk.key]:
+                self.logger.info(f"Deleted {deleted[fk.key]:,} orphaned rows from {fk.child_table} ({fk.name})")
+
+        duration = time.time() - start
+        self.logger.info(f"Orphan cleanup removed {sum(deleted.values()):,} rows in {duration:.2f}s")
+        return {
+            'orphans_deleted': deleted,
+            'delete_blocked': blocked,
+            'delete_seconds': round(duration, 3)
+        }
+
+    def run(self, delete_orphans=False, tables=None):
+        """Check every foreign key and optionally remove the orphans found"""
+        try:
+            report = self.check(tables)
+            foreign_keys = report.pop('foreign_keys')
+            if delete_orphans and report['orphans']:
+                report.update(self.delete_orphans(foreign_keys, report))
+                # Cascades may have removed rows counted under other constraints
+                remaining = self.check(tables)
+                remaining.pop('foreign_keys')
+                report['orphans_remaining'] = remaining['orphans']
+        finally:
+            self.close()
+        return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Find (and optionally delete) rows with missing foreign key parents')
+    parser.add_argument('--tables', help='Comma-separated tables whose foreign keys to check (default: all)')
+    parser.add_argument('--jobs', type=int, default=2, help='Parallel connections')
+    parser.add_argument('--chunk-pages', type=int, default=DEFAULT_CHUNK_PAGES,
+                        help='Check child tables larger than this many pages in ctid ranges')
+    parser.add_argument('--delete', action='store_true', help='Delete orphaned rows after checking')
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_DELETE_BATCH, help='Rows deleted per transaction')
+    args = parser.parse_args()
+
+    from restore import DatabaseRestore
+    restore_tool = DatabaseRestore()
+    checker = ForeignKeyChecker(restore_tool.db_config, restore_tool.logger, jobs=args.jobs,
+                                chunk_pages=args.chunk_pages, batch_size=args.batch_size)
+    tables = [t.strip() for t in args.tables.split(',')] if args.tables else None
+    report = checker.run(delete_orphans=args.delete, tables=tables)
+
+    print(f"\n{'constraint':<40} {'child -> parent':<40} {'orphans':>10}")
+    for result in report['constraints']:
+        link = f"{result['child_table']} -> {result['parent_table']}"
+        print(f"{result['constraint']:<40} {link:<40} {result['orphans']:>10,}")
+    if args.delete:
+        print(f"\nDeleted: {sum(report.get('orphans_deleted', {}).values()):,} rows, "
+              f"remaining orphans: {report.get('orphans_remaining', 0):,}")
+    remaining = report.get('orphans_remaining', report['orphans'])
+    sys.exit(1 if remaining or report['failed'] else 0)
+
+
+if __name__ == "__main__":
+    main()
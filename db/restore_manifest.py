@@ -0,0 +1,381 @@
+#!/usr/bin/env python3
+"""
+Backup Manifests and Restore Verification
+Per-table row counts and content checksums captured at backup time and checked after restore
+"""
+
+import os
+import sys
+import json
+import time
+import logging
+import datetime
+import argparse
+import subprocess
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+MANIFEST_VERSION = 1
+MANIFEST_SUFFIX = '.manifest.json'
+
+# Row text (and so the checksum) must not depend on the session's settings
+CHECKSUM_SETTINGS = """
+    SET TimeZone = 'UTC';
+    SET DateStyle = 'ISO, MDY';
+    SET IntervalStyle = 'postgres';
+    SET extra_float_digits = 1;
+    SET bytea_output = 'hex';
+"""
+
+USER_TABLES_SQL = """
+    SELECT n.nspname, c.relname
+      FROM pg_class c
+      JOIN pg_namespace n ON n.oid = c.relnamespace
+     WHERE c.relkind IN ('r', 'p')
+       AND n.nspname NOT IN ('pg_catalog', 'information_schema')
+       AND n.nspname NOT LIKE 'pg_toast%%'
+     ORDER BY pg_relation_size(c.oid) DESC
+"""
+
+# Row estimates for the cheap check. The live-tuple counter follows every
+# insert and delete, so it is preferred; after a stats reset it reads 0 and
+# the planner's reltuples stands in. A table that was never analyzed
+# (reltuples -1) has no estimate (NULL) and is counted instead. Partitioned
+# parents have neither: their rows are checked through their partitions
+ESTIMATES_SQL = """
+    SELECT n.nspname || '.' || c.relname, c.relkind,
+           CASE WHEN s.n_live_tup > 0 OR s.n_tup_del > 0 THEN s.n_live_tup
+                WHEN c.reltuples >= 0 THEN c.reltuples::bigint END
+      FROM pg_class c
+      JOIN pg_namespace n ON n.oid = c.relnamespace
+      LEFT JOIN pg_stat_user_tables s ON s.relid = c.oid
+     WHERE c.relkind IN ('r', 'p')
+       AND n.nspname NOT IN ('pg_catalog', 'information_schema')
+       AND n.nspname NOT LIKE 'pg_toast%%'
+"""
+
+# Estimated row counts within this fraction (or a few rows) count as a match
+ESTIMATE_TOLERANCE = 0.1
+ESTIMATE_SLACK_ROWS = 10
+
+
+def manifest_path(backup_file):
+    return f"{str(backup_file).rstrip(os.sep)}{MANIFEST_SUFFIX}"
+
+
+def load_manifest(backup_file):
+    """Manifest stored next to `backup_file`, or None"""
+    try:
+        with open(manifest_path(backup_file), 'r') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return manifest if manifest.get('version') == MANIFEST_VERSION else None
+
+
+def save_manifest(manifest, backup_file):
+    path = manifest_path(backup_file)
+    temp_file = f"{path}.tmp"
+    with open(temp_file, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(temp_file, path)
+    return path
+
+
+class RestoreManifest:
+    """
+    Captures and checks per-table manifests.
+
+    A manifest records, for every user table, its row count and an
+    order-independent checksum: the sum of a 64-bit hash of each row's
+    text. Checks run in parallel over a small connection pool. The fast
+    mode compares planner row estimates from a single catalog query,
+    counting only tables that were never analyzed; the exact mode
+    recounts and re-hashes every table.
+    """
+
+    def __init__(self, db_config, logger=None, jobs=4):
+        self.db_config = db_config
+        self.logger = logger or logging.getLogger(__name__)
+        self.jobs = max(1, int(jobs))
+        self._pool = None
+
+    def _open_pool(self):
+        # Imported here so restore.py can load manifests without psycopg2
+        from psycopg2 import pool
+        self._pool = pool.ThreadedConnectionPool(
+            1, self.jobs,
+            host=self.db_config['host'],
+            port=self.db_config['port'],
+            dbname=self.db_config['database'],
+            user=self.db_config['user'],
+            password=self.db_config['password']
+        )
+
+    def _close_pool(self):
+        if self._pool:
+            self._pool.closeall()
+            self._pool = None
+
+    def _run(self, work, snapshot=None):
+        """Run `work(cursor)` on a pooled connection, inside `snapshot` if given"""
+        conn = self._pool.getconn()
+        try:
+            conn.autocommit = False
+            with conn.cursor() as cur:
+                if snapshot:
+                    cur.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ, READ ONLY")
+                    cur.execute("SET TRANSACTION SNAPSHOT %s", (snapshot,))
+                cur.execute(CHECKSUM_SETTINGS)
+                return work(cur)
+        finally:
+            conn.rollback()
+            self._pool.putconn(conn)
+
+    def list_tables(self, snapshot=None):
+        def work(cur):
+            cur.execute(USER_TABLES_SQL)
+            return [f"{schema}.{name}" for schema, name in cur.fetchall()]
+        return self._run(work, snapshot)
+
+    def table_summary(self, table, snapshot=None):
+        """Exact (row count, checksum) of one table"""
+        from psycopg2 import sql
+        schema, _, name = table.partition('.')
+
+        def work(cur):
+            cur.execute(sql.SQL(
+                "SELECT count(*), coalesce(sum(hashtextextended(t::text, 0)), 0)::text FROM {} t"
+            ).format(sql.Identifier(schema, name)))
+            rows, checksum = cur.fetchone()
+            return {'rows': rows, 'checksum': checksum}
+        return self._run(work, snapshot)
+
+    def _summarize_tables(self, tables, snapshot=None):
+        import psycopg2
+        results, errors = {}, {}
+        with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            futures = {executor.submit(self.table_summary, table, snapshot): table for table in tables}
+            for future in as_completed(futures):
+                try:
+                    results[futures[future]] = future.result()
+                except psycopg2.Error as e:
+                    errors[futures[future]] = str(e).strip()
+        return results, errors
+
+    def capture(self, snapshot=None, tables=None):
+        """
+        Build a manifest of the current database (or of an exported snapshot,
+        so it matches a pg_dump run with --snapshot exactly).
+
+        `tables` limits the (full-scan) capture to those tables.
+        """
+        start = time.time()
+        self._open_pool()
+        try:
+            tables = self.list_tables(snapshot) if tables is None else list(tables)
+            results, errors = self._summarize_tables(tables, snapshot)
+        finally:
+            self._close_pool()
+        if errors:
+            raise RuntimeError("Manifest capture failed: " + '; '.join(f"{t}: {e}" for t, e in errors.items()))
+
+        duration = time.time() - start
+        self.logger.info(f"Captured manifest of {len(results)} tables in {duration:.2f}s")
+        return {
+            'version': MANIFEST_VERSION,
+            'database': self.db_config['database'],
+            'captured_at': datetime.datetime.now().isoformat(),
+            'snapshot': snapshot,
+            'capture_seconds': round(duration, 3),
+            'tables': {table: results[table] for table in tables}
+        }
+
+    def verify(self, manifest, mode='fast', tables=None):
+        """
+        Compare the database with `manifest`; returns a report dict with `ok`.
+
+        `tables` limits the check to a selective restore's tables.
+        """
+        start = time.time()
+        expected = manifest['tables']
+        if tables:
+            expected = {table: info for table, info in expected.items()
+                        if table in tables or table.split('.', 1)[-1] in tables}
+
+        self._open_pool()
+        try:
+            present = set(self.list_tables())
+            missing = [table for table in expected if table not in present]
+            checked = [table for table in expected if table in present]
+            if mode == 'exact':
+                mismatches = self._verify_exact(expected, checked)
+            else:
+                mismatches = self._verify_estimates(expected, checked)
+        finally:
+            self._close_pool()
+
+        report = {
+            'mode': mode,
+            'ok': not missing and not mismatches,
+            'tables_checked': len(checked),
+            'missing_tables': missing,
+            'mismatches': mismatches,
+            'seconds': round(time.time() - start, 3)
+        }
+        if report['ok']:
+            self.logger.info(f"Manifest verification ({mode}) passed: {len(checked)} tables in {report['seconds']:.2f}s")
+        else:
+            for table in missing:
+                self.logger.error(f"Manifest verification: table {table} is missing")
+            for mismatch in mismatches:
+                self.logger.error(f"Manifest verification: {mismatch['table']} - {mismatch['reason']}")
+        return report
+
+    def _verify_exact(self, expected, tables):
+        results, errors = self._summarize_tables(tables)
+        mismatches = [{'table': table, 'reason': f"check failed: {error}"} for table, error in errors.items()]
+        for table, actual in results.items():
+            want = expected[table]
+            if actual['rows'] != want['rows']:
+                reason = f"expected {want['rows']:,} rows, found {actual['rows']:,}"
+            elif want.get('checksum') is not None and actual['checksum'] != want['checksum']:
+                # Incremental backups record some tables by row count only
+                reason = "row contents differ (checksum mismatch)"
+            else:
+                continue
+            mismatches.append({
+                'table': table,
+                'reason': reason,
+                'expected_rows': want['rows'],
+                'actual_rows': actual['rows']
+            })
+        return mismatches
+
+    def row_count(self, table):
+        """Exact row count of one table"""
+        from psycopg2 import sql
+        schema, _, name = table.partition('.')
+
+        def work(cur):
+            cur.execute(sql.SQL("SELECT count(*) FROM {}").format(sql.Identifier(schema, name)))
+            return cur.fetchone()[0]
+        return self._run(work)
+
+    def _verify_estimates(self, expected, tables):
+        def work(cur):
+            cur.execute(ESTIMATES_SQL)
+            return {table: (relkind, estimate) for table, relkind, estimate in cur.fetchall()}
+        estimates = self._run(work)
+
+        mismatches = []
+        for table in tables:
+            want = expected[table]['rows']
+            relkind, estimate = estimates.get(table, ('r', None))
+            if relkind == 'p':
+                continue
+            if estimate is None:
+                estimate = self.row_count(table)
+            if abs(estimate - want) > max(want * ESTIMATE_TOLERANCE, ESTIMATE_SLACK_ROWS):
+                mismatches.append({
+                    'table': table,
+                    'reason': f"expected {want:,} rows, estimate is {estimate:,}",
+                    'expected_rows': want,
+                    'actual_rows': estimate
+                })
+        return mismatches
+
+
+def dump_with_manifest(db_config, pg_dump_cmd, backup_file, logger=None, jobs=4, timeout=None, runner=None):
+    """
+    Run `pg_dump_cmd` and capture the manifest from the same snapshot.
+
+    The snapshot is exported from a transaction held open for the whole
+    dump, so the manifest describes exactly the data in the backup even
+    while the application keeps writing. `runner(cmd, env)` runs pg_dump
+    instead of subprocess.run when its output has to be piped somewhere.
+    Returns the pg_dump result.
+    """
+    import psycopg2
+    logger = logger or logging.getLogger(__name__)
+    conn = psycopg2.connect(
+        host=db_config['host'],
+        port=db_config['port'],
+        dbname=db_config['database'],
+        user=db_config['user'],
+        password=db_config['password']
+    )
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ, READ ONLY")
+            cur.execute("SELECT pg_export_snapshot()")
+            snapshot = cur.fetchone()[0]
+
+        env = os.environ.copy()
+        env['PGPASSWORD'] = db_config['password']
+        cmd = pg_dump_cmd + [f'--snapshot={snapshot}']
+        if runner:
+            result = runner(cmd, env)
+        else:
+            result = subprocess.run(cmd, env=env, capture_output=True, text=True, timeout=timeout)
+        if result.returncode == 0:
+            try:
+                manifest = RestoreManifest(db_config, logger, jobs).capture(snapshot)
+                logger.info(f"Manifest saved: {save_manifest(manifest, backup_file)}")
+            except (psycopg2.Error, RuntimeError, OSError) as e:
+                # The backup is still good; it just verifies the old way
+                logger.warning(f"Could not capture backup manifest: {e}")
+        return result
+    finally:
+        conn.rollback()
+        conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Capture or verify backup manifests')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    capture = subparsers.add_parser('capture', help='Write a manifest of the current database for a backup')
+    capture.add_argument('backup_file')
+    capture.add_argument('--snapshot', help='Exported snapshot the backup was taken from')
+
+    verify = subparsers.add_parser('verify', help='Check the database against a backup manifest')
+    verify.add_argument('backup_file')
+    verify.add_argument('--exact', action='store_true', help='Recount and checksum every table')
+    verify.add_argument('--tables', help='Comma-separated tables to check')
+
+    dump = subparsers.add_parser('dump', help='Run pg_dump and capture its manifest from the same snapshot')
+    dump.add_argument('backup_file')
+    dump.add_argument('pg_dump_args', nargs=argparse.REMAINDER, help='Arguments for pg_dump (after --)')
+
+    for sub in (capture, verify, dump):
+        sub.add_argument('--jobs', type=int, default=4, help='Connections in the pool (default: 4)')
+    args = parser.parse_args()
+
+    # Connection settings and logging as configured for the restore tools
+    from restore import DatabaseRestore
+    restore_tool = DatabaseRestore()
+    db_config = restore_tool.db_config
+    tool = RestoreManifest(db_config, restore_tool.logger, jobs=args.jobs)
+
+    if args.command == 'capture':
+        manifest = tool.capture(args.snapshot)
+        print(f"Manifest saved: {save_manifest(manifest, args.backup_file)}")
+    elif args.command == 'verify':
+        manifest = load_manifest(args.backup_file)
+        if not manifest:
+            print(f"No manifest found for {args.backup_file}")
+            sys.exit(1)
+        tables = args.tables.split(',') if args.tables else None
+        report = tool.verify(manifest, 'exact' if args.exact else 'fast', tables)
+        print(json.dumps(report, indent=2))
+        sys.exit(0 if report['ok'] else 1)
+    else:
+        pg_dump_args = [arg for arg in args.pg_dump_args if arg != '--']
+        result = dump_with_manifest(db_config, ['pg_dump'] + pg_dump_args, args.backup_file,
+                                    restore_tool.logger, jobs=args.jobs)
+        sys.stderr.write(result.stderr)
+        sys.exit(result.returncode)
+
+
+if __name__ == "__main__":
+    main()
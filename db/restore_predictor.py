@@ -0,0 +1,298 @@
+#!/usr/bin/env python3
+"""
+Restore Duration Predictor
+Fits restore time against backup size, format and job count from past restore metadata
+"""
+
+import os
+import sys
+import json
+import math
+import argparse
+import logging
+import statistics
+from pathlib import Path
+
+from archive_toc import archive_size, is_directory_archive, recommended_jobs
+from parallel_export import is_copy_export
+from incremental_backup import is_incremental
+from chunk_store import CHUNK_LIST_SUFFIX
+
+# Fewer samples than this of the same format and engine widen the match
+MIN_SAMPLES = 3
+# Timeout = prediction x factor + slack, but never below the floor
+TIMEOUT_FACTOR = 3
+TIMEOUT_SLACK_SECONDS = 60
+MIN_TIMEOUT_SECONDS = 300
+# More jobs are only recommended while they still save this fraction
+JOBS_GAIN_THRESHOLD = 0.05
+
+MB = 1024 * 1024
+
+
+def backup_format(backup_file):
+    """Format name as used by the backup listing"""
+    backup_file = str(backup_file)
+    if is_copy_export(backup_file):
+        return 'copy_export'
+    if is_incremental(backup_file):
+        return 'incremental'
+    if backup_file.endswith(CHUNK_LIST_SUFFIX):
+        return 'chunked_sql'
+    if is_directory_archive(backup_file):
+        return 'directory'
+    if backup_file.endswith('.backup'):
+        return 'custom'
+    if backup_file.endswith(('.gz', '.zst')):
+        return 'compressed_sql'
+    return 'plain_sql'
+
+
+def supports_jobs(fmt, engine):
+    """Whether the restore method for this format spreads work over several jobs"""
+    return (fmt in ('custom', 'directory', 'copy_export', 'incremental')
+            or (fmt == 'plain_sql' and engine == 'parallel'))
+
+
+def _solve(matrix, vector):
+    """Solve a small linear system by Gaussian elimination; None if singular"""
+    n = len(vector)
+    rows = [list(matrix[i]) + [vector[i]] for i in range(n)]
+    for col in range(n):
+        pivot = max(range(col, n), key=lambda r: abs(rows[r][col]))
+        if abs(rows[pivot][col]) < 1e-12:
+            return None
+        rows[col], rows[pivot] = rows[pivot], rows[col]
+        for r in range(n):
+            if r != col:
+                factor = rows[r][col] / rows[col][col]
+                rows[r] = [a - factor * b for a, b in zip(rows[r], rows[col])]
+    return [rows[i][n] / rows[i][i] for i in range(n)]
+
+
+def least_squares(features, targets):
+    """Coefficients minimizing the squared error of features . x = targets"""
+    width = len(features[0])
+    normal = [[sum(f[i] * f[j] for f in features) for j in range(width)] for i in range(width)]
+    rhs = [sum(f[i] * t for f, t in zip(features, targets)) for i in range(width)]
+    return _solve(normal, rhs)
+
+
+class RestorePredictor:
+    """
+    Predicts how long a restore will take from the restores that came before.
+
+    Every restore leaves a restore_<timestamp>.json in the backup directory
+    with its duration; backup size, format, engine and job count come from
+    the same file, or for older files from the backup itself or the backup
+    registry. Successful full restores are fitted with the simplest model
+    the history supports:
+
+        seconds = a + b * MB + c * MB / jobs   (several job counts seen)
+        seconds = a + b * MB                   (several sizes seen)
+        seconds = MB * median seconds per MB   (anything less)
+
+    using only restores of the same format and engine when there are
+    enough of them.
+    """
+
+    def __init__(self, backup_path, logger=None):
+        self.backup_path = backup_path
+        self.logger = logger or logging.getLogger(__name__)
+        self._history = None
+
+    def catalog_sizes(self):
+        """Backup sizes by file name from backup_registry.json and backup metadata files"""
+        sizes = {}
+        registry_file = os.path.join(self.backup_path, 'backup_registry.json')
+        try:
+            with open(registry_file, 'r', encoding='utf-8-sig') as f:
+                registry = json.load(f)
+            # The scheduled task writes a single object, the Node scheduler a list
+            for entry in registry if isinstance(registry, list) else [registry]:
+                name = entry.get('filename') or os.path.basename(entry.get('filepath', ''))
+                if name and entry.get('size'):
+                    sizes[name] = entry['size']
+        except (OSError, ValueError, AttributeError):
+            pass
+
+        for metadata_file in Path(self.backup_path).glob('*.json'):
+            if metadata_file.name.startswith(('restore_', 'backup_registry')):
+                continue
+            try:
+                with open(metadata_file, 'r') as f:
+                    metadata = json.load(f)
+                name = metadata.get('backup_file') or metadata.get('filename')
+                size = metadata.get('file_size') or metadata.get('size')
+                if name and size:
+                    sizes.setdefault(os.path.basename(name), size)
+            except (OSError, ValueError, AttributeError):
+                continue
+        return sizes
+
+    def load_history(self):
+        """Samples of successful full restores: dicts with size, format, engine, jobs, seconds"""
+        if self._history is not None:
+            return self._history
+
+        sizes = self.catalog_sizes()
+        history = []
+        for metadata_file in sorted(Path(self.backup_path).glob('restore_2*.json')):
+            try:
+                with open(metadata_file, 'r') as f:
+                    metadata = json.load(f)
+            except (OSError, ValueError):
+                continue
+            if not metadata.get('success') or metadata.get('mode') == 'tables' or metadata.get('resumed'):
+                continue
+            backup_file = metadata.get('backup_file') or ''
+            size = metadata.get('backup_size') or sizes.get(os.path.basename(backup_file))
+            if not size and backup_file and os.path.exists(backup_file):
+                size = archive_size(backup_file)
+            seconds = metadata.get('duration_seconds')
+            if not size or not seconds:
+                continue
+
+            fmt = metadata.get('backup_format') or backup_format(backup_file)
+            # Older metadata only names the engine for native/parallel SQL restores
+            engine = metadata.get('engine') or ('pg_restore' if fmt in ('custom', 'directory') else 'psql')
+            history.append({
+                'backup_file': backup_file,
+                'size_mb': size / MB,
+                'format': fmt,
+                'engine': engine,
+                'jobs': metadata.get('jobs') or 1,
+                'seconds': seconds
+            })
+        self._history = history
+        return history
+
+    def samples_for(self, fmt, engine):
+        """Most specific set of past restores with enough samples to fit"""
+        history = self.load_history()
+        for match in (lambda s: s['format'] == fmt and s['engine'] == engine,
+                      lambda s: s['format'] == fmt,
+                      lambda s: True):
+            samples = [s for s in history if match(s)]
+            if len(samples) >= MIN_SAMPLES:
+                return samples
+        return history
+
+    def fit(self, samples):
+        """(model name, coefficients) for the richest model the samples support"""
+        if not samples:
+            return None, None
+        targets = [s['seconds'] for s in samples]
+
+        def non_negative(terms):
+            # A negative fixed overhead is noise; refit through the origin then
+            coefficients = least_squares([[1.0] + terms(s) for s in samples], targets)
+            if coefficients and coefficients[0] < 0:
+                coefficients = least_squares([terms(s) for s in samples], targets)
+                coefficients = [0.0] + coefficients if coefficients else None
+            if coefficients and all(c >= 0 for c in coefficients):
+                return coefficients
+            return None
+
+        if len({s['jobs'] for s in samples}) > 1 and len(samples) >= 4:
+            coefficients = non_negative(lambda s: [s['size_mb'], s['size_mb'] / s['jobs']])
+            if coefficients:
+                return 'size+jobs', coefficients
+
+        if len({round(s['size_mb'], 1) for s in samples}) > 1:
+            coefficients = non_negative(lambda s: [s['size_mb']])
+            if coefficients:
+                return 'size', coefficients + [0.0]
+
+        rate = statistics.median(s['seconds'] / s['size_mb'] for s in samples if s['size_mb'])
+        return 'throughput', [0.0, rate, 0.0]
+
+    @staticmethod
+    def estimate(coefficients, size_mb, jobs):
+        a, b, c = coefficients
+        return a + b * size_mb + c * size_mb / max(1, jobs)
+
+    def recommend_jobs(self, model, coefficients, size_mb, fmt, engine):
+        """Fewest jobs within a few percent of the fastest predicted restore"""
+        if not supports_jobs(fmt, engine):
+            return 1
+        max_jobs = recommended_jobs()
+        if model != 'size+jobs':
+            return max_jobs
+        predictions = {jobs: self.estimate(coefficients, size_mb, jobs) for jobs in range(1, max_jobs + 1)}
+        best = min(predictions.values())
+        return min(jobs for jobs, seconds in predictions.items()
+                   if seconds <= best * (1 + JOBS_GAIN_THRESHOLD))
+
+    def predict(self, backup_file, engine=None, jobs=None):
+        """
+        Expected duration, recommended jobs and timeout for restoring `backup_file`.
+
+        Returns None when there is no usable restore history.
+        """
+        fmt = backup_format(backup_file)
+        if fmt in ('copy_export', 'incremental'):
+            engine = fmt
+        elif engine is None or fmt in ('custom', 'directory'):
+            engine = 'pg_restore' if fmt in ('custom', 'directory') else (engine or 'native')
+        size_mb = archive_size(backup_file) / MB
+
+        samples = self.samples_for(fmt, engine)
+        model, coefficients = self.fit(samples)
+        if not model:
+            return None
+
+        best_jobs = self.recommend_jobs(model, coefficients, size_mb, fmt, engine)
+        run_jobs = (jobs or best_jobs) if supports_jobs(fmt, engine) else 1
+        expected = max(1.0, self.estimate(coefficients, size_mb, run_jobs))
+        residuals = [s['seconds'] - self.estimate(coefficients, s['size_mb'], s['jobs']) for s in samples]
+        rmse = math.sqrt(sum(r * r for r in residuals) / len(residuals))
+        timeout = max(MIN_TIMEOUT_SECONDS, expected * TIMEOUT_FACTOR + TIMEOUT_SLACK_SECONDS, expected + 4 * rmse)
+
+        return {
+            'backup_size_mb': round(size_mb, 2),
+            'format': fmt,
+            'engine': engine,
+            'jobs': run_jobs,
+            'expected_seconds': round(expected, 1),
+            'error_seconds': round(rmse, 1),
+            'recommended_jobs': best_jobs,
+            'timeout_seconds': int(math.ceil(timeout)),
+            'model': model,
+            'samples': len(samples)
+        }
+
+    def describe(self, prediction):
+        """One-line summary for the console and log"""
+        return (f"Expected restore duration: ~{prediction['expected_seconds']:.0f}s "
+                f"(±{prediction['error_seconds']:.0f}s, {prediction['model']} model over "
+                f"{prediction['samples']} past restores); recommended --jobs {prediction['recommended_jobs']}; "
+                f"timeout {prediction['timeout_seconds'] / 60:.1f} min")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Predict how long restoring a backup will take')
+    parser.add_argument('backup_file', help='Backup to predict for')
+    parser.add_argument('--engine', choices=['native', 'parallel', 'psql'], default='native',
+                        help='SQL restore engine that will be used')
+    parser.add_argument('--jobs', type=int, help='Jobs the restore will run with (default: recommended)')
+    parser.add_argument('--backup-path', help='Directory holding restore_*.json files (default: BACKUP_PATH)')
+    args = parser.parse_args()
+
+    if args.backup_path:
+        backup_path = args.backup_path
+    else:
+        from restore import DatabaseRestore
+        backup_path = DatabaseRestore().restore_config['backup_path']
+
+    predictor = RestorePredictor(backup_path)
+    prediction = predictor.predict(args.backup_file, engine=args.engine, jobs=args.jobs)
+    if not prediction:
+        print(f"No successful restores recorded in {backup_path} yet - nothing to predict from")
+        sys.exit(1)
+    print(predictor.describe(prediction))
+    print(json.dumps(prediction, indent=2))
+
+
+if __name__ == "__main__":
+    main()
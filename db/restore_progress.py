@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+"""
+Restore Progress Tracking
+Byte and TOC-item based progress, ETA and bounded output buffering for restores
+"""
+
+import os
+import re
+import json
+import time
+import datetime
+from collections import deque
+
+# pg_restore --verbose reports every TOC entry it handles: "processing item"
+# in serial phases and "finished item" from parallel workers
+ITEM_PATTERN = re.compile(r'^pg_restore: (?:processing|finished) item (\d+) (.+)$')
+OBJECT_PATTERN = re.compile(r'^pg_restore: (creating (\S+(?: \S+)?) "(.+)"|processing data for table "(.+)"|executing (.+))$')
+ERROR_PATTERN = re.compile(r'(^pg_restore: error:|^psql:.*ERROR:|^ERROR:)')
+
+POST_DATA_OBJECTS = ('INDEX', 'CONSTRAINT', 'FK CONSTRAINT', 'TRIGGER', 'RULE', 'POLICY')
+
+
+class RestoreProgress:
+    """
+    Tracks how far a restore has got and how long it has left.
+
+    Progress is measured in bytes consumed from the dump when the restore
+    reads it through Python, or in archive TOC items for pg_restore. Output
+    lines are kept in a ring buffer so memory stays bounded no matter how
+    verbose the restore is, and snapshots are written to a JSON state file
+    (at most once per `emit_interval`) for the API and other callers.
+    """
+
+    def __init__(self, backup_file, total_bytes=None, total_items=None, state_file=None,
+                 callback=None, logger=None, buffer_lines=200, emit_interval=1.0):
+        self.backup_file = backup_file
+        self.total_bytes = total_bytes
+        self.total_items = total_items
+        self.state_file = state_file
+        self.callback = callback
+        self.logger = logger
+        self.emit_interval = emit_interval
+
+        self.bytes_done = 0
+        self.items_done = 0
+        self.errors = 0
+        self.phase = 'starting'
+        self.current_object = None
+        self.status = 'running'
+        self.started = time.time()
+        self.lines = deque(maxlen=buffer_lines)
+        self._seen_item_lines = False
+        self._last_emit = 0
+        self._last_logged_percent = -10
+
+    def advance(self, nbytes):
+        """Record bytes consumed from the dump file"""
+        self.bytes_done += nbytes
+        self._maybe_emit()
+
+    def set_phase(self, phase, current_object=None):
+        self.phase = phase
+        if current_object:
+            self.current_object = current_object
+        self._maybe_emit()
+
+    def record_line(self, line):
+        """Buffer one line of restore output and turn it into a progress event"""
+        line = line.rstrip()
+        if not line:
+            return
+        self.lines.append(line)
+
+        if ERROR_PATTERN.search(line):
+            self.errors += 1
+            if self.logger:
+                self.logger.warning(line)
+
+        item = ITEM_PATTERN.match(line)
+        if item:
+            self._seen_item_lines = True
+            self.items_done += 1
+            self.current_object = item.group(2)
+        else:
+            event = OBJECT_PATTERN.match(line)
+            if event:
+                # Older pg_restore versions only print the object lines
+                if not self._seen_item_lines:
+                    self.items_done += 1
+                if event.group(2):
+                    self.current_object = f"{event.group(2)} {event.group(3)}"
+                    self.phase = 'post-data' if event.group(2) in POST_DATA_OBJECTS else 'pre-data'
+                elif event.group(4):
+                    self.current_object = f"TABLE DATA {event.group(4)}"
+                    self.phase = 'data'
+                else:
+                    self.current_object = event.group(5)
+
+        self._maybe_emit()
+
+    @property
+    def percent(self):
+        if self.status == 'completed':
+            return 100.0
+        if self.total_bytes:
+            done, total = self.bytes_done, self.total_bytes
+        elif self.total_items:
+            done, total = self.items_done, self.total_items
+        else:
+            return None
+        # Never report 100% before the restore has actually finished
+        return min(99.9, round(done * 100.0 / total, 1)) if total else None
+
+    @property
+    def eta_seconds(self):
+        percent = self.percent
+        if not percent or self.status != 'running':
+            return None
+        elapsed = time.time() - self.started
+        return round(elapsed * (100.0 - percent) / percent, 1)
+
+    def tail(self, count=20):
+        """The most recent output lines, oldest first"""
+        return list(self.lines)[-count:]
+
+    def snapshot(self):
+        return {
+            'backup_file': self.backup_file,
+            'status': self.status,
+            'phase': self.phase,
+            'current_object': self.current_object,
+            'percent': self.percent,
+            'eta_seconds': self.eta_seconds,
+            'elapsed_seconds': round(time.time() - self.started, 1),
+            'bytes_done': self.bytes_done,
+            'total_bytes': self.total_bytes,
+            'items_done': self.items_done,
+            'total_items': self.total_items,
+            'errors': self.errors,
+            'recent_output': self.tail(),
+            'updated_at': datetime.datetime.now().isoformat()
+        }
+
+    def finish(self, success):
+        self.status = 'completed' if success else 'failed'
+        self.phase = 'finished'
+        self._emit()
+
+    def _maybe_emit(self):
+        if time.time() - self._last_emit >= self.emit_interval:
+            self._emit()
+
+    def _emit(self):
+        self._last_emit = time.time()
+        snapshot = self.snapshot()
+
+        percent = snapshot['percent']
+        if self.logger and percent is not None and percent - self._last_logged_percent >= 10:
+            self._last_logged_percent = percent
+            eta = snapshot['eta_seconds']
+            eta_text = f", ETA {eta:.0f}s" if eta is not None else ''
+            self.logger.info(f"Restore progress: {percent:.1f}% ({self.phase}{eta_text})")
+
+        if self.state_file:
+            try:
+                temp_file = f"{self.state_file}.tmp"
+                with open(temp_file, 'w') as f:
+                    json.dump(snapshot, f, indent=2)
+                os.replace(temp_file, self.state_file)
+            except OSError as e:
+                if self.logger:
+                    self.logger.debug(f"Could not write progress file: {e}")
+
+        if self.callback:
+            self.callback(snapshot)
@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+"""
+Restore Session Tuning
+Load-friendly session settings, autovacuum suspension and WAL-skipping turbo loads
+"""
+
+import os
+import logging
+
+
+def default_session_settings():
+    """Settings for restore sessions only; they vanish when the session ends"""
+    return {
+        'maintenance_work_mem': os.getenv('RESTORE_MAINTENANCE_WORK_MEM', '512MB'),
+        'max_parallel_maintenance_workers': str(min(4, os.cpu_count() or 1)),
+        'synchronous_commit': 'off'
+    }
+
+
+class RestoreTuning:
+    """
+    Restore profile shared by the restore tools.
+
+    Session settings go to every restore connection (as SET statements for
+    the native engine, PGOPTIONS for psql and pg_restore) and so revert on
+    disconnect. Autovacuum is switched off per table while data loads and
+    each table's own setting is put back afterwards. Turbo mode loads every
+    table in the same transaction that gives it a new relfilenode, which
+    lets PostgreSQL skip WAL for the load when wal_level=minimal.
+    """
+
+    def __init__(self, db_config, logger=None, settings=None, turbo=False):
+        self.db_config = db_config
+        self.logger = logger or logging.getLogger(__name__)
+        self.settings = settings or default_session_settings()
+        self.turbo_requested = turbo
+        self.turbo = False
+        self._suspended = {}
+
+    def connect(self):
+        # Imported here so restore.py's psql fallbacks still work without psycopg2
+        import psycopg2
+        conn = psycopg2.connect(
+            host=self.db_config['host'],
+            port=self.db_config['port'],
+            dbname=self.db_config['database'],
+            user=self.db_config['user'],
+            password=self.db_config['password']
+        )
+        conn.autocommit = True
+        return conn
+
+    def prepare(self):
+        """Decide whether turbo loads can skip WAL on this server"""
+        self.logger.info("Restore profile: " + ', '.join(f"{name}={value}" for name, value in self.settings.items()))
+        if not self.turbo_requested:
+            return self
+        try:
+            import psycopg2
+        except ImportError as e:
+            self.logger.warning(f"Could not check wal_level for turbo mode: {e}")
+            return self
+        try:
+            conn = self.connect()
+            try:
+                with conn.cursor() as cur:
+                    cur.execute("SHOW wal_level")
+                    wal_level = cur.fetchone()[0]
+            finally:
+                conn.close()
+        except psycopg2.Error as e:
+            self.logger.warning(f"Could not check wal_level for turbo mode: {str(e).strip()}")
+            return self
+
+        self.turbo = wal_level == 'minimal'
+        if self.turbo:
+            self.logger.info("Turbo mode: tables are created and loaded in one transaction, skipping WAL")
+        else:
+            self.logger.warning(f"Turbo mode needs wal_level=minimal (server has {wal_level}); loads stay WAL-logged")
+        return self
+
+    def session_sql(self):
+        return b''.join(
+            f"SET {name} = '{value}';\n".encode() for name, value in self.settings.items()
+        )
+
+    def pg_env(self, env):
+        """Add the session settings to PGOPTIONS for psql and pg_restore"""
+        options = ' '.join(f"-c {name}={value}" for name, value in self.settings.items())
+        env['PGOPTIONS'] = f"{env.get('PGOPTIONS', '')} {options}".strip()
+        return env
+
+    def pg_restore_passes(self, cmd):
+        """
+        Split a pg_restore command into a pre-data pass and a data/post-data
+        pass so autovacuum can be suspended on the new tables in between.
+
+        Only an empty target is split: --clean limited to pre-data cannot
+        drop tables that post-data foreign keys still reference. Turbo mode
+        keeps a single run too, because pg_restore only truncates-and-loads
+        in one transaction tables it created in the same run.
+        """
+        try:
+            if self.turbo or self._has_user_tables():
+                return [cmd]
+        except ImportError:
+            # Without psycopg2 autovacuum cannot be suspended between passes
+            return [cmd]
+        backup_file = cmd[-1]
+        pre_data = cmd[:-1] + ['--section=pre-data', backup_file]
+        data = [arg for arg in cmd[:-1] if arg not in ('--clean', '--if-exists')]
+        data += ['--section=data', '--section=post-data', backup_file]
+        return [pre_data, data]
+
+    def _has_user_tables(self):
+        conn = self.connect()
+        try:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    SELECT EXISTS (
+                        SELECT 1 FROM pg_class c
+                          JOIN pg_namespace n ON n.oid = c.relnamespace
+                         WHERE c.relkind IN ('r', 'p')
+                           AND n.nspname NOT IN ('pg_catalog', 'information_schema')
+                           AND n.nspname NOT LIKE 'pg_toast%%'
+                    )
+                """)
+                return cur.fetchone()[0]
+        finally:
+            conn.close()
+
+    def suspend_autovacuum(self, tables=None):
+        """Turn autovacuum off on `tables` (all user tables by default) until resumed"""
+        from psycopg2 import sql
+        conn = self.connect()
+        try:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    SELECT c.oid::regclass::text, o.option_value
+                      FROM pg_class c
+                      JOIN pg_namespace n ON n.oid = c.relnamespace
+                      LEFT JOIN LATERAL pg_options_to_table(c.reloptions) o
+                             ON o.option_name = 'autovacuum_enabled'
+                     WHERE c.relkind = 'r'
+                       AND n.nspname NOT IN ('pg_catalog', 'information_schema')
+                       AND n.nspname NOT LIKE 'pg_toast%%'
+                       AND (%s::text[] IS NULL OR c.oid = ANY(%s::text[]::regclass[]))
+                """, (tables, tables))
+                for relation, original in cur.fetchall():
+                    if relation in self._suspended:
+                        continue
+                    cur.execute(sql.SQL("ALTER TABLE {} SET (autovacuum_enabled = false)").format(sql.SQL(relation)))
+                    self._suspended[relation] = original
+        finally:
+            conn.close()
+        self.logger.info(f"Autovacuum suspended on {len(self._suspended)} tables during load")
+
+    def resume_autovacuum(self):
+        """Put back each suspended table's own autovacuum setting"""
+        if not self._suspended:
+            return
+        import psycopg2
+        from psycopg2 import sql
+        conn = self.connect()
+        try:
+            with conn.cursor() as cur:
+                for relation, original in self._suspended.items():
+                    try:
+                        if original is None:
+                            cur.execute(sql.SQL("ALTER TABLE {} RESET (autovacuum_enabled)").format(sql.SQL(relation)))
+                        else:
+                            cur.execute(sql.SQL("ALTER TABLE {} SET (autovacuum_enabled = {})").format(
+                                sql.SQL(relation), sql.Literal(original)))
+                    except psycopg2.Error as e:
+                        # Dropped by a failed restore; nothing left to revert
+                        self.logger.warning(f"Could not restore autovacuum on {relation}: {str(e).strip()}")
+        finally:
+            conn.close()
+        self.logger.info(f"Autovacuum settings restored on {len(self._suspended)} tables")
+        self._suspended = {}
+
+    def summary(self):
+        return {
+            'settings': self.settings,
+            'turbo_requested': self.turbo_requested,
+            'turbo': self.turbo
+        }
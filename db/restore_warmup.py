@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+"""
+Post-Restore Warm-Up
+Parallel ANALYZE and buffer prewarming so a freshly restored database serves fast plans
+"""
+
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import psycopg2
+from psycopg2 import sql
+
+# Relations behind the dashboard and catalogue queries in backend/routes
+DEFAULT_HOT_TABLES = ['orders', 'users', 'products']
+
+
+class RestoreWarmup:
+    """
+    Post-restore stage that collects planner statistics and warms caches.
+
+    ANALYZE runs on every user table, largest first, spread over `jobs`
+    connections. The hot tables and their indexes are then loaded into
+    shared buffers with pg_prewarm when the extension is installed, or
+    read sequentially otherwise, until `time_budget` seconds have passed
+    since the stage started. The extension is only created when
+    `create_extension` is set.
+    """
+
+    def __init__(self, db_config, logger=None, jobs=2, time_budget=60, hot_tables=None, create_extension=False):
+        self.db_config = db_config
+        self.logger = logger or logging.getLogger(__name__)
+        self.jobs = max(1, int(jobs))
+        self.time_budget = time_budget
+        self.hot_tables = hot_tables or DEFAULT_HOT_TABLES
+        self.create_extension = create_extension
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+        self._started = None
+
+    def connect(self):
+        conn = psycopg2.connect(
+            host=self.db_config['host'],
+            port=self.db_config['port'],
+            dbname=self.db_config['database'],
+            user=self.db_config['user'],
+            password=self.db_config['password']
+        )
+        conn.autocommit = True
+        return conn
+
+    def _worker_connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or conn.closed:
+            conn = self.connect()
+            self._local.conn = conn
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    def close(self):
+        with self._lock:
+            for conn in self._connections:
+                try:
+                    conn.close()
+                except Exception:
+                    pass
+            self._connections = []
+
+    def remaining_budget(self):
+        return self.time_budget - (time.time() - self._started)
+
+    def run(self):
+        """Run ANALYZE then prewarm; returns a report of what was done and how long it took"""
+        self._started = time.time()
+        report = {'time_budget_seconds': self.time_budget}
+        try:
+            report.update(self.analyze_all())
+            report.update(self.prewarm())
+        finally:
+            self.close()
+        report['total_seconds'] = round(time.time() - self._started, 3)
+        self.logger.info(
+            f"Warm-up completed in {report['total_seconds']:.2f}s: "
+            f"{report['tables_analyzed']} tables analyzed, "
+            f"{len(report['prewarmed'])} relations prewarmed ({report['prewarm_method']})"
+        )
+        return report
+
+    def analyze_all(self):
+        """ANALYZE every user table in parallel, largest tables first"""
+        start = time.time()
+        conn = self._worker_connection()
+        with conn.cursor() as cur:
+            cur.execute("""
+                SELECT n.nspname, c.relname
+                  FROM pg_class c
+                  JOIN pg_namespace n ON n.oid = c.relnamespace
+                 WHERE c.relkind IN ('r', 'p', 'm')
+                   AND n.nspname NOT IN ('pg_catalog', 'information_schema')
+                   AND n.nspname NOT LIKE 'pg_toast%%'
+                 ORDER BY pg_relation_size(c.oid) DESC
+            """)
+            tables = cur.fetchall()
+
+        failed = []
+        with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            futures = {executor.submit(self._analyze, schema, table): f"{schema}.{table}" for schema, table in tables}
+            for future in as_completed(futures):
+                try:
+                    future.result()
+                except psycopg2.Error as e:
+                    self.logger.warning(f"ANALYZE {futures[future]} failed: {str(e).strip()}")
+                    failed.append(futures[future])
+
+        duration = time.time() - start
+        self.logger.info(f"Analyzed {len(tables) - len(failed)} tables in {duration:.2f}s with {self.jobs} connections")
+        return {
+            'tables_analyzed': len(tables) - len(failed),
+            'analyze_failed': failed,
+            'analyze_seconds': round(duration, 3)
+        }
+
+    def _analyze(self, schema, table):
+        with self._worker_connection().cursor() as cur:
+            cur.execute(sql.SQL("ANALYZE {}").format(sql.Identifier(schema, table)))
+
+    def prewarm(self):
+        """Load hot heaps and indexes into cache until the time budget runs out"""
+        start = time.time()
+        conn = self._worker_connection()
+        method = 'pg_prewarm' if self._enable_prewarm(conn) else 'sequential read'
+
+        with conn.cursor() as cur:
+            cur.execute("""
+                SELECT c.oid::regclass::text, c.relkind
+                  FROM pg_class t
+                  LEFT JOIN pg_index i ON i.indrelid = t.oid
+                  JOIN pg_class c ON c.oid = t.oid OR c.oid = i.indexrelid
+                 WHERE t.relname = ANY(%s) AND t.relkind = 'r'
+                   AND t.relnamespace = 'public'::regnamespace
+                 GROUP BY c.oid, c.relkind, t.oid, t.relname
+                 ORDER BY array_position(%s, t.relname::text), c.relkind DESC, pg_relation_size(c.oid) DESC
+            """, (self.hot_tables, self.hot_tables))
+            relations = cur.fetchall()
+
+        prewarmed, skipped = [], []
+        for relation, relkind in relations:
+            if method == 'sequential read' and relkind == 'i':
+                # Index pages can only be loaded directly through pg_prewarm
+                continue
+            remaining = self.remaining_budget()
+            if remaining <= 0:
+                skipped.append(relation)
+                continue
+            try:
+                with conn.cursor() as cur:
+                    cur.execute("SELECT set_config('statement_timeout', %s, false)", (f"{int(remaining * 1000)}ms",))
+                    if method == 'pg_prewarm':
+                        cur.execute("SELECT pg_prewarm(%s::regclass)", (relation,))
+                    else:
+                        cur.execute(sql.SQL("SELECT count(*) FROM {}").format(sql.SQL(relation)))
+                prewarmed.append(relation)
+            except psycopg2.errors.QueryCanceled:
+                skipped.append(relation)
+            except psycopg2.Error as e:
+                self.logger.warning(f"Prewarm of {relation} failed: {str(e).strip()}")
+                skipped.append(relation)
+
+        duration = time.time() - start
+        if skipped:
+            self.logger.info(f"Warm-up budget of {self.time_budget}s reached; skipped {', '.join(skipped)}")
+        return {
+            'prewarm_method': method,
+            'prewarmed': prewarmed,
+            'prewarm_skipped': skipped,
+            'prewarm_seconds': round(duration, 3)
+        }
+
+    def _enable_prewarm(self, conn):
+        with conn.cursor() as cur:
+            cur.execute("SELECT installed_version IS NOT NULL FROM pg_available_extensions WHERE name = 'pg_prewarm'")
+            row = cur.fetchone()
+            if not row:
+                self.logger.info("pg_prewarm is not available on this server - using sequential reads")
+                return False
+            if row[0]:
+                return True
+            if not self.create_extension:
+                self.logger.info("pg_prewarm is not installed in this database - using sequential reads")
+                return False
+            try:
+                cur.execute("CREATE EXTENSION IF NOT EXISTS pg_prewarm")
+                return True
+            except psycopg2.Error as e:
+                self.logger.info(f"pg_prewarm unavailable ({str(e).strip()}) - using sequential reads")
+                return False
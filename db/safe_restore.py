@@ -6,14 +6,24 @@ Enhanced Database Restore Script with Additional Safety Measures
 import os
 import sys
 import subprocess
+import tempfile
 import datetime
+import time
 import logging
 import json
 import shutil
-import tempfile
 from pathlib import Path
 from dotenv import load_dotenv
 
+from dump_io import SQL_DUMP_SUFFIXES, open_dump, stream_to_process
+from restore_progress import RestoreProgress
+from archive_toc import (ArchiveFormatError, archive_size, is_archive, is_directory_archive,
+                         missing_data_files, recommended_jobs, schedule_restore)
+from restore_tuning import RestoreTuning
+from restore_manifest import RestoreManifest, dump_with_manifest, load_manifest, manifest_path
+from restore_predictor import RestorePredictor
+from restore_coordinator import RestoreCoordinator
+
 class SafeDatabaseRestore:
     def __init__(self):
         # Load environment variables from backend directory
@@ -43,12 +53,31 @@ class SafeDatabaseRestore:
         self.restore_config = {
             'backup_path': backup_path,
             'create_backup_before_restore': True,
+            'safety_backup_mode': 'clone',  # clone (template database) | dump (plain pg_dump)
+            'safety_snapshots_to_keep': 3,
             'verify_after_restore': True,
-            'parallel_jobs': 4,
-            'max_restore_time_minutes': 30,
-            'safety_checks': True
+            'verify_mode': 'fast',  # fast (planner estimates) | exact (counts and checksums)
+            'verify_jobs': 4,
+            'parallel_jobs': None,  # one per core unless set
+            'largest_first': True,
+            'max_restore_time_minutes': 30,  # used until there is restore history to predict from
+            'predict_timeout': True,
+            'safety_checks': True,
+            'sql_restore_engine': 'native',
+            'restore_profile': 'tuned',  # tuned | default
+            'turbo': False,
+            'progress_callback': None
         }
         
+        # Progress of the restore in flight, also mirrored to restore_progress.json
+        self.progress = None
+        
+        # Session tuning of the restore in flight
+        self.tuning = None
+        
+        # Expected duration of the restore in flight, from past restores
+        self.prediction = None
+        
         # Setup logging
         self.setup_logging()
 
@@ -84,6 +113,9 @@ class SafeDatabaseRestore:
             self.logger.error(f"Backup file does not exist: {backup_file}")
             return False, "File does not exist"
         
+        if os.path.isdir(backup_file):
+            return self._validate_directory_archive(backup_file)
+        
         # Check file size
         file_size = os.path.getsize(backup_file)
         if file_size == 0:
@@ -94,7 +126,7 @@ class SafeDatabaseRestore:
             self.logger.warning(f"Backup file is unusually small: {file_size} bytes")
         
         # Check file extension
-        valid_extensions = ['.sql', '.sql.gz', '.backup']
+        valid_extensions = [*SQL_DUMP_SUFFIXES, '.backup']
         if not any(backup_file.endswith(ext) for ext in valid_extensions):
             self.logger.error(f"Invalid backup file extension: {backup_file}")
             return False, "Invalid file extension"
@@ -123,6 +155,29 @@ class SafeDatabaseRestore:
         self.logger.info(f"Backup file validation passed: {backup_file} ({file_size:,} bytes)")
         return True, "Valid backup file"
 
+    def _validate_directory_archive(self, backup_dir):
+        """Validate a pg_dump directory-format archive: TOC header and every data file it lists"""
+        if not is_directory_archive(backup_dir):
+            self.logger.error(f"Directory has no toc.dat: {backup_dir}")
+            return False, "Not a directory-format archive"
+        
+        try:
+            missing = missing_data_files(backup_dir)
+        except ArchiveFormatError as e:
+            self.logger.error(f"Invalid directory archive TOC: {e}")
+            return False, "Invalid directory format backup"
+        except Exception as e:
+            self.logger.error(f"Error reading directory archive TOC: {e}")
+            return False, f"Cannot read archive: {e}"
+        
+        if missing:
+            self.logger.error(f"Directory archive is missing data files: {', '.join(missing)}")
+            return False, f"Missing data files: {', '.join(missing)}"
+        
+        archive_bytes = archive_size(backup_dir)
+        self.logger.info(f"Backup file validation passed: {backup_dir} ({archive_bytes:,} bytes)")
+        return True, "Valid directory archive"
+
     def check_database_connectivity(self):
         """Check if database server is accessible"""
         self.logger.info("Checking database server connectivity...")
@@ -161,10 +216,125 @@ class SafeDatabaseRestore:
             return False, str(e)
 
     def create_safety_backup(self):
-        """Create a safety backup before restore operation"""
+        """
+        Create a safety backup before restore operation.
+        
+        By default the live database is cloned with CREATE DATABASE ...
+        TEMPLATE, which copies files instead of dumping and replaying SQL.
+        A plain pg_dump is the fallback when the clone cannot be made.
+        Returns the snapshot database name or the dump path, or None.
+        """
         if not self.restore_config['create_backup_before_restore']:
             return None
         
+        if self.restore_config['safety_backup_mode'] == 'clone':
+            snapshot = self._clone_safety_snapshot()
+            if snapshot:
+                self._prune_safety_snapshots()
+                return snapshot
+            self.logger.warning("Falling back to a pg_dump safety backup")
+        
+        safety_backup = self._dump_safety_backup()
+        if safety_backup:
+            self._prune_safety_snapshots()
+        return safety_backup
+
+    def _run_admin_sql(self, sql):
+        """Run one statement against the maintenance database"""
+        env = os.environ.copy()
+        env['PGPASSWORD'] = self.db_config['password']
+        
+        cmd = [
+            'psql',
+            '-h', self.db_config['host'],
+            '-p', self.db_config['port'],
+            '-U', self.db_config['user'],
+            '-d', 'postgres',
+            '-v', 'ON_ERROR_STOP=1',
+            '-c', sql,
+            '--no-password',
+            '-t',
+            '-A'
+        ]
+        
+        result = subprocess.run(cmd, env=env, capture_output=True, text=True, timeout=600)
+        if result.returncode == 0:
+            return True, result.stdout.strip()
+        return False, result.stderr.strip()
+
+    def _clone_safety_snapshot(self, attempts=3):
+        """Clone the live database as <database>_safety_<timestamp>; returns its name or None"""
+        production = self.db_config['database']
+        snapshot = f"{production}_safety_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}"
+        self.logger.info(f"Creating safety snapshot '{snapshot}' from template '{production}'...")
+        
+        ok, version = self._run_admin_sql("SHOW server_version_num;")
+        # FILE_COPY copies the data files directly; the PG15+ default
+        # (WAL_LOG) writes every block of the database to WAL as well
+        strategy = ' STRATEGY FILE_COPY' if ok and int(version) >= 150000 else ''
+        
+        start = datetime.datetime.now()
+        # A template must have no other sessions for the length of the copy
+        ok, output = self._run_admin_sql(f'ALTER DATABASE "{production}" WITH ALLOW_CONNECTIONS false;')
+        if not ok:
+            self.logger.warning(f"Cannot drain connections for cloning: {output}")
+            return None
+        try:
+            for attempt in range(1, attempts + 1):
+                self._run_admin_sql(
+                    f"SELECT count(pg_terminate_backend(pid)) FROM pg_stat_activity "
+                    f"WHERE datname = '{production}' AND pid <> pg_backend_pid();"
+                )
+                ok, output = self._run_admin_sql(f'CREATE DATABASE "{snapshot}" TEMPLATE "{production}"{strategy};')
+                if ok:
+                    break
+                # Terminated backends can take a moment to exit
+                self.logger.warning(f"Clone attempt {attempt} failed: {output}")
+                time.sleep(attempt)
+        finally:
+            self._run_admin_sql(f'ALTER DATABASE "{production}" WITH ALLOW_CONNECTIONS true;')
+        
+        if not ok:
+            return None
+        
+        duration = (datetime.datetime.now() - start).total_seconds()
+        self._run_admin_sql(
+            f"COMMENT ON DATABASE \"{snapshot}\" IS "
+            f"'Safety snapshot of {production} taken {start.isoformat(timespec='seconds')} before a restore';"
+        )
+        self.logger.info(
+            f"Safety snapshot created in {duration:.2f}s: '{snapshot}' "
+            f"(roll back with: python restore.py --rollback-to {snapshot})"
+        )
+        return snapshot
+
+    def _prune_safety_snapshots(self):
+        """Keep only the newest snapshot databases and safety dump files"""
+        keep = self.restore_config['safety_snapshots_to_keep']
+        production = self.db_config['database']
+        
+        ok, output = self._run_admin_sql(
+            f"SELECT datname FROM pg_database WHERE datname LIKE '{production}\\_safety\\_%' ORDER BY datname DESC;"
+        )
+        if ok:
+            for snapshot in output.splitlines()[keep:]:
+                dropped, error = self._run_admin_sql(f'DROP DATABASE IF EXISTS "{snapshot}";')
+                if dropped:
+                    self.logger.info(f"Pruned old safety snapshot '{snapshot}'")
+                else:
+                    self.logger.warning(f"Could not prune safety snapshot '{snapshot}': {error}")
+        
+        dumps = sorted(Path(self.restore_config['backup_path']).glob('safety_backup_before_restore_*.sql'), reverse=True)
+        for dump in dumps[keep:]:
+            try:
+                dump.unlink()
+                Path(manifest_path(str(dump))).unlink(missing_ok=True)
+                self.logger.info(f"Pruned old safety backup {dump.name}")
+            except OSError as e:
+                self.logger.warning(f"Could not prune safety backup {dump.name}: {e}")
+
+    def _dump_safety_backup(self):
+        """Plain pg_dump of the live database; returns its path or None"""
         self.logger.info("Creating safety backup before restore operation...")
         
         try:
@@ -191,7 +361,10 @@ class SafeDatabaseRestore:
                 '-f', safety_backup_path
             ]
             
-            result = subprocess.run(cmd, env=env, capture_output=True, text=True, timeout=600)
+            # The manifest is taken from the dump's own snapshot so a later
+            # restore of this safety backup can be verified against it
+            result = dump_with_manifest(self.db_config, cmd, safety_backup_path, self.logger,
+                                        self.restore_config['verify_jobs'], timeout=600)
             
             if result.returncode == 0:
                 file_size = os.path.getsize(safety_backup_path)
@@ -239,13 +412,14 @@ class SafeDatabaseRestore:
         
         # Phase 3: Actual restore
         self.logger.info("Phase 3: Performing database restore")
+        self._predict_duration(backup_file)
         start_time = datetime.datetime.now()
         
         try:
             # Determine restore method based on file type
-            if backup_file.endswith('.backup'):
+            if is_archive(backup_file):
                 success, message = self._restore_custom_format(backup_file)
-            elif backup_file.endswith('.sql.gz'):
+            elif backup_file.endswith(('.sql.gz', '.sql.zst')):
                 success, message = self._restore_compressed_sql(backup_file)
             else:  # .sql files
                 success, message = self._restore_sql_file(backup_file)
@@ -253,19 +427,23 @@ class SafeDatabaseRestore:
             end_time = datetime.datetime.now()
             duration = (end_time - start_time).total_seconds()
             
+            if self.progress:
+                self.progress.finish(success)
+            
             if success:
                 self.logger.info(f"Restore completed successfully in {duration:.2f} seconds")
                 
                 # Phase 4: Post-restore verification
                 if self.restore_config['verify_after_restore']:
                     self.logger.info("Phase 4: Post-restore verification")
-                    verification_success, verification_message = self.verify_restore()
+                    verification_success, verification_message = self.verify_restore(backup_file)
                     
                     if verification_success:
                         self.logger.info("Database restore and verification completed successfully")
                         return True, {
                             'success': True,
                             'duration': duration,
+                            'expected_duration': self.prediction['expected_seconds'] if self.prediction else None,
                             'safety_backup': safety_backup,
                             'verification': verification_message
                         }
@@ -276,6 +454,7 @@ class SafeDatabaseRestore:
                     return True, {
                         'success': True,
                         'duration': duration,
+                        'expected_duration': self.prediction['expected_seconds'] if self.prediction else None,
                         'safety_backup': safety_backup
                     }
             else:
@@ -286,12 +465,72 @@ class SafeDatabaseRestore:
             self.logger.error(f"Unexpected error during restore: {e}")
             return False, f"Unexpected error: {e}"
 
+    def _predict_duration(self, backup_file):
+        """Expected duration from past restores; also sets the restore timeout"""
+        self.prediction = None
+        if not self.restore_config['predict_timeout']:
+            return None
+        try:
+            predictor = RestorePredictor(self.restore_config['backup_path'], self.logger)
+            self.prediction = predictor.predict(
+                backup_file,
+                engine=self.restore_config['sql_restore_engine'],
+                jobs=self.restore_config['parallel_jobs']
+            )
+        except Exception as e:
+            self.logger.warning(f"Could not predict restore duration: {e}")
+        
+        if self.prediction:
+            self.logger.info(predictor.describe(self.prediction))
+        else:
+            self.logger.info(f"No restore history to predict from - timeout is "
+                             f"{self.restore_config['max_restore_time_minutes']} minutes")
+        return self.prediction
+
+    def _restore_timeout_seconds(self):
+        if self.prediction:
+            return self.prediction['timeout_seconds']
+        return self.restore_config['max_restore_time_minutes'] * 60
+
+    def _start_progress(self, backup_file, total_items=None):
+        """Create the progress tracker for a restore of `backup_file`"""
+        self.progress = RestoreProgress(
+            backup_file,
+            total_bytes=None if total_items else archive_size(backup_file),
+            total_items=total_items,
+            state_file=os.path.join(self.restore_config['backup_path'], 'restore_progress.json'),
+            callback=self.restore_config['progress_callback'],
+            logger=self.logger
+        )
+        return self.progress
+
+    def _count_archive_entries(self, backup_file):
+        """Count TOC entries in a custom format archive (used for progress)"""
+        try:
+            result = subprocess.run(['pg_restore', '-l', backup_file], capture_output=True, text=True, timeout=60)
+            if result.returncode == 0:
+                return sum(1 for line in result.stdout.splitlines() if line.strip() and not line.startswith(';'))
+        except Exception as e:
+            self.logger.warning(f"Could not list archive contents: {e}")
+        return None
+
+    def _start_tuning(self):
+        """Restore profile for the next restore, or None for server defaults"""
+        self.tuning = None
+        if self.restore_config['restore_profile'] == 'tuned':
+            self.tuning = RestoreTuning(self.db_config, self.logger, turbo=self.restore_config['turbo']).prepare()
+        return self.tuning
+
     def _restore_custom_format(self, backup_file):
-        """Restore from pg_dump custom format"""
-        self.logger.info(f"Restoring from custom format backup: {backup_file}")
+        """Restore from pg_dump custom or directory format"""
+        archive_format = 'directory' if is_directory_archive(backup_file) else 'custom'
+        self.logger.info(f"Restoring from {archive_format} format backup: {backup_file}")
         
         env = os.environ.copy()
         env['PGPASSWORD'] = self.db_config['password']
+        tuning = self._start_tuning()
+        if tuning:
+            tuning.pg_env(env)
         
         cmd = [
             'pg_restore',
@@ -302,14 +541,44 @@ class SafeDatabaseRestore:
             '--verbose',
             '--no-password',
             '--clean',
-            '--if-exists',
-            f'--jobs={self.restore_config["parallel_jobs"]}',
-            backup_file
+            '--if-exists'
         ]
         
+        # Schedule the largest tables and index builds first so no worker is
+        # left finishing the biggest item alone at the end
+        jobs = self.restore_config['parallel_jobs']
+        list_file = None
+        if self.restore_config['largest_first']:
+            # A private file per restore, removed once pg_restore has read it
+            fd, list_file = tempfile.mkstemp(prefix='restore_order_', suffix='.list')
+            os.close(fd)
+            try:
+                jobs, heaviest = schedule_restore(backup_file, list_file, jobs)
+                cmd.extend(['-L', list_file])
+                self.logger.info("Largest-first restore order: " + ', '.join(
+                    f"{entry.table} ({entry.data_size:,} bytes)" for entry in heaviest[:3]))
+            except (ArchiveFormatError, OSError, subprocess.CalledProcessError) as e:
+                self.logger.warning(f"Using pg_restore's default ordering: {e}")
+        jobs = jobs or recommended_jobs()
+        if tuning and tuning.turbo:
+            # pg_restore only loads tables in their creating transaction in parallel mode
+            jobs = max(jobs, 2)
+        cmd.extend([f'--jobs={jobs}', backup_file])
+        
         try:
-            timeout_seconds = self.restore_config['max_restore_time_minutes'] * 60
-            result = subprocess.run(cmd, env=env, capture_output=True, text=True, timeout=timeout_seconds)
+            timeout_seconds = self._restore_timeout_seconds()
+            progress = self._start_progress(backup_file, total_items=self._count_archive_entries(backup_file))
+            passes = tuning.pg_restore_passes(cmd) if tuning else [cmd]
+            try:
+                for pass_number, pass_cmd in enumerate(passes):
+                    if pass_number:
+                        tuning.suspend_autovacuum()
+                    result = stream_to_process(pass_cmd, env=env, timeout=timeout_seconds, on_line=progress.record_line)
+                    if result.returncode != 0:
+                        break
+            finally:
+                if tuning:
+                    tuning.resume_autovacuum()
             
             if result.returncode == 0:
                 self.logger.info("Custom format restore completed successfully")
@@ -319,46 +588,61 @@ class SafeDatabaseRestore:
                 return False, result.stderr
                 
         except subprocess.TimeoutExpired:
-            self.logger.error(f"Restore operation timed out after {self.restore_config['max_restore_time_minutes']} minutes")
+            self.logger.error(f"Restore operation timed out after {self._restore_timeout_seconds() / 60:.1f} minutes")
             return False, "Restore operation timed out"
         except Exception as e:
             self.logger.error(f"Error during custom format restore: {e}")
             return False, str(e)
+        finally:
+            if list_file and os.path.exists(list_file):
+                os.remove(list_file)
 
     def _restore_compressed_sql(self, backup_file):
         """Restore from compressed SQL file"""
         self.logger.info(f"Restoring from compressed SQL backup: {backup_file}")
         
-        # Create temporary uncompressed file
-        with tempfile.NamedTemporaryFile(mode='w', suffix='.sql', delete=False) as temp_file:
-            temp_sql_file = temp_file.name
+        if self.restore_config['sql_restore_engine'] == 'native':
+            return self._restore_with_engine(backup_file)
         
+        # Stream the decompressed dump into psql chunk by chunk instead of
+        # inflating it into memory and a temporary file first
+        return self._run_psql_restore(backup_file)
+
+    def _restore_sql_file(self, backup_file):
+        """Restore from SQL dump file"""
+        self.logger.info(f"Restoring from SQL backup: {backup_file}")
+        
+        if self.restore_config['sql_restore_engine'] == 'native':
+            return self._restore_with_engine(backup_file)
+        return self._run_psql_restore(backup_file)
+
+    def _restore_with_engine(self, backup_file):
+        """Restore a plain or gzip SQL dump in-process with psycopg2 COPY"""
         try:
-            # Decompress file
-            self.logger.info("Decompressing backup file...")
-            with open(backup_file, 'rb') as compressed_file:
-                import gzip
-                with gzip.open(compressed_file, 'rt') as gz_file:
-                    with open(temp_sql_file, 'w') as output_file:
-                        output_file.write(gz_file.read())
+            from restore_engine import SqlRestoreEngine
+        except ImportError as e:
+            self.logger.warning(f"Native restore engine unavailable ({e}) - falling back to psql")
+            return self._run_psql_restore(backup_file)
+        
+        try:
+            timeout_seconds = self._restore_timeout_seconds()
+            engine = SqlRestoreEngine(self.db_config, self.logger, timeout=timeout_seconds,
+                                      progress=self._start_progress(backup_file), tuning=self._start_tuning())
+            summary = engine.restore_stream(backup_file)
             
-            # Restore from decompressed file
-            success, message = self._restore_sql_file(temp_sql_file)
+            self.logger.info(f"Restored {summary['rows']:,} rows ({summary['bytes']:,} bytes) in {len(summary['tables'])} tables")
+            if summary['warnings']:
+                self.logger.warning(f"{len(summary['warnings'])} statements reported errors during restore")
             
-            return success, message
+            self.logger.info("SQL restore completed successfully")
+            return True, "Success"
             
         except Exception as e:
-            self.logger.error(f"Error restoring compressed SQL file: {e}")
+            self.logger.error(f"Error during native SQL restore: {e}")
             return False, str(e)
-        finally:
-            # Clean up temporary file
-            if os.path.exists(temp_sql_file):
-                os.unlink(temp_sql_file)
 
-    def _restore_sql_file(self, backup_file):
-        """Restore from SQL dump file"""
-        self.logger.info(f"Restoring from SQL backup: {backup_file}")
-        
+    def _run_psql_restore(self, backup_file):
+        """Stream a plain or gzip SQL dump into psql's stdin"""
         env = os.environ.copy()
         env['PGPASSWORD'] = self.db_config['password']
         
@@ -368,13 +652,17 @@ class SafeDatabaseRestore:
             '-p', self.db_config['port'],
             '-U', self.db_config['user'],
             '-d', self.db_config['database'],
-            '--no-password',
-            '-f', backup_file
+            '--no-password'
         ]
+        if self._start_tuning():
+            self.tuning.pg_env(env)
         
         try:
-            timeout_seconds = self.restore_config['max_restore_time_minutes'] * 60
-            result = subprocess.run(cmd, env=env, capture_output=True, text=True, timeout=timeout_seconds)
+            timeout_seconds = self._restore_timeout_seconds()
+            progress = self._start_progress(backup_file)
+            progress.set_phase('restoring')
+            with open_dump(backup_file, progress) as source:
+                result = stream_to_process(cmd, source, env=env, timeout=timeout_seconds, on_line=progress.record_line)
             
             if result.returncode == 0:
                 self.logger.info("SQL restore completed successfully")
@@ -384,16 +672,30 @@ class SafeDatabaseRestore:
                 return False, result.stderr
                 
         except subprocess.TimeoutExpired:
-            self.logger.error(f"Restore operation timed out after {self.restore_config['max_restore_time_minutes']} minutes")
+            self.logger.error(f"Restore operation timed out after {self._restore_timeout_seconds() / 60:.1f} minutes")
             return False, "Restore operation timed out"
         except Exception as e:
             self.logger.error(f"Error during SQL restore: {e}")
             return False, str(e)
 
-    def verify_restore(self):
+    def verify_restore(self, backup_file=None):
         """Comprehensive post-restore verification"""
         self.logger.info("Performing comprehensive post-restore verification...")
         
+        # Backups with a manifest are checked table by table against it
+        manifest = load_manifest(backup_file) if backup_file else None
+        if manifest:
+            try:
+                checker = RestoreManifest(self.db_config, self.logger, self.restore_config['verify_jobs'])
+                report = checker.verify(manifest, self.restore_config['verify_mode'])
+            except Exception as e:
+                self.logger.error(f"Error during manifest verification: {e}")
+                return False, str(e)
+            if not report['ok']:
+                problems = report['missing_tables'] + [m['table'] for m in report['mismatches']]
+                return False, f"Manifest mismatch in {', '.join(problems)}"
+            return True, report
+        
         verification_queries = [
             ("SELECT COUNT(*) FROM users", "User count"),
             ("SELECT COUNT(*) FROM products", "Product count"),
@@ -447,20 +749,38 @@ def main():
     parser.add_argument('backup_file', nargs='?', help='Path to backup file to restore')
     parser.add_argument('--force', action='store_true', help='Force restore without safety checks')
     parser.add_argument('--no-verify', action='store_true', help='Skip post-restore verification')
+    parser.add_argument('--verify-mode', choices=['fast', 'exact'], default='fast',
+                        help='Manifest check: planner estimates (fast) or full counts and checksums (exact)')
     parser.add_argument('--list', action='store_true', help='List available backup files')
+    parser.add_argument('--safety-mode', choices=['clone', 'dump'], default='clone',
+                        help='Safety backup as a template clone of the database (fast) or a plain pg_dump')
+    parser.add_argument('--keep-snapshots', type=int, default=3,
+                        help='Safety snapshots (and safety dumps) to keep; older ones are pruned')
+    parser.add_argument('--engine', choices=['native', 'psql'], default='native',
+                        help='SQL dump restore engine (default: native)')
+    parser.add_argument('--profile', choices=['tuned', 'default'], default='tuned',
+                        help='Restore session profile (default: tuned)')
+    parser.add_argument('--turbo', action='store_true',
+                        help='Load each table in the transaction that creates it (skips WAL with wal_level=minimal)')
     
     args = parser.parse_args()
     
     restore_tool = SafeDatabaseRestore()
+    restore_tool.restore_config['sql_restore_engine'] = args.engine
+    restore_tool.restore_config['restore_profile'] = args.profile
+    restore_tool.restore_config['turbo'] = args.turbo
+    restore_tool.restore_config['safety_backup_mode'] = args.safety_mode
+    restore_tool.restore_config['safety_snapshots_to_keep'] = max(1, args.keep_snapshots)
     
     if args.list:
         # List available backups
         backup_dir = Path(restore_tool.restore_config['backup_path'])
         if backup_dir.exists():
-            backups = sorted(backup_dir.glob('*.{sql,backup}'))
+            backups = sorted(path for path in backup_dir.iterdir()
+                             if path.name.endswith((*SQL_DUMP_SUFFIXES, '.backup')) or is_directory_archive(path))
             print("\n=== Available Backup Files ===")
             for i, backup in enumerate(backups, 1):
-                size = backup.stat().st_size
+                size = archive_size(backup)
                 modified = datetime.datetime.fromtimestamp(backup.stat().st_mtime)
                 print(f"{i}. {backup.name}")
                 print(f"   Size: {size:,} bytes ({size/(1024*1024):.2f} MB)")
@@ -477,14 +797,25 @@ def main():
     # Disable verification if requested
     if args.no_verify:
         restore_tool.restore_config['verify_after_restore'] = False
+    restore_tool.restore_config['verify_mode'] = args.verify_mode
     
-    # Perform restore
-    success, result = restore_tool.perform_safe_restore(args.backup_file, force=args.force)
+    # Perform restore, queued behind any restore already running elsewhere
+    coordinator = RestoreCoordinator(restore_tool.restore_config['backup_path'], restore_tool.db_config,
+                                     restore_tool.logger)
+    success, result = coordinator.run(
+        args.backup_file, 'safe_restore.py',
+        lambda: restore_tool.perform_safe_restore(args.backup_file, force=args.force),
+        options={'mode': 'safe', 'force': args.force},
+        on_merged=lambda job: (job['status'] == 'completed',
+                               job.get('message') or f"Merged into restore job {job['id']} ({job['status']})")
+    )
     
     if success:
         print(f"\nRestore completed successfully!")
         if isinstance(result, dict):
             print(f"Duration: {result.get('duration', 'Unknown')} seconds")
+            if result.get('expected_duration'):
+                print(f"Expected: {result['expected_duration']} seconds")
             if result.get('safety_backup'):
                 print(f"Safety backup: {result['safety_backup']}")
             if result.get('verification'):
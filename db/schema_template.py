@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+"""
+Schema Template Cache
+Keeps one template database per dump schema so clean restores start from a clone with pre-data applied
+"""
+
+import sys
+import time
+import hashlib
+import logging
+import argparse
+import datetime
+
+import psycopg2
+
+from dump_io import open_dump
+from dump_parser import DumpParser
+from restore_engine import SqlRestoreEngine
+
+TEMPLATE_PREFIX = 'schema_template_'
+# Hex digits of the schema hash kept in the database name
+NAME_HASH_LENGTH = 16
+DEFAULT_TEMPLATES_TO_KEEP = 3
+
+
+def schema_fingerprint(backup_file):
+    """SHA-256 of a dump's session settings and pre-data entries; None for a dump without schema"""
+    digest = hashlib.sha256()
+    entries = 0
+    with open_dump(backup_file) as stream:
+        parser = DumpParser(stream)
+        digest.update(parser.session_sql)
+        for entry in parser.schema_entries():
+            digest.update(f"{entry.entry_type}\0{entry.schema}\0{entry.name}\0".encode('utf-8'))
+            digest.update(entry.sql)
+            digest.update(b'\0')
+            entries += 1
+    return digest.hexdigest() if entries else None
+
+
+class SchemaTemplateCache:
+    """
+    Template databases holding the schema of a dump with empty tables.
+
+    The template for a dump is named after the hash of its pre-data, so
+    every backup taken from the same schema shares one template. A clean
+    restore creates its target with CREATE DATABASE ... TEMPLATE, which
+    copies the catalog in a fraction of the time it takes to replay the
+    DDL, and the restore engine then loads data and post-data only.
+
+    Templates are built under a temporary name and renamed when complete,
+    then marked IS_TEMPLATE with connections disallowed so nothing can
+    modify them or hold a session that would block the clone. A schema
+    whose DDL reports errors is not cached; those restores take the
+    ordinary path.
+    """
+
+    def __init__(self, db_config, logger=None, keep=DEFAULT_TEMPLATES_TO_KEEP):
+        self.db_config = db_config
+        self.logger = logger or logging.getLogger(__name__)
+        self.keep = max(1, int(keep))
+
+    def _admin_connection(self):
+        conn = psycopg2.connect(
+            host=self.db_config['host'],
+            port=self.db_config['port'],
+            dbname='postgres',
+            user=self.db_config['user'],
+            password=self.db_config['password']
+        )
+        conn.autocommit = True
+        return conn
+
+    def _execute(self, statement, params=None):
+        conn = self._admin_connection()
+        try:
+            with conn.cursor() as cur:
+                cur.execute(statement, params)
+                return cur.fetchall() if cur.description else None
+        finally:
+            conn.close()
+
+    @staticmethod
+    def template_name(fingerprint):
+        return f"{TEMPLATE_PREFIX}{fingerprint[:NAME_HASH_LENGTH]}"
+
+    def exists(self, name):
+        return bool(self._execute("SELECT 1 FROM pg_database WHERE datname = %s", (name,)))
+
+    def list_templates(self):
+        """Cached templates, newest first"""
+        rows = self._execute("""
+            SELECT d.datname, pg_database_size(d.oid), shobj_description(d.oid, 'pg_database')
+              FROM pg_database d
+             WHERE d.datname LIKE %s AND d.datistemplate
+             ORDER BY d.oid DESC
+        """, (TEMPLATE_PREFIX.replace('_', r'\_') + '%',))
+        return [{'name': name, 'size': size, 'comment': comment} for name, size, comment in rows]
+
+    def drop_template(self, name):
+        # A database marked IS_TEMPLATE cannot be dropped
+        self._execute(f'ALTER DATABASE "{name}" WITH IS_TEMPLATE false')
+        self._execute(f'DROP DATABASE IF EXISTS "{name}"')
+
+    def build(self, backup_file, fingerprint):
+        """Create the template for `backup_file`; returns its name, or None if the schema did not apply cleanly"""
+        name = self.template_name(fingerprint)
+        staging = f"{name}_build"
+        start = time.time()
+
+        # Left behind by a build that was interrupted
+        self._execute(f'DROP DATABASE IF EXISTS "{staging}"')
+        self._execute(f'CREATE DATABASE "{staging}"')
+        try:
+            engine = SqlRestoreEngine(dict(self.db_config, database=staging), self.logger)
+            summary = engine.restore_schema(backup_file)
+            if summary['warnings']:
+                self.logger.warning(
+                    f"Not caching a schema template: {len(summary['warnings'])} pre-data statements failed"
+                )
+                self._execute(f'DROP DATABASE IF EXISTS "{staging}"')
+                return None
+
+            self._execute(f'ALTER DATABASE "{staging}" RENAME TO "{name}"')
+        except Exception:
+            self._execute(f'DROP DATABASE IF EXISTS "{staging}"')
+            raise
+
+        self._execute(f'ALTER DATABASE "{name}" WITH IS_TEMPLATE true ALLOW_CONNECTIONS false')
+        created = datetime.datetime.now().isoformat(timespec='seconds')
+        comment = f"Schema template {fingerprint} from {backup_file} ({created})"
+        self._execute(f'COMMENT ON DATABASE "{name}" IS %s', (comment,))
+        self.logger.info(f"Built schema template '{name}' in {time.time() - start:.2f}s")
+        return name
+
+    def ensure(self, backup_file):
+        """
+        Name of the template holding the schema of `backup_file`, building it if needed.
+
+        Returns None when the dump's schema cannot be cached.
+        """
+        start = time.time()
+        fingerprint = schema_fingerprint(backup_file)
+        if not fingerprint:
+            # Data-only dumps load into an existing schema
+            return None
+        name = self.template_name(fingerprint)
+        if self.exists(name):
+            self.logger.info(f"Using schema template '{name}' (hashed in {time.time() - start:.2f}s)")
+            return name
+
+        self.logger.info(f"No schema template for this dump yet - building '{name}'")
+        name = self.build(backup_file, fingerprint)
+        if name:
+            self.prune(keep_name=name)
+        return name
+
+    def prune(self, keep_name=None):
+        """Drop all but the newest `keep` templates"""
+        templates = [t['name'] for t in self.list_templates() if t['name'] != keep_name]
+        kept = self.keep - 1 if keep_name else self.keep
+        for name in templates[kept:]:
+            try:
+                self.drop_template(name)
+                self.logger.info(f"Dropped old schema template '{name}'")
+            except psycopg2.Error as e:
+                self.logger.warning(f"Failed to drop schema template '{name}': {str(e).strip()}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Manage the schema template databases used by clean restores')
+    parser.add_argument('backup_file', nargs='?', help='Build (or find) the template for this plain or gzip dump')
+    parser.add_argument('--list', action='store_true', help='List cached templates')
+    parser.add_argument('--clear', action='store_true', help='Drop every cached template')
+    parser.add_argument('--keep', type=int, default=DEFAULT_TEMPLATES_TO_KEEP, help='Templates to keep when pruning')
+    args = parser.parse_args()
+
+    from restore import DatabaseRestore
+    restore_tool = DatabaseRestore()
+    cache = SchemaTemplateCache(restore_tool.db_config, restore_tool.logger, keep=args.keep)
+
+    if args.clear:
+        for template in cache.list_templates():
+            cache.drop_template(template['name'])
+            print(f"Dropped {template['name']}")
+    if args.backup_file:
+        name = cache.ensure(args.backup_file)
+        if not name:
+            sys.exit(1)
+        print(name)
+    if args.list or not (args.clear or args.backup_file):
+        for template in cache.list_templates():
+            print(f"{template['name']:<36} {template['size']:>12,} bytes  {template['comment'] or ''}")
+
+
+if __name__ == "__main__":
+    main()
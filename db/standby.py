@@ -0,0 +1,328 @@
+#!/usr/bin/env python3
+"""
+Warm Standby Maintenance
+Keeps <database>_standby restored from the newest full backup so emergency recovery is a rename
+"""
+
+import os
+import sys
+import json
+import time
+import logging
+import socket
+import argparse
+import datetime
+
+from archive_toc import is_archive
+from restore_coordinator import _process_alive
+
+# Shared with backend/emergency-recovery-server.js
+STATE_FILE = 'standby_state.json'
+LOCK_FILE = 'standby.lock'
+DEFAULT_INTERVAL_SECONDS = 300
+# Backup types that hold both schema and data
+FULL_BACKUP_TYPES = {'complete', 'full'}
+
+
+def _now():
+    return datetime.datetime.now().isoformat()
+
+
+class WarmStandby:
+    """
+    A verified copy of production restored from the newest full backup.
+
+    refresh() looks for a backup newer than the one the standby holds -
+    in backup_registry.json or the backup directory - restores it into a
+    staging database, verifies it against its manifest and swaps it in
+    for the previous standby. Production is never touched and the old
+    standby stays usable until the new one has passed verification.
+
+    promote() renames the standby to the production name, keeping a
+    damaged production database (if any) aside. The data is as old as
+    the backup the standby was restored from; that age is the recovery
+    point reported by status().
+
+    State is kept in standby_state.json next to the backups so the
+    emergency server can report it without a database connection.
+    """
+
+    def __init__(self, restore_tool, standby=None):
+        self.restore_tool = restore_tool
+        self.logger = restore_tool.logger
+        self.production = restore_tool.db_config['database']
+        self.standby = standby or f"{self.production}_standby"
+        self.backup_path = restore_tool.restore_config['backup_path']
+        self.state_file = os.path.join(self.backup_path, STATE_FILE)
+        self.lock_file = os.path.join(self.backup_path, LOCK_FILE)
+        self.host = socket.gethostname()
+
+    # State file
+
+    def load_state(self):
+        try:
+            with open(self.state_file, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def save_state(self, state):
+        temp_file = f"{self.state_file}.tmp"
+        with open(temp_file, 'w') as f:
+            json.dump(state, f, indent=2)
+        os.replace(temp_file, self.state_file)
+
+    def _take_lock(self):
+        """One refresh at a time; a lock left by a dead process on this host is taken over"""
+        try:
+            with open(self.lock_file, 'r') as f:
+                holder = json.load(f)
+            if holder.get('host') == self.host and not _process_alive(holder.get('pid', 0)):
+                self.logger.warning(f"Removing stale standby lock of process {holder.get('pid')}")
+                os.remove(self.lock_file)
+        except (OSError, ValueError):
+            pass
+        try:
+            fd = os.open(self.lock_file, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            return False
+        with os.fdopen(fd, 'w') as f:
+            json.dump({'pid': os.getpid(), 'host': self.host, 'started_at': _now()}, f)
+        return True
+
+    def _release_lock(self):
+        try:
+            os.remove(self.lock_file)
+        except OSError:
+            pass
+
+    # Backups
+
+    def registered_backups(self):
+        """Full backups from the registry and the backup directory, newest first"""
+        candidates = set()
+
+        registry_file = os.path.join(self.backup_path, 'backup_registry.json')
+        try:
+            with open(registry_file, 'r', encoding='utf-8-sig') as f:
+                registry = json.load(f)
+            # The scheduled task writes a single object, the Node scheduler a list
+            for entry in registry if isinstance(registry, list) else [registry]:
+                if entry.get('status', 'completed') not in ('completed', 'success'):
+                    continue
+                if entry.get('type', 'complete') not in FULL_BACKUP_TYPES:
+                    continue
+                backup_file = entry.get('filepath') or os.path.join(self.backup_path, entry.get('filename', ''))
+                if os.path.exists(backup_file):
+                    candidates.add(os.path.realpath(backup_file))
+        except (OSError, ValueError, AttributeError):
+            pass
+
+        for backup in self.restore_tool.list_available_backups():
+            if backup.get('success', True) and backup['type'] in FULL_BACKUP_TYPES:
+                candidates.add(os.path.realpath(backup['file']))
+
+        backups = [path for path in candidates if self.restore_tool.is_supported_format(path)]
+        return sorted(backups, key=os.path.getmtime, reverse=True)
+
+    # Maintenance
+
+    def refresh(self, force=False):
+        """Restore the newest full backup into the standby unless it already holds it"""
+        backups = self.registered_backups()
+        if not backups:
+            self.logger.warning("No full backups registered - nothing to build the standby from")
+            return False
+
+        newest = backups[0]
+        backup_mtime = os.path.getmtime(newest)
+        state = self.load_state()
+        if (not force and state.get('backup_file') == newest and state.get('backup_mtime') == backup_mtime
+                and state.get('available') and self.restore_tool.database_exists(self.standby)):
+            self.logger.info(f"Standby '{self.standby}' is up to date with {os.path.basename(newest)}")
+            return True
+
+        if not self._take_lock():
+            self.logger.info("A standby refresh is already running")
+            return False
+        try:
+            # Queued with restores like restore.py: the staging database
+            # competes for the same server and the swap must not interleave
+            return self.restore_tool.coordinator().run(
+                newest, 'standby.py', lambda: self._rebuild(newest, backup_mtime),
+                options={'mode': 'refresh_standby', 'standby': self.standby})
+        finally:
+            self._release_lock()
+
+    def _rebuild(self, backup_file, backup_mtime):
+        tool = self.restore_tool
+        staging = f"{self.standby}_build"
+        self.logger.info(f"Refreshing standby '{self.standby}' from {backup_file}")
+
+        # Left behind by a refresh that was interrupted
+        tool.run_admin_sql(f'DROP DATABASE IF EXISTS "{staging}";')
+        if tool.restore_config['sql_restore_mode'] == 'psql' and not is_archive(backup_file):
+            # psql would follow a dump's \connect into production
+            tool.restore_config['sql_restore_mode'] = 'native'
+        tool.prepare_schema_template(backup_file)
+        ok, output = tool.create_database(staging)
+        if not ok:
+            return self._record_failure(f"Failed to create '{staging}': {output}")
+
+        start_time = time.time()
+        tool.db_config['database'] = staging
+        try:
+            success = tool.restore_backup_file(backup_file)
+            if tool.progress:
+                tool.progress.finish(success)
+            verified = success and tool.verify_restore(backup_file)
+        finally:
+            tool.db_config['database'] = self.production
+        duration = time.time() - start_time
+
+        if not verified:
+            tool.run_admin_sql(f'DROP DATABASE IF EXISTS "{staging}";')
+            reason = "verification failed" if success else "restore failed"
+            return self._record_failure(f"Standby refresh from {os.path.basename(backup_file)}: {reason}")
+
+        if tool.database_exists(self.standby):
+            swapped, retired = tool.swap_databases(staging, self.standby, f"{self.standby}_previous")
+        else:
+            swapped, _ = tool.run_admin_sql(f'ALTER DATABASE "{staging}" RENAME TO "{self.standby}";')
+            retired = None
+        if not swapped:
+            tool.run_admin_sql(f'DROP DATABASE IF EXISTS "{staging}";')
+            return self._record_failure(f"Failed to swap '{staging}' into '{self.standby}'")
+        if retired:
+            ok, output = tool.run_admin_sql(f'DROP DATABASE IF EXISTS "{retired}";')
+            if not ok:
+                self.logger.warning(f"Failed to drop previous standby '{retired}': {output}")
+
+        self.save_state({
+            'database': self.standby,
+            'available': True,
+            'backup_file': backup_file,
+            'backup_mtime': backup_mtime,
+            'backup_created': datetime.datetime.fromtimestamp(backup_mtime).isoformat(),
+            'restored_at': _now(),
+            'duration_seconds': round(duration, 2),
+            'verification': tool.last_verification,
+            'schema_template': tool.schema_template,
+            'last_error': None
+        })
+        self.logger.info(f"Standby '{self.standby}' refreshed and verified in {duration:.2f} seconds")
+        return True
+
+    def _record_failure(self, message):
+        """Keep describing the standby that is still in place, with the failed attempt noted"""
+        self.logger.error(message)
+        state = self.load_state()
+        state.update({'last_error': message, 'last_error_at': _now()})
+        self.save_state(state)
+        return False
+
+    def promote(self):
+        """Rename the standby to the production name; returns (success, retired production name)"""
+        tool = self.restore_tool
+        state = self.load_state()
+        if not tool.database_exists(self.standby):
+            self.logger.error(f"Standby database '{self.standby}' does not exist")
+            return False, None
+        if not state.get('available'):
+            self.logger.warning(f"Standby '{self.standby}' has no verified refresh recorded - promoting anyway")
+
+        timestamp = datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
+        start_time = time.time()
+        swapped, retired = tool.swap_databases(self.standby, self.production, f"{self.production}_failed_{timestamp}")
+        if not swapped:
+            self.logger.error(f"Failed to promote standby '{self.standby}'")
+            return False, None
+
+        status = self.status(state)
+        self.logger.info(
+            f"Promoted standby '{self.standby}' to '{self.production}' in {time.time() - start_time:.2f}s; "
+            f"data as of {state.get('backup_created', 'unknown')} (RPO {status['rpo_seconds'] or 0:.0f}s)"
+        )
+        if retired:
+            self.logger.info(f"Previous database kept as '{retired}'")
+
+        state.update({
+            'available': False,
+            'promoted_at': _now(),
+            'promoted_backup_file': state.get('backup_file'),
+            'replaced_database': retired
+        })
+        self.save_state(state)
+        return True, retired
+
+    def status(self, state=None):
+        """Standby health and recovery point: how old its data is and whether a newer backup exists"""
+        state = state if state is not None else self.load_state()
+        now = datetime.datetime.now()
+
+        def age(timestamp):
+            return round((now - datetime.datetime.fromisoformat(timestamp)).total_seconds()) if timestamp else None
+
+        backups = self.registered_backups()
+        return {
+            'database': self.standby,
+            'available': bool(state.get('available')),
+            'backup_file': state.get('backup_file'),
+            'backup_created': state.get('backup_created'),
+            'restored_at': state.get('restored_at'),
+            'rpo_seconds': age(state.get('backup_created')),
+            'refreshed_seconds_ago': age(state.get('restored_at')),
+            'newest_backup': backups[0] if backups else None,
+            'behind_newest_backup': bool(backups) and backups[0] != state.get('backup_file'),
+            'last_error': state.get('last_error'),
+            'promoted_at': state.get('promoted_at')
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Maintain a warm standby database restored from the newest backup')
+    parser.add_argument('--refresh', action='store_true', help='Restore the newest full backup into the standby if it is newer')
+    parser.add_argument('--force', action='store_true', help='Rebuild the standby even if it is up to date')
+    parser.add_argument('--watch', action='store_true', help='Keep refreshing as new backups are registered')
+    parser.add_argument('--interval', type=int, default=DEFAULT_INTERVAL_SECONDS,
+                        help='Seconds between checks with --watch (default: 300)')
+    parser.add_argument('--promote', action='store_true', help='Replace production with the standby (emergency recovery)')
+    parser.add_argument('--status', action='store_true', help='Show standby age and state as JSON')
+    parser.add_argument('--standby', help='Standby database name (default: <database>_standby)')
+    args = parser.parse_args()
+
+    from restore import DatabaseRestore
+    restore_tool = DatabaseRestore()
+    if args.status:
+        # Log to stderr so stdout holds nothing but the JSON status
+        for handler in logging.getLogger().handlers:
+            if isinstance(handler, logging.StreamHandler) and handler.stream is sys.stdout:
+                handler.setStream(sys.stderr)
+    standby = WarmStandby(restore_tool, args.standby)
+
+    if args.promote:
+        # Queued with restores: a rename under a running restore would be lost
+        success, retired = restore_tool.coordinator().run(
+            standby.standby, 'standby.py', standby.promote, options={'mode': 'promote_standby'},
+            on_merged=lambda job: (job['status'] == 'completed', None))
+        sys.exit(0 if success else 1)
+
+    if args.watch:
+        while True:
+            try:
+                standby.refresh(force=args.force)
+            except Exception as e:
+                restore_tool.logger.error(f"Standby refresh failed: {e}")
+            args.force = False
+            time.sleep(args.interval)
+
+    if args.refresh or args.force:
+        success = standby.refresh(force=args.force)
+        if not args.status:
+            sys.exit(0 if success else 1)
+
+    print(json.dumps(standby.status(), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -244,8 +244,28 @@ const DatabaseTools = () => {
     setLoading(true);
     setRestoreStatus('Starting restore...');
     
+    const token = localStorage.getItem('token');
+    
+    // Poll live progress while the restore request is pending
+    const progressTimer = setInterval(async () => {
+      try {
+        const progressResponse = await fetch('/api/database/restore/progress', {
+          headers: { 'Authorization': `Bearer ${token}` }
+        });
+        const progressData = await progressResponse.json();
+        const progress = progressData.data;
+        if (progress && progress.status === 'running' && progress.filename === filename) {
+          const percent = progress.percent !== null ? `${progress.percent}%` : 'in progress';
+          const eta = progress.eta_seconds !== null ? ` - about ${progress.eta_seconds}s remaining` : '';
+          setRestoreStatus(`🔄 Restoring ${filename}: ${percent}${eta}
+        📍 ${progress.phase}${progress.current_object ? `: ${progress.current_object}` : ''}`);
+        }
+      } catch (error) {
+        // Progress is best-effort; the restore response reports the outcome
+      }
+    }, 2000);
+    
     try {
-      const token = localStorage.getItem('token');
       const response = await fetch('/api/database/restore', {
         method: 'POST',
         headers: {
@@ -267,6 +287,7 @@ const DatabaseTools = () => {
     } catch (error) {
       setRestoreStatus(`❌ Restore failed: ${error.message}`);
     } finally {
+      clearInterval(progressTimer);
       setLoading(false);
     }
   };